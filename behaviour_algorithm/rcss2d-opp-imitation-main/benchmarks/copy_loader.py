@@ -0,0 +1,139 @@
+"""
+    Benchmarks the INSERT and COPY loaders of copy_match_contents_to_postgres on the example tables at tests/data.
+
+    The database must have been set up with db/setup_pg_v1.sql. A scratch schema is created from db/setup_pg_v1_data.sql
+    and dropped at the end. Run it from the project root, e.g.:
+
+        python -m benchmarks.copy_loader --hostname localhost --password postgres --repeat 5
+"""
+import argparse
+import asyncio
+from contextlib import closing
+import os
+from pathlib import Path
+import shutil
+import tempfile
+import time
+from typing import Dict, List, Tuple
+
+import pandas as pd
+import psycopg2 as pg
+
+from tasks.v1.data import copy_match_contents_to_postgres, copy_match_metadata_to_postgres
+from tasks.v1.data.manifest import create_load_manifest
+
+HERE = Path(os.path.dirname(os.path.realpath(__file__)))
+PROJECT_ROOT = HERE.parent
+TESTFILES_DIRPATH = PROJECT_ROOT / 'tests' / 'data'
+CONTENTS_TABLES = [
+    'playertypes',
+    'matchstates',
+    'playerstates',
+    'playercommands',
+    'dash_commands',
+    'turn_commands',
+    'kick_commands',
+    'tackle_commands'
+]
+
+
+def make_match_group(outdir: Path) -> List[Path]:
+    """
+        Turns the example tables into a loadable match group.
+        The example command tables are not cut at the same cycles as the example match table,
+        so commands issued at cycles missing from the match table are left out.
+    """
+    match = pd.read_csv(TESTFILES_DIRPATH / 'test.match.csv')
+    left_teamname, right_teamname = match[' l_name'].iloc[0], match[' r_name'].iloc[0]
+    filestem = f"19700101000000-{left_teamname}_0-vs-{right_teamname}_0"
+    known_times = set(zip(match[' cycle'], match[' stopped']))
+    filepaths = []
+    for tabletype in ('match', 'playertypes'):
+        filepaths.append(outdir / f'{filestem}.{tabletype}.csv')
+        shutil.copy(TESTFILES_DIRPATH / f'test.{tabletype}.csv', filepaths[-1])
+    for tabletype in ('dash', 'turn', 'kick', 'tackle'):
+        commands = pd.read_csv(TESTFILES_DIRPATH / f'test.{tabletype}.csv')
+        commands = commands[[time in known_times for time in zip(commands['running_time'], commands['stopped_time'])]]
+        filepaths.append(outdir / f'{filestem}.{tabletype}.csv')
+        commands.to_csv(filepaths[-1], index=False)
+    return filepaths
+
+
+def create_schema(connection, schema: str) -> None:
+    setup_script = (PROJECT_ROOT / 'db' / 'setup_pg_v1_data.sql').read_text()
+    setup_script = setup_script.replace('CREATE SCHEMA IF NOT EXISTS ;', f'CREATE SCHEMA IF NOT EXISTS {schema};')
+    setup_script = setup_script.replace('SET SCHEMA ;', f"SET SCHEMA '{schema}';")
+    setup_script = setup_script.replace('BEGIN;', '').replace('COMMIT;', '')
+    with closing(connection.cursor()) as cursor:
+        cursor.execute(setup_script)
+        cursor.execute("SET SCHEMA 'public';")
+    connection.commit()
+    create_load_manifest(connection)
+
+
+def count_rows(connection, schema: str) -> Dict[str, int]:
+    counts = {}
+    with closing(connection.cursor()) as cursor:
+        for table in CONTENTS_TABLES:
+            cursor.execute(f"SELECT count(*) FROM {schema}.{table};")
+            (counts[table],) = cursor.fetchone()
+    return counts
+
+
+def run(connection, schema: str, match_filepaths: List[Path], use_copy: bool, repeat: int) -> Tuple[List[float], int]:
+    """
+        Loads the same match group :repeat: times, deleting it after every load.
+        Returns the elapsed time of each load and the number of rows written by a single load.
+    """
+    match_filepath = next(filepath for filepath in match_filepaths if filepath.name.endswith('.match.csv'))
+    elapsed = []
+    rows = 0
+    for _ in range(repeat):
+        asyncio.run(copy_match_metadata_to_postgres(match_filepath, connection))
+        start = time.perf_counter()
+        asyncio.run(copy_match_contents_to_postgres(match_filepaths, connection, schema, use_copy=use_copy))
+        elapsed.append(time.perf_counter() - start)
+        rows = sum(count_rows(connection, schema).values())
+        with closing(connection.cursor()) as cursor:
+            # Cascades to every table of the schema
+            cursor.execute("DELETE FROM public.matches WHERE match_timestamp = %s;", (match_filepath.name.split('-')[0],))
+        connection.commit()
+    return elapsed, rows
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--hostname', default='localhost')
+    parser.add_argument('--port', type=int, default=5432)
+    parser.add_argument('--user', default='postgres')
+    parser.add_argument('--password', default='')
+    parser.add_argument('--dbname', default='postgres')
+    parser.add_argument('--schema', default='bench_copy_loader')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    connection = pg.connect(f"host={args.hostname} port={args.port} dbname={args.dbname} user={args.user} password={args.password}")
+    connection.set_isolation_level(1)
+    workdir = Path(tempfile.mkdtemp())
+    try:
+        create_schema(connection, args.schema)
+        match_filepaths = make_match_group(workdir)
+        results = {}
+        for loader, use_copy in (('insert', False), ('copy', True)):
+            elapsed, rows = run(connection, args.schema, match_filepaths, use_copy, args.repeat)
+            results[loader] = min(elapsed)
+        print()
+        print(f"Rows per match load: {rows}")
+        for loader, best in results.items():
+            print(f"{loader:>8}: best of {args.repeat} = {best:.4f} sec, {rows / best:.0f} rows/sec")
+        print(f"COPY speedup: {results['insert'] / results['copy']:.2f}x")
+    finally:
+        with closing(connection.cursor()) as cursor:
+            cursor.execute(f"DROP SCHEMA IF EXISTS {args.schema} CASCADE;")
+        connection.commit()
+        connection.close()
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,234 @@
+"""
+    Generates a synthetic corpus of match groups (match, playertypes, dash, turn, kick and tackle tables, plus the
+    serverparams and playerparams tables of tests/data) with the column layout of rcg2csv/rcl2csv, at any scale.
+    Values are random but within the ranges of real matches, so every table can be extracted, normalized and loaded.
+    A corpus.json file lists the rows and bytes of every table. Run it from the project root, e.g.:
+
+        python -m benchmarks.corpus --outdir /tmp/corpus --matches 4 --cycles 6000
+"""
+import argparse
+import json
+import os
+from pathlib import Path
+import shutil
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+from tasks.v1.types import *
+
+HERE = Path(os.path.dirname(os.path.realpath(__file__)))
+PROJECT_ROOT = HERE.parent
+TESTFILES_DIRPATH = PROJECT_ROOT / 'tests' / 'data'
+CORPUS_MANIFEST_NAME = 'corpus.json'
+# Player types of a rcssserver v16 match: the default one and 17 heterogeneous ones
+PLAYER_TYPES = 18
+# Command tables and the share of the player moments with a command of each type
+COMMAND_RATES = {
+    TableType.DASH:     0.55,
+    TableType.TURN:     0.30,
+    TableType.KICK:     0.04,
+    TableType.TACKLE:   0.01,
+}
+# Columns of the command tables, as rcl2csv writes them
+COMMAND_COLUMNS = [
+    TableColumnType.ROWNUM,
+    CommandTableColumn.RUNNING_TIME,
+    CommandTableColumn.STOPPED_TIME,
+    CommandTableColumn.GLOBAL_ORDER_INDEX,
+    CommandTableColumn.TEAMNAME,
+    CommandTableColumn.UNIFORM_NUMBER,
+]
+COMMAND_PARAMETER_COLUMNS = {
+    TableType.DASH:     [ DashColumn.DASH_POWER, DashColumn.DASH_DIRECTION ],
+    TableType.TURN:     [ TurnColumn.TURN_MOMENT ],
+    TableType.KICK:     [ KickColumn.KICK_POWER, KickColumn.KICK_DIRECTION ],
+    TableType.TACKLE:   [ TackleColumn.TACKLE_DIRECTION, TackleColumn.FOUL_INTENTION ],
+}
+
+
+def _match_table(rng: np.random.Generator, cycles: int, left_teamname: str, right_teamname: str) -> pd.DataFrame:
+    """ One row per cycle from 1 to :cycles:, except 3000 (like the v1 dataset), with every column of MatchGeneralColumn and SinglePlayerColumn. """
+    cycle = np.array([ cycle for cycle in range(1, cycles + 1) if cycle != 3000 ], dtype=np.int64)
+    rows = len(cycle)
+    def uniform(low: float, high: float) -> np.ndarray:
+        return rng.uniform(low, high, size=rows).round(4)
+    def integers(low: int, high: int) -> np.ndarray:
+        return rng.integers(low, high, size=rows, endpoint=True)
+
+    columns = {
+        TableColumnType.ROWNUM:                 np.arange(1, rows + 1),
+        str(MatchGeneralColumn.CYCLE):          cycle,
+        str(MatchGeneralColumn.STOPPED):        np.zeros(rows, dtype=np.int64),
+        str(MatchGeneralColumn.PLAYMODE):       np.where(rng.random(rows) < 0.9, 'play_on', rng.choice(['kick_in_l', 'kick_in_r', 'free_kick_l', 'free_kick_r', 'goal_kick_l', 'goal_kick_r'], size=rows)),
+        str(MatchGeneralColumn.LEFT_NAME):      np.full(rows, left_teamname),
+        str(MatchGeneralColumn.LEFT_SCORE):     np.zeros(rows, dtype=np.int64),
+        str(MatchGeneralColumn.LEFT_PENALTY_SCORE):     np.zeros(rows, dtype=np.int64),
+        str(MatchGeneralColumn.RIGHT_NAME):     np.full(rows, right_teamname),
+        str(MatchGeneralColumn.RIGHT_SCORE):    np.zeros(rows, dtype=np.int64),
+        str(MatchGeneralColumn.RIGHT_PENALTY_SCORE):    np.zeros(rows, dtype=np.int64),
+        str(MatchGeneralColumn.BALL_X):         uniform(-52.5, 52.5),
+        str(MatchGeneralColumn.BALL_Y):         uniform(-34, 34),
+        str(MatchGeneralColumn.BALL_VX):        uniform(-3, 3),
+        str(MatchGeneralColumn.BALL_VY):        uniform(-3, 3),
+    }
+    for side in [ FieldSide.LEFT, FieldSide.RIGHT ]:
+        for unum in range(1, 12):
+            uniform_number = UniformNumber.from_int(unum)
+            values = {
+                SinglePlayerColumn.TYPE:            np.full(rows, rng.integers(0, PLAYER_TYPES)),
+                SinglePlayerColumn.IS_GOALIE:       np.full(rows, int(unum == 1)),
+                SinglePlayerColumn.X:               uniform(-52.5, 52.5),
+                SinglePlayerColumn.Y:               uniform(-34, 34),
+                SinglePlayerColumn.VX:              uniform(-1.05, 1.05),
+                SinglePlayerColumn.VY:              uniform(-1.05, 1.05),
+                SinglePlayerColumn.BODY_ANGLE:      uniform(-180, 180),
+                SinglePlayerColumn.NECK_ANGLE:      integers(-90, 90),
+                SinglePlayerColumn.ARM_POINT_X:     np.full(rows, np.nan),
+                SinglePlayerColumn.ARM_POINT_Y:     np.full(rows, np.nan),
+                SinglePlayerColumn.VIEW_QUALITY:    np.full(rows, 'h'),
+                SinglePlayerColumn.VIEW_WIDTH:      rng.choice([60, 120, 180], size=rows),
+                SinglePlayerColumn.STAMINA:         uniform(2000, 8000),
+                SinglePlayerColumn.EFFORT:          uniform(0.6, 1),
+                SinglePlayerColumn.STAMINA_RECOVERY: np.ones(rows, dtype=np.int64),
+                SinglePlayerColumn.STAMINA_RESERVE: integers(100000, 130600),
+                SinglePlayerColumn.FOCUS_SIDE:      np.where(rng.random(rows) < 0.5, 'l', ''),
+                SinglePlayerColumn.FOCUS_UNIFORM:    np.where(rng.random(rows) < 0.5, integers(1, 11).astype(np.float64), np.nan),
+            }
+            for column in SinglePlayerColumn:
+                name = MatchPlayerColumn.name(side, uniform_number, column)
+                if column in values:
+                    columns[name] = values[column]
+                elif column.value.endswith('_count'):
+                    # Counters only go up
+                    columns[name] = np.cumsum(integers(0, 1))
+                else:
+                    # Flags, mostly off
+                    columns[name] = (rng.random(rows) < 0.01).astype(np.int64)
+    df = pd.DataFrame(columns)
+    df[df.columns[df.columns.str.endswith('_focus_side')]] = df[df.columns[df.columns.str.endswith('_focus_side')]].replace('', np.nan)
+    return df
+
+
+def _playertypes_table(rng: np.random.Generator) -> pd.DataFrame:
+    """ The default player type and PLAYER_TYPES-1 heterogeneous ones, drawn within the rcssserver v16 delta ranges. """
+    template = pd.read_csv(TESTFILES_DIRPATH / 'test.playertypes.csv')
+    df = pd.concat([template.iloc[[0]]] * PLAYER_TYPES, ignore_index=True)
+    df[TableColumnType.ROWNUM] = np.arange(1, PLAYER_TYPES + 1)
+    df[str(PlayerTypesColumn.ID)] = np.arange(PLAYER_TYPES)
+    heterogeneous = slice(1, PLAYER_TYPES)
+    count = PLAYER_TYPES - 1
+    dash_power_rate_delta = rng.uniform(RCSSPlayerParamsV16.DASH_POWER_RATE_DELTA_MIN, RCSSPlayerParamsV16.DASH_POWER_RATE_DELTA_MAX, size=count)
+    player_decay_delta = rng.uniform(RCSSPlayerParamsV16.PLAYER_DECAY_DELTA_MIN, RCSSPlayerParamsV16.PLAYER_DECAY_DELTA_MAX, size=count)
+    kickable_margin_delta = rng.uniform(RCSSPlayerParamsV16.KICKABLE_MARGIN_DELTA_MIN, RCSSPlayerParamsV16.KICKABLE_MARGIN_DELTA_MAX, size=count)
+    extra_stamina_delta = rng.uniform(RCSSPlayerParamsV16.EXTRA_STAMINA_DELTA_MIN, RCSSPlayerParamsV16.EXTRA_STAMINA_DELTA_MAX, size=count)
+    deltas = {
+        PlayerTypesColumn.DASH_POWER_RATE:  (RCSSServerParamsV16.DASH_POWER_RATE, dash_power_rate_delta),
+        PlayerTypesColumn.STAMINA_INC_MAX:  (RCSSServerParamsV16.STAMINA_INC_MAX, RCSSPlayerParamsV16.STAMINA_INC_MAX_DELTA_FACTOR * dash_power_rate_delta),
+        PlayerTypesColumn.PLAYER_DECAY:     (RCSSServerParamsV16.PLAYER_DECAY, player_decay_delta),
+        PlayerTypesColumn.INERTIA_MOMENT:   (RCSSServerParamsV16.INERTIA_MOMENT, RCSSPlayerParamsV16.INERTIA_MOMENT_DELTA_FACTOR * player_decay_delta),
+        PlayerTypesColumn.KICKABLE_MARGIN:  (RCSSServerParamsV16.KICKABLE_MARGIN, kickable_margin_delta),
+        PlayerTypesColumn.KICK_RAND:        (RCSSServerParamsV16.KICK_RAND, RCSSPlayerParamsV16.KICK_RAND_DELTA_FACTOR * kickable_margin_delta),
+        PlayerTypesColumn.EXTRA_STAMINA:    (RCSSServerParamsV16.EXTRA_STAMINA, extra_stamina_delta),
+        PlayerTypesColumn.EFFORT_MAX:       (RCSSServerParamsV16.EFFORT_INIT, RCSSPlayerParamsV16.EFFORT_MAX_DELTA_FACTOR * extra_stamina_delta),
+        PlayerTypesColumn.EFFORT_MIN:       (RCSSServerParamsV16.EFFORT_MIN, RCSSPlayerParamsV16.EFFORT_MIN_DELTA_FACTOR * extra_stamina_delta),
+    }
+    for column, (default, delta) in deltas.items():
+        df[str(column)] = df[str(column)].astype(np.float64)
+        df.loc[heterogeneous, str(column)] = (default + delta).round(6)
+    return df
+
+
+def _command_tables(rng: np.random.Generator, match: pd.DataFrame, left_teamname: str, right_teamname: str) -> Dict[TableType, pd.DataFrame]:
+    """ At most one command per player and match table row, spread over the command tables by COMMAND_RATES. """
+    moments = len(match) * 22
+    cycle = np.repeat(match[str(MatchGeneralColumn.CYCLE)].values, 22)
+    stopped = np.repeat(match[str(MatchGeneralColumn.STOPPED)].values, 22)
+    teamname = np.tile(np.repeat([left_teamname, right_teamname], 11), len(match))
+    unum = np.tile(np.tile(np.arange(1, 12), 2), len(match))
+    order = np.arange(moments)
+    tabletypes = list(COMMAND_RATES)
+    draw = rng.choice(len(tabletypes) + 1, size=moments, p=[ *COMMAND_RATES.values(), 1 - sum(COMMAND_RATES.values()) ])
+    tables = {}
+    for index, tabletype in enumerate(tabletypes):
+        issued = draw == index
+        count = int(issued.sum())
+        df = pd.DataFrame({
+            TableColumnType.ROWNUM:                 np.arange(1, count + 1),
+            CommandTableColumn.RUNNING_TIME:        cycle[issued],
+            CommandTableColumn.STOPPED_TIME:        stopped[issued],
+            CommandTableColumn.GLOBAL_ORDER_INDEX:  order[issued],
+            CommandTableColumn.TEAMNAME:            teamname[issued],
+            CommandTableColumn.UNIFORM_NUMBER:      unum[issued],
+        })
+        for column in COMMAND_PARAMETER_COLUMNS[tabletype]:
+            if column is TackleColumn.FOUL_INTENTION:
+                df[str(column)] = (rng.random(count) < 0.1).astype(np.int64)
+            elif column is DashColumn.DASH_POWER or column is KickColumn.KICK_POWER:
+                df[str(column)] = rng.uniform(0, 100, size=count).round(3)
+            else:
+                df[str(column)] = rng.uniform(-180, 180, size=count).round(4)
+        tables[tabletype] = df
+    return tables
+
+
+def generate_match_group(outdir: Path, timestamp: str, cycles: int, seed: int) -> List[Path]:
+    """ Writes the tables of a synthetic match played at :timestamp: with :cycles: cycles into :outdir:. Returns their paths. """
+    rng = np.random.default_rng(seed)
+    left_teamname, right_teamname = 'BenchLeft', 'BenchRight'
+    filestem = f'{timestamp}-{left_teamname}_0-vs-{right_teamname}_0'
+    match = _match_table(rng, cycles, left_teamname, right_teamname)
+    tables = {
+        TableType.MATCH: match,
+        TableType.PTYPES: _playertypes_table(rng),
+        **_command_tables(rng, match, left_teamname, right_teamname)
+    }
+    filepaths = []
+    for tabletype, df in tables.items():
+        filepaths.append(outdir / f'{filestem}.{tabletype}.csv')
+        df.to_csv(filepaths[-1], index=False)
+    for tabletype in (TableType.SPARAMS, TableType.PPARAMS):
+        filepaths.append(outdir / f'{filestem}.{tabletype}.csv')
+        shutil.copy(TESTFILES_DIRPATH / f'test.{tabletype}.csv', filepaths[-1])
+    return filepaths
+
+
+def generate_corpus(outdir: Path, matches: int, cycles: int=6000, seed: int=0) -> dict:
+    """
+        Writes :matches: synthetic match groups of :cycles: cycles each into :outdir: and their manifest (CORPUS_MANIFEST_NAME).
+        Returns the manifest.
+    """
+    files = {}
+    for index in range(matches):
+        timestamp = f'{202001010000 + index}'
+        for filepath in generate_match_group(outdir, timestamp, cycles, seed + index):
+            with open(filepath, 'rb') as file:
+                rows = sum(1 for _ in file) - 1
+            files[filepath.name] = { 'rows': rows, 'bytes': filepath.stat().st_size }
+    manifest = { 'matches': matches, 'cycles': cycles, 'seed': seed, 'files': files }
+    with open(outdir / CORPUS_MANIFEST_NAME, 'w') as file:
+        json.dump(manifest, file, indent=2)
+    return manifest
+
+
+def read_corpus_manifest(corpusdir: Path) -> dict:
+    with open(corpusdir / CORPUS_MANIFEST_NAME, 'r') as file:
+        return json.load(file)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--outdir', type=Path, required=True)
+    parser.add_argument('--matches', type=int, default=1)
+    parser.add_argument('--cycles', type=int, default=6000, help='Cycles of every match, 6000 for a full match')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    os.makedirs(args.outdir, exist_ok=True)
+    manifest = generate_corpus(args.outdir, args.matches, args.cycles, args.seed)
+    total_bytes = sum(file['bytes'] for file in manifest['files'].values())
+    print(f"{len(manifest['files'])} tables of {args.matches} matches written to {args.outdir} ({total_bytes / 2**20:.1f} MB)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,265 @@
+"""
+    Benchmarks the extraction, normalization and postgres ingestion of a corpus of match groups (see benchmarks/corpus.py)
+    and reports the rows/sec, MB/sec and peak RSS of every stage, on screen and as a JSON file.
+
+    Every run of a stage happens in a fresh process, so its peak RSS is its own and not the one of the stages before it.
+    The best run of each stage is reported. The ingestion loads the metadata and contents of every match into a scratch schema,
+    created from db/setup_pg_v1_data.sql and dropped at the end; the database must have been set up with db/setup_pg_v1.sql.
+    The peak RSS of the ingestion is the one of the loader, not of the postgres server.
+    Run it from the project root, e.g.:
+
+        python -m benchmarks.corpus --outdir /tmp/corpus --matches 4
+        python -m benchmarks.pipeline --corpus /tmp/corpus --hostname localhost --password postgres --output results.json
+"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import closing, redirect_stdout
+import json
+import multiprocessing
+import os
+from pathlib import Path
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+from benchmarks.corpus import generate_corpus, read_corpus_manifest
+
+STAGES = ['extract', 'normalize', 'ingest']
+# Tables written by the rcg2csv/rcl2csv tools, i.e. the inputs of every stage
+TABLE_SUFFIXES = ('.match.csv', '.playertypes.csv', '.dash.csv', '.turn.csv', '.kick.csv', '.tackle.csv')
+PARAMS_SUFFIXES = ('.serverparams.csv', '.playerparams.csv')
+
+
+def _peak_rss_mb() -> float:
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on linux, bytes on macOS
+    return peak / 2**20 if sys.platform == 'darwin' else peak / 2**10
+
+
+def _connect(options: dict):
+    import psycopg2 as pg
+    connection = pg.connect(f"host={options['hostname']} port={options['port']} dbname={options['dbname']} user={options['user']} password={options['password']}")
+    connection.set_isolation_level(1)
+    return connection
+
+
+def _table_filepaths(dirpath: Path) -> List[Path]:
+    return sorted(filepath for filepath in dirpath.iterdir() if filepath.name.endswith(TABLE_SUFFIXES))
+
+
+def _match_groups(dirpath: Path) -> Dict[str, List[Path]]:
+    groups = {}
+    for filepath in _table_filepaths(dirpath):
+        groups.setdefault(filepath.name.split('.')[0], []).append(filepath)
+    return groups
+
+
+def _ingest(inputdir: Path, options: dict) -> int:
+    """ Loads every match group of :inputdir: into the scratch schema. Returns the rows written to its tables. """
+    import asyncio
+    from benchmarks.copy_loader import count_rows
+    from tasks.v1.data import copy_match_contents_to_postgres, copy_match_metadata_to_postgres
+
+    with closing(_connect(options)) as connection:
+        for filepaths in _match_groups(inputdir).values():
+            match_filepath = next(filepath for filepath in filepaths if filepath.name.endswith('.match.csv'))
+            asyncio.run(copy_match_metadata_to_postgres(match_filepath, connection))
+            asyncio.run(copy_match_contents_to_postgres(
+                filepaths,
+                connection,
+                options['schema'],
+                use_copy=options['use_copy'],
+                preallocate_ids=options['preallocate_ids'],
+                memory_budget=options['memory_budget']
+            ))
+        return sum(count_rows(connection, options['schema']).values())
+
+
+def _delete_matches(inputdir: Path, options: dict) -> None:
+    with closing(_connect(options)) as connection:
+        with closing(connection.cursor()) as cursor:
+            # Cascades to every table of the schema and to the load manifest
+            cursor.execute("DELETE FROM public.matches WHERE match_timestamp = ANY(%s);", ([ filestem.split('-')[0] for filestem in _match_groups(inputdir) ],))
+        connection.commit()
+
+
+def run_stage(stage: str, inputdir: Path, outputdir: Optional[Path], options: dict) -> dict:
+    """
+        Runs a stage over the tables at :inputdir: and returns its elapsed time, the rows it wrote (only known for the ingestion)
+        and the peak RSS of the process. Meant to be run in a fresh process.
+    """
+    import asyncio
+    from tasks.v1.data import extract_raw_features, normalize_raw_features
+
+    baseline_rss_mb = _peak_rss_mb()
+    rows = None
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        start = time.perf_counter()
+        if stage == 'extract':
+            for filepath in _table_filepaths(inputdir):
+                asyncio.run(extract_raw_features(filepath, False, outputdir, options['memory_budget']))
+        elif stage == 'normalize':
+            for filepath in _table_filepaths(inputdir):
+                asyncio.run(normalize_raw_features(filepath, False, outputdir, options['memory_budget']))
+        elif stage == 'ingest':
+            rows = _ingest(inputdir, options)
+        else:
+            raise ValueError(f'Unknown stage {stage}')
+        seconds = time.perf_counter() - start
+        if stage == 'ingest':
+            _delete_matches(inputdir, options)
+    return { 'seconds': seconds, 'rows': rows, 'peak_rss_mb': _peak_rss_mb(), 'baseline_rss_mb': baseline_rss_mb }
+
+
+def _count_rows(filepaths: List[Path]) -> int:
+    rows = 0
+    for filepath in filepaths:
+        with open(filepath, 'rb') as file:
+            rows += sum(1 for _ in file) - 1
+    return rows
+
+
+def benchmark_stage(stage: str, inputdir: Path, outputdir: Optional[Path], repeat: int, options: dict) -> dict:
+    """ Runs a stage :repeat: times, each in a fresh process, and summarizes its best run. """
+    input_filepaths = _table_filepaths(inputdir)
+    input_bytes = sum(filepath.stat().st_size for filepath in input_filepaths)
+    runs = []
+    for _ in range(repeat):
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+            runs.append(executor.submit(run_stage, stage, inputdir, outputdir, options).result())
+    best = min(runs, key=lambda run: run['seconds'])
+    # The ingestion counts the rows written to postgres, the other stages the rows they read
+    rows = best['rows'] if best['rows'] is not None else _count_rows(input_filepaths)
+    return {
+        'input_files': len(input_filepaths),
+        'rows': rows,
+        'bytes': input_bytes,
+        'seconds': best['seconds'],
+        'rows_per_sec': rows / best['seconds'],
+        'mb_per_sec': input_bytes / 2**20 / best['seconds'],
+        'peak_rss_mb': max(run['peak_rss_mb'] for run in runs),
+        'baseline_rss_mb': min(run['baseline_rss_mb'] for run in runs),
+        'runs_seconds': [ run['seconds'] for run in runs ],
+    }
+
+
+def _environment(options: dict, postgres: bool) -> dict:
+    import numpy as np
+    import pandas as pd
+    environment = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+    }
+    if postgres:
+        with closing(_connect(options)) as connection:
+            with closing(connection.cursor()) as cursor:
+                cursor.execute("SHOW server_version;")
+                (environment['postgres'],) = cursor.fetchone()
+    return environment
+
+
+def print_results(results: dict) -> None:
+    print()
+    print(f"{'stage':<10}{'rows':>12}{'MB':>10}{'sec':>10}{'rows/sec':>14}{'MB/sec':>10}{'peak RSS MB':>14}")
+    for stage, result in results['stages'].items():
+        print(
+            f"{stage:<10}{result['rows']:>12}{result['bytes'] / 2**20:>10.1f}{result['seconds']:>10.3f}"
+            f"{result['rows_per_sec']:>14.0f}{result['mb_per_sec']:>10.2f}{result['peak_rss_mb']:>14.1f}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--corpus', type=Path, help='Corpus of benchmarks/corpus.py. If not given, one is generated with --matches and --cycles')
+    parser.add_argument('--matches', type=int, default=2)
+    parser.add_argument('--cycles', type=int, default=6000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=STAGES)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--memory-budget', type=int, help='Bytes of the row chunks every stage streams the tables in (see read_table_chunks)')
+    parser.add_argument('--output', type=Path, default=Path('benchmark-results.json'))
+    parser.add_argument('--hostname', default='localhost')
+    parser.add_argument('--port', type=int, default=5432)
+    parser.add_argument('--user', default='postgres')
+    parser.add_argument('--password', default='')
+    parser.add_argument('--dbname', default='postgres')
+    parser.add_argument('--schema', default='bench_pipeline')
+    parser.add_argument('--use-copy', action='store_true', help='Ingest with COPY FROM STDIN instead of INSERT statements')
+    parser.add_argument('--preallocate-ids', action='store_true', help='Ingest with the ids of every match reserved upfront')
+    args = parser.parse_args()
+    options = {
+        'hostname': args.hostname,
+        'port': args.port,
+        'user': args.user,
+        'password': args.password,
+        'dbname': args.dbname,
+        'schema': args.schema,
+        'use_copy': args.use_copy,
+        'preallocate_ids': args.preallocate_ids,
+        'memory_budget': args.memory_budget,
+    }
+
+    workdir = Path(tempfile.mkdtemp())
+    connection = None
+    try:
+        corpusdir = args.corpus
+        if corpusdir is None:
+            corpusdir = workdir / 'corpus'
+            os.makedirs(corpusdir)
+            generate_corpus(corpusdir, args.matches, args.cycles, args.seed)
+        extracted_dir = workdir / 'extracted'
+        normalized_dir = workdir / 'normalized'
+        os.makedirs(extracted_dir)
+        os.makedirs(normalized_dir)
+        if 'ingest' in args.stages:
+            from benchmarks.copy_loader import create_schema
+            connection = _connect(options)
+            create_schema(connection, args.schema)
+
+        results = {
+            'corpus': { key: value for key, value in read_corpus_manifest(corpusdir).items() if key != 'files' },
+            'environment': _environment(options, 'ingest' in args.stages),
+            'options': { key: value for key, value in options.items() if key != 'password' },
+            'repeat': args.repeat,
+            'stages': {},
+        }
+        for stage in STAGES:
+            if stage not in args.stages:
+                continue
+            if stage == 'normalize' and 'extract' not in args.stages:
+                # The normalization runs on the extracted tables
+                benchmark_stage('extract', corpusdir, extracted_dir, 1, options)
+            if stage == 'extract':
+                results['stages'][stage] = benchmark_stage(stage, corpusdir, extracted_dir, args.repeat, options)
+            elif stage == 'normalize':
+                # The params of every match are read next to its tables
+                for filepath in corpusdir.iterdir():
+                    if filepath.name.endswith(PARAMS_SUFFIXES):
+                        shutil.copy(filepath, extracted_dir / filepath.name)
+                results['stages'][stage] = benchmark_stage(stage, extracted_dir, normalized_dir, args.repeat, options)
+            else:
+                results['stages'][stage] = benchmark_stage(stage, corpusdir, None, args.repeat, options)
+            print(f"{stage} done in {results['stages'][stage]['seconds']:.3f} sec")
+
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+        print_results(results)
+        print(f"Results saved at {args.output}")
+    finally:
+        if connection is not None:
+            with closing(connection.cursor()) as cursor:
+                cursor.execute(f"DROP SCHEMA IF EXISTS {args.schema} CASCADE;")
+            connection.commit()
+            connection.close()
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+BEGIN;
+
+SET SCHEMA ; -- PUT YOUR SCHEMA NAME HERE!
+
+--
+-- Flat commands: run it after setup_pg_v1_data.sql or setup_pg_v1_data_compact.sql, once.
+-- Every command is stored in a single flat_playercommands row with the parameters of its type, the ones of other types
+-- are NULL. A command is written with one statement instead of two, and read without joining the tables of each type.
+-- The playercommands, dash_commands, turn_commands, kick_commands and tackle_commands views give the commands back
+-- in the original layout, to read them only.
+-- The commands already in the schema are migrated (the command tables are rewritten, which takes a while on a full schema).
+-- Load it with copy-all-matches-contents-to-postgres --flat-playercommands=True.
+--
+
+ALTER TABLE playercommands RENAME TO flat_playercommands;
+
+ALTER TABLE flat_playercommands
+    ADD COLUMN dash_power           numeric,
+    ADD COLUMN dash_direction       numeric,
+    ADD COLUMN turn_moment          numeric,
+    ADD COLUMN kick_power           numeric,
+    ADD COLUMN kick_direction       numeric,
+    ADD COLUMN tackle_direction     numeric;
+
+UPDATE flat_playercommands AS commands SET dash_power = dash.dash_power, dash_direction = dash.dash_direction
+    FROM dash_commands AS dash WHERE dash.dash_id = commands.playercommand_id;
+UPDATE flat_playercommands AS commands SET turn_moment = turn.turn_moment
+    FROM turn_commands AS turn WHERE turn.turn_id = commands.playercommand_id;
+UPDATE flat_playercommands AS commands SET kick_power = kick.kick_power, kick_direction = kick.kick_direction
+    FROM kick_commands AS kick WHERE kick.kick_id = commands.playercommand_id;
+UPDATE flat_playercommands AS commands SET tackle_direction = tackle.tackle_direction
+    FROM tackle_commands AS tackle WHERE tackle.tackle_id = commands.playercommand_id;
+
+DROP TABLE dash_commands, turn_commands, kick_commands, tackle_commands;
+
+ALTER TABLE flat_playercommands
+    ADD CONSTRAINT dash_parameters CHECK (CASE WHEN playercommand_type = 'dash' THEN (dash_power, dash_direction) IS NOT NULL ELSE (dash_power, dash_direction) IS NULL END),
+    ADD CONSTRAINT turn_parameters CHECK (CASE WHEN playercommand_type = 'turn' THEN turn_moment IS NOT NULL ELSE turn_moment IS NULL END),
+    ADD CONSTRAINT kick_parameters CHECK (CASE WHEN playercommand_type = 'kick' THEN (kick_power, kick_direction) IS NOT NULL ELSE (kick_power, kick_direction) IS NULL END),
+    ADD CONSTRAINT tackle_parameters CHECK (CASE WHEN playercommand_type = 'tackle' THEN tackle_direction IS NOT NULL ELSE tackle_direction IS NULL END);
+
+--
+-- Readers of the commands in the original layout. playercommands has the columns of the commands table of the setup script
+--
+DO $$
+BEGIN
+    EXECUTE format('CREATE VIEW playercommands AS SELECT %s FROM flat_playercommands', (
+        SELECT string_agg(quote_ident(column_name), ', ' ORDER BY ordinal_position)
+        FROM information_schema.columns
+        WHERE table_schema = current_schema()
+            AND table_name = 'flat_playercommands'
+            AND column_name NOT IN ('dash_power', 'dash_direction', 'turn_moment', 'kick_power', 'kick_direction', 'tackle_direction')
+    ));
+END
+$$;
+
+CREATE VIEW dash_commands AS
+    SELECT playercommand_id AS dash_id, dash_power, dash_direction FROM flat_playercommands WHERE playercommand_type = 'dash';
+
+CREATE VIEW turn_commands AS
+    SELECT playercommand_id AS turn_id, turn_moment FROM flat_playercommands WHERE playercommand_type = 'turn';
+
+CREATE VIEW kick_commands AS
+    SELECT playercommand_id AS kick_id, kick_power, kick_direction FROM flat_playercommands WHERE playercommand_type = 'kick';
+
+CREATE VIEW tackle_commands AS
+    SELECT playercommand_id AS tackle_id, tackle_direction FROM flat_playercommands WHERE playercommand_type = 'tackle';
+
+COMMIT;
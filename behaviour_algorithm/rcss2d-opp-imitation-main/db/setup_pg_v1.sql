@@ -11,6 +11,17 @@ CREATE TABLE IF NOT EXISTS public.matches (
     UNIQUE (match_timestamp)
 );
 
+-- What has been loaded from which files (see tasks/v1/data/manifest.py)
+CREATE TABLE IF NOT EXISTS public.load_manifest (
+    operation           varchar(32) NOT NULL,
+    target_schema       varchar(64) NOT NULL,
+    match_timestamp     varchar(64) NOT NULL REFERENCES public.matches (match_timestamp) ON DELETE CASCADE,
+    checksum            char(64) NOT NULL,
+    stage               varchar(32) NOT NULL,
+    updated_at          timestamptz NOT NULL DEFAULT now(),
+    PRIMARY KEY (operation, target_schema, match_timestamp)
+);
+
 CREATE TYPE playmode_enum AS ENUM (
     'before_kick_off',
     'time_over',
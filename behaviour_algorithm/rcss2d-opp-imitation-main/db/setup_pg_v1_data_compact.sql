@@ -0,0 +1,133 @@
+BEGIN;
+
+--
+-- The v1 data schema with compact player states: run it instead of setup_pg_v1_data.sql.
+-- The 22 player states of a match state are stored in a single playerstate_blocks row, as arrays of one element per player in
+-- fixed order: l1, ..., l11, r1, ..., r11 (the teams are the left_teamname and right_teamname of the match state).
+-- Scanning the player states of a match reads 22 times fewer tuples, without repeating the keys of every player.
+-- Player states are stored as float4 (the precision every training set is made of) and their player type as the id of
+-- the type in the match (playertypes.id).
+-- Commands point at their issuer by match state, team and unum. The playerstates view gives the player states back with
+-- the columns of setup_pg_v1_data.sql, except for playerstate_id.
+-- Load it with copy-all-matches-contents-to-postgres --compact-playerstates=True, or convert a schema of either layout to
+-- the other with convert-playerstates.
+--
+
+CREATE SCHEMA IF NOT EXISTS ; -- PUT YOUR SCHEMA NAME HERE! e.g. data_compact
+SET SCHEMA ; -- PUT YOUR SCHEMA NAME HERE! e.g. 'data_compact'
+
+CREATE TABLE IF NOT EXISTS playertypes (
+    playertype_id int PRIMARY KEY GENERATED ALWAYS AS IDENTITY,
+    match_id_fk             int REFERENCES public.matches ON DELETE CASCADE ON UPDATE RESTRICT NOT NULL,
+    id                      int NOT NULL CHECK(id >= 0),
+    player_decay            numeric NOT NULL,
+    inertia_moment          numeric NOT NULL,
+    dash_power_rate         numeric NOT NULL,
+    kickable_margin         numeric NOT NULL,
+    kick_rand               numeric NOT NULL,
+    extra_stamina           numeric NOT NULL,
+    effort_min              numeric NOT NULL,
+    effort_max              numeric NOT NULL,
+    UNIQUE (playertype_id, match_id_fk),
+    UNIQUE (match_id_fk, id)
+);
+
+CREATE TABLE IF NOT EXISTS matchstates (
+    matchstate_id int PRIMARY KEY GENERATED ALWAYS AS IDENTITY,
+    match_id_fk             int REFERENCES public.matches ON DELETE CASCADE ON UPDATE RESTRICT NOT NULL,
+    cycle                   int NOT NULL CHECK(cycle > 0),
+    stopped_cycle           int NOT NULL CHECK(stopped_cycle >= 0),
+    playmode                public.playmode_enum NOT NULL,
+    left_teamname           varchar(32) CHECK (left_teamname IS NULL OR length(left_teamname) > 0),
+    right_teamname          varchar(32) CHECK (right_teamname IS NULL OR length(right_teamname) > 0),
+    ball_x                  numeric NOT NULL,
+    ball_y                  numeric NOT NULL,
+    ball_vx                 numeric NOT NULL,
+    ball_vy                 numeric NOT NULL,
+    CONSTRAINT teams_have_different_names CHECK (left_teamname != right_teamname),
+    UNIQUE (matchstate_id, match_id_fk),
+    UNIQUE (matchstate_id, cycle, stopped_cycle),
+    UNIQUE (match_id_fk, cycle, stopped_cycle)
+);
+
+CREATE TABLE IF NOT EXISTS playerstate_blocks (
+    matchstate_id_fk        int PRIMARY KEY,
+    match_id_fk             int NOT NULL, -- Redundant, but necessary to code FK integrity
+    playertype_ids          smallint[] NOT NULL CHECK (cardinality(playertype_ids) = 22),
+    isgoalie                boolean[] NOT NULL CHECK (cardinality(isgoalie) = 22),
+    isdiscarded             boolean[] NOT NULL CHECK (cardinality(isdiscarded) = 22),
+    x                       float4[] NOT NULL CHECK (cardinality(x) = 22),
+    y                       float4[] NOT NULL CHECK (cardinality(y) = 22),
+    vx                      float4[] NOT NULL CHECK (cardinality(vx) = 22),
+    vy                      float4[] NOT NULL CHECK (cardinality(vy) = 22),
+    body                    float4[] NOT NULL CHECK (cardinality(body) = 22),
+    stamina                 float4[] NOT NULL CHECK (cardinality(stamina) = 22),
+    stamina_capacity        float4[] NOT NULL CHECK (cardinality(stamina_capacity) = 22),
+    FOREIGN KEY (match_id_fk)                   REFERENCES public.matches(match_id) ON DELETE CASCADE ON UPDATE RESTRICT,
+    FOREIGN KEY (matchstate_id_fk, match_id_fk) REFERENCES matchstates(matchstate_id, match_id_fk) ON DELETE CASCADE ON UPDATE RESTRICT
+);
+
+CREATE TABLE IF NOT EXISTS playercommands (
+    playercommand_id    int PRIMARY KEY GENERATED ALWAYS AS IDENTITY,
+    matchstate_id_fk    int NOT NULL,
+    cycle_fk            int NOT NULL,
+    stopped_cycle_fk    int NOT NULL,
+    unum_fk             int NOT NULL CHECK (unum_fk BETWEEN 1 AND 11),
+    teamname_fk         varchar(32) NOT NULL,
+    playercommand_type  public.playercommand_type_enum,
+    UNIQUE (matchstate_id_fk, teamname_fk, unum_fk),
+    FOREIGN KEY (matchstate_id_fk, cycle_fk, stopped_cycle_fk)	REFERENCES matchstates(matchstate_id, cycle, stopped_cycle) ON DELETE CASCADE ON UPDATE CASCADE,
+    FOREIGN KEY (matchstate_id_fk)		                        REFERENCES playerstate_blocks(matchstate_id_fk) ON DELETE CASCADE ON UPDATE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS dash_commands (
+    dash_id                 int REFERENCES playercommands ON DELETE CASCADE ON UPDATE RESTRICT PRIMARY KEY,
+    dash_power              numeric NOT NULL,
+    dash_direction          numeric NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS turn_commands (
+    turn_id                 int REFERENCES playercommands ON DELETE CASCADE ON UPDATE RESTRICT PRIMARY KEY,
+    turn_moment             numeric NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS kick_commands (
+    kick_id                 int REFERENCES playercommands ON DELETE CASCADE ON UPDATE RESTRICT PRIMARY KEY,
+    kick_power              numeric NOT NULL,
+    kick_direction          numeric NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS tackle_commands (
+    tackle_id               int REFERENCES playercommands ON DELETE CASCADE ON UPDATE RESTRICT PRIMARY KEY,
+    tackle_direction        numeric NOT NULL
+);
+
+--
+-- Reader of the player states in the layout of setup_pg_v1_data.sql, a row per player. Values stay float4: numeric
+-- conversions of float4 keep 6 digits only
+--
+CREATE OR REPLACE VIEW playerstates AS
+    SELECT
+        blocks.match_id_fk,
+        blocks.matchstate_id_fk,
+        types.playertype_id AS playertype_id_fk,
+        (CASE WHEN players.position <= 11 THEN states.left_teamname ELSE states.right_teamname END)::varchar(32) AS teamname,
+        (players.position - 1) % 11 + 1 AS unum,
+        blocks.isgoalie[players.position] AS isgoalie,
+        blocks.isdiscarded[players.position] AS isdiscarded,
+        blocks.x[players.position] AS x,
+        blocks.y[players.position] AS y,
+        blocks.vx[players.position] AS vx,
+        blocks.vy[players.position] AS vy,
+        blocks.body[players.position] AS body,
+        blocks.stamina[players.position] AS stamina,
+        blocks.stamina_capacity[players.position] AS stamina_capacity
+    FROM playerstate_blocks AS blocks
+        JOIN matchstates AS states
+            ON states.matchstate_id = blocks.matchstate_id_fk
+        CROSS JOIN generate_series(1, 22) AS players(position)
+        JOIN playertypes AS types
+            ON types.match_id_fk = blocks.match_id_fk
+            AND types.id = blocks.playertype_ids[players.position];
+
+COMMIT;
@@ -0,0 +1,384 @@
+from contextlib import contextmanager
+from functools import wraps
+import inspect
+import itertools
+import json
+import os
+from pathlib import Path
+import threading
+import time
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+"""
+    Hierarchical span profiler.
+    A span times a block of code (wall and CPU time) and counts the rows and bytes it went through. Spans opened inside
+    another span are its children, so a run is a tree: e.g. a match load made of table reads, links, COPYs and a commit.
+        - `span` is the context manager, `profiled` the decorator (of plain and coroutine functions).
+        - Spans always measure themselves, but they are only recorded while profiling is enabled (see `enable`).
+        - The current span follows the code through coroutines. Threads and worker processes don't inherit it:
+          wrap thread targets with `in_thread`, and run process jobs inside `adopt(handoff())`, sending their records
+          back to be `merge`d (see tasks/v1/data/jobs.py).
+        - Records are exported as JSON, as Chrome traces (chrome://tracing, https://ui.perfetto.dev) and as a summary table.
+"""
+
+class SpanRecord(NamedTuple):
+    """ A finished span. Ids are unique across the processes of a run. """
+    name:       str
+    span_id:    str
+    parent_id:  Optional[str]
+    pid:        int
+    tid:        int
+    start:      float               # Seconds since the epoch
+    wall:       float               # Seconds
+    cpu:        float               # Seconds of CPU of the thread running the span
+    rows:       int
+    bytes:      int
+    attributes: Dict[str, Any]
+
+
+class SpanHandoff(NamedTuple):
+    """ What a thread or process needs to record spans as children of a span of another one. """
+    pid:        int
+    parent_id:  Optional[str]
+
+
+class Span:
+    """ An open span. Rows, bytes and attributes can be added until it finishes. """
+
+    def __init__(self, name: str, span_id: str, parent_id: Optional[str], rows: int, bytes: int, attributes: Dict[str, Any]) -> None:
+        self.name = name
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.rows = rows
+        self.bytes = bytes
+        self.attributes = attributes
+        self.start = time.time()
+        self.wall = 0.0
+        self.cpu = 0.0
+        self._wall_start = time.perf_counter()
+        self._cpu_start = time.thread_time()
+
+    def add(self, rows: int=0, bytes: int=0) -> None:
+        self.rows += rows
+        self.bytes += bytes
+
+    def annotate(self, **attributes: Any) -> None:
+        self.attributes.update(attributes)
+
+    def elapsed(self) -> float:
+        """ Wall time so far, in seconds. """
+        return time.perf_counter() - self._wall_start
+
+    def _finish(self) -> SpanRecord:
+        self.wall = time.perf_counter() - self._wall_start
+        self.cpu = time.thread_time() - self._cpu_start
+        return SpanRecord(
+            self.name,
+            self.span_id,
+            self.parent_id,
+            os.getpid(),
+            threading.get_ident(),
+            self.start,
+            self.wall,
+            self.cpu,
+            self.rows,
+            self.bytes,
+            self.attributes
+        )
+
+
+class Profiler:
+    """ Collects the records of the finished spans of a process. Thread-safe. """
+
+    def __init__(self) -> None:
+        self._records: List[SpanRecord] = []
+        self._lock = threading.Lock()
+
+    def record(self, record: SpanRecord) -> None:
+        with self._lock:
+            self._records.append(record)
+
+    def merge(self, records: Iterable[SpanRecord]) -> None:
+        with self._lock:
+            self._records.extend(records)
+
+    def records(self) -> List[SpanRecord]:
+        with self._lock:
+            return list(self._records)
+
+
+# The profiler of this process. None while profiling is disabled
+_profiler: Optional[Profiler] = None
+_current_span: ContextVar[Optional[Span]] = ContextVar('current_span', default=None)
+_span_counter = itertools.count()
+
+
+def enable() -> Profiler:
+    """ Starts recording spans in this process, with a new profiler. """
+    global _profiler
+    _profiler = Profiler()
+    return _profiler
+
+
+def disable() -> List[SpanRecord]:
+    """ Stops recording spans in this process. Returns the records so far. """
+    global _profiler
+    records = _profiler.records() if _profiler is not None else []
+    _profiler = None
+    return records
+
+
+def is_enabled() -> bool:
+    return _profiler is not None
+
+
+def records() -> List[SpanRecord]:
+    return _profiler.records() if _profiler is not None else []
+
+
+def merge(records: Iterable[SpanRecord]) -> None:
+    """ Adds the records of spans finished elsewhere (e.g. in a worker process) to the profiler of this process, if enabled. """
+    if _profiler is not None:
+        _profiler.merge(records)
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+@contextmanager
+def span(name: str, rows: int=0, bytes: int=0, **attributes: Any) -> Iterator[Span]:
+    """
+        Times the block as a child of the current span. The block may add rows and bytes to the span it gets.
+        Spans of failed blocks are recorded too, with the exception type as 'error' attribute.
+    """
+    parent = _current_span.get()
+    current = Span(
+        name,
+        f'{os.getpid()}-{next(_span_counter)}',
+        parent.span_id if parent is not None else _handoff_parent.get(),
+        rows,
+        bytes,
+        attributes
+    )
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as excpt:
+        current.annotate(error=type(excpt).__name__)
+        raise
+    finally:
+        _current_span.reset(token)
+        record = current._finish()
+        if _profiler is not None:
+            _profiler.record(record)
+
+
+def profiled(name: Optional[str]=None) -> Callable[[Callable], Callable]:
+    """ Decorates a function (or coroutine function) to run inside a span named after it. Returned lists count as rows. """
+    def decorate(fn: Callable) -> Callable:
+        span_name = name if name is not None else fn.__name__
+        if inspect.iscoroutinefunction(fn):
+            @wraps(fn)
+            async def profiled_coroutine(*args: Any, **kwargs: Any) -> Any:
+                with span(span_name) as current:
+                    result = await fn(*args, **kwargs)
+                    if isinstance(result, list):
+                        current.add(rows=len(result))
+                    return result
+            return profiled_coroutine
+        @wraps(fn)
+        def profiled_fn(*args: Any, **kwargs: Any) -> Any:
+            with span(span_name) as current:
+                result = fn(*args, **kwargs)
+                if isinstance(result, list):
+                    current.add(rows=len(result))
+                return result
+        return profiled_fn
+    return decorate
+
+
+def iter_spans(name: str, iterable: Iterable[Any], **attributes: Any) -> Iterator[Any]:
+    """
+        Gives the items of an iterable, timing the production of each one in its own span (e.g. a chunk parsed by a CSV reader).
+        Items with a length add it as rows. The consumer's work on an item is not part of its span.
+    """
+    iterator = iter(iterable)
+    while True:
+        with span(name, **attributes) as current:
+            try:
+                item = next(iterator)
+            except StopIteration:
+                current.annotate(exhausted=True)
+                return
+            if hasattr(item, '__len__'):
+                current.add(rows=len(item))
+        yield item
+
+
+#
+# Threads and processes
+#
+# Parent of the root spans of a thread or process that adopted a span of another one
+_handoff_parent: ContextVar[Optional[str]] = ContextVar('handoff_parent', default=None)
+
+
+def handoff() -> Optional[SpanHandoff]:
+    """ The current span, to be adopted by another thread or process. None while profiling is disabled. """
+    if _profiler is None:
+        return None
+    current = _current_span.get()
+    return SpanHandoff(os.getpid(), current.span_id if current is not None else _handoff_parent.get())
+
+
+@contextmanager
+def adopt(span_handoff: Optional[SpanHandoff]) -> Iterator[List[SpanRecord]]:
+    """
+        Records the spans of the block as children of a handed off span.
+        In another process, profiling is enabled for the block only and the list given is filled with the records
+        of the block when it finishes, for the caller to send them back to the handing process.
+        In the same process (e.g. a thread) the spans go straight to the profiler and the list stays empty.
+    """
+    global _profiler
+    collected: List[SpanRecord] = []
+    if span_handoff is None:
+        yield collected
+        return
+    token = _handoff_parent.set(span_handoff.parent_id)
+    span_token = _current_span.set(None)
+    if span_handoff.pid == os.getpid():
+        try:
+            yield collected
+        finally:
+            _current_span.reset(span_token)
+            _handoff_parent.reset(token)
+        return
+    # A forked worker may have inherited the profiler (and records) of its parent
+    inherited = _profiler
+    _profiler = Profiler()
+    try:
+        yield collected
+    finally:
+        collected.extend(_profiler.records())
+        _profiler = inherited
+        _current_span.reset(span_token)
+        _handoff_parent.reset(token)
+
+
+def in_thread(fn: Callable) -> Callable:
+    """ Wraps a thread target so that its spans are children of the span current when wrapping it. """
+    span_handoff = handoff()
+    @wraps(fn)
+    def adopted_fn(*args: Any, **kwargs: Any) -> Any:
+        with adopt(span_handoff):
+            return fn(*args, **kwargs)
+    return adopted_fn
+
+
+#
+# Exports
+#
+class SummaryRow(NamedTuple):
+    """ The spans of a run with the same path of names from the root, e.g. ('copy_match_contents_to_postgres', 'copy'). """
+    path:   Tuple[str, ...]
+    calls:  int
+    wall:   float
+    cpu:    float
+    rows:   int
+    bytes:  int
+
+
+def summary(span_records: Optional[List[SpanRecord]]=None) -> List[SummaryRow]:
+    """ Aggregates the records by path, in depth-first order of their first span. Defaults to the records of this process. """
+    span_records = records() if span_records is None else span_records
+    by_id = { record.span_id: record for record in span_records }
+    paths: Dict[str, Tuple[str, ...]] = {}
+    def path_of(record: SpanRecord) -> Tuple[str, ...]:
+        if record.span_id not in paths:
+            parent = by_id.get(record.parent_id)
+            paths[record.span_id] = (*(path_of(parent) if parent is not None else ()), record.name)
+        return paths[record.span_id]
+    totals: Dict[Tuple[str, ...], List[Any]] = {}
+    first_start: Dict[Tuple[str, ...], float] = {}
+    for record in span_records:
+        path = path_of(record)
+        total = totals.setdefault(path, [0, 0.0, 0.0, 0, 0])
+        total[0] += 1
+        total[1] += record.wall
+        total[2] += record.cpu
+        total[3] += record.rows
+        total[4] += record.bytes
+        first_start[path] = min(first_start.get(path, record.start), record.start)
+    # Sorting by the start of every ancestor keeps children right after their parent
+    order = lambda path: tuple(first_start.get(path[:depth], 0.0) for depth in range(1, len(path) + 1))
+    return [ SummaryRow(path, *totals[path]) for path in sorted(totals, key=order) ]
+
+
+def format_summary(span_records: Optional[List[SpanRecord]]=None) -> str:
+    """ The summary as a text table: one line per path, indented by depth, with its share of the wall time of its parent. """
+    rows = summary(span_records)
+    walls = { row.path: row.wall for row in rows }
+    lines = [ f"{'span':<48}{'calls':>8}{'wall s':>11}{'cpu s':>11}{'% parent':>10}{'rows':>12}{'MB':>10}{'rows/s':>12}" ]
+    for row in rows:
+        parent_wall = walls.get(row.path[:-1])
+        share = f'{100 * row.wall / parent_wall:.1f}' if parent_wall else ''
+        rate = f'{row.rows / row.wall:.0f}' if row.rows > 0 and row.wall > 0 else ''
+        name = ('  ' * (len(row.path) - 1) + row.path[-1])[:47]
+        lines.append(f"{name:<48}{row.calls:>8}{row.wall:>11.3f}{row.cpu:>11.3f}{share:>10}{row.rows:>12}{row.bytes / 2**20:>10.2f}{rate:>12}")
+    return '\n'.join(lines)
+
+
+def write_json(filepath: Path, span_records: Optional[List[SpanRecord]]=None) -> None:
+    span_records = records() if span_records is None else span_records
+    with open(filepath, 'w') as file:
+        json.dump({ 'spans': [ record._asdict() for record in span_records ] }, file, default=str)
+
+
+def write_chrome_trace(filepath: Path, span_records: Optional[List[SpanRecord]]=None) -> None:
+    """ Writes the records as complete events of the Chrome trace event format, one track per process and thread. """
+    span_records = records() if span_records is None else span_records
+    events = [
+        {
+            'name': record.name,
+            'cat': 'span',
+            'ph': 'X',
+            'ts': record.start * 1e6,
+            'dur': record.wall * 1e6,
+            'pid': record.pid,
+            'tid': record.tid,
+            'args': { 'cpu_ms': record.cpu * 1e3, 'rows': record.rows, 'bytes': record.bytes, **record.attributes },
+        }
+        for record in span_records
+    ]
+    with open(filepath, 'w') as file:
+        json.dump({ 'traceEvents': events, 'displayTimeUnit': 'ms' }, file, default=str)
+
+
+def save(prefix: Path, span_records: Optional[List[SpanRecord]]=None) -> List[Path]:
+    """ Writes <prefix>.spans.json and <prefix>.trace.json. Returns their paths. """
+    span_records = records() if span_records is None else span_records
+    filepaths = [ Path(f'{prefix}.spans.json'), Path(f'{prefix}.trace.json') ]
+    write_json(filepaths[0], span_records)
+    write_chrome_trace(filepaths[1], span_records)
+    return filepaths
+
+
+@contextmanager
+def profile_run(name: str, prefix: Optional[Path]) -> Iterator[None]:
+    """
+        Profiles a whole run (e.g. a CLI command) if :prefix: is given: records the block in a root span named :name:,
+        then saves the records (see save) and prints their summary. Does nothing otherwise.
+    """
+    if prefix is None:
+        yield
+        return
+    enable()
+    try:
+        with span(name):
+            yield
+    finally:
+        span_records = disable()
+        filepaths = save(prefix, span_records)
+        print(format_summary(span_records))
+        print(f"Profile saved at {', '.join(str(filepath) for filepath in filepaths)}")
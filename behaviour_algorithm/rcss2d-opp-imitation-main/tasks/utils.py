@@ -1,8 +1,8 @@
-from logging import LoggerAdapter
-import time
-from typing import Any, Dict, List
+from typing import Any, Dict
 from types import FunctionType
 
+from tasks.profiling import profiled
+
 def static_vars(**kwargs: Dict[str,Any]) -> FunctionType:
     """
         A simple decorator function to allow functions to have static variables.
@@ -13,21 +13,9 @@ def static_vars(**kwargs: Dict[str,Any]) -> FunctionType:
         return func
     return decorate
 
-@static_vars(correlationID=0)
 def profile(fn: FunctionType) -> FunctionType:
     """
         A simple decorator to time-profile end-to-end execution of functions.
-        This enables any functions that receive a LoggerAdapter object in a 'logger' keyword arguments to be time-profiled.
+        Kept for older callers, it's the same as tasks.profiling.profiled(): calls are recorded as spans while profiling is enabled.
     """
-    def profiled_fn(*args: List[Any], **kwargs: Dict[str,Any]):
-        if 'logger' not in kwargs:
-            # If there's no logger available, skip profiling.
-            return fn(*args, **kwargs)
-        logger: LoggerAdapter = kwargs['logger']
-        logger.info(f"Profile[function = {fn.__name__}][call={profile.correlationID}]: Start")
-        start = time.time()
-        result = fn(*args, **kwargs)
-        logger.info(f"Profile[function={fn.__name__}][call={profile.correlationID}]: Finished. Elapsed {time.time()-start} sec")
-        profile.correlationID += 1
-        return result
-    return profiled_fn
+    return profiled()(fn)
@@ -1,9 +1,9 @@
 import asyncio
 import ast
+from contextlib import closing
 import logging
 import os
 from pathlib import Path
-import psycopg2 as pg
 from nubia import command, argument
 import numpy as np
 import sys
@@ -11,7 +11,7 @@ import tensorflow as tf
 from termcolor import cprint
 import time
 from typing import Any, Dict, List, Optional, Tuple
-from .utils import listcsvs, SessionLoggerAdapter
+from .utils import catalog_match_groups, catalogcsvs, SessionLoggerAdapter
 
 @command("v1-data", help='Commands for data preparation of the v1 dataset.')
 class DataCLI:
@@ -24,34 +24,55 @@ class DataCLI:
     @argument("user", aliases=['u'], type=str, description="Postgres user.")
     @argument("dbname", aliases=['db'], type=str, description="Postgres database name.")
     @argument("schema", aliases=['sc'], type=str, description="Postgres database destination schema name.")
-    def update_all_matches_playertypes_at_postgres(self, indir: Path, hostname: str, password: str, port: int=5432, user: str='postgres', dbname: str='postgres', schema: str='data') -> int:
+    @argument("workers", aliases=['w'], type=int, description="Number of worker processes, each with its own Postgres connection. When batched, number of threads reading the tables.")
+    @argument("batched", aliases=['b'], type=bool, description="Whether to update every match at once, through a staging table, in a single transaction.")
+    @argument("profile", aliases=['pf'], type=Path, description="If given, path prefix where to save the profile of the run (<profile>.spans.json and <profile>.trace.json, for chrome://tracing).")
+    def update_all_matches_playertypes_at_postgres(self, indir: Path, hostname: str, password: str, port: int=5432, user: str='postgres', dbname: str='postgres', schema: str='data', workers: int=1, batched: bool=False, profile: Optional[Path]=None) -> int:
         """
             Update the existing playertypes postgres table using all playertypes CSV tables in a given folder.
             Returns an error code (Unix style).
         """
-        from tasks.v1.data import update_match_playertypes_at_postgres
+        from tasks.profiling import profile_run
+        from tasks.v1.data import read_match_ids, update_match_playertypes_at_postgres, update_matches_playertypes_at_postgres
+        from tasks.v1.data.ingestion import ConnectionParams, run_ingestion
+        from tasks.v1.data.manifest import create_load_manifest
         cprint(f"Input dir: {indir}")
         cprint(f"Host: {hostname}")
         cprint(f"Password: {password}")
         cprint(f"Port: {port}")
         cprint(f"Username: {user}")
         cprint(f"DB Name: {dbname}")
-        csvpaths, compressedcsvpaths = listcsvs(indir)
+        cprint(f"Workers: {workers}")
+        cprint(f"Batched? {batched}")
+        csvpaths, compressedcsvpaths = catalogcsvs(indir)
         cprint(f"Found {len(csvpaths)} CSV files")
         cprint(f"Found {len(compressedcsvpaths)} GZ-compressed CSV files")
-        async def tasks():
-            # Filter for player types tables
-            filtered_csvpaths = list(filter(lambda csvpath: csvpath.name.endswith('playertypes.csv'), csvpaths)) +\
-                list(filter(lambda csvpath: csvpath.name.endswith('playertypes.csv.gz'), compressedcsvpaths))
-            connection = pg.connect(f"host={hostname} port={port} dbname={dbname} user={user} password={password}")
-            connection.set_isolation_level(1)
-            try:
-                asyncjobs = list(map(lambda filepath: update_match_playertypes_at_postgres(filepath, connection, schema), filtered_csvpaths))
-                await asyncio.gather(*asyncjobs)
-            finally:
-                connection.close()
-        asyncio.run(tasks())
-        return 0
+        # Filter for player types tables
+        filtered_csvpaths = list(filter(lambda csvpath: csvpath.name.endswith('playertypes.csv'), csvpaths)) +\
+            list(filter(lambda csvpath: csvpath.name.endswith('playertypes.csv.gz'), compressedcsvpaths))
+        connection_params = ConnectionParams(hostname, password, port, user, dbname)
+        # Matches already in the load manifest are skipped, partially loaded ones are resumed
+        with closing(connection_params.connect()) as connection:
+            create_load_manifest(connection)
+            # Looked up once for every match instead of once per match
+            match_ids = read_match_ids(connection, filtered_csvpaths)
+        with profile_run('v1-data update-match-playertypes-at-postgres', profile):
+            if batched:
+                with closing(connection_params.connect()) as connection:
+                    failures = asyncio.run(update_matches_playertypes_at_postgres(filtered_csvpaths, connection, schema, workers=workers))
+                for filepath, error in failures:
+                    cprint(f"Failed {str(filepath)[:100]}: {error}", 'red')
+            else:
+                failures = run_ingestion(
+                    update_match_playertypes_at_postgres,
+                    filtered_csvpaths,
+                    connection_params,
+                    workers=workers,
+                    schema=schema,
+                    match_ids=match_ids
+                )
+        cprint(f"{len(filtered_csvpaths) - len(failures)} files updated, {len(failures)} failed")
+        return 0 if len(failures) == 0 else 1
 
     @command("copy-all-matches-contents-to-postgres", help="Copy all matches' contents spreaded into multiple tables of a specific schema of a postgresql database.")
     @argument("indir", aliases=['i'], type=Path, description="Path to look for CSVs.")
@@ -61,13 +82,31 @@ class DataCLI:
     @argument("user", aliases=['u'], type=str, description="Postgres user.")
     @argument("dbname", aliases=['db'], type=str, description="Postgres database name.")
     @argument("schema", aliases=['sc'], type=str, description="Postgres database destination schema name.")
-    def copy_all_matches_contents_to_postgres(self, indir: Path, hostname: str, password: str, schema: str, port: int=5432, user: str='postgres', dbname: str='postgres') -> int:
+    @argument("use_copy", aliases=['cp'], type=bool, description="Whether to stream tables with COPY FROM STDIN instead of INSERT statements.")
+    @argument("workers", aliases=['w'], type=int, description="Number of worker processes, each with its own Postgres connection.")
+    @argument("preallocate_ids", aliases=['pa'], type=bool, description="Whether to reserve id blocks per match and compute foreign keys locally instead of reading generated keys back.")
+    @argument("memory_budget", aliases=['mb'], type=int, description="Memory budget in MB of each table being processed, which is then streamed in chunks. 0 reads whole tables.")
+    @argument("bulk_load", aliases=['bl'], type=bool, description="Whether to drop the secondary indexes and foreign keys of playerstates and playercommands during the load and rebuild them at the end.")
+    @argument("upsert_metadata", aliases=['um'], type=bool, description="Whether to first upsert the metadata of every match into public.matches, with a single statement.")
+    @argument("compact_playerstates", aliases=['cps'], type=bool, description="Whether the schema was set up with db/setup_pg_v1_data_compact.sql, storing the 22 player states of every match state in a single row.")
+    @argument("flat_playercommands", aliases=['fpc'], type=bool, description="Whether the schema was migrated with db/pg_v1_flat_playercommands.sql, storing every command and its parameters in a single row.")
+    @argument("profile", aliases=['pf'], type=Path, description="If given, path prefix where to save the profile of the run (<profile>.spans.json and <profile>.trace.json, for chrome://tracing).")
+    def copy_all_matches_contents_to_postgres(self, indir: Path, hostname: str, password: str, schema: str, port: int=5432, user: str='postgres', dbname: str='postgres', use_copy: bool=False, workers: int=1, preallocate_ids: bool=False, memory_budget: int=0, bulk_load: bool=False, upsert_metadata: bool=False, compact_playerstates: bool=False, flat_playercommands: bool=False, profile: Optional[Path]=None) -> int:
         """
             Copy all data in a folder to a postgres database.
             The data is spreaded into multiple (pre-defined) tables of a specific schema.
+            Every match is loaded in its own transaction.
+            In bulk-load mode, the indexes and foreign keys are rebuilt (on as many connections as workers) even if the load fails.
             Returns an error code (Unix style).
         """
-        from tasks.v1.data import copy_match_contents_to_postgres
+        from contextlib import nullcontext
+        from tasks.profiling import profile_run
+        from tasks.v1.data import copy_match_contents_to_postgres, read_match_ids, upsert_matches_metadata
+        from tasks.v1.data.bulkload import deferred_indexes
+        from tasks.v1.data.compact import deferred_tables
+        from tasks.v1.data.ingestion import ConnectionParams, run_ingestion
+        from tasks.v1.data.manifest import create_load_manifest
+        from tasks.v1.types import TableType
         cprint(f"Input dir: {indir}")
         cprint(f"Host: {hostname}")
         cprint(f"Password: {password}")
@@ -75,85 +114,554 @@ class DataCLI:
         cprint(f"DB Schema: {schema}")
         cprint(f"Username: {user}")
         cprint(f"DB Name: {dbname}")
-        csvpaths, compressedcsvpaths = listcsvs(indir)
-        cprint(f"Found {len(csvpaths)} CSV files")
-        cprint(f"Found {len(compressedcsvpaths)} GZ-compressed CSV files")
-        async def tasks():
-            # Group files by soccer match
-            grouped_filestems: Dict[str, List[Path]] = {}
-            for path in [*csvpaths, *compressedcsvpaths]:
-                filestem = path.stem.split('.')[0]
-                if filestem not in grouped_filestems:
-                    grouped_filestems[filestem] = []
-                grouped_filestems[filestem].append(path)
-            connection = pg.connect(f"host={hostname} port={port} dbname={dbname} user={user} password={password}")
-            connection.set_isolation_level(1)
+        cprint(f"Use COPY? {use_copy}")
+        cprint(f"Preallocate ids? {preallocate_ids}")
+        cprint(f"Memory budget: {memory_budget} MB")
+        cprint(f"Bulk load? {bulk_load}")
+        cprint(f"Upsert metadata? {upsert_metadata}")
+        cprint(f"Compact player states? {compact_playerstates}")
+        cprint(f"Flat commands? {flat_playercommands}")
+        cprint(f"Workers: {workers}")
+        # Tables grouped by soccer match, from the dataset catalog
+        catalog_groups = catalog_match_groups(indir)
+        grouped_filestems = { filestem: [ catalog_file.path for catalog_file in catalog_files ] for filestem, catalog_files in catalog_groups.items() }
+        cprint(f"Found {sum(len(filepaths) for filepaths in grouped_filestems.values())} CSV tables of {len(grouped_filestems)} matches")
+        connection_params = ConnectionParams(hostname, password, port, user, dbname)
+        # Matches already in the load manifest are skipped, partially loaded ones are resumed
+        with closing(connection_params.connect()) as connection:
+            create_load_manifest(connection)
+            # Looked up once for every match instead of once per match
+            match_ids = read_match_ids(connection, [ filepaths[0] for filepaths in grouped_filestems.values() ])
+            if upsert_metadata:
+                upserted_match_ids, failures = asyncio.run(upsert_matches_metadata([
+                    catalog_file.path for catalog_files in catalog_groups.values() for catalog_file in catalog_files if catalog_file.tabletype == TableType.MATCH
+                ], connection))
+                match_ids.update(upserted_match_ids)
+                for filepath, error in failures:
+                    cprint(f"Failed {str(filepath)[:100]}: {error}", 'red')
+        with profile_run('v1-data copy-all-matches-contents-to-postgres', profile),\
+                (deferred_indexes(connection_params, schema, tables=deferred_tables(compact_playerstates, flat_playercommands), workers=workers) if bulk_load else nullcontext()):
+            failures = run_ingestion(
+                copy_match_contents_to_postgres,
+                list(grouped_filestems.values()),
+                connection_params,
+                workers=workers,
+                schema=schema,
+                use_copy=use_copy,
+                preallocate_ids=preallocate_ids,
+                memory_budget=(memory_budget * 2**20 if memory_budget > 0 else None),
+                compact_playerstates=compact_playerstates,
+                flat_playercommands=flat_playercommands,
+                match_ids=match_ids
+            )
+        cprint(f"{len(grouped_filestems) - len(failures)} matches loaded, {len(failures)} failed")
+        return 0 if len(failures) == 0 else 1
+
+    @command("watch", help="Watch a directory for new match groups and load each one into postgres (metadata, contents and playertypes) as soon as all its tables are written.")
+    @argument("indir", aliases=['i'], type=Path, description="Path to watch for CSVs.")
+    @argument("hostname", aliases=['hn'], type=str, description="Postgres host.")
+    @argument("password", aliases=['pw'], type=str, description="Postgres user password.")
+    @argument("port", aliases=['p'], type=int, description="Postgres port.")
+    @argument("user", aliases=['u'], type=str, description="Postgres user.")
+    @argument("dbname", aliases=['db'], type=str, description="Postgres database name.")
+    @argument("schema", aliases=['sc'], type=str, description="Postgres database destination schema name.")
+    @argument("poll_interval", aliases=['pi'], type=float, description="Seconds between two looks at the directory.")
+    @argument("settle", aliases=['st'], type=float, description="Seconds the tables of a match group must stay unchanged before it is loaded.")
+    @argument("use_copy", aliases=['cp'], type=bool, description="Whether to stream tables with COPY FROM STDIN instead of INSERT statements.")
+    @argument("workers", aliases=['w'], type=int, description="Number of worker processes, each with its own Postgres connection.")
+    @argument("memory_budget", aliases=['mb'], type=int, description="Memory budget in MB of each table being processed, which is then streamed in chunks. 0 reads whole tables.")
+    @argument("compact_playerstates", aliases=['cps'], type=bool, description="Whether the schema was set up with db/setup_pg_v1_data_compact.sql, storing the 22 player states of every match state in a single row.")
+    @argument("flat_playercommands", aliases=['fpc'], type=bool, description="Whether the schema was migrated with db/pg_v1_flat_playercommands.sql, storing every command and its parameters in a single row.")
+    @argument("profile", aliases=['pf'], type=Path, description="If given, path prefix where to save the profile of the run (<profile>.spans.json and <profile>.trace.json, for chrome://tracing).")
+    def watch(self, indir: Path, hostname: str, password: str, schema: str, port: int=5432, user: str='postgres', dbname: str='postgres', poll_interval: float=2.0, settle: float=5.0, use_copy: bool=False, workers: int=1, memory_budget: int=0, compact_playerstates: bool=False, flat_playercommands: bool=False, profile: Optional[Path]=None) -> int:
+        """
+            Loads the match groups of a directory tree as they are produced, until interrupted (Ctrl+C).
+            Groups already there are loaded first. Groups already loaded (see the load manifest) are skipped.
+            Returns an error code (Unix style).
+        """
+        from tasks.profiling import profile_run
+        from tasks.v1.data.ingestion import ConnectionParams
+        from tasks.v1.data.watch import watch
+        cprint(f"Input dir: {indir}")
+        cprint(f"Host: {hostname}")
+        cprint(f"Password: {password}")
+        cprint(f"Port: {port}")
+        cprint(f"DB Schema: {schema}")
+        cprint(f"Username: {user}")
+        cprint(f"DB Name: {dbname}")
+        cprint(f"Poll interval: {poll_interval} sec")
+        cprint(f"Settle time: {settle} sec")
+        cprint(f"Use COPY? {use_copy}")
+        cprint(f"Memory budget: {memory_budget} MB")
+        cprint(f"Compact player states? {compact_playerstates}")
+        cprint(f"Flat commands? {flat_playercommands}")
+        cprint(f"Workers: {workers}")
+        connection_params = ConnectionParams(hostname, password, port, user, dbname)
+        with profile_run('v1-data watch', profile):
+            history = watch(
+                indir,
+                connection_params,
+                schema,
+                poll_interval=poll_interval,
+                settle=settle,
+                workers=workers,
+                use_copy=use_copy,
+                memory_budget=(memory_budget * 2**20 if memory_budget > 0 else None),
+                compact_playerstates=compact_playerstates,
+                flat_playercommands=flat_playercommands
+            )
+        loaded = sum(stats.loaded for stats in history)
+        failed = sum(stats.failed for stats in history)
+        cprint(f"{loaded} matches loaded, {failed} failed")
+        return 0 if failed == 0 else 1
+
+    @command("build-cache", help="Convert every match's CSV tables into a columnar (Parquet) cache read by all other v1-data commands.")
+    @argument("indir", aliases=['i'], type=Path, description="Path to look for CSVs.")
+    def build_cache(self, indir: Path) -> int:
+        """
+            Builds the columnar cache of all CSV tables in a folder, match by match (see tasks/v1/data/cache.py).
+            Entries are kept next to their CSVs and tied to the CSV size and modification time, so only new or changed tables are converted.
+            Returns an error code (Unix style).
+        """
+        from tasks.v1.data.cache import build_cache, cache_available
+        if not cache_available():
+            cprint("pyarrow is needed to build the columnar cache. Install it with 'pip install pyarrow'.", 'red')
+            return 1
+        cprint(f"Input dir: {indir}")
+        # Tables grouped by soccer match, from the dataset catalog
+        grouped_filestems = {
+            filestem: [ catalog_file.path for catalog_file in catalog_files ]
+            for filestem, catalog_files in catalog_match_groups(indir).items()
+        }
+        cprint(f"Found {sum(len(filepaths) for filepaths in grouped_filestems.values())} CSV tables of {len(grouped_filestems)} matches")
+        failures = 0
+        for done, (filestem, filepaths) in enumerate(sorted(grouped_filestems.items()), start=1):
             try:
-                asyncjobs = list(map(lambda grouped_filepaths: copy_match_contents_to_postgres(grouped_filepaths, connection, schema), grouped_filestems.values()))
-                await asyncio.gather(*asyncjobs)
-            finally:
-                connection.close()
-        asyncio.run(tasks())
-        return 0
+                written = build_cache(filepaths)
+            except Exception as excpt:
+                cprint(f"[{done}/{len(grouped_filestems)}] Failed {filestem}: {type(excpt).__name__}: {excpt}", 'red')
+                failures += 1
+                continue
+            print(f"[{done}/{len(grouped_filestems)}] {filestem}: {written} of {len(filepaths)} tables converted")
+        cprint(f"{len(grouped_filestems) - failures} matches cached, {failures} failed")
+        return 0 if failures == 0 else 1
     
+    @command("catalog", help="Index every CSV table of a dataset directory tree into a persistent catalog, refreshed incrementally on later runs.")
+    @argument("indir", aliases=['i'], type=Path, description="Path to look for CSVs.")
+    @argument("checksums", aliases=['cs'], type=bool, description="Whether to also compute the checksum of every new or changed table.")
+    @argument("rows", aliases=['r'], type=bool, description="Whether to also count the rows of every new or changed table.")
+    @argument("full", aliases=['f'], type=bool, description="Whether to stat every table, instead of only listing again the directories that changed.")
+    def catalog(self, indir: Path, checksums: bool=False, rows: bool=False, full: bool=True) -> int:
+        """
+            Builds or refreshes the catalog of a dataset directory (see tasks/v1/data/catalog.py), kept at <indir>/.v1catalog.sqlite.
+            Only new, changed and removed tables are touched by a refresh.
+            The other v1-data commands list their input tables from the catalog, with a quick (full=False) refresh.
+            Returns an error code (Unix style).
+        """
+        from tasks.v1.data.catalog import Catalog
+        cprint(f"Input dir: {indir}")
+        cprint(f"Checksums? {checksums}")
+        cprint(f"Rows? {rows}")
+        cprint(f"Full? {full}")
+        with Catalog(indir) as catalog:
+            stats = catalog.refresh(checksums=checksums, rows=rows, full=full)
+            cprint(f"{stats.added} tables added, {stats.changed} changed, {stats.removed} removed, {stats.unchanged} unchanged in {stats.seconds:.3f} sec")
+            groups = catalog.match_groups()
+            complete = catalog.match_groups(complete=True)
+        cprint(f"{len(groups)} matches, {len(complete)} with all their tables")
+        cprint(f"Catalog saved at {catalog.dbpath}")
+        return 0
+
     @command("normalize-raw-features", aliases=['normalize'], help="Normalized extracted raw features for use in v1.0.x experiments from each CSV and save it in a new CSV.")
     @argument("compress", aliases=['c'], type=bool, description="Whether to compress the generated CSV.")
     @argument("indir", aliases=['i'], type=Path, description="Path to look for CSVs.")
     @argument("outdir", aliases=['o'], type=Path, description="Path to save the generated CSVs.")
-    def normalize_raw_features(self, indir: Path, compress: bool=True, outdir: Path=Path(os.getcwd())) -> int:
+    @argument("memory_budget", aliases=['mb'], type=int, description="Memory budget in MB of each table being processed, which is then streamed in chunks. 0 reads whole tables.")
+    @argument("jobs", aliases=['j'], type=int, description="Number of worker processes, each processing one file at a time.")
+    @argument("profile", aliases=['pf'], type=Path, description="If given, path prefix where to save the profile of the run (<profile>.spans.json and <profile>.trace.json, for chrome://tracing).")
+    def normalize_raw_features(self, indir: Path, compress: bool=True, outdir: Path=Path(os.getcwd()), memory_budget: int=0, jobs: int=1, profile: Optional[Path]=None) -> int:
         """
             Normalizes previously extracted raw features. Each feature has its own normalization bounds.
+            The params of each match are read from its serverparams and playerparams tables, if any next to it, and the
+            rcssserver v16 defaults are used otherwise (as for tables written by extract-raw-features).
         """
+        from tasks.profiling import profile_run
         from tasks.v1.data import normalize_raw_features
+        from tasks.v1.data.jobs import run_jobs
         os.getcwd()
         cprint(f"Compress? {compress}")
         cprint(f"Input dir: {indir}")
         cprint(f"Output dir: {outdir}")
+        cprint(f"Memory budget: {memory_budget} MB")
+        cprint(f"Jobs: {jobs}")
+        memory_budget = (memory_budget * 2**20 if memory_budget > 0 else None)
         if not outdir.exists():
             try:
                 os.makedirs(outdir)
             except OSError as err:
                 cprint(err)
                 return 1
-        csvpaths, compressedcsvpaths = listcsvs(indir)
+        csvpaths, compressedcsvpaths = catalogcsvs(indir, exclude=[outdir])
         cprint(f"Found {len(csvpaths)} CSV files")
         cprint(f"Found {len(compressedcsvpaths)} GZ-compressed CSV files")
-        async def tasks():
-            asyncjobs = list(map(lambda filepath: normalize_raw_features(filepath, compress, outdir), csvpaths)) +\
-                        list(map(lambda filepath: normalize_raw_features(filepath, compress, outdir), compressedcsvpaths))
-            await asyncio.gather(*asyncjobs)
-        asyncio.run(tasks())
-        return 0
+        with profile_run('v1-data normalize-raw-features', profile):
+            failures = run_jobs(
+                normalize_raw_features,
+                sorted([*csvpaths, *compressedcsvpaths]),
+                jobs=jobs,
+                compress=compress,
+                output_dir=outdir,
+                memory_budget=memory_budget
+            )
+        cprint(f"{len(csvpaths) + len(compressedcsvpaths) - len(failures)} files normalized, {len(failures)} failed")
+        return 0 if len(failures) == 0 else 1
 
     @command("extract-raw-features", aliases=['extract'], help="Extract the useful data for use in v1.0.x experiments from each CSV and save it in a new CSV.")
     @argument("compress", aliases=['c'], type=bool, description="Whether to compress the generated CSV.")
     @argument("indir", aliases=['i'], type=Path, description="Path to look for CSVs.")
     @argument("outdir", aliases=['o'], type=Path, description="Path to save the generated CSVs.")
-    def extract_raw_features(self, indir: Path, compress: bool=True, outdir: Path=Path(os.getcwd())) -> int:
+    @argument("memory_budget", aliases=['mb'], type=int, description="Memory budget in MB of each table being processed, which is then streamed in chunks. 0 reads whole tables.")
+    @argument("jobs", aliases=['j'], type=int, description="Number of worker processes, each processing one file at a time.")
+    @argument("profile", aliases=['pf'], type=Path, description="If given, path prefix where to save the profile of the run (<profile>.spans.json and <profile>.trace.json, for chrome://tracing).")
+    def extract_raw_features(self, indir: Path, compress: bool=True, outdir: Path=Path(os.getcwd()), memory_budget: int=0, jobs: int=1, profile: Optional[Path]=None) -> int:
         """
             Extracts a subset of raw features (table columns) from the canonical dataset that are useful for v1.0.x experiments
             Returns an error code (Unix style).
         """
+        from tasks.profiling import profile_run
         from tasks.v1.data import extract_raw_features
+        from tasks.v1.data.jobs import run_jobs
         cprint(f"Compress? {compress}")
         cprint(f"Input dir: {indir}")
         cprint(f"Output dir: {outdir}")
+        cprint(f"Memory budget: {memory_budget} MB")
+        cprint(f"Jobs: {jobs}")
+        memory_budget = (memory_budget * 2**20 if memory_budget > 0 else None)
         if not outdir.exists():
             try:
                 os.makedirs(outdir)
             except OSError as err:
                 cprint(err)
                 return 1
-        csvpaths, compressedcsvpaths = listcsvs(indir)
+        csvpaths, compressedcsvpaths = catalogcsvs(indir, exclude=[outdir])
         cprint(f"Found {len(csvpaths)} CSV files")
         cprint(f"Found {len(compressedcsvpaths)} GZ-compressed CSV files")
-        async def tasks():
-            asyncjobs = list(map(lambda filepath: extract_raw_features(filepath, compress, outdir), csvpaths)) +\
-                        list(map(lambda filepath: extract_raw_features(filepath, compress, outdir), compressedcsvpaths))
-            await asyncio.gather(*asyncjobs)
-        asyncio.run(tasks())
-        return 0
+        with profile_run('v1-data extract-raw-features', profile):
+            failures = run_jobs(
+                extract_raw_features,
+                sorted([*csvpaths, *compressedcsvpaths]),
+                jobs=jobs,
+                compress=compress,
+                output_dir=outdir,
+                memory_budget=memory_budget
+            )
+        cprint(f"{len(csvpaths) + len(compressedcsvpaths) - len(failures)} files extracted, {len(failures)} failed")
+        return 0 if len(failures) == 0 else 1
     
+    @command("prepare", help="Extract and normalize the useful data for use in v1.0.x experiments from each CSV in a single pass and save it in a new CSV.")
+    @argument("compress", aliases=['c'], type=bool, description="Whether to compress the generated CSV.")
+    @argument("indir", aliases=['i'], type=Path, description="Path to look for CSVs.")
+    @argument("outdir", aliases=['o'], type=Path, description="Path to save the generated (normalized) CSVs.")
+    @argument("rawdir", aliases=['r'], type=Path, description="If given, path to also save the extracted CSVs before normalization.")
+    @argument("memory_budget", aliases=['mb'], type=int, description="Memory budget in MB of each table being processed, which is then streamed in chunks. 0 reads whole tables.")
+    @argument("jobs", aliases=['j'], type=int, description="Number of worker processes, each processing one file at a time.")
+    @argument("profile", aliases=['pf'], type=Path, description="If given, path prefix where to save the profile of the run (<profile>.spans.json and <profile>.trace.json, for chrome://tracing).")
+    def prepare(self, indir: Path, compress: bool=True, outdir: Path=Path(os.getcwd()), rawdir: Optional[Path]=None, memory_budget: int=0, jobs: int=1, profile: Optional[Path]=None) -> int:
+        """
+            Extracts the same features as extract-raw-features and normalizes them as normalize-raw-features does, but every
+            raw table is read only once and normalized in memory, so no intermediate CSV is written and parsed back.
+            Unlike normalize-raw-features over an extracted directory, which has no serverparams or playerparams tables and so
+            falls back to the rcssserver v16 defaults, the match's own params are used: outputs only match for default params.
+            Returns an error code (Unix style).
+        """
+        from tasks.profiling import profile_run
+        from tasks.v1.data import prepare_raw_features
+        from tasks.v1.data.jobs import run_jobs
+        cprint(f"Compress? {compress}")
+        cprint(f"Input dir: {indir}")
+        cprint(f"Output dir: {outdir}")
+        cprint(f"Raw output dir: {rawdir}")
+        cprint(f"Memory budget: {memory_budget} MB")
+        cprint(f"Jobs: {jobs}")
+        memory_budget = (memory_budget * 2**20 if memory_budget > 0 else None)
+        for dirpath in (outdir, rawdir):
+            if dirpath is not None and not dirpath.exists():
+                try:
+                    os.makedirs(dirpath)
+                except OSError as err:
+                    cprint(err)
+                    return 1
+        csvpaths, compressedcsvpaths = catalogcsvs(indir, exclude=[ dirpath for dirpath in (outdir, rawdir) if dirpath is not None ])
+        cprint(f"Found {len(csvpaths)} CSV files")
+        cprint(f"Found {len(compressedcsvpaths)} GZ-compressed CSV files")
+        with profile_run('v1-data prepare', profile):
+            failures = run_jobs(
+                prepare_raw_features,
+                sorted([*csvpaths, *compressedcsvpaths]),
+                jobs=jobs,
+                compress=compress,
+                output_dir=outdir,
+                raw_output_dir=rawdir,
+                memory_budget=memory_budget
+            )
+        cprint(f"{len(csvpaths) + len(compressedcsvpaths) - len(failures)} files prepared, {len(failures)} failed")
+        return 0 if len(failures) == 0 else 1
+
+    @command("build-training-set", aliases=['training-set'], help="Build a training dataset (the rows of db/gen_dataset_indarch.sql) straight from every match's CSV tables, without postgres.")
+    @argument("indir", aliases=['i'], type=Path, description="Path to look for CSVs.")
+    @argument("outpath", aliases=['o'], type=Path, description="Training dataset CSV to write (.csv or .csv.gz), or else empty directory where to save shards.")
+    @argument("teamname", aliases=['t'], type=str, description="Team whose commands make the rows.")
+    @argument("goalkeeper", aliases=['g'], type=bool, description="Whether to also make rows of the goalkeeper's commands.")
+    @argument("rows_per_shard", aliases=['rs'], type=int, description="Maximum number of rows of each shard.")
+    @argument("shuffle_seed", aliases=['s'], type=int, description="Seed to shuffle the rows of each match. Negative keeps the match table order.")
+    @argument("jobs", aliases=['j'], type=int, description="Number of worker processes, each joining one match at a time.")
+    @argument("profile", aliases=['pf'], type=Path, description="If given, path prefix where to save the profile of the run (<profile>.spans.json and <profile>.trace.json, for chrome://tracing).")
+    def build_training_set(self, indir: Path, outpath: Path, teamname: str='HELIOS2019', goalkeeper: bool=False, rows_per_shard: int=2**20, shuffle_seed: int=-1, jobs: int=1, profile: Optional[Path]=None) -> int:
+        """
+            Joins the tables of every match in a folder into training rows (see tasks/v1/data/training.py), the same ones
+            db/gen_dataset_indarch.sql outputs from a postgres schema loaded with these tables, and writes them match after match.
+            The result can be given to v1-train (or to make-training-shards, if a CSV).
+            Returns an error code (Unix style).
+        """
+        from tasks.profiling import profile_run
+        from tasks.v1.data.training import is_csv_path, write_training_set
+        cprint(f"Input dir: {indir}")
+        cprint(f"Output: {outpath}")
+        cprint(f"Team: {teamname}")
+        cprint(f"Goalkeeper? {goalkeeper}")
+        cprint(f"Shuffle seed: {shuffle_seed if shuffle_seed >= 0 else None}")
+        cprint(f"Jobs: {jobs}")
+        outdir = outpath.parent if is_csv_path(outpath) else outpath
+        if not outdir.exists():
+            try:
+                os.makedirs(outdir)
+            except OSError as err:
+                cprint(err)
+                return 1
+        # Tables grouped by soccer match, from the dataset catalog
+        grouped_filestems = {
+            filestem: [ catalog_file.path for catalog_file in catalog_files ]
+            for filestem, catalog_files in catalog_match_groups(indir, exclude=[outdir]).items()
+        }
+        cprint(f"Found {sum(len(filepaths) for filepaths in grouped_filestems.values())} CSV tables of {len(grouped_filestems)} matches")
+        start_time = time.time()
+        with profile_run('v1-data build-training-set', profile):
+            try:
+                rows, failures = write_training_set(
+                    [ grouped_filestems[filestem] for filestem in sorted(grouped_filestems) ],
+                    outpath,
+                    jobs=jobs,
+                    teamname=teamname,
+                    goalkeeper=goalkeeper,
+                    rows_per_shard=rows_per_shard,
+                    shuffle_seed=(shuffle_seed if shuffle_seed >= 0 else None)
+                )
+            except Exception as excpt:
+                cprint(f"Failed to write {outpath}: {type(excpt).__name__}: {excpt}", 'red')
+                return 1
+        cprint(f"Wrote {rows} rows of {len(grouped_filestems) - len(failures)} matches in {time.time() - start_time} sec, {len(failures)} failed")
+        return 0 if len(failures) == 0 else 1
+
+    @command("make-training-shards", aliases=['shards'], help="Convert a training dataset CSV into memory-mapped float32 shards that v1-train reads without parsing text.")
+    @argument("infile", aliases=['i'], type=Path, description="Training dataset CSV (may be GZ-compressed).")
+    @argument("outdir", aliases=['o'], type=Path, description="Empty directory where to save the shards.")
+    @argument("rows_per_shard", aliases=['rs'], type=int, description="Maximum number of rows of each shard.")
+    @argument("chunk_rows", aliases=['cr'], type=int, description="Number of CSV rows converted at once.")
+    @argument("shuffle_seed", aliases=['s'], type=int, description="Seed to shuffle the rows of each converted chunk. Negative keeps the CSV order.")
+    def make_training_shards(self, infile: Path, outdir: Path, rows_per_shard: int=2**20, chunk_rows: int=2**16, shuffle_seed: int=-1) -> int:
+        """
+            Converts a training (or test and validation) dataset CSV into shards (see tasks/v1/data/shards.py).
+            The resulting directory can be given to v1-train in place of the CSV.
+            Returns an error code (Unix style).
+        """
+        from tasks.v1.data.shards import write_training_shards
+        cprint(f"Input file: {infile}")
+        cprint(f"Output dir: {outdir}")
+        cprint(f"Rows per shard: {rows_per_shard}")
+        cprint(f"Shuffle seed: {shuffle_seed if shuffle_seed >= 0 else None}")
+        if not outdir.exists():
+            try:
+                os.makedirs(outdir)
+            except OSError as err:
+                cprint(err)
+                return 1
+        start_time = time.time()
+        try:
+            manifests = write_training_shards(
+                infile,
+                outdir,
+                rows_per_shard=rows_per_shard,
+                chunk_rows=chunk_rows,
+                shuffle_seed=(shuffle_seed if shuffle_seed >= 0 else None)
+            )
+        except Exception as excpt:
+            cprint(f"Failed to convert {infile}: {type(excpt).__name__}: {excpt}", 'red')
+            return 1
+        cprint(f"Wrote {sum(manifest.rows for manifest in manifests)} rows in {len(manifests)} shards in {time.time() - start_time} sec")
+        return 0
+
+    @command("make-training-tfrecords", aliases=['tfrecords'], help="Convert a training dataset CSV into sharded GZIP-compressed TFRecord files that v1-train decodes in parallel.")
+    @argument("infile", aliases=['i'], type=Path, description="Training dataset CSV (may be GZ-compressed).")
+    @argument("outdir", aliases=['o'], type=Path, description="Empty directory where to save the TFRecord files.")
+    @argument("num_files", aliases=['n'], type=int, description="Number of TFRecord files to spread the rows over.")
+    @argument("chunk_rows", aliases=['cr'], type=int, description="Number of CSV rows converted at once.")
+    @argument("shuffle_seed", aliases=['s'], type=int, description="Seed to shuffle the rows of each converted chunk. Negative keeps the CSV order.")
+    def make_training_tfrecords(self, infile: Path, outdir: Path, num_files: int=16, chunk_rows: int=2**16, shuffle_seed: int=-1) -> int:
+        """
+            Converts a training (or test and validation) dataset CSV into TFRecord files (see tasks/v1/experiments/tfrecords.py).
+            The resulting directory can be given to v1-train in place of the CSV.
+            Returns an error code (Unix style).
+        """
+        from tasks.v1.experiments.tfrecords import write_training_tfrecords
+        cprint(f"Input file: {infile}")
+        cprint(f"Output dir: {outdir}")
+        cprint(f"Number of files: {num_files}")
+        cprint(f"Shuffle seed: {shuffle_seed if shuffle_seed >= 0 else None}")
+        if not outdir.exists():
+            try:
+                os.makedirs(outdir)
+            except OSError as err:
+                cprint(err)
+                return 1
+        start_time = time.time()
+        try:
+            manifest = write_training_tfrecords(
+                infile,
+                outdir,
+                num_files=num_files,
+                chunk_rows=chunk_rows,
+                shuffle_seed=(shuffle_seed if shuffle_seed >= 0 else None)
+            )
+        except Exception as excpt:
+            cprint(f"Failed to convert {infile}: {type(excpt).__name__}: {excpt}", 'red')
+            return 1
+        cprint(f"Wrote {sum(file['rows'] for file in manifest['files'])} rows in {len(manifest['files'])} files in {time.time() - start_time} sec")
+        return 0
+
+    @command("restore-deferred-indexes", help="Rebuild the indexes and foreign keys dropped by a bulk load (see copy-all-matches-contents-to-postgres) that was interrupted.")
+    @argument("hostname", aliases=['hn'], type=str, description="Postgres host.")
+    @argument("password", aliases=['pw'], type=str, description="Postgres user password.")
+    @argument("port", aliases=['p'], type=int, description="Postgres port.")
+    @argument("user", aliases=['u'], type=str, description="Postgres user.")
+    @argument("dbname", aliases=['db'], type=str, description="Postgres database name.")
+    @argument("schema", aliases=['sc'], type=str, description="Postgres database schema name.")
+    @argument("workers", aliases=['w'], type=int, description="Number of Postgres connections rebuilding indexes and validating foreign keys at the same time.")
+    def restore_deferred_indexes(self, hostname: str, password: str, schema: str, port: int=5432, user: str='postgres', dbname: str='postgres', workers: int=4) -> int:
+        """
+            Restores what a bulk load deferred and couldn't restore itself (e.g. killed, or duplicated rows that have been fixed since).
+            Returns an error code (Unix style).
+        """
+        from tasks.v1.data.bulkload import restore_deferred
+        from tasks.v1.data.ingestion import ConnectionParams
+        cprint(f"Host: {hostname}")
+        cprint(f"Port: {port}")
+        cprint(f"DB Schema: {schema}")
+        cprint(f"Username: {user}")
+        cprint(f"DB Name: {dbname}")
+        cprint(f"Workers: {workers}")
+        try:
+            restored = restore_deferred(ConnectionParams(hostname, password, port, user, dbname), schema, workers=workers)
+        except Exception as excpt:
+            # What was restored until then stays restored, the rest stays recorded
+            cprint(f"Failed to restore the deferred indexes and constraints of {schema}: {type(excpt).__name__}: {excpt}", 'red')
+            return 1
+        cprint(f"{len(restored)} indexes and constraints restored")
+        return 0
+
+    @command("convert-playerstates", help="Copy every match of a postgres schema into an empty schema with the other player states layout (see db/setup_pg_v1_data_compact.sql).")
+    @argument("hostname", aliases=['hn'], type=str, description="Postgres host.")
+    @argument("password", aliases=['pw'], type=str, description="Postgres user password.")
+    @argument("port", aliases=['p'], type=int, description="Postgres port.")
+    @argument("user", aliases=['u'], type=str, description="Postgres user.")
+    @argument("dbname", aliases=['db'], type=str, description="Postgres database name.")
+    @argument("source", aliases=['src'], type=str, description="Postgres database schema name to convert.")
+    @argument("target", aliases=['dst'], type=str, description="Postgres database schema name, set up with the other layout, where to copy the matches.")
+    @argument("workers", aliases=['w'], type=int, description="Number of Postgres connections converting matches at the same time.")
+    @argument("profile", aliases=['pf'], type=Path, description="If given, path prefix where to save the profile of the run (<profile>.spans.json and <profile>.trace.json, for chrome://tracing).")
+    def convert_playerstates(self, hostname: str, password: str, source: str, target: str, port: int=5432, user: str='postgres', dbname: str='postgres', workers: int=1, profile: Optional[Path]=None) -> int:
+        """
+            Compacts the player states of a schema of db/setup_pg_v1_data.sql into one of db/setup_pg_v1_data_compact.sql,
+            or expands them back. Matches already converted are skipped, so an interrupted conversion can be run again.
+            Returns an error code (Unix style).
+        """
+        from tasks.profiling import profile_run
+        from tasks.v1.data.compact import convert_playerstates
+        from tasks.v1.data.ingestion import ConnectionParams
+        cprint(f"Host: {hostname}")
+        cprint(f"Port: {port}")
+        cprint(f"Source schema: {source}")
+        cprint(f"Target schema: {target}")
+        cprint(f"Username: {user}")
+        cprint(f"DB Name: {dbname}")
+        cprint(f"Workers: {workers}")
+        with profile_run('v1-data convert-playerstates', profile):
+            try:
+                converted, failures = convert_playerstates(ConnectionParams(hostname, password, port, user, dbname), source, target, workers=workers)
+            except ValueError as excpt:
+                cprint(f"Failed to convert {source}: {excpt}", 'red')
+                return 1
+        cprint(f"{converted} matches converted, {len(failures)} failed")
+        return 0 if len(failures) == 0 else 1
+
+    @command("export-training-shards", aliases=['export'], help="Export the training dataset of a postgres schema (the rows of db/gen_dataset_indarch.sql) straight into memory-mapped shards.")
+    @argument("hostname", aliases=['hn'], type=str, description="Postgres host.")
+    @argument("password", aliases=['pw'], type=str, description="Postgres user password.")
+    @argument("port", aliases=['p'], type=int, description="Postgres port.")
+    @argument("user", aliases=['u'], type=str, description="Postgres user.")
+    @argument("dbname", aliases=['db'], type=str, description="Postgres database name.")
+    @argument("schema", aliases=['sc'], type=str, description="Postgres database schema name.")
+    @argument("outdir", aliases=['o'], type=Path, description="Empty directory where to save the shards.")
+    @argument("connections", aliases=['c'], type=int, description="Number of Postgres connections exporting ranges of matches at the same time.")
+    @argument("partitions", aliases=['pt'], type=int, description="Number of ranges of matches to split the export into. Zero or less gives one range per connection.")
+    @argument("teamname", aliases=['t'], type=str, description="Team whose commands make the rows.")
+    @argument("goalkeeper", aliases=['g'], type=bool, description="Whether to also make rows of the goalkeeper's commands.")
+    @argument("rows_per_shard", aliases=['rs'], type=int, description="Maximum number of rows of each shard.")
+    @argument("chunk_rows", aliases=['cr'], type=int, description="Number of rows decoded at once by each connection.")
+    @argument("profile", aliases=['pf'], type=Path, description="If given, path prefix where to save the profile of the run (<profile>.spans.json and <profile>.trace.json, for chrome://tracing).")
+    def export_training_shards(self, hostname: str, password: str, schema: str, outdir: Path, port: int=5432, user: str='postgres', dbname: str='postgres', connections: int=4, partitions: int=0, teamname: str='HELIOS2019', goalkeeper: bool=False, rows_per_shard: int=2**20, chunk_rows: int=2**14, profile: Optional[Path]=None) -> int:
+        """
+            Streams the training rows of every range of matches of a schema with a binary COPY into its own shards
+            (see tasks/v1/data/export.py). The resulting directory can be given to v1-train.
+            Returns an error code (Unix style).
+        """
+        from tasks.profiling import profile_run
+        from tasks.v1.data.export import export_training_shards
+        from tasks.v1.data.ingestion import ConnectionParams
+        cprint(f"Host: {hostname}")
+        cprint(f"Port: {port}")
+        cprint(f"DB Schema: {schema}")
+        cprint(f"Username: {user}")
+        cprint(f"DB Name: {dbname}")
+        cprint(f"Output dir: {outdir}")
+        cprint(f"Connections: {connections}")
+        cprint(f"Team: {teamname}")
+        cprint(f"Goalkeeper? {goalkeeper}")
+        if not outdir.exists():
+            try:
+                os.makedirs(outdir)
+            except OSError as err:
+                cprint(err)
+                return 1
+        start_time = time.time()
+        with profile_run('v1-data export-training-shards', profile):
+            try:
+                rows, failures = export_training_shards(
+                    ConnectionParams(hostname, password, port, user, dbname),
+                    schema,
+                    outdir,
+                    connections=connections,
+                    partitions=(partitions if partitions > 0 else None),
+                    teamname=teamname,
+                    goalkeeper=goalkeeper,
+                    rows_per_shard=rows_per_shard,
+                    chunk_rows=chunk_rows
+                )
+            except Exception as excpt:
+                cprint(f"Failed to export {schema}: {type(excpt).__name__}: {excpt}", 'red')
+                return 1
+        cprint(f"Exported {rows} rows in {time.time() - start_time} sec, {len(failures)} ranges of matches failed")
+        return 0 if len(failures) == 0 else 1
+
     @command("copy-all-matches-metadata-to-postgres", aliases=['postgres'], help="Copy Matches' metadata to a postgresql database's 'public.matches' table.")
     @argument("indir", aliases=['i'], type=Path, description="Path to look for CSVs.")
     @argument("hostname", aliases=['hn'], type=str, description="Postgres host.")
@@ -161,33 +669,52 @@ class DataCLI:
     @argument("port", aliases=['p'], type=int, description="Postgres port.")
     @argument("user", aliases=['u'], type=str, description="Postgres user.")
     @argument("dbname", aliases=['db'], type=str, description="Postgres database name.")
-    def copy_all_matches_metadata_to_postgres(self, indir: Path, hostname: str, password: str, port: int=5432, user: str='postgres', dbname: str='postgres') -> int:
+    @argument("workers", aliases=['w'], type=int, description="Number of worker processes, each with its own Postgres connection.")
+    @argument("batched", aliases=['b'], type=bool, description="Whether to upsert every match at once, with a single statement, instead of inserting them one by one.")
+    @argument("profile", aliases=['pf'], type=Path, description="If given, path prefix where to save the profile of the run (<profile>.spans.json and <profile>.trace.json, for chrome://tracing).")
+    def copy_all_matches_metadata_to_postgres(self, indir: Path, hostname: str, password: str, port: int=5432, user: str='postgres', dbname: str='postgres', workers: int=1, batched: bool=False, profile: Optional[Path]=None) -> int:
         """
             Copy all data in a folder to a postgres database.
             All the data is dumped into a specific table of a specific schema.
             Returns an error code (Unix style).
         """
-        from tasks.v1.data import copy_match_metadata_to_postgres
+        from tasks.profiling import profile_run
+        from tasks.v1.data import copy_match_metadata_to_postgres, upsert_matches_metadata
+        from tasks.v1.data.ingestion import ConnectionParams, run_ingestion
+        from tasks.v1.data.manifest import create_load_manifest
         cprint(f"Input dir: {indir}")
         cprint(f"Host: {hostname}")
         cprint(f"Password: {password}")
         cprint(f"Port: {port}")
         cprint(f"Username: {user}")
         cprint(f"DB Name: {dbname}")
-        csvpaths, compressedcsvpaths = listcsvs(indir)
+        cprint(f"Workers: {workers}")
+        cprint(f"Batched? {batched}")
+        csvpaths, compressedcsvpaths = catalogcsvs(indir)
         cprint(f"Found {len(csvpaths)} CSV files")
         cprint(f"Found {len(compressedcsvpaths)} GZ-compressed CSV files")
-        async def tasks():
-            connection = pg.connect(f"host={hostname} port={port} dbname={dbname} user={user} password={password}")
-            try:
-                match_filepaths = list(filter(lambda filepath: filepath.name.endswith('.match.csv'), csvpaths)) +\
-                        list(filter(lambda filepath: filepath.name.endswith('.match.csv.gz'), compressedcsvpaths))
-                asyncjobs = list(map(lambda match_filepath: copy_match_metadata_to_postgres(match_filepath, connection), match_filepaths))
-                await asyncio.gather(*asyncjobs)
-            finally:
-                connection.close()
-        asyncio.run(tasks())
-        return 0
+        match_filepaths = list(filter(lambda filepath: filepath.name.endswith('.match.csv'), csvpaths)) +\
+                list(filter(lambda filepath: filepath.name.endswith('.match.csv.gz'), compressedcsvpaths))
+        # Metadata inserts keep the connection's default isolation level
+        connection_params = ConnectionParams(hostname, password, port, user, dbname, isolation_level=None)
+        # Matches already in the load manifest are skipped
+        with closing(connection_params.connect()) as connection:
+            create_load_manifest(connection)
+        with profile_run('v1-data copy-all-matches-metadata-to-postgres', profile):
+            if batched:
+                with closing(connection_params.connect()) as connection:
+                    _, failures = asyncio.run(upsert_matches_metadata(match_filepaths, connection))
+                for filepath, error in failures:
+                    cprint(f"Failed {str(filepath)[:100]}: {error}", 'red')
+            else:
+                failures = run_ingestion(
+                    copy_match_metadata_to_postgres,
+                    match_filepaths,
+                    connection_params,
+                    workers=workers
+                )
+        cprint(f"{len(match_filepaths) - len(failures)} matches copied, {len(failures)} failed")
+        return 0 if len(failures) == 0 else 1
 
 
 @command("v1-train", help='Commands for training models for experiments')
@@ -223,8 +750,8 @@ class TrainCLI:
 
     
     @command("v1-0-x", help='Feedforward Neural Network training for action type prediction and action parameter regression')
-    @argument('training', type=Path, description="The path to the training dataset file.")
-    @argument('test_and_validation', type=Path, description="The path to the test and validation dataset file.")
+    @argument('training', type=Path, description="The path to the training dataset file (GZ-compressed CSV) or shards/TFRecords directory (see v1-data make-training-shards and make-training-tfrecords).")
+    @argument('test_and_validation', type=Path, description="The path to the test and validation dataset file (GZ-compressed CSV) or shards/TFRecords directory.")
     @argument('nsessions', type=int, description="Number of training sessions to execute.")
     @argument('outdir', type=Path, description="The root folder where to store training logs, tensorboard logs and trained models.")
     @argument('seed', type=int, description="Seed to be used for random number generation during training. If none is specified, a new one is generated")
@@ -370,6 +897,7 @@ class TrainCLI:
                     logger=SessionLoggerAdapter(logger,{},session),
                     tensorboard_suffix=tensorboard_suffix,
                     num_checkpoints=num_checkpoints,
+                    seed=seed,
                     # Dataset params
                     training_datasetpath=training,
                     test_and_validation_datasetpath=test_and_validation,
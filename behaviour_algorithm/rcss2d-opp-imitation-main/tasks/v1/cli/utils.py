@@ -1,7 +1,10 @@
 import logging
 import os
 from pathlib import Path
-from typing import Any, Dict, List, Tuple
+import sqlite3
+from typing import Any, Dict, Iterable, List, Tuple
+
+from tasks.v1.data.catalog import Catalog, CatalogFile
 
 def listcsvs(dataset_dirpath: Path) -> Tuple[List[Path], List[Path]]:
     """ 
@@ -26,6 +29,31 @@ def listcsvs(dataset_dirpath: Path) -> Tuple[List[Path], List[Path]]:
             compressedcsvpaths.append(content_path)
     return csvpaths, compressedcsvpaths
 
+def catalogcsvs(dataset_dirpath: Path, exclude: Iterable[Path]=()) -> Tuple[List[Path], List[Path]]:
+    """ 
+        Lists the CSV tables of a dataset directory tree, at any depth, from its catalog (see tasks/v1/data/catalog.py).
+        The catalog is brought up to date first, only listing again the directories that changed.
+        :exclude: directories whose tables are left out, like the output directories of a command inside the dataset.
+
+        Returns list with CSVs paths, list with compressed CSVs paths
+    """
+    with _refreshed_catalog(dataset_dirpath) as catalog:
+        return catalog.csvpaths(exclude)
+
+def catalog_match_groups(dataset_dirpath: Path, exclude: Iterable[Path]=()) -> Dict[str, List[CatalogFile]]:
+    """ Tables of a dataset directory tree grouped by soccer match, from its catalog. See catalogcsvs. """
+    with _refreshed_catalog(dataset_dirpath) as catalog:
+        return catalog.match_groups(exclude=exclude)
+
+def _refreshed_catalog(dataset_dirpath: Path) -> Catalog:
+    try:
+        catalog = Catalog(dataset_dirpath)
+    except (sqlite3.Error, OSError):
+        # Nowhere to keep it (e.g. read-only dataset and cache directory): the whole tree is walked into memory instead
+        catalog = Catalog(dataset_dirpath, dbpath=Path(':memory:'))
+    catalog.refresh(full=False)
+    return catalog
+
 class SessionLoggerAdapter(logging.LoggerAdapter):
     """ 
         Logger Adapter for training sessions
@@ -0,0 +1,259 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing, contextmanager
+from typing import Dict, Iterator, List, NamedTuple, Optional
+
+import psycopg2 as pg
+from termcolor import cprint
+
+from tasks.profiling import in_thread, span
+from .ingestion import ConnectionParams
+
+"""
+    Bulk-load mode: the secondary indexes and the foreign keys of the biggest tables of a v1 schema are dropped before a large
+    load and built again once every match is loaded, instead of being maintained row by row.
+        - the definitions of what is dropped are recorded in DEFERRED_TABLE, in the same transaction as the drops, so they survive
+          a failed load or a killed process. Running the bulk-load mode again (or restore_deferred) restores them.
+        - primary keys and check constraints are kept: the loaders read the generated keys back and checks are cheap.
+        - unique constraints are rebuilt as plain unique indexes, several at a time (one connection each), and then attached to
+          their tables, which takes no time. Foreign keys are added back NOT VALID and validated afterwards, one table per connection.
+    Matches must not be deleted in between: without their foreign keys, the ON DELETE CASCADE of the deferred tables don't run.
+"""
+DEFERRED_TABLE = 'public.deferred_definitions'
+DEFERRED_DDL = f"""
+CREATE TABLE IF NOT EXISTS {DEFERRED_TABLE} (
+    target_schema       varchar(64) NOT NULL,
+    name                varchar(64) NOT NULL,
+    tablename           varchar(64) NOT NULL,
+    kind                varchar(16) NOT NULL,
+    definition          text NOT NULL,
+    deferred_at         timestamptz NOT NULL DEFAULT now(),
+    PRIMARY KEY (target_schema, name)
+);
+"""
+# Tables of a v1 schema with the most rows, hence the most index and foreign key maintenance
+DEFAULT_DEFERRED_TABLES = ['playerstates', 'playercommands']
+# Kinds of deferred definitions, in restoring order
+INDEX = 'index'
+UNIQUE = 'unique'
+FOREIGN_KEY = 'foreign key'
+
+
+class DeferredDefinition(NamedTuple):
+    name:       str
+    tablename:  str
+    kind:       str
+    # CREATE INDEX statement for indexes and unique constraints, constraint definition for foreign keys
+    definition: str
+
+
+def drop_statement(schema: str, definition: DeferredDefinition) -> str:
+    if definition.kind == INDEX:
+        return f"DROP INDEX \"{schema}\".\"{definition.name}\";"
+    return f"ALTER TABLE \"{schema}\".\"{definition.tablename}\" DROP CONSTRAINT \"{definition.name}\";"
+
+
+def index_statement(definition: DeferredDefinition) -> str:
+    """ Builds the index of an index or unique constraint, as captured (schema-qualified). """
+    return definition.definition + ";"
+
+
+def constraint_statement(schema: str, definition: DeferredDefinition) -> str:
+    """ Adds back a unique constraint, on top of its index, or a foreign key, NOT VALID (see validate_statement). """
+    if definition.kind == UNIQUE:
+        return f"ALTER TABLE \"{schema}\".\"{definition.tablename}\" ADD CONSTRAINT \"{definition.name}\" UNIQUE USING INDEX \"{definition.name}\";"
+    return f"ALTER TABLE \"{schema}\".\"{definition.tablename}\" ADD CONSTRAINT \"{definition.name}\" {definition.definition} NOT VALID;"
+
+
+def validate_statement(schema: str, definition: DeferredDefinition) -> str:
+    return f"ALTER TABLE \"{schema}\".\"{definition.tablename}\" VALIDATE CONSTRAINT \"{definition.name}\";"
+
+
+def _deferrable_definitions(cursor: pg.extensions.cursor, schema: str, tables: List[str]) -> List[DeferredDefinition]:
+    """
+        Secondary indexes, unique constraints and foreign keys of :tables:, in dropping order.
+        Foreign keys of other tables of the schema relying on one of those unique constraints are included, since they must go first.
+    """
+    cursor.execute(
+        """
+        SELECT index.relname, target.relname, CASE WHEN con.oid IS NULL THEN %s ELSE %s END, pg_get_indexdef(index.oid)
+        FROM pg_index AS i
+        JOIN pg_class AS index ON index.oid = i.indexrelid
+        JOIN pg_class AS target ON target.oid = i.indrelid
+        JOIN pg_namespace AS ns ON ns.oid = target.relnamespace
+        LEFT JOIN pg_constraint AS con ON con.conindid = i.indexrelid AND con.conrelid = i.indrelid AND con.contype = 'u'
+        WHERE ns.nspname = %s AND target.relname = ANY(%s) AND NOT i.indisprimary
+            AND NOT EXISTS (SELECT 1 FROM pg_constraint AS other WHERE other.conindid = i.indexrelid AND other.conrelid = i.indrelid AND other.contype != 'u')
+        ORDER BY target.relname, index.relname;
+        """,
+        (INDEX, UNIQUE, schema, tables)
+    )
+    indexes = [ DeferredDefinition(*row) for row in cursor.fetchall() ]
+    cursor.execute(
+        """
+        SELECT con.conname, target.relname, %s, pg_get_constraintdef(con.oid)
+        FROM pg_constraint AS con
+        JOIN pg_class AS target ON target.oid = con.conrelid
+        JOIN pg_namespace AS ns ON ns.oid = target.relnamespace
+        LEFT JOIN pg_class AS index ON index.oid = con.conindid
+        WHERE con.contype = 'f' AND ns.nspname = %s AND (
+            target.relname = ANY(%s) OR index.relname = ANY(%s) AND index.relnamespace = ns.oid
+        )
+        ORDER BY target.relname, con.conname;
+        """,
+        (FOREIGN_KEY, schema, tables, [ definition.name for definition in indexes if definition.kind == UNIQUE ])
+    )
+    return [ DeferredDefinition(*row) for row in cursor.fetchall() ] + indexes
+
+
+def create_deferred_table(connection) -> None:
+    with closing(connection.cursor()) as cursor:
+        cursor.execute(DEFERRED_DDL)
+    connection.commit()
+
+
+def read_deferred(connection, schema: str) -> List[DeferredDefinition]:
+    """ What is dropped from :schema: and waiting to be restored. """
+    with closing(connection.cursor()) as cursor:
+        cursor.execute(f"SELECT name, tablename, kind, definition FROM {DEFERRED_TABLE} WHERE target_schema = %s ORDER BY tablename, name;", (schema,))
+        return [ DeferredDefinition(*row) for row in cursor.fetchall() ]
+
+
+def defer(connection, schema: str, tables: List[str]=DEFAULT_DEFERRED_TABLES) -> List[DeferredDefinition]:
+    """
+        Records and drops the secondary indexes, unique constraints and foreign keys of :tables: in a single transaction.
+        Definitions already deferred by an earlier run are kept. Returns every deferred definition of the schema.
+    """
+    create_deferred_table(connection)
+    with closing(connection.cursor()) as cursor:
+        try:
+            # Every name in the recorded definitions comes schema-qualified
+            cursor.execute("SET LOCAL search_path = pg_catalog;")
+            definitions = _deferrable_definitions(cursor, schema, tables)
+            for definition in definitions:
+                cursor.execute(
+                    f"INSERT INTO {DEFERRED_TABLE} (target_schema, name, tablename, kind, definition) VALUES (%s, %s, %s, %s, %s) " +
+                    "ON CONFLICT (target_schema, name) DO NOTHING;",
+                    (schema, *definition)
+                )
+                cursor.execute(drop_statement(schema, definition))
+        except Exception:
+            connection.rollback()
+            raise
+    connection.commit()
+    deferred = read_deferred(connection, schema)
+    cprint(f"Deferred {len(deferred)} indexes and constraints of {schema}: {', '.join(definition.name for definition in deferred)}")
+    return deferred
+
+
+def _forget(cursor: pg.extensions.cursor, schema: str, definition: DeferredDefinition) -> None:
+    cursor.execute(f"DELETE FROM {DEFERRED_TABLE} WHERE target_schema = %s AND name = %s;", (schema, definition.name))
+
+
+def _constraint_exists(cursor: pg.extensions.cursor, schema: str, definition: DeferredDefinition) -> bool:
+    cursor.execute(
+        "SELECT 1 FROM pg_constraint AS con JOIN pg_class AS target ON target.oid = con.conrelid " +
+        "WHERE target.relnamespace = %s::regnamespace AND target.relname = %s AND con.conname = %s;",
+        (schema, definition.tablename, definition.name)
+    )
+    return cursor.fetchone() is not None
+
+
+def _build_index(connection_params: ConnectionParams, schema: str, definition: DeferredDefinition, maintenance_work_mem: Optional[str]) -> None:
+    """ Builds an index on its own connection. Indexes that already exist (e.g. built by a restore that failed later) are kept. """
+    with closing(connection_params.connect()) as connection, closing(connection.cursor()) as cursor:
+        if maintenance_work_mem is not None:
+            cursor.execute("SET maintenance_work_mem = %s;", (maintenance_work_mem,))
+        cursor.execute("SELECT to_regclass(%s);", (f'"{schema}"."{definition.name}"',))
+        (existing,) = cursor.fetchone()
+        with span('index', table=definition.tablename, index=definition.name):
+            if existing is None:
+                cursor.execute(index_statement(definition))
+            if definition.kind == INDEX:
+                _forget(cursor, schema, definition)
+        connection.commit()
+
+
+def _validate_foreign_keys(connection_params: ConnectionParams, schema: str, definitions: List[DeferredDefinition]) -> None:
+    """ Validates the foreign keys of a table on its own connection, each in its own transaction. """
+    with closing(connection_params.connect()) as connection, closing(connection.cursor()) as cursor:
+        for definition in definitions:
+            with span('validate', table=definition.tablename, constraint=definition.name):
+                cursor.execute(validate_statement(schema, definition))
+                _forget(cursor, schema, definition)
+            connection.commit()
+
+
+def restore_deferred(connection_params: ConnectionParams, schema: str, workers: int=4, maintenance_work_mem: Optional[str]=None) -> List[DeferredDefinition]:
+    """
+        Restores every definition deferred from :schema:, using up to :workers: connections at a time:
+        indexes first, then unique constraints on top of their indexes and last the foreign keys, validated against the loaded rows.
+        Raises on the first definition that can't be restored (e.g. duplicated rows for a unique constraint). What was restored
+        until then stays restored, and the rest stays recorded, so it can be called again once the data is fixed.
+        Returns the restored definitions.
+    """
+    with closing(connection_params.connect()) as connection:
+        create_deferred_table(connection)
+        deferred = read_deferred(connection, schema)
+        if len(deferred) == 0:
+            return []
+        cprint(f"Restoring {len(deferred)} indexes and constraints of {schema}...")
+        with span('restore', rows=len(deferred), schema=schema):
+            indexes = [ definition for definition in deferred if definition.kind in (INDEX, UNIQUE) ]
+            with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+                # Results are waited for in order, so the first failure is raised once every build has finished
+                for future in [ executor.submit(in_thread(_build_index), connection_params, schema, definition, maintenance_work_mem) for definition in indexes ]:
+                    future.result()
+            foreign_keys = [ definition for definition in deferred if definition.kind == FOREIGN_KEY ]
+            with closing(connection.cursor()) as cursor:
+                try:
+                    for definition in deferred:
+                        if definition.kind == UNIQUE:
+                            if not _constraint_exists(cursor, schema, definition):
+                                cursor.execute(constraint_statement(schema, definition))
+                            _forget(cursor, schema, definition)
+                    for definition in foreign_keys:
+                        if not _constraint_exists(cursor, schema, definition):
+                            # Checked by the validation below, which doesn't block writes to the table
+                            cursor.execute(constraint_statement(schema, definition))
+                except Exception:
+                    connection.rollback()
+                    raise
+            connection.commit()
+            # Validations of the same table block each other
+            by_table: Dict[str, List[DeferredDefinition]] = {}
+            for definition in foreign_keys:
+                by_table.setdefault(definition.tablename, []).append(definition)
+            with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+                for future in [ executor.submit(in_thread(_validate_foreign_keys), connection_params, schema, definitions) for definitions in by_table.values() ]:
+                    future.result()
+    cprint(f"Restored {len(deferred)} indexes and constraints of {schema}")
+    return deferred
+
+
+@contextmanager
+def deferred_indexes(connection_params: ConnectionParams, schema: str, tables: List[str]=DEFAULT_DEFERRED_TABLES, workers: int=4, maintenance_work_mem: Optional[str]=None) -> Iterator[List[DeferredDefinition]]:
+    """
+        Runs a bulk load with the indexes and constraints of :tables: deferred (see defer), and restores them afterwards,
+        whether the load succeeds or fails (see restore_deferred).
+        If the load fails, its error is the one raised, even if restoring fails too.
+    """
+    with closing(connection_params.connect()) as connection:
+        deferred = defer(connection, schema, tables)
+    try:
+        yield deferred
+    except BaseException:
+        try:
+            restore_deferred(connection_params, schema, workers, maintenance_work_mem)
+        except Exception as excpt:
+            _report_restore_failure(schema, excpt)
+        raise
+    try:
+        restore_deferred(connection_params, schema, workers, maintenance_work_mem)
+    except Exception as excpt:
+        _report_restore_failure(schema, excpt)
+        raise
+
+
+def _report_restore_failure(schema: str, excpt: Exception) -> None:
+    cprint(f"Failed to restore the deferred indexes and constraints of {schema}: {type(excpt).__name__}: {excpt}", 'red')
+    cprint(f"What is left stays recorded in {DEFERRED_TABLE}: run restore-deferred-indexes again once fixed.", 'red')
@@ -0,0 +1,119 @@
+import os
+from pathlib import Path
+from typing import Iterator, List, Optional
+
+import pandas as pd
+
+from .schema import file_dtypes
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    # The cache is optional: without pyarrow every table is read from its CSV
+    pa = None
+    pq = None
+
+"""
+    Columnar cache of the CSV tables of the dataset.
+    Every table is converted once into a Parquet file at <table dir>/.v1cache/<table name without .csv[.gz]>.parquet,
+    holding the same columns, with the types of the schema registry (see schema.py) or else the ones pandas infers from the CSV.
+    The Parquet metadata records the size and modification time of the source CSV, so an entry is only used while its source is unchanged.
+"""
+CACHE_DIRNAME = '.v1cache'
+SOURCE_SIZE_KEY = b'rcss2d.source_size'
+SOURCE_MTIME_KEY = b'rcss2d.source_mtime_ns'
+
+
+def cache_available() -> bool:
+    return pq is not None
+
+
+def cache_path(filepath: Path) -> Path:
+    """ Where the columnar copy of a CSV table goes. """
+    name = filepath.name
+    for suffix in ('.csv.gz', '.csv'):
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+            break
+    return filepath.parent / CACHE_DIRNAME / (name + '.parquet')
+
+
+def fresh_cache_path(filepath: Path) -> Optional[Path]:
+    """ The cache entry of a CSV table if there is one built from the current version of the file, None otherwise. """
+    if pq is None:
+        return None
+    cachepath = cache_path(filepath)
+    if not cachepath.exists():
+        return None
+    try:
+        metadata = pq.read_schema(cachepath).metadata or {}
+        source_stat = os.stat(filepath)
+    except (OSError, pa.ArrowException):
+        return None
+    if (metadata.get(SOURCE_SIZE_KEY) != str(source_stat.st_size).encode('utf8')
+        or metadata.get(SOURCE_MTIME_KEY) != str(source_stat.st_mtime_ns).encode('utf8')):
+        return None
+    return cachepath
+
+
+def build_cache_entry(filepath: Path) -> bool:
+    """
+        Converts a CSV table into its cache entry, unless a fresh one already exists.
+        Returns whether an entry has been written.
+    """
+    if pq is None:
+        raise ImportError("pyarrow is needed to build the columnar cache. Install it with 'pip install pyarrow'.")
+    if fresh_cache_path(filepath) is not None:
+        return False
+    # Stat before reading: if the file changes meanwhile, the entry is born stale instead of wrong
+    source_stat = os.stat(filepath)
+    df = pd.read_csv(filepath, compression=('gzip' if filepath.match('*.gz') else None), dtype=file_dtypes(filepath))
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.replace_schema_metadata({
+        **(table.schema.metadata or {}),
+        SOURCE_SIZE_KEY: str(source_stat.st_size).encode('utf8'),
+        SOURCE_MTIME_KEY: str(source_stat.st_mtime_ns).encode('utf8'),
+    })
+    cachepath = cache_path(filepath)
+    os.makedirs(cachepath.parent, exist_ok=True)
+    # Write aside and move into place, so readers never see a half-written entry
+    temporary_path = cachepath.with_name(f'.{cachepath.name}.{os.getpid()}.tmp')
+    try:
+        pq.write_table(table, temporary_path)
+        os.replace(temporary_path, cachepath)
+    finally:
+        if temporary_path.exists():
+            temporary_path.unlink()
+    return True
+
+
+def build_cache(filepaths: List[Path]) -> int:
+    """ Builds the cache entries of a group of tables (e.g. a match). Returns the number of entries written. """
+    return sum(build_cache_entry(filepath) for filepath in filepaths)
+
+
+def _cached_columns(cachepath: Path, usecols: Optional[List[str]]) -> Optional[List[str]]:
+    """ Selected columns in table order, as pandas.read_csv gives them. """
+    if usecols is None:
+        return None
+    selected = set(usecols)
+    columns = [ column for column in pq.read_schema(cachepath).names if column in selected ]
+    if len(columns) != len(selected):
+        raise ValueError(f"Columns {sorted(selected.difference(columns))} are not in the table {cachepath}")
+    return columns
+
+
+def read_cached(cachepath: Path, usecols: Optional[List[str]]=None) -> pd.DataFrame:
+    return pq.read_table(cachepath, columns=_cached_columns(cachepath, usecols)).to_pandas()
+
+
+def iter_cached(cachepath: Path, rows: int, usecols: Optional[List[str]]=None) -> Iterator[pd.DataFrame]:
+    """ Reads a cache entry as consecutive chunks of :rows: rows, keeping their row numbers as index. """
+    columns = _cached_columns(cachepath, usecols)
+    start = 0
+    for batch in pq.ParquetFile(cachepath).iter_batches(batch_size=rows, columns=columns):
+        chunk = batch.to_pandas()
+        chunk.index = pd.RangeIndex(start, start + len(chunk))
+        start += len(chunk)
+        yield chunk
@@ -0,0 +1,384 @@
+from contextlib import closing
+import gzip
+import hashlib
+import os
+from pathlib import Path
+import sqlite3
+import time
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from tasks.v1.types import TableType
+from .manifest import files_checksum
+from .utils import MATCH_FILENAME_PATTERN, MatchData
+
+"""
+    Catalog of the CSV tables of a dataset directory, persisted as a SQLite index at <root>/.v1catalog.sqlite
+    (or in the user cache directory, for datasets that can't be written to, see default_dbpath).
+    Listing a large dataset (e.g. 100k tables over many directories) from the catalog is a single indexed query,
+    instead of walking the whole directory tree and parsing every filename again.
+        - the tree is walked with os.scandir, at any depth. Hidden directories (like the .v1cache of cache.py) are skipped.
+        - every table is indexed by its path relative to the root, with its match group (filename stem), table type, size,
+          modification time, the match fields of its filename (see MatchData) and, if asked, its checksum (the one of the
+          load manifest, see files_checksum) and number of rows.
+        - refreshing walks the tree again but only touches the tables that are new, changed (size or modification time)
+          or gone. Checksums and row counts are only computed for new and changed tables.
+        - a quick refresh (full=False) only lists again the directories whose modification time changed, i.e. the ones
+          with tables added, removed or renamed: reading an up to date catalog costs a stat per directory, not per table.
+          A directory modified within MTIME_TICK_NS of a refresh could change again without its modification time
+          changing, so it's listed again by the next refresh too.
+"""
+CATALOG_FILENAME = '.v1catalog.sqlite'
+# Catalogs of the datasets that can't be written to, by dataset path
+CATALOG_CACHE_DIRPATH = Path(os.environ.get('XDG_CACHE_HOME', Path.home() / '.cache')) / 'rcss2d-opp-imitation' / 'catalogs'
+# Coarsest timestamp resolution of the filesystems a dataset may be on (FAT has 2 sec)
+MTIME_TICK_NS = 2 * 10**9
+# Stored instead of the modification time of the directories that must be listed again
+RACY_MTIME_NS = -1
+CATALOG_VERSION = '2'
+# Tables of a match group, as written by rcg2csv/rcl2csv. The params tables are optional
+MATCH_GROUP_TABLETYPES = [
+    TableType.MATCH,
+    TableType.PTYPES,
+    TableType.DASH,
+    TableType.TURN,
+    TableType.KICK,
+    TableType.TACKLE
+]
+CATALOG_DDL = """
+CREATE TABLE IF NOT EXISTS catalog (
+    key     TEXT PRIMARY KEY,
+    value   TEXT
+);
+CREATE TABLE IF NOT EXISTS files (
+    relpath             TEXT PRIMARY KEY,
+    filestem            TEXT NOT NULL,
+    tabletype           TEXT,
+    size                INTEGER NOT NULL,
+    mtime_ns            INTEGER NOT NULL,
+    checksum            TEXT,
+    rows                INTEGER,
+    match_timestamp     TEXT,
+    left_teamname       TEXT,
+    left_finalscore     INTEGER,
+    right_teamname      TEXT,
+    right_finalscore    INTEGER
+);
+CREATE TABLE IF NOT EXISTS directories (
+    relpath             TEXT PRIMARY KEY,
+    mtime_ns            INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_filestem ON files (filestem);
+CREATE INDEX IF NOT EXISTS files_match_timestamp ON files (match_timestamp);
+"""
+FILE_COLUMNS = [
+    'relpath',
+    'filestem',
+    'tabletype',
+    'size',
+    'mtime_ns',
+    'checksum',
+    'rows',
+    'match_timestamp',
+    'left_teamname',
+    'left_finalscore',
+    'right_teamname',
+    'right_finalscore'
+]
+
+
+def _is_csv(name: str) -> bool:
+    return name.endswith('.csv') or name.endswith('.csv.gz')
+
+
+def walk_csvs(root: Path, max_depth: Optional[int]=None) -> Iterator[os.DirEntry]:
+    """
+        Every CSV table (.csv or .csv.gz) under :root:, skipping hidden directories.
+        :max_depth: how many directory levels below the root to visit (0 is the root only), any depth if None.
+    """
+    pending = [ (str(root), 0) ]
+    while len(pending) > 0:
+        dirpath, depth = pending.pop()
+        with os.scandir(dirpath) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if not entry.name.startswith('.') and (max_depth is None or depth < max_depth):
+                        pending.append((entry.path, depth + 1))
+                elif _is_csv(entry.name):
+                    yield entry
+
+
+def filestem(filename: str) -> str:
+    """ The match group of a table, i.e. its filename without the table type and extensions. """
+    return filename.split('.')[0]
+
+
+def group_match_files(filepaths: List[Path]) -> Dict[str, List[Path]]:
+    """ Groups the tables of a dataset by soccer match (see filestem). """
+    groups: Dict[str, List[Path]] = {}
+    for filepath in filepaths:
+        groups.setdefault(filestem(filepath.name), []).append(filepath)
+    return groups
+
+
+def count_rows(filepath: Path, blocksize: int=1 << 20) -> int:
+    """ Number of rows of a CSV table, without its header. Doesn't parse the table: fields never span lines in the v1 tables. """
+    lines = 0
+    last = b'\n'
+    with (gzip.open(filepath, 'rb') if filepath.name.endswith('.gz') else open(filepath, 'rb')) as file:
+        for block in iter(lambda: file.read(blocksize), b''):
+            lines += block.count(b'\n')
+            last = block[-1:]
+    if last != b'\n':
+        lines += 1
+    return max(lines - 1, 0)
+
+
+class CatalogFile(NamedTuple):
+    """ A table of the catalog. Match fields are None for filenames out of the v1 format. """
+    root:               Path
+    relpath:            str
+    filestem:           str
+    tabletype:          Optional[TableType]
+    size:               int
+    mtime_ns:           int
+    checksum:           Optional[str]
+    rows:               Optional[int]
+    match_timestamp:    Optional[str]
+    left_teamname:      Optional[str]
+    left_finalscore:    Optional[int]
+    right_teamname:     Optional[str]
+    right_finalscore:   Optional[int]
+
+    @property
+    def path(self) -> Path:
+        # Built on demand: making paths takes longer than querying them
+        return self.root / self.relpath
+
+    def match_data(self) -> MatchData:
+        data = MatchData()
+        data.timestamp = self.match_timestamp
+        data.left_teamname = self.left_teamname
+        data.left_finalscore = self.left_finalscore
+        data.right_teamname = self.right_teamname
+        data.right_finalscore = self.right_finalscore
+        return data
+
+
+class RefreshStats(NamedTuple):
+    added:      int
+    changed:    int
+    removed:    int
+    unchanged:  int
+    seconds:    float
+
+
+_TABLETYPES = { str(tabletype): tabletype for tabletype in TableType }
+
+
+def _tabletype(filename: str) -> Optional[str]:
+    try:
+        return str(TableType.from_filepath(Path(filename)))
+    except ValueError:
+        return None
+
+
+def _file_row(relpath: str, name: str, size: int, mtime_ns: int) -> tuple:
+    match = MATCH_FILENAME_PATTERN.match(name)
+    fields = (match[1], match[2], int(match[3]), match[4], int(match[5])) if match is not None else (None,) * 5
+    return (relpath, filestem(name), _tabletype(name), size, mtime_ns, None, None, *fields)
+
+
+def default_dbpath(root: Path) -> Path:
+    """ Where the catalog of the dataset at :root: is kept: <root>/CATALOG_FILENAME, or the user cache directory if :root: is read-only. """
+    dbpath = Path(root) / CATALOG_FILENAME
+    if os.access(dbpath, os.W_OK) if dbpath.exists() else os.access(root, os.W_OK):
+        return dbpath
+    return CATALOG_CACHE_DIRPATH / f"{hashlib.sha256(str(Path(root).resolve()).encode('utf8')).hexdigest()[:16]}.sqlite"
+
+
+class Catalog:
+    """
+        The catalog of the dataset at :root:, kept at :dbpath: (see default_dbpath), or in memory if it's ':memory:'.
+        Opening it creates an empty catalog if there's none: call refresh to index the tables.
+        Can be used as a context manager, which closes it.
+    """
+
+    def __init__(self, root: Path, dbpath: Optional[Path]=None) -> None:
+        self.root = Path(root)
+        self.dbpath = Path(dbpath) if dbpath is not None else default_dbpath(self.root)
+        if str(self.dbpath) != ':memory:':
+            os.makedirs(self.dbpath.parent, exist_ok=True)
+        self._connection = sqlite3.connect(str(self.dbpath))
+        with closing(self._connection.cursor()) as cursor:
+            cursor.executescript(CATALOG_DDL)
+            cursor.execute("SELECT value FROM catalog WHERE key = 'version';")
+            version = cursor.fetchone()
+            if version is not None and version[0] != CATALOG_VERSION:
+                # Built by another version of this module: start over
+                cursor.executescript("DELETE FROM files; DELETE FROM directories; DELETE FROM catalog;")
+            cursor.execute("INSERT OR REPLACE INTO catalog (key, value) VALUES ('version', ?);", (CATALOG_VERSION,))
+        self._connection.commit()
+
+    def __enter__(self) -> 'Catalog':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._connection.close()
+
+    def refresh(self, checksums: bool=False, rows: bool=False, full: bool=True) -> RefreshStats:
+        """
+            Brings the catalog up to date with the tables under the root.
+            :checksums: and :rows: compute the checksum and number of rows of every table missing them,
+            i.e. the new and changed tables, and the ones of previous refreshes without them.
+            :full: stats every table. Otherwise only the directories whose modification time changed are listed again,
+            and only their tables are stat'ed: a table rewritten in place (same name) is only seen by a full refresh.
+        """
+        start = time.perf_counter()
+        started_ns = time.time_ns()
+        with closing(self._connection.cursor()) as cursor:
+            # Known tables by directory, known directories and their subdirectories
+            known: Dict[str, Dict[str, Tuple[int, int]]] = {}
+            cursor.execute("SELECT relpath, size, mtime_ns FROM files;")
+            for relpath, size, mtime_ns in cursor.fetchall():
+                reldir, name = os.path.split(relpath)
+                known.setdefault(reldir, {})[name] = (size, mtime_ns)
+            cursor.execute("SELECT relpath, mtime_ns FROM directories;")
+            known_directories = dict(cursor.fetchall())
+            subdirectories: Dict[str, List[str]] = {}
+            for reldir in known_directories:
+                if reldir != '':
+                    subdirectories.setdefault(os.path.dirname(reldir), []).append(reldir)
+            directories: Dict[str, int] = {}
+            added = []
+            changed = []
+            removed = []
+            unchanged = 0
+            pending = [ '' ]
+            while len(pending) > 0:
+                reldir = pending.pop()
+                dirpath = os.path.join(str(self.root), reldir)
+                try:
+                    directories[reldir] = os.stat(dirpath).st_mtime_ns
+                except FileNotFoundError:
+                    # Gone since it was listed: its tables are removed below
+                    continue
+                files = known.pop(reldir, {})
+                if not full and known_directories.get(reldir) == directories[reldir]:
+                    unchanged += len(files)
+                    pending.extend(subdirectories.get(reldir, []))
+                    continue
+                with os.scandir(dirpath) as entries:
+                    for entry in entries:
+                        relpath = os.path.join(reldir, entry.name)
+                        if entry.is_dir(follow_symlinks=False):
+                            if not entry.name.startswith('.'):
+                                pending.append(relpath)
+                            continue
+                        if not _is_csv(entry.name):
+                            continue
+                        stat = entry.stat()
+                        previous = files.pop(entry.name, None)
+                        if previous is None:
+                            added.append(_file_row(relpath, entry.name, stat.st_size, stat.st_mtime_ns))
+                        elif previous != (stat.st_size, stat.st_mtime_ns):
+                            changed.append((stat.st_size, stat.st_mtime_ns, relpath))
+                        else:
+                            unchanged += 1
+                removed += [ os.path.join(reldir, name) for name in files ]
+            # The tables of the directories that are gone
+            removed += [ os.path.join(reldir, name) for reldir, files in known.items() for name in files ]
+            cursor.executemany(f"INSERT INTO files ({','.join(FILE_COLUMNS)}) VALUES ({','.join(['?'] * len(FILE_COLUMNS))});", added)
+            # What was computed from the old contents is stale
+            cursor.executemany("UPDATE files SET size = ?, mtime_ns = ?, checksum = NULL, rows = NULL WHERE relpath = ?;", changed)
+            cursor.executemany("DELETE FROM files WHERE relpath = ?;", [ (relpath,) for relpath in removed ])
+            cursor.execute("DELETE FROM directories;")
+            cursor.executemany("INSERT INTO directories (relpath, mtime_ns) VALUES (?, ?);", [
+                # Entries can still be added in the same timestamp tick without changing it
+                (reldir, mtime_ns if mtime_ns < started_ns - MTIME_TICK_NS else RACY_MTIME_NS) for reldir, mtime_ns in directories.items()
+            ])
+            if checksums:
+                cursor.execute("SELECT relpath FROM files WHERE checksum IS NULL;")
+                cursor.executemany(
+                    "UPDATE files SET checksum = ? WHERE relpath = ?;",
+                    [ (files_checksum([self.root / relpath]), relpath) for (relpath,) in cursor.fetchall() ]
+                )
+            if rows:
+                cursor.execute("SELECT relpath FROM files WHERE rows IS NULL;")
+                cursor.executemany(
+                    "UPDATE files SET rows = ? WHERE relpath = ?;",
+                    [ (count_rows(self.root / relpath), relpath) for (relpath,) in cursor.fetchall() ]
+                )
+            cursor.execute("INSERT OR REPLACE INTO catalog (key, value) VALUES ('refreshed_at', ?);", (str(time.time()),))
+        self._connection.commit()
+        return RefreshStats(len(added), len(changed), len(removed), unchanged, time.perf_counter() - start)
+
+    def files(self, tabletype: Optional[TableType]=None, exclude: Iterable[Path]=()) -> List[CatalogFile]:
+        """ Every table of the catalog (or only the ones of a type), ordered by path. """
+        conditions, params = self._excluding(exclude)
+        if tabletype is not None:
+            conditions += " AND tabletype = ?"
+            params += (str(tabletype),)
+        with closing(self._connection.cursor()) as cursor:
+            cursor.execute(f"SELECT {','.join(FILE_COLUMNS)} FROM files WHERE TRUE{conditions} ORDER BY relpath;", params)
+            return [ self._catalog_file(row) for row in cursor.fetchall() ]
+
+    def csvpaths(self, exclude: Iterable[Path]=()) -> Tuple[List[Path], List[Path]]:
+        """
+            Like tasks.v1.cli.utils.listcsvs, at any depth, from the catalog: list with CSVs paths, list with compressed CSVs paths.
+            :exclude: directories whose tables are left out (e.g. an output directory inside the dataset).
+        """
+        conditions, params = self._excluding(exclude)
+        with closing(self._connection.cursor()) as cursor:
+            cursor.execute(f"SELECT relpath FROM files WHERE TRUE{conditions} ORDER BY relpath;", params)
+            relpaths = [ relpath for (relpath,) in cursor.fetchall() ]
+        return (
+            [ self.root / relpath for relpath in relpaths if relpath.endswith('.csv') ],
+            [ self.root / relpath for relpath in relpaths if relpath.endswith('.csv.gz') ]
+        )
+
+    def match_groups(self, complete: bool=False, exclude: Iterable[Path]=()) -> Dict[str, List[CatalogFile]]:
+        """
+            The tables of every match, by filename stem.
+            :complete: only the matches with a table of every type in MATCH_GROUP_TABLETYPES.
+            :exclude: directories whose tables are left out, see csvpaths.
+        """
+        exclude = list(exclude)
+        conditions, params = self._excluding(exclude)
+        if complete:
+            tabletypes = [ str(tabletype) for tabletype in MATCH_GROUP_TABLETYPES ]
+            complete_conditions, complete_params = self._excluding(exclude)
+            conditions += (
+                f" AND filestem IN (SELECT filestem FROM files WHERE tabletype IN ({','.join(['?'] * len(tabletypes))}){complete_conditions}" +
+                " GROUP BY filestem HAVING count(DISTINCT tabletype) = ?)"
+            )
+            params += (*tabletypes, *complete_params, len(tabletypes))
+        groups: Dict[str, List[CatalogFile]] = {}
+        with closing(self._connection.cursor()) as cursor:
+            cursor.execute(f"SELECT {','.join(FILE_COLUMNS)} FROM files WHERE TRUE{conditions} ORDER BY relpath;", params)
+            for row in cursor.fetchall():
+                catalog_file = self._catalog_file(row)
+                groups.setdefault(catalog_file.filestem, []).append(catalog_file)
+        return groups
+
+    def _excluding(self, exclude: Iterable[Path]) -> Tuple[str, tuple]:
+        """ Conditions (and their params) of a WHERE clause leaving out the tables under the :exclude: directories. """
+        root = self.root.resolve()
+        conditions = ""
+        params: tuple = ()
+        for dirpath in exclude:
+            try:
+                reldir = Path(dirpath).resolve().relative_to(root)
+            except ValueError:
+                # Out of the dataset: none of its tables are in the catalog
+                continue
+            prefix = os.path.join(str(reldir), '') if str(reldir) != '.' else ''
+            conditions += " AND substr(relpath, 1, ?) != ?"
+            params += (len(prefix), prefix)
+        return conditions, params
+
+    def _catalog_file(self, row: tuple) -> CatalogFile:
+        relpath, stem, tabletype, *fields = row
+        return CatalogFile(self.root, relpath, stem, _TABLETYPES.get(tabletype), *fields)
@@ -0,0 +1,140 @@
+import gzip
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from tasks.profiling import iter_spans, span
+from .cache import fresh_cache_path, iter_cached, read_cached
+from .schema import file_dtypes, with_dtypes
+
+# Rows parsed upfront to estimate the in-memory size of a table row
+SAMPLE_ROWS = 256
+# A chunk is not alone in memory: the parser buffers, the frame itself and whatever the consumer derives from it
+# (normalized copies, row tuples for postgres...). A chunk takes about this share of the budget.
+WORKING_SET_FACTOR = 4
+
+
+def read_table(filepath: Path, usecols: Optional[List[str]]=None) -> pd.DataFrame:
+    """
+        Reads a whole CSV table with the dtypes of the schema registry (see schema.py),
+        from its columnar cache entry when there's a fresh one (see cache.py).
+    """
+    dtypes = file_dtypes(filepath, usecols)
+    cachepath = fresh_cache_path(filepath)
+    with span('read', table=filepath.name, cached=cachepath is not None) as reading:
+        if cachepath is not None:
+            df = with_dtypes(read_cached(cachepath, usecols=usecols), dtypes)
+        else:
+            df = pd.read_csv(filepath, compression=('gzip' if filepath.match('*.gz') else None), usecols=usecols, dtype=dtypes)
+        reading.add(rows=len(df), bytes=(cachepath if cachepath is not None else filepath).stat().st_size)
+    return df
+
+
+def rows_per_chunk(filepath: Path, memory_budget: int, usecols: Optional[List[str]]=None) -> int:
+    """
+        Number of rows of a CSV table that can be processed at once within a memory budget (in bytes).
+        The row size is estimated from the first SAMPLE_ROWS rows of the table.
+    """
+    cachepath = fresh_cache_path(filepath)
+    if cachepath is not None:
+        sample = next(iter_cached(cachepath, SAMPLE_ROWS, usecols=usecols), pd.DataFrame())
+    else:
+        sample = pd.read_csv(
+            filepath,
+            compression=('gzip' if filepath.match('*.gz') else None),
+            usecols=usecols,
+            dtype=file_dtypes(filepath, usecols),
+            nrows=SAMPLE_ROWS
+        )
+    if len(sample) == 0:
+        return SAMPLE_ROWS
+    row_size = sample.memory_usage(index=True, deep=True).sum() / len(sample)
+    return max(1, int(memory_budget / (row_size * WORKING_SET_FACTOR)))
+
+
+def read_table_chunks(filepath: Path, memory_budget: Optional[int]=None, usecols: Optional[List[str]]=None) -> Iterator[pd.DataFrame]:
+    """
+        Reads a CSV table as consecutive row ranges (cycle ranges for match tables) that fit a memory budget (in bytes).
+        Chunks keep their row numbers in the whole table as index.
+        Without a budget the whole table is given as a single chunk.
+        Tables with a fresh columnar cache entry are read from it (see cache.py).
+
+        Each chunk of a CSV would otherwise guess its own column types (e.g. a float column with only round values in a chunk
+        would be read as integers). Columns in the schema registry (see schema.py) have their dtypes fixed upfront; if there are
+        other columns, the table is parsed twice: once to settle their types the way a whole table read does (reading only them)
+        and once to give the chunks. Cache entries are already typed.
+    """
+    if memory_budget is None:
+        yield read_table(filepath, usecols=usecols)
+        return
+    chunksize = rows_per_chunk(filepath, memory_budget, usecols=usecols)
+    dtypes = file_dtypes(filepath, usecols)
+    cachepath = fresh_cache_path(filepath)
+    if cachepath is not None:
+        for chunk in iter_spans('read', iter_cached(cachepath, chunksize, usecols=usecols), table=filepath.name, cached=True):
+            yield with_dtypes(chunk, dtypes)
+        return
+    compression = ('gzip' if filepath.match('*.gz') else None)
+    columns = usecols if usecols is not None else pd.read_csv(filepath, compression=compression, nrows=0).columns.tolist()
+    untyped = [ column for column in columns if column not in dtypes ]
+    if len(untyped) > 0:
+        inferred = {}
+        with pd.read_csv(filepath, compression=compression, usecols=untyped, chunksize=chunksize) as reader:
+            for chunk in reader:
+                for column, dtype in chunk.dtypes.items():
+                    inferred[column] = _promote_dtypes(inferred[column], dtype) if column in inferred else dtype
+        dtypes = { **dtypes, **inferred }
+    with pd.read_csv(filepath, compression=compression, usecols=usecols, chunksize=chunksize, dtype=dtypes) as reader:
+        yield from iter_spans('read', reader, table=filepath.name, cached=False)
+
+
+def _promote_dtypes(dtype: np.dtype, other: np.dtype) -> np.dtype:
+    if dtype.kind in 'iuf' and other.kind in 'iuf':
+        return np.promote_types(dtype, other)
+    return dtype if dtype == other else np.dtype(object)
+
+
+class CsvChunkWriter:
+    """
+        Appends consecutive chunks of a table to a single CSV file, with the header of the first one.
+        Used as a context manager: if the block fails, the partial file is removed.
+    """
+
+    def __init__(self, filepath: Path, compress: bool):
+        self.filepath = filepath
+        self.compress = compress
+        self.rows = 0
+        self._file = None
+        self._header = True
+
+    def __enter__(self) -> 'CsvChunkWriter':
+        self._file = gzip.open(self.filepath, 'wt', newline='') if self.compress else open(self.filepath, 'w', newline='')
+        return self
+
+    def write(self, chunk: pd.DataFrame) -> None:
+        with span('write', table=Path(self.filepath).name) as writing:
+            position = self._file.tell()
+            chunk.to_csv(self._file, header=self._header, index=False)
+            # Uncompressed bytes for GZ-compressed files
+            writing.add(rows=len(chunk), bytes=self._file.tell() - position)
+        self._header = False
+        self.rows += len(chunk)
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self._file.close()
+        if exc_type is not None and self.filepath.exists():
+            self.filepath.unlink()
+
+
+def write_csv_chunks(chunks: Iterable[pd.DataFrame], filepath: Path, compress: bool) -> int:
+    """
+        Writes consecutive chunks of a table to a single CSV file, with the header of the first one.
+        If producing a chunk fails, the partial file is removed.
+        Returns the number of rows written.
+    """
+    with CsvChunkWriter(filepath, compress) as writer:
+        for chunk in chunks:
+            writer.write(chunk)
+    return writer.rows
@@ -0,0 +1,220 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from typing import Any, List, Tuple
+
+import psycopg2 as pg
+from termcolor import cprint
+
+from tasks.profiling import in_thread, profiled, span
+from .ingestion import ConnectionParams, _report
+from .linking import FLAT_PLAYERCOMMAND_PARAMETERS, FLAT_PLAYERCOMMANDS_TABLE
+from .manifest import MANIFEST_TABLE, STAGE_DONE, LoadOperation
+from .rows import MATCHSTATES_COLUMNS, PLAYERSTATE_BLOCKS_COLUMNS, PLAYERSTATE_ORDER, PLAYERSTATES_COLUMNS, PLAYERTYPES_COLUMNS
+
+"""
+    Conversion of the player states of a v1 schema between the layout of db/setup_pg_v1_data.sql (a playerstates row per
+    player) and the compact layout of db/setup_pg_v1_data_compact.sql (a playerstate_blocks row per match state).
+    Matches are copied from a schema into an empty schema of the other layout, each in its own transaction, with
+    INSERT ... SELECT statements run by postgres itself. Every row keeps its id, except player states, which are numbered
+    again when expanded. The load manifest entries of a match are copied along, so loads into the new schema skip it.
+    Only whole matches are converted: matches partially loaded into the source are left out.
+    Flat commands (see db/pg_v1_flat_playercommands.sql) are converted too, if both schemas have them.
+"""
+COMPACT_TABLE = 'playerstate_blocks'
+# Tables copied as they are, with the columns both layouts share, and their identity column
+COPIED_TABLES = [
+    ('playertypes', 'playertype_id', PLAYERTYPES_COLUMNS),
+    ('matchstates', 'matchstate_id', MATCHSTATES_COLUMNS)
+]
+PLAYERCOMMAND_TABLES = ['dash', 'turn', 'kick', 'tackle']
+PLAYERCOMMANDS_SHARED_COLUMNS = [
+    'matchstate_id_fk',
+    'cycle_fk',
+    'stopped_cycle_fk',
+    'unum_fk',
+    'teamname_fk',
+    'playercommand_type'
+]
+# Columns of playerstates holding float4 values in the compact layout
+FLOAT_PLAYERSTATE_COLUMNS = PLAYERSTATE_BLOCKS_COLUMNS[5:]
+
+
+def is_compact_schema(cursor: pg.extensions.cursor, schema: str) -> bool:
+    """ Whether a v1 schema has the compact player states layout. Raises ValueError if it isn't a v1 schema. """
+    cursor.execute("SELECT to_regclass(%s), to_regclass(%s);", (f'"{schema}".{COMPACT_TABLE}', f'"{schema}".matchstates'))
+    compact, matchstates = cursor.fetchone()
+    if matchstates is None:
+        raise ValueError(f"{schema} has no v1 tables")
+    return compact is not None
+
+
+def is_flat_playercommands_schema(cursor: pg.extensions.cursor, schema: str) -> bool:
+    """ Whether the commands of a v1 schema have the flat layout of db/pg_v1_flat_playercommands.sql. """
+    cursor.execute("SELECT to_regclass(%s);", (f'"{schema}".{FLAT_PLAYERCOMMANDS_TABLE}',))
+    (flat,) = cursor.fetchone()
+    return flat is not None
+
+
+def deferred_tables(compact: bool, flat: bool) -> List[str]:
+    """ Tables whose indexes and foreign keys a bulk load defers (see bulkload.deferred_indexes), in a schema of the given layout. """
+    return [ COMPACT_TABLE if compact else 'playerstates', FLAT_PLAYERCOMMANDS_TABLE if flat else 'playercommands' ]
+
+
+def _player_position(players: str, states: str) -> str:
+    """ 1-based position of a player state in PLAYERSTATE_ORDER, the index of its values in the compact arrays. """
+    return f"(CASE WHEN {players}.teamname = {states}.left_teamname THEN 0 ELSE {len(PLAYERSTATE_ORDER) // 2} END + {players}.unum)"
+
+
+def _compact_statement(source: str, target: str) -> str:
+    aggregates = [
+        f"array_agg(types.id::smallint ORDER BY {_player_position('players', 'states')})",
+        *(f"array_agg(players.{column} ORDER BY {_player_position('players', 'states')})" for column in ['isgoalie', 'isdiscarded']),
+        *(f"array_agg(players.{column}::real ORDER BY {_player_position('players', 'states')})" for column in FLOAT_PLAYERSTATE_COLUMNS)
+    ]
+    return f"""
+        INSERT INTO "{target}".{COMPACT_TABLE} ({', '.join(PLAYERSTATE_BLOCKS_COLUMNS)})
+        SELECT players.match_id_fk, players.matchstate_id_fk, {', '.join(aggregates)}
+        FROM "{source}".playerstates AS players
+            JOIN "{source}".matchstates AS states
+                ON states.matchstate_id = players.matchstate_id_fk
+            JOIN "{source}".playertypes AS types
+                ON types.playertype_id = players.playertype_id_fk
+        WHERE players.match_id_fk = %(match_id)s
+        GROUP BY players.match_id_fk, players.matchstate_id_fk;
+    """
+
+
+def _expand_statement(source: str, target: str) -> str:
+    # float4 to numeric conversions keep 6 digits, but float4 texts are exact
+    values = [ f"players.{column}::text::numeric" if column in FLOAT_PLAYERSTATE_COLUMNS else f"players.{column}" for column in PLAYERSTATES_COLUMNS ]
+    return f"""
+        INSERT INTO "{target}".playerstates ({', '.join(PLAYERSTATES_COLUMNS)})
+        SELECT {', '.join(values)}
+        FROM "{source}".playerstates AS players
+            JOIN "{source}".matchstates AS states
+                ON states.matchstate_id = players.matchstate_id_fk
+        WHERE players.match_id_fk = %(match_id)s
+        ORDER BY players.matchstate_id_fk, {_player_position('players', 'states')};
+    """
+
+
+def _playercommands_statement(source: str, target: str, compact: bool, flat: bool) -> str:
+    """ Copies the commands of a match, with their parameters if :flat:. Expanded commands point at their player state again. """
+    table = FLAT_PLAYERCOMMANDS_TABLE if flat else 'playercommands'
+    shared_columns = PLAYERCOMMANDS_SHARED_COLUMNS + (FLAT_PLAYERCOMMAND_PARAMETERS if flat else [])
+    columns = [ f"commands.{column}" for column in shared_columns ]
+    if compact:
+        return f"""
+            INSERT INTO "{target}".{table} (playercommand_id, {', '.join(shared_columns)}) OVERRIDING SYSTEM VALUE
+            SELECT commands.playercommand_id, {', '.join(columns)}
+            FROM "{source}".{table} AS commands
+                JOIN "{source}".matchstates AS states
+                    ON states.matchstate_id = commands.matchstate_id_fk
+            WHERE states.match_id_fk = %(match_id)s;
+        """
+    return f"""
+        INSERT INTO "{target}".{table} (playercommand_id, {', '.join(shared_columns)}, playerstate_id_fk) OVERRIDING SYSTEM VALUE
+        SELECT commands.playercommand_id, {', '.join(columns)}, players.playerstate_id
+        FROM "{source}".{table} AS commands
+            JOIN "{source}".matchstates AS states
+                ON states.matchstate_id = commands.matchstate_id_fk
+            JOIN "{target}".playerstates AS players
+                ON players.matchstate_id_fk = commands.matchstate_id_fk
+                AND players.teamname = commands.teamname_fk
+                AND players.unum = commands.unum_fk
+        WHERE states.match_id_fk = %(match_id)s;
+    """
+
+
+def _convert_match(connection_params: ConnectionParams, source: str, target: str, compact: bool, flat: bool, match_id: int) -> None:
+    """ Copies a match from :source: into :target: in a single transaction, compacting or expanding its player states. """
+    with closing(connection_params.connect()) as connection, closing(connection.cursor()) as cursor:
+        params = { 'match_id': match_id, 'source': source, 'target': target }
+        try:
+            with span('convert', match=match_id):
+                for table, id_column, columns in COPIED_TABLES:
+                    cursor.execute(
+                        f"INSERT INTO \"{target}\".{table} ({id_column}, {', '.join(columns)}) OVERRIDING SYSTEM VALUE " +
+                        f"SELECT {id_column}, {', '.join(columns)} FROM \"{source}\".{table} WHERE match_id_fk = %(match_id)s;",
+                        params
+                    )
+                cursor.execute(_compact_statement(source, target) if compact else _expand_statement(source, target), params)
+                cursor.execute(_playercommands_statement(source, target, compact, flat), params)
+                for tabletype in (PLAYERCOMMAND_TABLES if not flat else []):
+                    cursor.execute(
+                        f"INSERT INTO \"{target}\".{tabletype}_commands SELECT parameters.* FROM \"{source}\".{tabletype}_commands AS parameters " +
+                        f"JOIN \"{source}\".playercommands AS commands ON commands.playercommand_id = parameters.{tabletype}_id " +
+                        f"JOIN \"{source}\".matchstates AS states ON states.matchstate_id = commands.matchstate_id_fk " +
+                        "WHERE states.match_id_fk = %(match_id)s;",
+                        params
+                    )
+                cursor.execute(
+                    f"INSERT INTO {MANIFEST_TABLE} (operation, target_schema, match_timestamp, checksum, stage) " +
+                    f"SELECT operation, %(target)s, match_timestamp, checksum, stage FROM {MANIFEST_TABLE} " +
+                    "WHERE target_schema = %(source)s AND match_timestamp = (SELECT match_timestamp FROM public.matches WHERE match_id = %(match_id)s) " +
+                    "ON CONFLICT (operation, target_schema, match_timestamp) DO NOTHING;",
+                    params
+                )
+        except Exception:
+            connection.rollback()
+            raise
+        with span('commit'):
+            connection.commit()
+
+
+def _sync_identity(cursor: pg.extensions.cursor, schema: str, table: str, id_column: str) -> None:
+    """ Moves the identity sequence of a table past the ids copied into it, under the lock of reserve_ids. """
+    cursor.execute("SELECT pg_get_serial_sequence(%s, %s);", (f'"{schema}".{table}', id_column))
+    (sequence,) = cursor.fetchone()
+    lock = cursor.mogrify("hashtext(%s)", (f'{schema}.reserve_ids',)).decode('utf8')
+    cursor.execute(f"SELECT pg_advisory_lock({lock});")
+    try:
+        cursor.execute(f"SELECT setval(%s, ids.last_id) FROM (SELECT max({id_column}) AS last_id FROM \"{schema}\".{table}) AS ids, {sequence} AS sequence WHERE ids.last_id > sequence.last_value OR (ids.last_id IS NOT NULL AND NOT sequence.is_called);", (sequence,))
+    finally:
+        cursor.execute(f"SELECT pg_advisory_unlock({lock});")
+
+
+@profiled()
+def convert_playerstates(connection_params: ConnectionParams, source: str, target: str, workers: int=1) -> Tuple[int, List[Tuple[int, str]]]:
+    """
+        Copies every whole match of the :source: schema into the :target: schema, which has the other player states layout
+        (see db/setup_pg_v1_data_compact.sql), over :workers: connections. Matches already in :target: are skipped, so an
+        interrupted conversion can be run again as is. Don't load matches into :target: meanwhile.
+        Raises ValueError if both schemas have the same player states layout or different commands layouts.
+        Returns the number of converted matches and the (match, error message) pairs of the failed ones.
+    """
+    with closing(connection_params.connect()) as connection, closing(connection.cursor()) as cursor:
+        compact = not is_compact_schema(cursor, source)
+        if is_compact_schema(cursor, target) != compact:
+            raise ValueError(f"{source} and {target} have the same player states layout")
+        flat = is_flat_playercommands_schema(cursor, source)
+        if is_flat_playercommands_schema(cursor, target) != flat:
+            raise ValueError(f"{source} and {target} have different commands layouts")
+        # Matches whose contents load didn't finish in the source have a manifest entry of another stage
+        cursor.execute(
+            f"SELECT matches.match_id FROM public.matches AS matches " +
+            f"WHERE EXISTS (SELECT 1 FROM \"{source}\".matchstates AS states WHERE states.match_id_fk = matches.match_id) " +
+            f"AND NOT EXISTS (SELECT 1 FROM \"{target}\".matchstates AS states WHERE states.match_id_fk = matches.match_id) " +
+            f"AND NOT EXISTS (SELECT 1 FROM {MANIFEST_TABLE} AS manifest WHERE manifest.operation = %s AND manifest.target_schema = %s " +
+            "AND manifest.match_timestamp = matches.match_timestamp AND manifest.stage != %s) " +
+            "ORDER BY matches.match_id;",
+            (str(LoadOperation.CONTENTS), source, STAGE_DONE)
+        )
+        match_ids = [ match_id for (match_id,) in cursor.fetchall() ]
+        connection.rollback()
+    cprint(f"{'Compacting' if compact else 'Expanding'} the player states of {len(match_ids)} matches of {source} into {target}...")
+    failures: List[Tuple[Any, str]] = []
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        futures = [ executor.submit(in_thread(_convert_match), connection_params, source, target, compact, flat, match_id) for match_id in match_ids ]
+        for done, (match_id, future) in enumerate(zip(match_ids, futures), start=1):
+            try:
+                future.result()
+                error = None
+            except pg.Error as excpt:
+                error = f"{type(excpt).__name__}: {excpt}"
+            _report(done, len(match_ids), f"match {match_id}", error, failures)
+    with closing(connection_params.connect()) as connection, closing(connection.cursor()) as cursor:
+        for table, id_column, _ in [ *COPIED_TABLES, (FLAT_PLAYERCOMMANDS_TABLE if flat else 'playercommands', 'playercommand_id', None) ]:
+            _sync_identity(cursor, target, table, id_column)
+        connection.commit()
+    return len(match_ids) - len(failures), failures
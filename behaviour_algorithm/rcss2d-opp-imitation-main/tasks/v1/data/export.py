@@ -0,0 +1,397 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from pathlib import Path
+import threading
+import time
+from typing import Any, Callable, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+import psycopg2 as pg
+from termcolor import cprint
+
+from tasks.profiling import in_thread, profiled, span
+from tasks.v1.experiments.columns import ALL_BALL_FEATURES, ALL_FEATURE_COLUMNS, ALL_SELF_FEATURES, HETEROPARAM_FEATURES, POSE_FEATURES, REGRESSION_OUTPUT_COLUMNS, VEL_FEATURES
+from .compact import is_compact_schema, is_flat_playercommands_schema
+from .ingestion import ConnectionParams, _report
+from .linking import FLAT_PLAYERCOMMANDS_TABLE
+from .rows import PLAYERSTATE_ORDER
+from .shards import LABEL_VALUES, NOP_COMMAND, SHARD_MANIFEST_GLOB, ShardManifest, ShardSetWriter
+from .training import DEFAULT_TEAMNAME, GOALKEEPER_UNUM, TRAINING_PLAYMODE
+
+"""
+    Training shards exported straight out of a postgres schema loaded with the v1-data commands.
+    The matches are split into ranges of match ids, and every range is exported on its own connection by a single
+    COPY (SELECT ...) TO STDOUT (FORMAT binary) giving the rows of db/gen_dataset_indarch.sql for those matches
+    (condensed states are built on the fly, so neither the materialized view nor db/pg_v1_optimizations.sql are needed).
+    The query casts every field to a fixed-size, non-null binary value, so all rows have the same size: they are decoded
+    with strided NumPy views into the shard arrays, a chunk at a time, and written to the range's own shards.
+    Memory use depends on the chunk size and the number of connections, never on the size of the schema.
+"""
+# Fields of an exported row: the features, the label (index in LABEL_VALUES) and the regression targets
+EXPORT_FIELDS = [
+    *(('>f4', column) for column in ALL_FEATURE_COLUMNS),
+    ('>i2', 'playercommand_type'),
+    *(('>f4', column) for column in REGRESSION_OUTPUT_COLUMNS)
+]
+PGCOPY_SIGNATURE = b'PGCOPY\n\xff\r\n\x00'
+PGCOPY_HEADER_SIZE = len(PGCOPY_SIGNATURE) + 4 + 4
+PGCOPY_TRAILER = b'\xff\xff'
+# Shards of every range are named after it, so ranges can be exported at the same time to the same directory
+RANGE_SHARD_NAME_TEMPLATE = 'shard-m%08d-%%05d'
+REGRESSION_SOURCES = {
+    'dash_power':       ('dash_command', 'dash_power'),
+    'dash_direction':   ('dash_command', 'dash_direction'),
+    'turn_moment':      ('turn_command', 'turn_moment'),
+    'kick_power':       ('kick_command', 'kick_power'),
+    'kick_direction':   ('kick_command', 'kick_direction'),
+    'tackle_direction': ('tackle_command', 'tackle_direction')
+}
+
+
+def _real(expression: str) -> str:
+    """ A feature as a non-null float4: missing values become NaN, as in the shards. """
+    return f"COALESCE({expression}, 'NaN')::real"
+
+
+def _player_features(alias: str, types_alias: str) -> List[str]:
+    return [ f"{alias}.{feature}" for feature in POSE_FEATURES + VEL_FEATURES ] + [ f"{types_alias}.{feature}" for feature in HETEROPARAM_FEATURES ]
+
+
+def _export_columns(condensed: str, self_features: List[str], flat: bool) -> List[str]:
+    """
+        Columns of the exported rows, out of the :condensed: states and the features of the player issuing the command.
+        :flat: commands carry their own parameters.
+    """
+    labels = " ".join(f"WHEN '{label}' THEN {index}" for index, label in enumerate(LABEL_VALUES) if label != NOP_COMMAND)
+    return [
+        *(f"{condensed}.{column}" for column in ALL_BALL_FEATURES),
+        *(f"{condensed}.{side}{unum}_{feature}" for side, unum in PLAYERSTATE_ORDER for feature in POSE_FEATURES + VEL_FEATURES + HETEROPARAM_FEATURES),
+        *(f"{_real(expression)} AS {column}" for column, expression in zip(ALL_SELF_FEATURES, self_features)),
+        f"(CASE self_command.playercommand_type::text {labels} ELSE {LABEL_VALUES.index(NOP_COMMAND)} END)::smallint AS playercommand_type",
+        *(f"COALESCE({'self_command' if flat else alias}.{source}, 0)::real AS {column}" for column, (alias, source) in ((column, REGRESSION_SOURCES[column]) for column in REGRESSION_OUTPUT_COLUMNS))
+    ]
+
+
+def _commands_table(schema: str, flat: bool) -> str:
+    return f'"{schema}".{FLAT_PLAYERCOMMANDS_TABLE if flat else "playercommands"}'
+
+
+def _parameter_joins(schema: str, flat: bool) -> str:
+    if flat:
+        return ""
+    return f"""
+            LEFT JOIN "{schema}".dash_commands AS dash_command
+                ON dash_command.dash_id = self_command.playercommand_id
+            LEFT JOIN "{schema}".turn_commands AS turn_command
+                ON turn_command.turn_id = self_command.playercommand_id
+            LEFT JOIN "{schema}".kick_commands AS kick_command
+                ON kick_command.kick_id = self_command.playercommand_id
+            LEFT JOIN "{schema}".tackle_commands AS tackle_command
+                ON tackle_command.tackle_id = self_command.playercommand_id
+    """
+
+
+def _compact_export_query(schema: str, flat: bool) -> str:
+    """
+        export_query of a schema with compact player states (see db/setup_pg_v1_data_compact.sql): every match state is
+        condensed out of its single playerstate_blocks row, so nothing is aggregated.
+        The parameters of the player types of every match are gathered into arrays ordered by their id.
+    """
+    def player_features(blocks: str, types: str, position: str) -> List[str]:
+        """ Features of the player at :position: of the :blocks: row, with the :types: prefix of the player types arrays. """
+        return [ f"{blocks}.{feature}[{position}]" for feature in POSE_FEATURES + VEL_FEATURES ] + [
+            f"{types}{feature}[array_position({types}ids, {blocks}.playertype_ids[{position}]::int)]" for feature in HETEROPARAM_FEATURES
+        ]
+    condensed = [ f"states.{column}::real AS {column}" for column in ALL_BALL_FEATURES ]
+    for position, (side, unum) in enumerate(PLAYERSTATE_ORDER, start=1):
+        for feature, expression in zip(POSE_FEATURES + VEL_FEATURES + HETEROPARAM_FEATURES, player_features('blocks', 'types.', str(position))):
+            condensed.append(f"{_real(expression)} AS {side}{unum}_{feature}")
+    self_position = f"(CASE WHEN self_command.teamname_fk = condensed.left_teamname THEN 0 ELSE {len(PLAYERSTATE_ORDER) // 2} END + self_command.unum_fk)"
+    return f"""
+        WITH types AS (
+            SELECT
+                match_id_fk,
+                array_agg(id ORDER BY id) AS ids,
+                {', '.join(f"array_agg({feature}::real ORDER BY id) AS {feature}" for feature in HETEROPARAM_FEATURES)}
+            FROM "{schema}".playertypes
+            WHERE match_id_fk BETWEEN %(first)s AND %(last)s
+            GROUP BY match_id_fk
+        )
+        SELECT {', '.join(_export_columns('condensed', player_features('condensed', 'condensed.types_', self_position), flat))}
+        FROM (
+            SELECT
+                states.matchstate_id,
+                states.left_teamname,
+                blocks.*,
+                {', '.join(f"types.{feature} AS types_{feature}" for feature in ['ids', *HETEROPARAM_FEATURES])},
+                {', '.join(condensed)}
+            FROM "{schema}".matchstates AS states
+                JOIN "{schema}".playerstate_blocks AS blocks
+                    ON blocks.matchstate_id_fk = states.matchstate_id
+                LEFT JOIN types
+                    ON types.match_id_fk = states.match_id_fk
+            WHERE states.match_id_fk BETWEEN %(first)s AND %(last)s
+                AND states.playmode = '{TRAINING_PLAYMODE}'
+            -- Keeps the planner from pulling the subquery up, which would condense the state once per command
+            OFFSET 0
+        ) AS condensed
+            JOIN {_commands_table(schema, flat)} AS self_command
+                ON self_command.matchstate_id_fk = condensed.matchstate_id
+                AND self_command.teamname_fk = %(teamname)s
+                AND (%(goalkeeper)s OR self_command.unum_fk != {GOALKEEPER_UNUM})
+            {_parameter_joins(schema, flat)}
+    """
+
+
+def export_query(schema: str, compact: bool=False, flat: bool=False) -> str:
+    """
+        The query of the exported rows of a range of matches (see EXPORT_FIELDS), with the %(first)s and %(last)s match ids,
+        the %(teamname)s whose commands make the rows and whether to keep the %(goalkeeper)s ones as parameters.
+        Schemas with :compact: player states are read from their playerstate_blocks, a tuple per match state, and the
+        parameters of :flat: commands from the commands themselves, without joining the tables of every command type.
+    """
+    if compact:
+        return _compact_export_query(schema, flat)
+    condensed = []
+    for side, unum in PLAYERSTATE_ORDER:
+        teamname = 'states.left_teamname' if side == 'l' else 'states.right_teamname'
+        for feature, expression in zip(POSE_FEATURES + VEL_FEATURES + HETEROPARAM_FEATURES, _player_features('players', 'types')):
+            condensed.append(f"{_real(f'min({expression}) FILTER (WHERE players.teamname = {teamname} AND players.unum = {unum})')} AS {side}{unum}_{feature}")
+    return f"""
+        SELECT {', '.join(_export_columns('condensed', _player_features('self_state', 'self_type'), flat))}
+        FROM (
+            SELECT
+                states.matchstate_id,
+                {', '.join(f"states.{column}::real AS {column}" for column in ALL_BALL_FEATURES)},
+                {', '.join(condensed)}
+            FROM "{schema}".matchstates AS states
+                JOIN "{schema}".playerstates AS players
+                    ON players.matchstate_id_fk = states.matchstate_id
+                JOIN "{schema}".playertypes AS types
+                    ON types.playertype_id = players.playertype_id_fk
+            WHERE states.match_id_fk BETWEEN %(first)s AND %(last)s
+                AND states.playmode = '{TRAINING_PLAYMODE}'
+            GROUP BY states.matchstate_id
+        ) AS condensed
+            JOIN "{schema}".playerstates AS self_state
+                ON self_state.matchstate_id_fk = condensed.matchstate_id
+                AND self_state.teamname = %(teamname)s
+                AND (%(goalkeeper)s OR self_state.unum != {GOALKEEPER_UNUM})
+            JOIN "{schema}".playertypes AS self_type
+                ON self_type.playertype_id = self_state.playertype_id_fk
+            JOIN {_commands_table(schema, flat)} AS self_command
+                ON self_command.playerstate_id_fk = self_state.playerstate_id
+            {_parameter_joins(schema, flat)}
+    """
+
+
+class BinaryRowDecoder:
+    """
+        File-like target of a COPY ... TO STDOUT (FORMAT binary) (see cursor.copy_expert) whose rows are made of
+        the non-null, fixed-size :fields: ((big-endian NumPy dtype, name) pairs, in column order).
+        Whole rows are decoded :chunk_rows: at a time into one native array per field dtype run, e.g. a (rows, 303) float32
+        matrix out of 303 consecutive float4 fields, and given to :consume:. Call finish once the COPY is over.
+    """
+
+    def __init__(self, fields: List[Tuple[str, str]], consume: Callable[[List[np.ndarray]], None], chunk_rows: int=2**14):
+        self.fields = fields
+        self.consume = consume
+        self.chunk_rows = chunk_rows
+        # Runs of consecutive fields of the same dtype: (dtype, offset in the row of the first length word, count)
+        self.runs: List[Tuple[np.dtype, int, int]] = []
+        offset = 2
+        for dtype, _ in fields:
+            dtype = np.dtype(dtype)
+            if len(self.runs) > 0 and self.runs[-1][0] == dtype:
+                self.runs[-1] = (dtype, self.runs[-1][1], self.runs[-1][2] + 1)
+            else:
+                self.runs.append((dtype, offset, 1))
+            offset += 4 + dtype.itemsize
+        self.row_size = offset
+        self.buffer = bytearray()
+        self.header_read = False
+        self.rows = 0
+        self.bytes = 0
+
+    def write(self, data: bytes) -> int:
+        self.buffer += data
+        self.bytes += len(data)
+        if len(self.buffer) >= PGCOPY_HEADER_SIZE + self.chunk_rows * self.row_size:
+            self._decode()
+        return len(data)
+
+    def finish(self) -> None:
+        """ Decodes the last rows. Raises ValueError if the COPY stream is cut short. """
+        self._decode()
+        if not self.header_read or bytes(self.buffer) != PGCOPY_TRAILER:
+            raise ValueError(f"Truncated binary COPY stream ({len(self.buffer)} undecoded bytes)")
+        self.buffer.clear()
+
+    def _decode(self) -> None:
+        start = 0
+        if not self.header_read:
+            if len(self.buffer) < PGCOPY_HEADER_SIZE:
+                return
+            if bytes(self.buffer[:len(PGCOPY_SIGNATURE)]) != PGCOPY_SIGNATURE:
+                raise ValueError("Not a binary COPY stream")
+            extension_size = int.from_bytes(self.buffer[PGCOPY_HEADER_SIZE - 4:PGCOPY_HEADER_SIZE], 'big')
+            if len(self.buffer) < PGCOPY_HEADER_SIZE + extension_size:
+                return
+            start = PGCOPY_HEADER_SIZE + extension_size
+            self.header_read = True
+        rows = (len(self.buffer) - start) // self.row_size
+        if rows > 0:
+            with span('decode', rows=rows, bytes=rows * self.row_size):
+                arrays = self._arrays(start, rows)
+            self.rows += rows
+            start += rows * self.row_size
+        # No view of the buffer may be left when resizing it
+        del self.buffer[:start]
+        if rows > 0:
+            self.consume(arrays)
+
+    def _arrays(self, start: int, rows: int) -> List[np.ndarray]:
+        counts = np.ndarray((rows,), dtype='>i2', buffer=self.buffer, offset=start, strides=(self.row_size,))
+        if (counts != len(self.fields)).any():
+            raise ValueError(f"Binary COPY rows don't have the {len(self.fields)} expected fields")
+        arrays = []
+        for dtype, offset, count in self.runs:
+            field_size = 4 + dtype.itemsize
+            lengths = np.ndarray((rows, count), dtype='>i4', buffer=self.buffer, offset=start + offset, strides=(self.row_size, field_size))
+            if (lengths != dtype.itemsize).any():
+                raise ValueError(f"Binary COPY rows have null or {dtype.itemsize}-byte fields of another size")
+            values = np.ndarray((rows, count), dtype=dtype, buffer=self.buffer, offset=start + offset + 4, strides=(self.row_size, field_size))
+            arrays.append(values.astype(dtype.newbyteorder('=')))
+        return arrays
+
+
+class MatchRange(NamedTuple):
+    first:  int
+    last:   int
+
+    def __str__(self) -> str:
+        return f"matches {self.first} to {self.last}"
+
+
+def match_ranges(connection, schema: str, partitions: int) -> List[MatchRange]:
+    """ Splits the matches with states in :schema: into up to :partitions: ranges of ids with about as many matches each. """
+    with closing(connection.cursor()) as cursor:
+        cursor.execute(
+            f"SELECT match_id FROM public.matches AS matches WHERE EXISTS (SELECT 1 FROM \"{schema}\".matchstates AS states WHERE states.match_id_fk = matches.match_id) ORDER BY match_id;"
+        )
+        match_ids = np.array([ match_id for (match_id,) in cursor.fetchall() ], dtype=np.int64)
+    return [ MatchRange(int(ids[0]), int(ids[-1])) for ids in np.array_split(match_ids, max(partitions, 1)) if len(ids) > 0 ]
+
+
+class _ExportProgress:
+    """ Rows and bytes exported by all connections, printed at most every :interval: seconds. """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.rows = 0
+        self.bytes = 0
+        self.start = time.time()
+        self.last_print = self.start
+
+    def add(self, rows: int, bytes: int) -> None:
+        with self.lock:
+            self.rows += rows
+            self.bytes += bytes
+            now = time.time()
+            if now - self.last_print < self.interval:
+                return
+            self.last_print = now
+            cprint(f"Exported {self.rows} rows ({self.bytes / 2**20:.1f} MiB) in {now - self.start:.0f} sec, {self.rows / max(now - self.start, 1e-9):.0f} rows/sec")
+
+
+def _export_range(
+    connection_params: ConnectionParams,
+    schema: str,
+    match_range: MatchRange,
+    output_dir: Path,
+    rows_per_shard: int,
+    chunk_rows: int,
+    teamname: str,
+    goalkeeper: bool,
+    compact: bool,
+    flat: bool,
+    progress: _ExportProgress
+) -> List[ShardManifest]:
+    """ Streams the rows of a range of matches on its own connection into its own shards. Returns their manifests. """
+    writer = ShardSetWriter(output_dir, rows_per_shard, RANGE_SHARD_NAME_TEMPLATE % match_range.first)
+    written = [0]
+
+    def consume(arrays: List[np.ndarray]) -> None:
+        features, labels, regression = arrays
+        with span('write', rows=len(labels)):
+            writer.write((features, labels[:, 0].astype(np.int8), regression))
+        progress.add(len(labels), decoder.bytes - written[0])
+        written[0] = decoder.bytes
+
+    decoder = BinaryRowDecoder(EXPORT_FIELDS, consume, chunk_rows)
+    try:
+        with closing(connection_params.connect()) as connection, closing(connection.cursor()) as cursor:
+            query = cursor.mogrify(export_query(schema, compact, flat), { 'first': match_range.first, 'last': match_range.last, 'teamname': teamname, 'goalkeeper': goalkeeper }).decode('utf8')
+            with span('copy', table=str(match_range)) as copying:
+                cursor.copy_expert(f"COPY ({query}) TO STDOUT (FORMAT binary)", decoder)
+                decoder.finish()
+                copying.add(rows=decoder.rows, bytes=decoder.bytes)
+            connection.rollback()
+        manifests = writer.close()
+    except BaseException:
+        # The shards of a range that failed would pass for all of its rows
+        writer.discard()
+        raise
+    progress.add(0, decoder.bytes - written[0])
+    return manifests
+
+
+@profiled()
+def export_training_shards(
+    connection_params: ConnectionParams,
+    schema: str,
+    output_dir: Path,
+    connections: int=4,
+    partitions: Optional[int]=None,
+    teamname: str=DEFAULT_TEAMNAME,
+    goalkeeper: bool=False,
+    rows_per_shard: int=2**20,
+    chunk_rows: int=2**14,
+    report_interval: float=10.0
+) -> Tuple[int, List[Tuple[MatchRange, str]]]:
+    """
+        Exports the training rows of :schema: (the rows of db/gen_dataset_indarch.sql, see export_query) into memory-mapped
+        shards of up to :rows_per_shard: rows in the empty :output_dir:, over :connections: connections at a time.
+        The matches are split into :partitions: ranges (one per connection by default), each exported into its own shards,
+        :chunk_rows: rows at a time. If a range fails, its shards are removed and the others are still exported.
+        Schemas of either player states layout (see db/setup_pg_v1_data_compact.sql) are exported, with either commands
+        layout (see db/pg_v1_flat_playercommands.sql).
+
+        Returns the number of rows exported and the (match range, error message) pairs of the failed ranges.
+    """
+    if any(output_dir.glob(SHARD_MANIFEST_GLOB)):
+        raise ValueError(f"{output_dir} already holds shards. Use an empty directory.")
+    with closing(connection_params.connect()) as connection:
+        with closing(connection.cursor()) as cursor:
+            compact = is_compact_schema(cursor, schema)
+            flat = is_flat_playercommands_schema(cursor, schema)
+        ranges = match_ranges(connection, schema, partitions if partitions is not None else connections)
+    cprint(f"Exporting {len(ranges)} ranges of matches over {min(connections, len(ranges))} connections...")
+    progress = _ExportProgress(report_interval)
+    failures: List[Tuple[Any, str]] = []
+    rows = 0
+    with ThreadPoolExecutor(max_workers=max(connections, 1)) as executor:
+        futures = [
+            executor.submit(in_thread(_export_range), connection_params, schema, match_range, output_dir, rows_per_shard, chunk_rows, teamname, goalkeeper, compact, flat, progress)
+            for match_range in ranges
+        ]
+        for done, (match_range, future) in enumerate(zip(ranges, futures), start=1):
+            try:
+                manifests = future.result()
+                rows += sum(manifest.rows for manifest in manifests)
+                error = None
+            except (pg.Error, ValueError, OSError) as excpt:
+                error = f"{type(excpt).__name__}: {excpt}"
+            _report(done, len(ranges), match_range, error, failures)
+    return rows, failures
@@ -0,0 +1,97 @@
+import asyncio
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing.util import Finalize
+from typing import Any, Callable, Coroutine, Dict, List, NamedTuple, Optional, Tuple
+
+import psycopg2 as pg
+from termcolor import cprint
+
+from tasks import profiling
+from tasks.profiling import SpanHandoff, SpanRecord
+
+
+class ConnectionParams(NamedTuple):
+    """ Everything a worker needs to open its own postgres connection. """
+    hostname:           str
+    password:           str
+    port:               int = 5432
+    user:               str = 'postgres'
+    dbname:             str = 'postgres'
+    isolation_level:    Optional[int] = 1
+
+    def connect(self):
+        connection = pg.connect(f"host={self.hostname} port={self.port} dbname={self.dbname} user={self.user} password={self.password}")
+        if self.isolation_level is not None:
+            connection.set_isolation_level(self.isolation_level)
+        return connection
+
+
+IngestionJob = Callable[..., Coroutine[Any, Any, None]]
+
+# The connection owned by the current worker process. Opened once by the pool initializer and reused by every job.
+_worker_connection = None
+
+
+def _open_worker_connection(params: ConnectionParams) -> None:
+    global _worker_connection
+    _worker_connection = params.connect()
+    # Pool workers leave through os._exit, which skips atexit, so the connection is closed by multiprocessing's own finalizers
+    Finalize(None, _worker_connection.close, exitpriority=10)
+
+
+def _run_job(job: IngestionJob, item: Any, kwargs: Dict[str, Any], span_handoff: Optional[SpanHandoff]=None) -> Tuple[Optional[str], List[SpanRecord]]:
+    """
+        Runs a single ingestion job (e.g. one match) on the worker's connection.
+        Jobs own their transactions: they commit on success and roll back on failure.
+        Returns None on success or the error message otherwise, and the spans recorded by a worker process (see profiling.adopt).
+    """
+    with profiling.adopt(span_handoff) as span_records:
+        try:
+            asyncio.run(job(item, _worker_connection, **kwargs))
+        except Exception as excpt:
+            # Make sure a half-done transaction does not leak into the next job of this worker
+            _worker_connection.rollback()
+            error = f"{type(excpt).__name__}: {excpt}"
+        else:
+            error = None
+    return error, span_records
+
+
+def run_ingestion(job: IngestionJob, items: List[Any], connection_params: ConnectionParams, workers: int=1, **kwargs: Any) -> List[Tuple[Any, str]]:
+    """
+        Runs job(item, connection, **kwargs) for every item on a bounded pool of worker processes.
+        Each worker opens its own connection, so items are parsed, built and sent to postgres in parallel.
+        With workers <= 1 everything runs in the current process on a single connection.
+
+        Returns the (item, error message) pairs of the failed jobs.
+    """
+    failures = []
+    if workers <= 1:
+        _open_worker_connection(connection_params)
+        try:
+            for done, item in enumerate(items, start=1):
+                error, _ = _run_job(job, item, kwargs)
+                _report(done, len(items), item, error, failures)
+        finally:
+            _worker_connection.close()
+        return failures
+    with ProcessPoolExecutor(max_workers=workers, initializer=_open_worker_connection, initargs=(connection_params,)) as executor:
+        futures = {executor.submit(_run_job, job, item, kwargs, profiling.handoff()): item for item in items}
+        for done, future in enumerate(as_completed(futures), start=1):
+            item = futures[future]
+            try:
+                error, span_records = future.result()
+                profiling.merge(span_records)
+            except Exception as excpt:
+                # The worker itself died (e.g. could not connect)
+                error = f"{type(excpt).__name__}: {excpt}"
+            _report(done, len(items), item, error, failures)
+    return failures
+
+
+def _report(done: int, total: int, item: Any, error: Optional[str], failures: List[Tuple[Any, str]]) -> None:
+    if error is None:
+        print(f"[{done}/{total}] Done {str(item)[:100]}")
+    else:
+        cprint(f"[{done}/{total}] Failed {str(item)[:100]}: {error}", 'red')
+        failures.append((item, error))
@@ -0,0 +1,51 @@
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from tasks import profiling
+from tasks.profiling import SpanHandoff, SpanRecord
+from .ingestion import _report
+
+
+def _run_job(job: Callable[..., Any], item: Any, kwargs: Dict[str, Any], span_handoff: Optional[SpanHandoff]=None) -> Tuple[Optional[str], List[SpanRecord]]:
+    """
+        Runs a single file job to completion. Coroutine functions (like the ones in preparation.py) get their own event loop.
+        Returns None on success or the error message otherwise, and the spans recorded by a worker process (see profiling.adopt).
+    """
+    with profiling.adopt(span_handoff) as span_records:
+        try:
+            result = job(item, **kwargs)
+            if asyncio.iscoroutine(result):
+                asyncio.run(result)
+        except Exception as excpt:
+            error = f"{type(excpt).__name__}: {excpt}"
+        else:
+            error = None
+    return error, span_records
+
+
+def run_jobs(job: Callable[..., Any], items: List[Any], jobs: int=1, **kwargs: Any) -> List[Tuple[Any, str]]:
+    """
+        Runs job(item, **kwargs) for every item on a pool of :jobs: worker processes, so CPU-bound work like parsing
+        and normalizing tables spreads over the cores. With jobs <= 1 everything runs in the current process.
+        Results are reported in the order of :items:, whatever the order the jobs finish in.
+
+        Returns the (item, error message) pairs of the failed jobs.
+    """
+    failures = []
+    if jobs <= 1:
+        for done, item in enumerate(items, start=1):
+            error, _ = _run_job(job, item, kwargs)
+            _report(done, len(items), item, error, failures)
+        return failures
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [ executor.submit(_run_job, job, item, kwargs, profiling.handoff()) for item in items ]
+        for done, (item, future) in enumerate(zip(items, futures), start=1):
+            try:
+                error, span_records = future.result()
+                profiling.merge(span_records)
+            except Exception as excpt:
+                # The worker itself died (e.g. killed for running out of memory)
+                error = f"{type(excpt).__name__}: {excpt}"
+            _report(done, len(items), item, error, failures)
+    return failures
@@ -0,0 +1,140 @@
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from tasks.profiling import profiled
+from tasks.v1.types import *
+from .rows import PLAYERSTATE_ORDER
+from .utils import MatchData
+
+"""
+    We have made a mistake when writing the rcl2csv program so we don't have the original order of issuing
+    of commands when a dumb player sends multiple commands at the same server cycle.
+    The server executes commands as they come, therefore we have lost the information of the true command executed in
+    a situation like this. Luckly, this typically happens very little in a match. In order to not lose the cycle information,
+    we pretend the server has a priority for commands: tackle, kick, turn, dash. We choose this to prioritize less issued commands.
+"""
+PLAYERCOMMAND_PRIORITY = [
+    TableType.TACKLE,
+    TableType.KICK,
+    TableType.TURN,
+    TableType.DASH
+]
+PLAYERCOMMAND_PARAMETERS = {
+    TableType.DASH:     [ DashColumn.DASH_POWER, DashColumn.DASH_DIRECTION ],
+    TableType.TURN:     [ TurnColumn.TURN_MOMENT ],
+    TableType.KICK:     [ KickColumn.KICK_POWER, KickColumn.KICK_DIRECTION ],
+    TableType.TACKLE:   [ TackleColumn.TACKLE_DIRECTION ],
+}
+FLAT_PLAYERCOMMANDS_TABLE = 'flat_playercommands'
+# Parameter columns of every command type, as the nullable columns of the flat commands table (see db/pg_v1_flat_playercommands.sql)
+FLAT_PLAYERCOMMAND_PARAMETERS = [ str(column) for parameters in PLAYERCOMMAND_PARAMETERS.values() for column in parameters ]
+# Due to a flaw in our v1 dataset. We don't have the state of cycles 0 and 3000
+UNAVAILABLE_CYCLES = (0, 3000)
+LINKED_PLAYERCOMMAND_COLUMNS = [
+    'matchstate_id_fk',
+    'cycle_fk',
+    'stopped_cycle_fk',
+    'unum_fk',
+    'teamname_fk',
+    'playerstate_id_fk'
+]
+
+
+def local_state_ids(cycles: np.ndarray, stopped_cycles: np.ndarray, match_data: MatchData) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+        The matchstate_ids and playerstate_ids frames of link_playercommands for the states of a match numbered from 0,
+        as they are laid out: a match state per match table row and, after the ones of the rows before it, the player states
+        of a row in PLAYERSTATE_ORDER.
+
+        :cycles: and :stopped_cycles: the cycle and stopped cycle of every match table row.
+    """
+    states_count = len(cycles)
+    matchstate_ids = pd.DataFrame({
+        'matchstate_id':    np.arange(states_count),
+        'cycle':            cycles,
+        'stopped_cycle':    stopped_cycles,
+    })
+    playerstate_ids = pd.DataFrame({
+        'playerstate_id':   np.arange(states_count * len(PLAYERSTATE_ORDER)),
+        'matchstate_id':    np.repeat(np.arange(states_count), len(PLAYERSTATE_ORDER)),
+        'teamname':         np.tile([ (match_data.left_teamname if side == 'l' else match_data.right_teamname) for side, _ in PLAYERSTATE_ORDER ], states_count),
+        'unum':             np.tile([ unum for _, unum in PLAYERSTATE_ORDER ], states_count),
+    })
+    return matchstate_ids, playerstate_ids
+
+
+@profiled('link')
+def link_playercommands(commands: Dict[TableType, pd.DataFrame], matchstate_ids: pd.DataFrame, playerstate_ids: pd.DataFrame) -> Dict[TableType, pd.DataFrame]:
+    """
+        Links every command of a match to the match state and player state it was issued at.
+        Commands at cycles 0 and 3000 are dropped. When a player has issued more than one command at the same moment,
+        only the first one of the highest priority table is kept (see PLAYERCOMMAND_PRIORITY).
+
+        :commands: the dash, turn, kick and tackle tables of a match.
+        :matchstate_ids: frame with the matchstate_id, cycle and stopped_cycle of every match state.
+        :playerstate_ids: frame with the playerstate_id, matchstate_id, teamname and unum of every player state.
+        Returns a frame per command table with LINKED_PLAYERCOMMAND_COLUMNS followed by the command parameters.
+        Rows keep their order in the command table.
+    """
+    keys = pd.concat([
+        pd.DataFrame({
+            'priority':         priority,
+            'position':         np.arange(len(commands[tabletype])),
+            'cycle':            commands[tabletype][CommandTableColumn.RUNNING_TIME].values.astype('int64'),
+            'stopped_cycle':    commands[tabletype][CommandTableColumn.STOPPED_TIME].values.astype('int64'),
+            'teamname':         commands[tabletype][CommandTableColumn.TEAMNAME].values.astype(str),
+            'unum':             commands[tabletype][CommandTableColumn.UNIFORM_NUMBER].values.astype('int64'),
+        }) for priority, tabletype in enumerate(PLAYERCOMMAND_PRIORITY)
+    ], ignore_index=True)
+    keys = keys[~keys['cycle'].isin(UNAVAILABLE_CYCLES)]
+    keys = keys.merge(matchstate_ids[['matchstate_id', 'cycle', 'stopped_cycle']], on=['cycle', 'stopped_cycle'], how='left', validate='many_to_one')
+    if keys['matchstate_id'].isna().any():
+        missing = keys.loc[keys['matchstate_id'].isna(), ['cycle', 'stopped_cycle']].drop_duplicates()
+        raise ValueError(f'Commands issued at moments without a match state: {list(missing.itertuples(index=False, name=None))[:10]}')
+    ## Rank the commands of each player state and keep the first one
+    keys = keys.sort_values(['priority', 'position'], kind='stable')
+    keys = keys[keys.groupby(['matchstate_id', 'teamname', 'unum'], sort=False).cumcount() == 0]
+    keys = keys.merge(playerstate_ids[['playerstate_id', 'matchstate_id', 'teamname', 'unum']], on=['matchstate_id', 'teamname', 'unum'], how='left', validate='one_to_one')
+    if keys['playerstate_id'].isna().any():
+        missing = keys.loc[keys['playerstate_id'].isna(), ['cycle', 'stopped_cycle', 'teamname', 'unum']]
+        raise ValueError(f'Commands issued by players without a player state: {list(missing.itertuples(index=False, name=None))[:10]}')
+
+    linked = {}
+    for priority, tabletype in enumerate(PLAYERCOMMAND_PRIORITY):
+        kept = keys[keys['priority'] == priority]
+        kept_rows = commands[tabletype].iloc[kept['position'].values]
+        linked[tabletype] = pd.DataFrame({
+            'matchstate_id_fk':     kept['matchstate_id'].values,
+            'cycle_fk':             kept['cycle'].values,
+            'stopped_cycle_fk':     kept['stopped_cycle'].values,
+            'unum_fk':              kept['unum'].values,
+            'teamname_fk':          kept['teamname'].values,
+            'playerstate_id_fk':    kept['playerstate_id'].values,
+            **{ str(column): kept_rows[str(column)].values for column in PLAYERCOMMAND_PARAMETERS[tabletype] }
+        })
+    return linked
+
+
+@profiled()
+def frame_rows(frame: pd.DataFrame, columns: List[str]) -> List[tuple]:
+    """ Turns the selected columns of a frame into a list of row tuples of python scalars. """
+    return list(zip(*(frame[column].tolist() for column in columns)))
+
+
+@profiled()
+def flat_playercommand_rows(linked_playercommands: Dict[TableType, pd.DataFrame], columns: List[str]) -> List[tuple]:
+    """
+        Rows of the flat commands table for the linked commands of every type (see link_playercommands), in PLAYERCOMMAND_PRIORITY
+        order: the selected columns followed by FLAT_PLAYERCOMMAND_PARAMETERS, None for the parameters of the other types.
+    """
+    rows = []
+    for tabletype in PLAYERCOMMAND_PRIORITY:
+        linked = linked_playercommands[tabletype]
+        parameters = [ str(column) for column in PLAYERCOMMAND_PARAMETERS[tabletype] ]
+        rows += zip(*(
+            linked[column].tolist() if column in columns or column in parameters else [None] * len(linked)
+            for column in [ *columns, *FLAT_PLAYERCOMMAND_PARAMETERS ]
+        ))
+    return rows
@@ -0,0 +1,99 @@
+from contextlib import closing
+from enum import Enum
+import hashlib
+from pathlib import Path
+from typing import List, NamedTuple, Optional
+
+import psycopg2 as pg
+
+"""
+    The load manifest records what has been loaded into postgres, so an interrupted ingestion can be re-run as is:
+    matches already loaded from the same files are skipped with a primary key lookup, and partially loaded matches
+    continue from the first stage that did not finish. Entries go away with their match (ON DELETE CASCADE).
+"""
+MANIFEST_TABLE = 'public.load_manifest'
+MANIFEST_DDL = f"""
+CREATE TABLE IF NOT EXISTS {MANIFEST_TABLE} (
+    operation           varchar(32) NOT NULL,
+    target_schema       varchar(64) NOT NULL,
+    match_timestamp     varchar(64) NOT NULL REFERENCES public.matches (match_timestamp) ON DELETE CASCADE,
+    checksum            char(64) NOT NULL,
+    stage               varchar(32) NOT NULL,
+    updated_at          timestamptz NOT NULL DEFAULT now(),
+    PRIMARY KEY (operation, target_schema, match_timestamp)
+);
+"""
+# Stage of an entry whose load has finished
+STAGE_DONE = 'done'
+# Stages of a match contents load, in loading order
+CONTENTS_STAGES = [
+    'playertypes',
+    'matchstates',
+    'playerstates',
+    'playercommands'
+]
+
+
+class LoadOperation(Enum):
+
+    METADATA    = 'metadata'
+    CONTENTS    = 'contents'
+    PLAYERTYPES = 'playertypes'
+
+    def __str__(self) -> str:
+        return self.value
+
+
+class ManifestEntry(NamedTuple):
+    checksum:   str
+    stage:      str
+
+
+def files_checksum(filepaths: List[Path], blocksize: int=1 << 20) -> str:
+    """ SHA-256 hex digest of the names and contents of a group of files, independent of the order they are given in. """
+    digest = hashlib.sha256()
+    for filepath in sorted(filepaths, key=lambda filepath: filepath.name):
+        digest.update(filepath.name.encode('utf8'))
+        with open(filepath, 'rb') as file:
+            for block in iter(lambda: file.read(blocksize), b''):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def create_load_manifest(connection) -> None:
+    """ Creates the manifest table if it does not exist yet. Run it once before dispatching loads to workers. """
+    with closing(connection.cursor()) as cursor:
+        cursor.execute(MANIFEST_DDL)
+    connection.commit()
+
+
+def read_manifest_entry(cursor: pg.extensions.cursor, operation: LoadOperation, schema: str, timestamp: str) -> Optional[ManifestEntry]:
+    cursor.execute(
+        f"SELECT checksum, stage FROM {MANIFEST_TABLE} WHERE operation = %s AND target_schema = %s AND match_timestamp = %s;",
+        (str(operation), schema, timestamp)
+    )
+    row = cursor.fetchone()
+    return ManifestEntry(*row) if row is not None else None
+
+
+def check_manifest_entry(entry: Optional[ManifestEntry], checksum: str, description: str) -> Optional[str]:
+    """
+        Tells where a load should start from given its manifest entry.
+        Returns None for a new load, the last finished stage for a partial load or STAGE_DONE if there's nothing left to do.
+        Raises ValueError if the entry was recorded for different files.
+    """
+    if entry is None:
+        return None
+    if entry.checksum != checksum:
+        raise ValueError(f'{description} was loaded from different files (checksum {entry.checksum}). Delete the match to load it again.')
+    return entry.stage
+
+
+def manifest_entry_statement(cursor: pg.extensions.cursor, operation: LoadOperation, schema: str, timestamp: str, checksum: str, stage: str) -> str:
+    """ Statement recording the stage reached by a load. Send it in the same transaction as the stage itself. """
+    return cursor.mogrify(
+        f"INSERT INTO {MANIFEST_TABLE} (operation, target_schema, match_timestamp, checksum, stage) VALUES (%s, %s, %s, %s, %s) " +
+        "ON CONFLICT (operation, target_schema, match_timestamp) DO UPDATE SET checksum = EXCLUDED.checksum, stage = EXCLUDED.stage, updated_at = now();",
+        (str(operation), schema, timestamp, checksum, stage)
+    ).decode('utf8')
+
@@ -0,0 +1,108 @@
+from contextlib import contextmanager
+import csv
+import io
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import psycopg2 as pg
+
+from tasks.profiling import span
+
+
+def insert_statement(cursor: pg.extensions.cursor, schema: str, table: str, columns: List[str], rows: List[Sequence[Any]], returning: Optional[List[str]]=None, overriding_system_value: bool=False) -> str:
+    """
+        Builds a single INSERT ... VALUES statement for rows of a table of the v1 schema.
+        Every row is escaped client-side through cursor.mogrify.
+
+        :overriding_system_value: the rows carry their own values for a GENERATED ALWAYS identity column.
+    """
+    row_template = "(" + ",".join(["%s"] * len(columns)) + ")"
+    with span('mogrify', rows=len(rows), table=table) as mogrifying:
+        values = ",".join(cursor.mogrify(row_template, tuple(row)).decode('utf8') for row in rows)
+        mogrifying.add(bytes=len(values))
+    query = f"INSERT INTO {schema}.{table} ({','.join(columns)})"
+    if overriding_system_value:
+        query += " OVERRIDING SYSTEM VALUE"
+    query += f" VALUES {values}"
+    if returning is not None:
+        query += f" RETURNING {','.join(returning)}"
+    return query + ";"
+
+
+def insert_rows(cursor: pg.extensions.cursor, schema: str, table: str, columns: List[str], rows: List[Sequence[Any]], returning: Optional[List[str]]=None) -> List[Tuple]:
+    """
+        Writes rows to a table of the v1 schema with a single INSERT ... VALUES statement.
+
+        :returning: columns to be sent back by the database for the inserted rows, in insertion order.
+        Returns the fetched RETURNING rows (empty if nothing is asked back).
+    """
+    if len(rows) == 0:
+        return []
+    query = insert_statement(cursor, schema, table, columns, rows, returning=returning)
+    with span('execute', rows=len(rows), bytes=len(query), table=table):
+        cursor.execute(query)
+        return cursor.fetchall() if returning is not None else []
+
+
+def copy_rows(cursor: pg.extensions.cursor, schema: str, table: str, columns: List[str], rows: List[Sequence[Any]]) -> int:
+    """
+        Streams rows to a table of the v1 schema with COPY ... FROM STDIN.
+        Rows are serialized into an in-memory CSV buffer, where None becomes NULL and
+        every other value is written with its Python text representation (the same mogrify would use).
+        Unquoted empty fields are how CSV spells NULL, so empty strings are copied as NULL too: no text column of the v1 schema allows them.
+
+        Returns the number of rows copied.
+    """
+    if len(rows) == 0:
+        return 0
+    with span('serialize', rows=len(rows), table=table) as serializing:
+        buffer = io.StringIO()
+        csv.writer(buffer, lineterminator='\n').writerows(rows)
+        serializing.add(bytes=buffer.tell())
+        buffer.seek(0)
+    with span('copy', rows=len(rows), bytes=serializing.bytes, table=table):
+        cursor.copy_expert(f"COPY {schema}.{table} ({','.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+    return len(rows)
+
+
+def reserve_ids(cursor: pg.extensions.cursor, schema: str, counts: Dict[Tuple[str, str], int]) -> Dict[Tuple[str, str], int]:
+    """
+        Reserves a contiguous block of values from the identity sequence of several (table, id column) pairs
+        with a single round trip. The caller owns ids first, ..., first + count - 1 of every block and writes them explicitly.
+
+        Each block is taken by moving the sequence forward with setval right after a nextval, under a transaction-independent
+        advisory lock of the schema, so concurrent reservations never overlap. Plain inserts relying on the identity default
+        do not take that lock: do not run them against the same schema while blocks are being reserved.
+
+        :counts: number of ids wanted per (table, id column).
+        Returns the first reserved id per (table, id column).
+    """
+    keys = list(counts.keys())
+    if len(keys) == 0:
+        return {}
+    blocks = []
+    for table, column in keys:
+        # A sequence can't be moved backwards below its start, so empty blocks still reserve (and waste) one id
+        sequence = cursor.mogrify("pg_get_serial_sequence(%s, %s)", (f'{schema}.{table}', column)).decode('utf8')
+        size = max(counts[(table, column)], 1)
+        blocks.append(f"setval({sequence}, nextval({sequence}) + {size - 1}) - {size - 1}")
+    lock = cursor.mogrify("hashtext(%s)", (f'{schema}.reserve_ids',)).decode('utf8')
+    # OFFSET 0 fences keep the planner from reordering the lock, the reservations and the unlock
+    cursor.execute(
+        f"SELECT blocks.*, pg_advisory_unlock({lock}) FROM (" +
+        f"SELECT {', '.join(blocks)} FROM (SELECT pg_advisory_lock({lock}) OFFSET 0) AS locked OFFSET 0" +
+        ") AS blocks;"
+    )
+    firsts = cursor.fetchone()
+    return { key: first for key, first in zip(keys, firsts) }
+
+
+@contextmanager
+def savepoint(cursor: pg.extensions.cursor, name: str) -> Iterator[None]:
+    """ Runs a block inside a savepoint. On failure only the block is rolled back and the transaction stays usable. """
+    cursor.execute(f"SAVEPOINT {name};")
+    try:
+        yield
+    except Exception:
+        cursor.execute(f"ROLLBACK TO SAVEPOINT {name};")
+        raise
+    cursor.execute(f"RELEASE SAVEPOINT {name};")
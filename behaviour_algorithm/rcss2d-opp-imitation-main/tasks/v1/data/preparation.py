@@ -1,72 +1,103 @@
-from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, closing
+import numpy as np
 import pandas as pd
 import psycopg2 as pg
 from pathlib import Path
 import re
 from termcolor import cprint
-import time
-from typing import List, Optional, final
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple, final
 
+from tasks.profiling import current_span, in_thread, profiled, span
 from tasks.rcss2d import FieldSide, UniformNumber
 from tasks.v1.types import *
+from .chunking import CsvChunkWriter, read_table, read_table_chunks, write_csv_chunks
+from .linking import FLAT_PLAYERCOMMAND_PARAMETERS, FLAT_PLAYERCOMMANDS_TABLE, LINKED_PLAYERCOMMAND_COLUMNS, PLAYERCOMMAND_PARAMETERS, PLAYERCOMMAND_PRIORITY, flat_playercommand_rows, frame_rows, link_playercommands, local_state_ids
+from .manifest import CONTENTS_STAGES, MANIFEST_TABLE, STAGE_DONE, LoadOperation, ManifestEntry, check_manifest_entry, files_checksum, manifest_entry_statement, read_manifest_entry
+from .postgres import copy_rows, insert_rows, insert_statement, reserve_ids, savepoint
+from .rows import MATCHSTATES_COLUMNS, MATCHSTATES_MATCH_COLUMNS, PLAYERSTATE_BLOCKS_COLUMNS, PLAYERSTATE_ORDER, PLAYERSTATES_COLUMNS, PLAYERSTATES_MATCH_COLUMNS, PLAYERTYPES_COLUMNS, matchstates_rows, playerstate_blocks_rows, playerstates_rows, playertypes_rows
+from .schema import load_usecols
 from .utils import MatchData
 
-async def update_match_playertypes_at_postgres(playertypes_filepath: Path, conn, schema: str) -> None:
-    profiling_start = time.time()
+# Columns set by the playertypes update, keyed by match and player type id
+PLAYERTYPES_UPDATING_COLUMNS = [
+    'match_id_fk',
+    'id',
+    'player_decay',
+    'inertia_moment',
+    'dash_power_rate',
+    'kickable_margin',
+    'kick_rand',
+    'extra_stamina',
+    'effort_min',
+    'effort_max'
+]
+
+def _match_id(cursor: pg.extensions.cursor, timestamp: str, match_ids: Optional[Dict[str, int]]) -> int:
+    """ The match_id of a match, from :match_ids: (see upsert_matches_metadata and read_match_ids) or else from public.matches. """
+    if match_ids is not None and timestamp in match_ids:
+        return match_ids[timestamp]
+    matchid_subquery = cursor.mogrify("SELECT match_id FROM public.matches WHERE match_timestamp = %s;", (timestamp,)).decode('utf8')
+    cursor.execute(matchid_subquery)
+    (match_id,) = cursor.fetchone()
+    return match_id
+
+@profiled()
+async def update_match_playertypes_at_postgres(playertypes_filepath: Path, conn, schema: str, match_ids: Optional[Dict[str, int]]=None) -> None:
+    """ :match_ids: match_id of every match timestamp known upfront, saving a lookup (see upsert_matches_metadata). """
     print(f"Starting file {str(playertypes_filepath)[:100]}...")
     
     match_data = MatchData.from_filepath(playertypes_filepath)
+    current_span().annotate(match=match_data.timestamp)
     table = None
     try:
-        table = pd.read_csv(
-            playertypes_filepath, 
-            compression=('gzip' if playertypes_filepath.match('*.gz') else None),
-        )
+        table = read_table(playertypes_filepath, usecols=load_usecols(LoadOperation.PLAYERTYPES, TableType.PTYPES))
     except Exception as excpt:
         print(excpt)
         print(f"Failed to read table data from {playertypes_filepath}")
         return
 
+    checksum = files_checksum([playertypes_filepath])
     cursor = conn.cursor()
+    match_id_cache = None
 
     # Find match in the database
     try:
-        matchid_subquery = cursor.mogrify("SELECT match_id FROM public.matches WHERE match_timestamp = %s;", (match_data.timestamp,)).decode('utf8')
-        cursor.execute(matchid_subquery)
+        if check_manifest_entry(
+            read_manifest_entry(cursor, LoadOperation.PLAYERTYPES, schema, match_data.timestamp),
+            checksum,
+            f'Playertypes of match {match_data.timestamp}'
+        ) == STAGE_DONE:
+            conn.rollback()
+            print(f"Playertypes of match {match_data.timestamp} are already updated in {schema}. Skip.")
+            return
         # Cache the result for later use
-        (match_id_cache,) = cursor.fetchone()
+        match_id_cache = _match_id(cursor, match_data.timestamp, match_ids)
         #
         # 2. Add all player types
         #
-        playertypes_updating_columns = [
-            'match_id_fk',
-            'id',
-            'player_decay',
-            'inertia_moment',
-            'dash_power_rate',
-            'kickable_margin',
-            'kick_rand',
-            'extra_stamina',
-            'effort_min',
-            'effort_max'
-        ]
+        playertypes_updating_columns = PLAYERTYPES_UPDATING_COLUMNS
         playertypes_updating_columns_str = ','.join(playertypes_updating_columns)
         playertypes_update_statement = ",".join(
             f"{column} = new.{column}" for column in playertypes_updating_columns[2:] # Skip match_id_fk and id
         )
-        values = ",".join(
-            cursor.mogrify("(%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)", (
-                match_id_cache,
-                *(csv_row[playertypes_column] for playertypes_column in playertypes_updating_columns[1:]),
-            )).decode('utf8') for _, csv_row in table.iterrows()
-        )
+        with span('mogrify', rows=len(table), table='playertypes') as mogrifying:
+            values = ",".join(
+                cursor.mogrify("(%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)", (
+                    match_id_cache,
+                    *(csv_row[playertypes_column] for playertypes_column in playertypes_updating_columns[1:]),
+                )).decode('utf8') for _, csv_row in table.iterrows()
+            )
+            mogrifying.add(bytes=len(values))
         query = f"UPDATE \"{schema}\".playertypes AS current SET " +\
                 playertypes_update_statement +\
                 " from (values " +\
                 values +\
                 f") AS new({playertypes_updating_columns_str}) " +\
                 f"WHERE current.match_id_fk = new.match_id_fk AND current.id = new.id;"
-        cursor.execute(query)
+        with span('execute', rows=len(table), bytes=len(query), table='playertypes'):
+            cursor.execute(query)
+        cursor.execute(manifest_entry_statement(cursor, LoadOperation.PLAYERTYPES, schema, match_data.timestamp, checksum, STAGE_DONE))
     except Exception as excpt:
         print(excpt)
         dumpfilename = 'v1data_update_match_playertypes_at_postgres.errlog'
@@ -79,15 +110,123 @@ async def update_match_playertypes_at_postgres(playertypes_filepath: Path, conn,
             ]))
         print(f"The transaction failed for the file {playertypes_filepath}\nRollback and abort badly.\nCache is dumped to {dumpfilename}")
         conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    with span('commit'):
+        conn.commit()
+
+    print(f"Finished match {match_data.timestamp} in {current_span().elapsed()} sec")
+
+@profiled()
+async def update_matches_playertypes_at_postgres(playertypes_filepaths: List[Path], conn, schema: str, workers: int=1) -> List[Tuple[Path, str]]:
+    """
+        Batched update_match_playertypes_at_postgres: the playertypes tables of many matches are read (by :workers: threads),
+        copied together into a temporary staging table and applied with a single UPDATE joined with public.matches,
+        all in one transaction. Matches already updated from the same files (see the load manifest) are skipped.
+        Returns the (filepath, error message) pairs of the tables left out, e.g. unreadable or of a match missing from public.matches.
+    """
+    print(f"Starting {len(playertypes_filepaths)} playertypes files...")
+    failures = []
+    usecols = load_usecols(LoadOperation.PLAYERTYPES, TableType.PTYPES)
+    tables = {}
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        for filepath, future in [ (filepath, executor.submit(in_thread(read_table), filepath, usecols=usecols)) for filepath in playertypes_filepaths ]:
+            try:
+                match_data = MatchData.from_filepath(filepath)
+                if match_data.timestamp in tables:
+                    raise ValueError(f'Match {match_data.timestamp} has another playertypes table in the batch')
+                tables[match_data.timestamp] = (filepath, future.result(), files_checksum([filepath]))
+            except Exception as excpt:
+                failures.append((filepath, f"{type(excpt).__name__}: {excpt}"))
+
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            f"SELECT match_timestamp, checksum, stage FROM {MANIFEST_TABLE} WHERE operation = %s AND target_schema = %s AND match_timestamp = ANY(%s);",
+            (str(LoadOperation.PLAYERTYPES), schema, list(tables.keys()))
+        )
+        for timestamp, checksum, stage in cursor.fetchall():
+            filepath, _, expected_checksum = tables[timestamp]
+            try:
+                if check_manifest_entry(ManifestEntry(checksum, stage), expected_checksum, f'Playertypes of match {timestamp}') == STAGE_DONE:
+                    print(f"Playertypes of match {timestamp} are already updated in {schema}. Skip.")
+                    del tables[timestamp]
+            except ValueError as excpt:
+                failures.append((filepath, f"{type(excpt).__name__}: {excpt}"))
+                del tables[timestamp]
+        cursor.execute(
+            "CREATE TEMPORARY TABLE playertypes_staging (" +
+            "match_timestamp varchar(64) NOT NULL, checksum char(64) NOT NULL, id int NOT NULL, " +
+            ",".join(f"{column} numeric NOT NULL" for column in PLAYERTYPES_UPDATING_COLUMNS[2:]) +
+            ") ON COMMIT DROP;"
+        )
+        staging_columns = [ 'match_timestamp', 'checksum', *PLAYERTYPES_UPDATING_COLUMNS[1:] ]
+        # A single COPY for every match
+        copy_rows(cursor, 'pg_temp', 'playertypes_staging', staging_columns, [
+            (timestamp, checksum, *row)
+                for timestamp, (_, table, checksum) in tables.items()
+                    for row in table[PLAYERTYPES_UPDATING_COLUMNS[1:]].itertuples(index=False, name=None)
+        ])
+        cursor.execute(
+            "SELECT DISTINCT staging.match_timestamp FROM pg_temp.playertypes_staging AS staging " +
+            "WHERE NOT EXISTS (SELECT 1 FROM public.matches AS matches WHERE matches.match_timestamp = staging.match_timestamp);"
+        )
+        for (timestamp,) in cursor.fetchall():
+            failures.append((tables.pop(timestamp)[0], f"Match {timestamp} is not in public.matches"))
+        with span('execute', rows=sum(len(table) for _, table, _ in tables.values()), table='playertypes'):
+            cursor.execute(
+                f"UPDATE \"{schema}\".playertypes AS current SET " +
+                ",".join(f"{column} = staging.{column}" for column in PLAYERTYPES_UPDATING_COLUMNS[2:]) +
+                " FROM pg_temp.playertypes_staging AS staging JOIN public.matches AS matches ON matches.match_timestamp = staging.match_timestamp" +
+                " WHERE current.match_id_fk = matches.match_id AND current.id = staging.id;"
+            )
+            cursor.execute(
+                f"INSERT INTO {MANIFEST_TABLE} (operation, target_schema, match_timestamp, checksum, stage) " +
+                "SELECT DISTINCT %s, %s, staging.match_timestamp, staging.checksum, %s FROM pg_temp.playertypes_staging AS staging " +
+                "JOIN public.matches AS matches ON matches.match_timestamp = staging.match_timestamp " +
+                "ON CONFLICT (operation, target_schema, match_timestamp) DO UPDATE SET checksum = EXCLUDED.checksum, stage = EXCLUDED.stage, updated_at = now();",
+                (str(LoadOperation.PLAYERTYPES), schema, STAGE_DONE)
+            )
+    except Exception as excpt:
+        print(excpt)
+        print(f"The transaction failed for the playertypes of {len(tables)} matches\nRollback and abort badly.")
+        conn.rollback()
+        raise
     finally:
         cursor.close()
-    conn.commit()
+    with span('commit'):
+        conn.commit()
+
+    print(f"Finished playertypes of {len(tables)} matches in {current_span().elapsed()} sec")
+    return failures
+
 
-    profiling_end = time.time()
-    print(f"Finished match {match_data.timestamp} in {profiling_end-profiling_start} sec")
+def playercommand_columns(compact_playerstates: bool) -> List[str]:
+    """ Columns of the playercommands rows written by the loader. Commands of compact schemas don't point at a player state row. """
+    return [ column for column in LINKED_PLAYERCOMMAND_COLUMNS if not (compact_playerstates and column == 'playerstate_id_fk') ] + ['playercommand_type']
 
-async def copy_match_contents_to_postgres(match_filepaths: List[Path], conn, schema: str) -> None:
-    profiling_start = time.time()
+
+@profiled()
+async def copy_match_contents_to_postgres(match_filepaths: List[Path], conn, schema: str, use_copy: bool=False, preallocate_ids: bool=False, memory_budget: Optional[int]=None, match_ids: Optional[Dict[str, int]]=None, compact_playerstates: bool=False, flat_playercommands: bool=False) -> None:
+    """
+        Loads the contents of a match group (match, playertypes, dash, turn, kick and tackle tables) into a postgres schema.
+        The whole match is loaded in a single transaction, one savepoint per stage (see CONTENTS_STAGES).
+        Progress is recorded in the load manifest: matches already loaded from the same files are skipped and,
+        if a stage fails, the stages before it are kept so the next run continues from the failed stage.
+
+        :use_copy: stream the rows of each table through COPY FROM STDIN instead of building INSERT statements.
+        :preallocate_ids: reserve blocks of ids for the whole match upfront (see reserve_ids) and compute every foreign key locally,
+            so the tables are written without waiting for generated keys. Don't mix it with concurrent loads without this option.
+            Partially loaded matches are always resumed without it.
+        :memory_budget: if given, the match table is streamed in cycle-range chunks that fit this many bytes,
+            reading only the columns each stage needs, and its rows are sent to postgres chunk by chunk.
+        :match_ids: match_id of every match timestamp known upfront, saving a lookup (see upsert_matches_metadata).
+        :compact_playerstates: the schema has the compact layout of db/setup_pg_v1_data_compact.sql: the player states of a
+            match table row are written as a single playerstate_blocks row, and commands don't point at a player state row.
+        :flat_playercommands: the schema has the flat commands of db/pg_v1_flat_playercommands.sql: every command is written
+            with its parameters as a single row, so the commands of a match take one statement and no generated keys.
+    """
     print(f"Starting file group {str(match_filepaths)[:100]}...")
     class Tables:
         def __init__(self) -> None:
@@ -101,13 +240,14 @@ async def copy_match_contents_to_postgres(match_filepaths: List[Path], conn, sch
     tables = Tables()
     match_data = None
 
+    match_filepath = None
+
     for table_path in match_filepaths:
         tabletype = TableType.from_filepath(table_path)
         try:
-            df = pd.read_csv(
-                table_path, 
-                compression=('gzip' if table_path.match('*.gz') else None),
-            )
+            # Tables are read only with the columns the load needs. A streamed match table is read later, stage by stage
+            usecols = load_usecols(LoadOperation.CONTENTS, tabletype)
+            df = read_table(table_path, usecols=usecols) if usecols is not None and (tabletype is not TableType.MATCH or memory_budget is None) else None
             if tabletype is TableType.DASH:
                 if tables.dash is not None:
                     print('Duplicated Dash tables in the match group. Abort safely.')
@@ -129,11 +269,13 @@ async def copy_match_contents_to_postgres(match_filepaths: List[Path], conn, sch
                     return
                 tables.tackle = df
             elif tabletype is TableType.MATCH:
-                if tables.match is not None:
+                if match_filepath is not None:
                     print('Duplicated Match tables in the match group. Abort safely.')
                     return
                 tables.match = df
+                match_filepath = table_path
                 match_data = MatchData.from_filepath(table_path)
+                current_span().annotate(match=match_data.timestamp)
             elif tabletype is TableType.PTYPES:
                 if tables.playertypes is not None:
                     print('Duplicated PlayerTypes tables in the match group. Abort safely.')
@@ -146,7 +288,7 @@ async def copy_match_contents_to_postgres(match_filepaths: List[Path], conn, sch
             cprint(excpt)
             return
     
-    if (tables.match is None
+    if (match_filepath is None
         or tables.playertypes is None
         or tables.dash is None
         or tables.turn is None
@@ -161,6 +303,7 @@ async def copy_match_contents_to_postgres(match_filepaths: List[Path], conn, sch
         or match_data.right_finalscore is None):
         raise ValueError(f'Filepath group {match_filepaths} is incomplete. Abort.')
 
+    checksum = files_checksum(match_filepaths)
     with closing(conn.cursor()) as cursor:
         cursor: pg.cursor
         #
@@ -168,327 +311,324 @@ async def copy_match_contents_to_postgres(match_filepaths: List[Path], conn, sch
         #
         match_id_cache = None
         playertype_id_cache = {}            # cache key is (typeid)
-        matchstate_id_cache = []            # cache key is (csv_row_index) 
-        matchstate_id_cache_per_time = {}   # cache key is (cycle, stopped_) 
-        playerstate_id_cache = {}           # cache key is (matchstate_id, teamname, unum) 
-        playercommand_id_dash_cache = {}    # cache key is (cycle, stopped_cycle, teamname, unum)
-        playercommand_id_turn_cache = {}    # cache key is (cycle, stopped_cycle, teamname, unum)
-        playercommand_id_kick_cache = {}    # cache key is (cycle, stopped_cycle, teamname, unum)
-        playercommand_id_tackle_cache = {}  # cache key is (cycle, stopped_cycle, teamname, unum)
-        try:
-            #
-            # 1. Create subquery to fetch this match's match_id
-            #
-            matchid_subquery = cursor.mogrify("SELECT match_id FROM public.matches WHERE match_timestamp = %s;", (match_data.timestamp,)).decode('utf8')
-            cursor.execute(matchid_subquery)
-            # Cache the result for later use
-            (match_id_cache,) = cursor.fetchone()
-            #
-            # 2. Add all player types
-            #
-            playertypes_columns = [
-                'match_id_fk',
-                'id',
-                'player_decay',
-                'inertia_moment',
-                'dash_power_rate',
-                'kickable_margin',
-                'kick_rand',
-                'extra_stamina',
-                'effort_min',
-                'effort_max'
-            ]
-            playertypes_columns_str = ",".join(playertypes_columns)
-            values = ",".join(
-                cursor.mogrify("(%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)", (
-                    match_id_cache,
-                    *(csv_row[playertypes_column] for playertypes_column in playertypes_columns[1:]),
-                )).decode('utf8') for _, csv_row in tables.playertypes.iterrows()
-            )
-            query = f"INSERT INTO {schema}.playertypes ({playertypes_columns_str}) VALUES {values} RETURNING playertype_id;"
-            cursor.execute(query)
-            #
-            # Cache playertype_id return for later use
-            #
-            for typeid, returned in enumerate(cursor.fetchall()):
-                (playertype_id,) = returned
-                playertype_id_cache[typeid] = playertype_id
-            #
-            # 3. Add all match states
-            #
-            matchstates_columns = [
-                'match_id_fk',
-                'cycle',
-                'stopped_cycle',
-                'playmode',
-                'left_teamname',
-                'right_teamname',
-                'ball_x',
-                'ball_y',
-                'ball_vx',
-                'ball_vy'
-            ]
-            matchstates_columns_str = ",".join(matchstates_columns)
-            match_columns = [
-                ' cycle',
-                ' stopped',
-                ' playmode',
-                ' l_name',
-                ' r_name',
-                ' b_x',
-                ' b_y',
-                ' b_vx',
-                ' b_vy'
-            ]
-            values = ",".join(
-                cursor.mogrify("(%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)", (
-                    match_id_cache,
-                    *(csv_row[match_column] for match_column in match_columns),
-                )).decode('utf8') for _, csv_row in tables.match.iterrows()
-            )
-            query = f"INSERT INTO {schema}.matchstates ({matchstates_columns_str}) VALUES {values} RETURNING matchstate_id, cycle, stopped_cycle;"
-            cursor.execute(query)
-            #
-            # Cache matchstate_id return for later use
-            #
-            for (matchstate_id, cycle, stopped_cycle) in cursor.fetchall():
-                matchstate_id_cache.append(matchstate_id)
-                matchstate_id_cache_per_time[(cycle, stopped_cycle)] = matchstate_id
-            #
-            # 4. Add all player states
-            #
-            playerstates_columns = [
-                'match_id_fk',
-                'matchstate_id_fk',
-                'playertype_id_fk',
-                'teamname',
-                'unum',
-                'isgoalie',
-                'isdiscarded',
-                'x',
-                'y',
-                'vx',
-                'vy',
-                'body',
-                'stamina',
-                'stamina_capacity'
-            ]
-            playerstates_columns_str = ",".join(playerstates_columns)
-            values = ",".join(
-                cursor.mogrify("(%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)", (
-                    match_id_cache,
-                    matchstate_id_cache[index],
-                    playertype_id_cache[csv_row[' %s%s_t' % (side,unum)]],
-                    (match_data.left_teamname if side == 'l' else match_data.right_teamname),
-                    unum,
-                    str(csv_row[' %s%s_goalie' % (side,unum)]), # Postgres accepts '1'/'0' as true/false
-                    str(csv_row[' %s%s_discarded' % (side,unum)]), # Postgres accepts '1'/'0' as true/false
-                    csv_row[' %s%s_x' % (side,unum)],
-                    csv_row[' %s%s_y' % (side,unum)],
-                    csv_row[' %s%s_vx' % (side,unum)],
-                    csv_row[' %s%s_vy' % (side,unum)],
-                    csv_row[' %s%s_body' % (side,unum)],
-                    csv_row[' %s%s_stamina' % (side,unum)],
-                    csv_row[' %s%s_stamina_cap' % (side,unum)],
-                )).decode('utf8') for index, csv_row in tables.match.iterrows() for side in ('l', 'r') for unum in range(1,12)
-            )
-            query = f"INSERT INTO {schema}.playerstates ({playerstates_columns_str}) VALUES {values} RETURNING playerstate_id, matchstate_id_fk, teamname, unum;"
-            cursor.execute(query)
-            #
-            # Cache playerstate_id return for later use
-            #
-            for (playerstate_id, matchstate_id, teamname, unum) in cursor.fetchall():
-                playerstate_id_cache[(matchstate_id, teamname, unum)] = playerstate_id
-            playerstate_id_cache_usedkeys = set() # This is important to counter flaws in the data where multiple commands have been issued by the same player at a single moment of time
-            playerstate_id_cache_usedkeys_accumulated = set() # Same here, but to counter different kinds of commands issued by the same player at a single moment of time
-            def valid_playercommand_csv_row(playercommand_csv_row) -> bool:
-                if playercommand_csv_row['running_time'] in (0, 3000):
-                    ## Due to a flaw in our v1 dataset. We don't have the state of cycles 0 and 3000
-                    return False
-                playerstate_id_cache_key = (matchstate_id_cache_per_time[(playercommand_csv_row['running_time'],playercommand_csv_row['stopped_time'])], playercommand_csv_row['teamname'], playercommand_csv_row['unum'])
-                if (playerstate_id_cache_key in playerstate_id_cache_usedkeys 
-                or playerstate_id_cache_key in playerstate_id_cache_usedkeys_accumulated):
-                    # This playerstate has already been linked to a previous command
-                    return False
-                else:
-                    # This playerstate is available, reserve it for this command
-                    playerstate_id_cache_usedkeys.add(playerstate_id_cache_key)
-                return True
-            #
-            #  Some common stuff
-            #
-            playercommands_columns = [
-                'matchstate_id_fk',
-                'cycle_fk',
-                'stopped_cycle_fk',
-                'unum_fk', 
-                'teamname_fk',
-                'playerstate_id_fk',
-                'playercommand_type'
-            ]
-            playercommands_columns_str = ",".join(playercommands_columns)
-
-            #
-            #   NOTE:   We have made a mistake when writing the rcl2csv program so we don't have the original order of issuing
-            #       of commands when a dumb player sends multiple commands at the same server cycle.
-            #           The server executes commands as they come, therefore we have lost the information of the true command executed in
-            #       a situation like this. Luckly, this typically happens very little in a match. In order to not lose the cycle information,
-            #       we pretend the server has a priority for commands: tackle, kick, turn, dash. We choose this to prioritize less issued commands.
-            #           Therefore, do not change the order we process the tables for a given match.
-            #
-
-            #
-            # 5. Add all tackles
-            #
-            playerstate_id_cache_usedkeys.clear() ## Clear as we go through every row once again
-            values = ",".join(
-                cursor.mogrify("(%s,%s,%s,%s,%s,%s,%s)", (
-                    matchstate_id_cache_per_time[(csv_row['running_time'],csv_row['stopped_time'])],
-                    csv_row['running_time'],
-                    csv_row['stopped_time'],
-                    csv_row['unum'],
-                    csv_row['teamname'],
-                    playerstate_id_cache[(matchstate_id_cache_per_time[(csv_row['running_time'],csv_row['stopped_time'])], csv_row['teamname'], csv_row['unum'])],
-                    'tackle'
-                )).decode('utf8') for _, csv_row in tables.tackle.iterrows() if valid_playercommand_csv_row(csv_row)
-            )
-            query = f"INSERT INTO {schema}.playercommands ({playercommands_columns_str}) VALUES {values} RETURNING playercommand_id, cycle_fk, stopped_cycle_fk, teamname_fk, unum_fk"
-            cursor.execute(query)
-            #
-            # Capture command ids and use them to send tackle
-            # Use (cycle_fk, stopped_cycle_fk, teamname_fk, unum_fk) as cache key
-            #
-            for (playercommand_id, cycle_fk, stopped_cycle_fk, teamname_fk, unum_fk) in cursor.fetchall():
-                playercommand_id_tackle_cache[(cycle_fk, stopped_cycle_fk, teamname_fk, unum_fk)] = playercommand_id
-            # Now add tackle polymorphic columns
-            tackle_columns = ['tackle_id', 'tackle_direction']
-            tackle_columns_str = ",".join(tackle_columns)
-            playerstate_id_cache_usedkeys.clear() ## Clear as we go through every row once again
-            values = ",".join(
-                cursor.mogrify("(%s,%s)", (
-                    playercommand_id_tackle_cache[(csv_row['running_time'],csv_row['stopped_time'],csv_row['teamname'],csv_row['unum'])],
-                    csv_row['tackle_direction']
-                )).decode('utf8') for _, csv_row in tables.tackle.iterrows() if valid_playercommand_csv_row(csv_row)
-            )
-            query = f"INSERT INTO {schema}.tackle_commands ({tackle_columns_str}) VALUES {values};"
-            cursor.execute(query)
+        matchstate_id_cache = []            # cache key is (csv_row_index)
+        matchstate_ids = None               # frame of (matchstate_id, cycle, stopped_cycle)
+        playerstate_ids = None              # frame of (playerstate_id, matchstate_id, teamname, unum)
+        linked_playercommands = {}          # frame of linked commands per command table type
+        first_ids = {}                      # first reserved id per (table, id column)
+        current_stage = None
+        keep_finished_stages = False
+        commands = {
+            TableType.DASH: tables.dash,
+            TableType.TURN: tables.turn,
+            TableType.KICK: tables.kick,
+            TableType.TACKLE: tables.tackle
+        }
 
+        def match_chunks(usecols: List[str]) -> Iterator[pd.DataFrame]:
+            """ The match table as a whole or, with a memory budget, as chunks of only the :usecols: columns. """
+            if memory_budget is None:
+                yield tables.match
+            else:
+                yield from read_table_chunks(match_filepath, memory_budget, usecols=usecols)
 
-            #
-            # 6. Add all kicks
-            #
-            playerstate_id_cache_usedkeys_accumulated.update(playerstate_id_cache_usedkeys)
-            playerstate_id_cache_usedkeys.clear() ## Clear as we go through every row once again
-            values = ",".join(
-                cursor.mogrify("(%s,%s,%s,%s,%s,%s,%s)", (
-                    matchstate_id_cache_per_time[(csv_row['running_time'],csv_row['stopped_time'])],
-                    csv_row['running_time'],
-                    csv_row['stopped_time'],
-                    csv_row['unum'],
-                    csv_row['teamname'],
-                    playerstate_id_cache[(matchstate_id_cache_per_time[(csv_row['running_time'],csv_row['stopped_time'])], csv_row['teamname'], csv_row['unum'])],
-                    'kick'
-                )).decode('utf8') for _, csv_row in tables.kick.iterrows() if valid_playercommand_csv_row(csv_row)
-            )
-            query = f"INSERT INTO {schema}.playercommands ({playercommands_columns_str}) VALUES {values} RETURNING playercommand_id, cycle_fk, stopped_cycle_fk, teamname_fk, unum_fk"
-            cursor.execute(query)
-            #
-            # Capture command ids and use them to send kick
-            # Use (cycle_fk, stopped_cycle_fk, teamname_fk, unum_fk) as cache key
-            #
-            for (playercommand_id, cycle_fk, stopped_cycle_fk, teamname_fk, unum_fk) in cursor.fetchall():
-                playercommand_id_kick_cache[(cycle_fk, stopped_cycle_fk, teamname_fk, unum_fk)] = playercommand_id
-            # Now add turn polymorphic columns
-            kick_columns = ['kick_id', 'kick_power', 'kick_direction']
-            kick_columns_str = ",".join(kick_columns)
-            playerstate_id_cache_usedkeys.clear() ## Clear as we go through every row once again
-            values = ",".join(
-                cursor.mogrify("(%s,%s,%s)", (
-                    playercommand_id_kick_cache[(csv_row['running_time'],csv_row['stopped_time'],csv_row['teamname'],csv_row['unum'])],
-                    csv_row['kick_power'],
-                    csv_row['kick_direction']
-                )).decode('utf8') for _, csv_row in tables.kick.iterrows() if valid_playercommand_csv_row(csv_row)
-            )
-            query = f"INSERT INTO {schema}.kick_commands ({kick_columns_str}) VALUES {values};"
-            cursor.execute(query)
+        def store(table: str, columns: List[str], row_chunks: Iterable[List[tuple]], returning: Optional[List[str]]=None, reselect: Optional[str]=None) -> List[tuple]:
+            """
+                Writes rows, chunk by chunk, with the selected loader and gives back the generated keys, if asked.
+                COPY has no RETURNING clause, so the keys are read back with the :reselect: query once every chunk is written.
+                Both ways return the keys in insertion order.
+            """
+            returned_rows = []
+            for rows in row_chunks:
+                if use_copy:
+                    copy_rows(cursor, schema, table, columns, rows)
+                else:
+                    returned_rows += insert_rows(cursor, schema, table, columns, rows, returning=returning)
+            if use_copy and returning is not None:
+                with span('execute', table=table) as reselecting:
+                    cursor.execute(reselect)
+                    returned_rows = cursor.fetchall()
+                    reselecting.add(rows=len(returned_rows))
+            return returned_rows
 
+        def load_stage(stage: str, table: str, columns: List[str], build_rows: Callable[[], Iterable[List[tuple]]], returning: Optional[List[str]], reselect: Optional[str]) -> List[tuple]:
+            """
+                Stores the rows of a stage inside its own savepoint and records the stage in the manifest.
+                Stages finished by a previous run only read their keys back, if they have any.
+            """
+            nonlocal current_stage
+            current_stage = stage
+            if stage in finished_stages:
+                if reselect is None:
+                    return []
+                cursor.execute(reselect)
+                return cursor.fetchall()
+            with savepoint(cursor, stage):
+                returned_rows = store(table, columns, build_rows(), returning=returning, reselect=reselect)
+                cursor.execute(manifest_entry_statement(cursor, LoadOperation.CONTENTS, schema, match_data.timestamp, checksum, stage))
+            return returned_rows
 
+        try:
             #
-            # 7. Add all turns
+            # 0. Look the match up in the load manifest
             #
-            playerstate_id_cache_usedkeys_accumulated.update(playerstate_id_cache_usedkeys) 
-            playerstate_id_cache_usedkeys.clear() ## Clear as we go through every row once again
-            values = ",".join(
-                cursor.mogrify("(%s,%s,%s,%s,%s,%s,%s)", (
-                    matchstate_id_cache_per_time[(csv_row['running_time'],csv_row['stopped_time'])],
-                    csv_row['running_time'],
-                    csv_row['stopped_time'],
-                    csv_row['unum'],
-                    csv_row['teamname'],
-                    playerstate_id_cache[(matchstate_id_cache_per_time[(csv_row['running_time'],csv_row['stopped_time'])], csv_row['teamname'], csv_row['unum'])],
-                    'turn'
-                )).decode('utf8') for _, csv_row in tables.turn.iterrows() if valid_playercommand_csv_row(csv_row)
+            resume_after = check_manifest_entry(
+                read_manifest_entry(cursor, LoadOperation.CONTENTS, schema, match_data.timestamp),
+                checksum,
+                f'Match {match_data.timestamp}'
             )
-            query = f"INSERT INTO {schema}.playercommands ({playercommands_columns_str}) VALUES {values} RETURNING playercommand_id, cycle_fk, stopped_cycle_fk, teamname_fk, unum_fk"
-            cursor.execute(query)
+            if resume_after == STAGE_DONE:
+                conn.rollback()
+                print(f"Match {match_data.timestamp} is already loaded into {schema}. Skip.")
+                return
+            finished_stages = CONTENTS_STAGES[:CONTENTS_STAGES.index(resume_after) + 1] if resume_after is not None else []
+            if resume_after is not None:
+                print(f"Match {match_data.timestamp} was loaded up to stage {resume_after}. Resume.")
             #
-            # Capture command ids and use them to send turn
-            # Use (cycle_fk, stopped_cycle_fk, teamname_fk, unum_fk) as cache key
+            # 1. Fetch this match's match_id, unless it's known upfront
             #
-            for (playercommand_id, cycle_fk, stopped_cycle_fk, teamname_fk, unum_fk) in cursor.fetchall():
-                playercommand_id_turn_cache[(cycle_fk, stopped_cycle_fk, teamname_fk, unum_fk)] = playercommand_id
-            # Now add turn polymorphic columns
-            turn_columns = ['turn_id', 'turn_moment']
-            turn_columns_str = ",".join(turn_columns)
-            playerstate_id_cache_usedkeys.clear() ## Clear as we go through every row once again
-            values = ",".join(
-                cursor.mogrify("(%s,%s)", (
-                    playercommand_id_turn_cache[(csv_row['running_time'],csv_row['stopped_time'],csv_row['teamname'],csv_row['unum'])],
-                    csv_row['turn_moment']
-                )).decode('utf8') for _, csv_row in tables.turn.iterrows() if valid_playercommand_csv_row(csv_row)
-            )
-            query = f"INSERT INTO {schema}.turn_commands ({turn_columns_str}) VALUES {values};"
-            cursor.execute(query)
+            # Cache the result for later use
+            match_id_cache = _match_id(cursor, match_data.timestamp, match_ids)
 
+            if preallocate_ids and resume_after is None:
+                #
+                # 2. Lay out every key of the match as an offset inside its table's block of ids
+                #   and link the commands with them. Rows are numbered the way the database would number them
+                #
+                moments = pd.concat([
+                    chunk[[MatchGeneralColumn.CYCLE.value, MatchGeneralColumn.STOPPED.value]]
+                    for chunk in match_chunks([MatchGeneralColumn.CYCLE.value, MatchGeneralColumn.STOPPED.value])
+                ])
+                states_count = len(moments)
+                matchstate_ids, playerstate_ids = local_state_ids(
+                    moments[MatchGeneralColumn.CYCLE.value].values,
+                    moments[MatchGeneralColumn.STOPPED.value].values,
+                    match_data
+                )
+                linked_playercommands = link_playercommands(commands, matchstate_ids, playerstate_ids)
+                #
+                # 3. Reserve all the ids of the match in a single round trip and turn offsets into ids
+                #
+                first_ids = reserve_ids(cursor, schema, {
+                    ('playertypes', 'playertype_id'):       len(tables.playertypes),
+                    ('matchstates', 'matchstate_id'):       states_count,
+                    **({ ('playerstates', 'playerstate_id'): len(playerstate_ids) } if not compact_playerstates else {}),
+                    **({ ('playercommands', 'playercommand_id'): sum(len(linked) for linked in linked_playercommands.values()) } if not flat_playercommands else {}),
+                })
+                first_playertype_id = first_ids[('playertypes', 'playertype_id')]
+                first_matchstate_id = first_ids[('matchstates', 'matchstate_id')]
+                # Compact player states have no ids: the local ones only link the commands
+                first_playerstate_id = first_ids.get(('playerstates', 'playerstate_id'), 0)
+                # Nothing points at flat commands: they take their ids from the identity
+                next_playercommand_id = first_ids.get(('playercommands', 'playercommand_id'))
+                playertype_id_cache = { typeid: first_playertype_id + typeid for typeid in range(len(tables.playertypes)) }
+                matchstate_ids['matchstate_id'] += first_matchstate_id
+                matchstate_id_cache = matchstate_ids['matchstate_id'].tolist()
+                playerstate_ids['playerstate_id'] += first_playerstate_id
+                playerstate_ids['matchstate_id'] += first_matchstate_id
+                for tabletype in PLAYERCOMMAND_PRIORITY:
+                    linked = linked_playercommands[tabletype]
+                    linked['matchstate_id_fk'] += first_matchstate_id
+                    linked['playerstate_id_fk'] += first_playerstate_id
+                    linked['playercommand_type'] = str(tabletype)
+                    if not flat_playercommands:
+                        linked['playercommand_id'] = np.arange(next_playercommand_id, next_playercommand_id + len(linked))
+                        next_playercommand_id += len(linked)
+                #
+                # 4. Send every table with its ids. Nothing has to come back, so INSERT statements go out as one batch
+                #   (one per chunk of the match table when streaming it, not to hold the whole match in memory)
+                #
+                batch = []
+                def send(table: str, id_column: Optional[str], columns: List[str], ids: Optional[List[int]], rows: List[tuple]) -> None:
+                    if id_column is not None:
+                        rows = [ (row_id, *row) for row_id, row in zip(ids, rows) ]
+                        columns = [ id_column, *columns ]
+                    if len(rows) == 0:
+                        return
+                    if use_copy:
+                        copy_rows(cursor, schema, table, columns, rows)
+                    elif memory_budget is None:
+                        batch.append(insert_statement(cursor, schema, table, columns, rows, overriding_system_value=(id_column is not None)))
+                    else:
+                        query = insert_statement(cursor, schema, table, columns, rows, overriding_system_value=(id_column is not None))
+                        with span('execute', rows=len(rows), bytes=len(query), table=table):
+                            cursor.execute(query)
 
-            #
-            # 8. Add all dashes
-            #
-            # Add base table playercommands
-            playerstate_id_cache_usedkeys_accumulated.update(playerstate_id_cache_usedkeys)
-            playerstate_id_cache_usedkeys.clear()
-            values = ",".join(
-                cursor.mogrify("(%s,%s,%s,%s,%s,%s,%s)", (
-                    matchstate_id_cache_per_time[(csv_row['running_time'],csv_row['stopped_time'])],
-                    csv_row['running_time'],
-                    csv_row['stopped_time'],
-                    csv_row['unum'],
-                    csv_row['teamname'],
-                    playerstate_id_cache[(matchstate_id_cache_per_time[(csv_row['running_time'],csv_row['stopped_time'])], csv_row['teamname'], csv_row['unum'])],
-                    'dash'
-                )).decode('utf8') for _, csv_row in tables.dash.iterrows() if valid_playercommand_csv_row(csv_row)
-            )
-            query = f"INSERT INTO {schema}.playercommands ({playercommands_columns_str}) VALUES {values} RETURNING playercommand_id, cycle_fk, stopped_cycle_fk, teamname_fk, unum_fk;"
-            cursor.execute(query)
-            #
-            # Capture command ids and use them to send dash
-            # Use (cycle_fk, stopped_cycle_fk, teamname_fk, unum_fk) as cache key
-            #
-            for (playercommand_id, cycle_fk, stopped_cycle_fk, teamname_fk, unum_fk) in cursor.fetchall():
-                playercommand_id_dash_cache[(cycle_fk, stopped_cycle_fk, teamname_fk, unum_fk)] = playercommand_id
-            # Now add dash polymorphic columns
-            dash_columns = ['dash_id', 'dash_power', 'dash_direction']
-            dash_columns_str = ",".join(dash_columns)
-            playerstate_id_cache_usedkeys.clear() ## Clear as we go through every row once again
-            values = ",".join(
-                cursor.mogrify("(%s,%s,%s)", (
-                    playercommand_id_dash_cache[(csv_row['running_time'],csv_row['stopped_time'],csv_row['teamname'],csv_row['unum'])],
-                    csv_row['dash_power'],
-                    csv_row['dash_direction']
-                )).decode('utf8') for _, csv_row in tables.dash.iterrows() if valid_playercommand_csv_row(csv_row)
-            )
-            query = f"INSERT INTO {schema}.dash_commands ({dash_columns_str}) VALUES {values};"
-            cursor.execute(query)
+                send(
+                    'playertypes', 'playertype_id', PLAYERTYPES_COLUMNS,
+                    [ playertype_id_cache[typeid] for typeid in range(len(tables.playertypes)) ],
+                    playertypes_rows(tables.playertypes, match_id_cache)
+                )
+                for chunk in match_chunks(MATCHSTATES_MATCH_COLUMNS):
+                    send(
+                        'matchstates', 'matchstate_id', MATCHSTATES_COLUMNS,
+                        matchstate_ids['matchstate_id'].values[chunk.index.values].tolist(),
+                        matchstates_rows(chunk, match_id_cache)
+                    )
+                for chunk in match_chunks(PLAYERSTATES_MATCH_COLUMNS):
+                    if compact_playerstates:
+                        send(
+                            'playerstate_blocks', None, PLAYERSTATE_BLOCKS_COLUMNS, None,
+                            playerstate_blocks_rows(chunk, match_id_cache, matchstate_id_cache, playertype_id_cache)
+                        )
+                        continue
+                    # Player states of a match table row are numbered after the ones of the rows before it
+                    positions = (chunk.index.values[:, np.newaxis] * len(PLAYERSTATE_ORDER) + np.arange(len(PLAYERSTATE_ORDER))).ravel()
+                    send(
+                        'playerstates', 'playerstate_id', PLAYERSTATES_COLUMNS,
+                        playerstate_ids['playerstate_id'].values[positions].tolist(),
+                        playerstates_rows(chunk, match_data, match_id_cache, matchstate_id_cache, playertype_id_cache)
+                    )
+                playercommands_columns = playercommand_columns(compact_playerstates)
+                if flat_playercommands:
+                    send(
+                        FLAT_PLAYERCOMMANDS_TABLE, None, [ *playercommands_columns, *FLAT_PLAYERCOMMAND_PARAMETERS ], None,
+                        flat_playercommand_rows(linked_playercommands, playercommands_columns)
+                    )
+                for tabletype in (PLAYERCOMMAND_PRIORITY if not flat_playercommands else []):
+                    linked = linked_playercommands[tabletype]
+                    send(
+                        'playercommands', 'playercommand_id', playercommands_columns,
+                        linked['playercommand_id'].tolist(),
+                        frame_rows(linked, playercommands_columns)
+                    )
+                for tabletype in (PLAYERCOMMAND_PRIORITY if not flat_playercommands else []):
+                    linked = linked_playercommands[tabletype]
+                    parameter_columns = [ str(column) for column in PLAYERCOMMAND_PARAMETERS[tabletype] ]
+                    # The polymorphic tables have no identity of their own, they carry the playercommand_id
+                    rows = frame_rows(linked, [ 'playercommand_id', *parameter_columns ])
+                    if len(rows) == 0:
+                        continue
+                    if use_copy:
+                        copy_rows(cursor, schema, f'{tabletype}_commands', [ f'{tabletype}_id', *parameter_columns ], rows)
+                    else:
+                        batch.append(insert_statement(cursor, schema, f'{tabletype}_commands', [ f'{tabletype}_id', *parameter_columns ], rows))
+                batch.append(manifest_entry_statement(cursor, LoadOperation.CONTENTS, schema, match_data.timestamp, checksum, STAGE_DONE))
+                query = "\n".join(batch)
+                with span('execute', bytes=len(query)):
+                    cursor.execute(query)
+            else:
+                keep_finished_stages = True
+                #
+                # 2. Add all player types
+                #
+                returned_rows = load_stage(
+                    'playertypes',
+                    'playertypes',
+                    PLAYERTYPES_COLUMNS,
+                    lambda: [ playertypes_rows(tables.playertypes, match_id_cache) ],
+                    returning=['playertype_id'],
+                    reselect=cursor.mogrify(f"SELECT playertype_id FROM {schema}.playertypes WHERE match_id_fk = %s ORDER BY playertype_id;", (match_id_cache,)).decode('utf8')
+                )
+                #
+                # Cache playertype_id return for later use
+                #
+                for typeid, returned in enumerate(returned_rows):
+                    (playertype_id,) = returned
+                    playertype_id_cache[typeid] = playertype_id
+                #
+                # 3. Add all match states
+                #
+                returned_rows = load_stage(
+                    'matchstates',
+                    'matchstates',
+                    MATCHSTATES_COLUMNS,
+                    lambda: ( matchstates_rows(chunk, match_id_cache) for chunk in match_chunks(MATCHSTATES_MATCH_COLUMNS) ),
+                    returning=['matchstate_id', 'cycle', 'stopped_cycle'],
+                    reselect=cursor.mogrify(f"SELECT matchstate_id, cycle, stopped_cycle FROM {schema}.matchstates WHERE match_id_fk = %s ORDER BY matchstate_id;", (match_id_cache,)).decode('utf8')
+                )
+                #
+                # Cache matchstate_id return for later use
+                #
+                matchstate_ids = pd.DataFrame(returned_rows, columns=['matchstate_id', 'cycle', 'stopped_cycle'])
+                matchstate_id_cache = matchstate_ids['matchstate_id'].tolist()
+                #
+                # 4. Add all player states
+                #
+                if compact_playerstates:
+                    load_stage(
+                        'playerstates',
+                        'playerstate_blocks',
+                        PLAYERSTATE_BLOCKS_COLUMNS,
+                        lambda: (
+                            playerstate_blocks_rows(chunk, match_id_cache, matchstate_id_cache, playertype_id_cache)
+                            for chunk in match_chunks(PLAYERSTATES_MATCH_COLUMNS)
+                        ),
+                        returning=None,
+                        reselect=None
+                    )
+                    #
+                    # Compact player states have no ids: number them locally, only to link the commands
+                    #
+                    _, playerstate_ids = local_state_ids(matchstate_ids['cycle'].values, matchstate_ids['stopped_cycle'].values, match_data)
+                    playerstate_ids['matchstate_id'] = matchstate_ids['matchstate_id'].values[playerstate_ids['matchstate_id'].values]
+                else:
+                    returned_rows = load_stage(
+                        'playerstates',
+                        'playerstates',
+                        PLAYERSTATES_COLUMNS,
+                        lambda: (
+                            playerstates_rows(chunk, match_data, match_id_cache, matchstate_id_cache, playertype_id_cache)
+                            for chunk in match_chunks(PLAYERSTATES_MATCH_COLUMNS)
+                        ),
+                        returning=['playerstate_id', 'matchstate_id_fk', 'teamname', 'unum'],
+                        reselect=cursor.mogrify(f"SELECT playerstate_id, matchstate_id_fk, teamname, unum FROM {schema}.playerstates WHERE match_id_fk = %s ORDER BY playerstate_id;", (match_id_cache,)).decode('utf8')
+                    )
+                    #
+                    # Cache playerstate_id return for later use
+                    #
+                    playerstate_ids = pd.DataFrame(returned_rows, columns=['playerstate_id', 'matchstate_id', 'teamname', 'unum'])
+                #
+                # 5. Link every command to its match state and player state.
+                #   Players sending multiple commands at the same cycle keep only one (see link_playercommands)
+                # 6. Add all commands, one command type at a time in priority order: tackle, kick, turn and dash
+                #   (flat commands all at once, with their parameters). This is the last stage, so it finishes the match in the manifest
+                #
+                current_stage = 'playercommands'
+                with savepoint(cursor, current_stage):
+                    linked_playercommands = link_playercommands(commands, matchstate_ids, playerstate_ids)
+                    playercommands_columns = playercommand_columns(compact_playerstates)
+                    for tabletype in PLAYERCOMMAND_PRIORITY:
+                        linked_playercommands[tabletype]['playercommand_type'] = str(tabletype)
+                    if flat_playercommands:
+                        store(
+                            FLAT_PLAYERCOMMANDS_TABLE,
+                            [ *playercommands_columns, *FLAT_PLAYERCOMMAND_PARAMETERS ],
+                            [ flat_playercommand_rows(linked_playercommands, playercommands_columns) ]
+                        )
+                    playercommands_keys = ['cycle_fk', 'stopped_cycle_fk', 'teamname_fk', 'unum_fk']
+                    playercommands_reselect = (
+                        f"SELECT pc.playercommand_id, pc.cycle_fk, pc.stopped_cycle_fk, pc.teamname_fk, pc.unum_fk FROM {schema}.playercommands AS pc " +
+                        f"JOIN {schema}.matchstates AS ms ON ms.matchstate_id = pc.matchstate_id_fk " +
+                        "WHERE ms.match_id_fk = %s AND pc.playercommand_type = %s ORDER BY pc.playercommand_id;"
+                    )
+                    for tabletype in (PLAYERCOMMAND_PRIORITY if not flat_playercommands else []):
+                        linked = linked_playercommands[tabletype]
+                        returned_rows = store(
+                            'playercommands',
+                            playercommands_columns,
+                            [ frame_rows(linked, playercommands_columns) ],
+                            returning=['playercommand_id', *playercommands_keys],
+                            reselect=cursor.mogrify(playercommands_reselect, (match_id_cache, str(tabletype))).decode('utf8')
+                        )
+                        #
+                        # Capture command ids and use them to send the polymorphic columns
+                        # Use (cycle_fk, stopped_cycle_fk, teamname_fk, unum_fk) as key
+                        #
+                        linked = linked.merge(
+                            pd.DataFrame(returned_rows, columns=['playercommand_id', *playercommands_keys]),
+                            on=playercommands_keys,
+                            how='left',
+                            validate='one_to_one'
+                        )
+                        linked_playercommands[tabletype] = linked
+                        parameter_columns = [ str(column) for column in PLAYERCOMMAND_PARAMETERS[tabletype] ]
+                        store(
+                            f'{tabletype}_commands',
+                            [ f'{tabletype}_id', *parameter_columns ],
+                            [ frame_rows(linked, [ 'playercommand_id', *parameter_columns ]) ]
+                        )
+                    cursor.execute(manifest_entry_statement(cursor, LoadOperation.CONTENTS, schema, match_data.timestamp, checksum, STAGE_DONE))
 
         except Exception as excpt:
             print(excpt)
@@ -497,129 +637,41 @@ async def copy_match_contents_to_postgres(match_filepaths: List[Path], conn, sch
                 logfile.write("\n".join([
                     f"match_filepaths = {match_filepaths}",
                     f"match_data = {match_data}",
+                    f"failed_stage = {current_stage}",
                     f"match_id_cache = {match_id_cache}",
+                    f"first_ids = {first_ids}",
                     f"playertype_id_cache = {playertype_id_cache}",
                     f"matchstate_id_cache = {matchstate_id_cache}",
-                    f"matchstate_id_cache_per_time = {matchstate_id_cache_per_time}",
-                    f"playerstate_id_cache = {playerstate_id_cache}",
-                    f"playercommand_id_dash_cache = {playercommand_id_dash_cache}",
-                    f"playercommand_id_turn_cache = {playercommand_id_turn_cache}",
-                    f"playercommand_id_kick_cache = {playercommand_id_kick_cache}",
-                    f"playercommand_id_tackle_cache = {playercommand_id_tackle_cache}",
+                    f"matchstate_ids = {matchstate_ids}",
+                    f"playerstate_ids = {playerstate_ids}",
+                    *(f"linked_playercommands[{tabletype}] = {linked}" for tabletype, linked in linked_playercommands.items()),
                     str(excpt)
                 ]))
-            print(f"The transaction failed for the group {match_filepaths}\nRollback and abort badly.\nCache is dumped to {dumpfilename}")
-            conn.rollback()
-            return
-        conn.commit()
-        profiling_end = time.time()
-        print(f"Finished match {match_data.timestamp} in {profiling_end-profiling_start} sec")
+            if keep_finished_stages:
+                # The failed stage has been rolled back to its savepoint. Keep the ones before it for the next run
+                print(f"The stage {current_stage} failed for the group {match_filepaths}\nKeep finished stages and abort.\nCache is dumped to {dumpfilename}")
+                with span('commit'):
+                    conn.commit()
+            else:
+                print(f"The transaction failed for the group {match_filepaths}\nRollback and abort badly.\nCache is dumped to {dumpfilename}")
+                conn.rollback()
+            raise
+        with span('commit'):
+            conn.commit()
+        print(f"Finished match {match_data.timestamp} in {current_span().elapsed()} sec")
         
 
-async def normalize_raw_features(filepath: Path, compress: bool, output_dir: Path) -> None:
-    print(f"Start file {filepath}")
-    start_time = time.time()
-    ## Analize table type
-    tabletype = TableType.from_filepath(filepath)
-    ## Set columns to be normalized
-    normalizable = None
-    if tabletype is TableType.DASH:
-        normalizable = [ DashColumn.DASH_POWER, DashColumn.DASH_DIRECTION ]
-        output_suffix = '.dash.csv'
-    elif tabletype is TableType.TURN:
-        normalizable = [ TurnColumn.TURN_MOMENT]
-        output_suffix = '.turn.csv'
-    elif tabletype is TableType.KICK:
-        normalizable = [ KickColumn.KICK_POWER, KickColumn.KICK_DIRECTION ]
-        output_suffix = '.kick.csv'
-    elif tabletype is TableType.TACKLE:
-        normalizable = [ TackleColumn.TACKLE_DIRECTION ]
-        output_suffix = '.tackle.csv'
-    elif tabletype is TableType.MATCH:
-        normalizable = [ 
-            MatchGeneralColumn.BALL_X,
-            MatchGeneralColumn.BALL_Y,
-            MatchGeneralColumn.BALL_VX,
-            MatchGeneralColumn.BALL_VY
-        ]
-        player_normalizable = [
-            SinglePlayerColumn.X,
-            SinglePlayerColumn.Y,
-            SinglePlayerColumn.VX,
-            SinglePlayerColumn.VY,
-            SinglePlayerColumn.BODY_ANGLE,
-            SinglePlayerColumn.STAMINA,
-            SinglePlayerColumn.STAMINA_RESERVE
-        ]
-        for side in [ FieldSide.LEFT, FieldSide.RIGHT ]:
-            for unum in range(1,12):
-                for player_column in player_normalizable:
-                    normalizable.append(MatchPlayerColumn(side, UniformNumber.from_int(unum), player_column))
-        output_suffix = '.match.csv'
-    elif tabletype is TableType.PTYPES:
-        normalizable = [ 
-            PlayerTypesColumn.DASH_POWER_RATE,
-            PlayerTypesColumn.PLAYER_DECAY,
-            PlayerTypesColumn.INERTIA_MOMENT,
-            PlayerTypesColumn.KICKABLE_MARGIN,
-            PlayerTypesColumn.KICK_RAND,
-            PlayerTypesColumn.EXTRA_STAMINA,
-            PlayerTypesColumn.EFFORT_MIN,
-            PlayerTypesColumn.EFFORT_MAX
-        ]
-        output_suffix = '.playertypes.csv'
-    else:
-        ## Not interested
-        return
-    ## Create normalizers
-    normalizers = [ normalizer_from_columntype(column_type) for column_type in normalizable ]
-    ## Read table
-    df = None
-    columns_names = list(map(str, normalizable))
-    try:
-        df = pd.read_csv(
-            filepath, 
-            compression=('gzip' if filepath.match('*.gz') else None),
-        )
-    except Exception as excpt:
-        print(excpt)
-        return
-    ## Normalize
-    for column, normalizer in zip(columns_names, normalizers):
-        df[column] = normalizer.normalize(df[column].astype('float64').values)
-    ## Dump output table
-    outputfilename = filepath.name.split('.')[0] + output_suffix + ('.gz' if compress else '')
-    df.to_csv(
-        output_dir / outputfilename, 
-        compression=('gzip' if compress else None),
-        index=False
-    )
-    print(f"Finished file {filepath} in {time.time() - start_time} sec")
-
-
-async def extract_raw_features(filepath: Path, compress: bool, output_dir: Path) -> None:
-    ## Analyze table type
-    raw_feature_list = None
-    output_suffix = ''
-    try:
-        tabletype = TableType.from_filepath(filepath)
-    except ValueError as excpt:
-        print(excpt.message)
-        print("Skip file.")
-        return
+def raw_feature_columns(tabletype: TableType) -> Optional[List[str]]:
+    """ Columns of a raw table used by the v1.0.x experiments. None if the table is of no interest. """
     if tabletype == TableType.DASH:
-        raw_feature_list = ['running_time', 'stopped_time', 'teamname', 'unum', 'dash_power', 'dash_direction']
-        output_suffix += '.dash.csv'
-    elif tabletype == TableType.KICK:
-        raw_feature_list = ['running_time', 'stopped_time', 'teamname', 'unum', 'kick_power', 'kick_direction']
-        output_suffix += '.kick.csv'
-    elif tabletype == TableType.TURN:
-        raw_feature_list = ['running_time', 'stopped_time', 'teamname', 'unum', 'turn_moment']
-        output_suffix += '.turn.csv'
-    elif tabletype == TableType.TACKLE:
-        raw_feature_list = ['running_time', 'stopped_time', 'teamname', 'unum', 'tackle_direction']
-        output_suffix += '.tackle.csv'
-    elif tabletype == TableType.MATCH:
+        return ['running_time', 'stopped_time', 'teamname', 'unum', 'dash_power', 'dash_direction']
+    if tabletype == TableType.KICK:
+        return ['running_time', 'stopped_time', 'teamname', 'unum', 'kick_power', 'kick_direction']
+    if tabletype == TableType.TURN:
+        return ['running_time', 'stopped_time', 'teamname', 'unum', 'turn_moment']
+    if tabletype == TableType.TACKLE:
+        return ['running_time', 'stopped_time', 'teamname', 'unum', 'tackle_direction']
+    if tabletype == TableType.MATCH:
         raw_feature_list = [
             'cycle', 
             'stopped', 
@@ -647,12 +699,11 @@ async def extract_raw_features(filepath: Path, compress: bool, output_dir: Path)
                         ] 
             ]
         ]
-        output_suffix += '.match.csv'
         ## FIXME: The line below won't be needed once we have version 1.0.1 of the dataset
-        raw_feature_list = [f' {raw_feature_name}' for raw_feature_name in raw_feature_list]
+        return [f' {raw_feature_name}' for raw_feature_name in raw_feature_list]
         ##
-    elif tabletype == TableType.PTYPES:
-        raw_feature_list = [
+    if tabletype == TableType.PTYPES:
+        return [
             'id',
             'dash_power_rate',
             'player_decay',
@@ -663,32 +714,116 @@ async def extract_raw_features(filepath: Path, compress: bool, output_dir: Path)
             'effort_min',
             'effort_max'
         ]
-        output_suffix += '.playertypes.csv'
-    else:
-        # Skip this CSV, not of our interest
+    # Not of our interest
+    return None
+
+
+def _output_filename(filepath: Path, tabletype: TableType, compress: bool) -> str:
+    return filepath.name.split('.')[0] + f'.{tabletype}.csv' + ('.gz' if compress else '')
+
+
+@profiled('normalize')
+def _normalize_chunk(df: pd.DataFrame, plan: NormalizationPlan) -> pd.DataFrame:
+    # All the normalized columns are taken out as a single float block, normalized at once and put back
+    df[plan.columns] = plan.apply(df[plan.columns].to_numpy(dtype=np.float64, copy=True))
+    return df
+
+
+@profiled()
+async def normalize_raw_features(filepath: Path, compress: bool, output_dir: Path, memory_budget: Optional[int]=None) -> None:
+    """
+        Normalizes the features of a table (see normalization_plan) and saves it as a new CSV in :output_dir:.
+        The params of the match are read from the serverparams and playerparams tables next to the table, if any (see NormalizationParams.of_table).
+
+        :memory_budget: if given, the table is streamed in row chunks that fit this many bytes.
+        Raises on unreadable tables, so that the caller can report them.
+    """
+    print(f"Start file {filepath}")
+    current_span().annotate(table=filepath.name)
+    ## Analize table type
+    tabletype = TableType.from_filepath(filepath)
+    ## Get the normalization of the columns to be normalized
+    plan = normalization_plan(tabletype, NormalizationParams.of_table(filepath))
+    if plan is None:
         return
-    ## Load table only with the data needed
-    df = None
+    ## Read table, normalize and dump output table
+    write_csv_chunks(
+        (_normalize_chunk(df, plan) for df in read_table_chunks(filepath, memory_budget)),
+        output_dir / _output_filename(filepath, tabletype, compress),
+        compress
+    )
+    print(f"Finished file {filepath} in {current_span().elapsed()} sec")
+
+
+@profiled()
+async def extract_raw_features(filepath: Path, compress: bool, output_dir: Path, memory_budget: Optional[int]=None) -> None:
+    """
+        Extracts the columns of a table used by the v1.0.x experiments and saves them as a new CSV in :output_dir:.
+
+        :memory_budget: if given, the table is streamed in row chunks that fit this many bytes.
+        Tables of no interest are skipped. Raises on unreadable tables, so that the caller can report them.
+    """
+    current_span().annotate(table=filepath.name)
+    ## Analyze table type
     try:
-        df = pd.read_csv(
-            filepath, 
-            compression=('gzip' if filepath.match('*.gz') else None),
-            usecols=raw_feature_list
-        )
-    except Exception as excpt:
-        cprint(excpt)
+        tabletype = TableType.from_filepath(filepath)
+    except ValueError as excpt:
+        print(excpt)
+        print("Skip file.")
         return
-    ## Dump output table
-    outputfilename = filepath.name.split('.')[0] + output_suffix + ('.gz' if compress else '')
-    df.to_csv(
-        output_dir / outputfilename, 
-        compression=('gzip' if compress else None),
-        index=False
+    raw_feature_list = raw_feature_columns(tabletype)
+    if raw_feature_list is None:
+        # Skip this CSV, not of our interest
+        return
+    ## Load table only with the data needed and dump output table
+    write_csv_chunks(
+        read_table_chunks(filepath, memory_budget, usecols=raw_feature_list),
+        output_dir / _output_filename(filepath, tabletype, compress),
+        compress
     )
 
 
+@profiled()
+async def prepare_raw_features(filepath: Path, compress: bool, output_dir: Path, raw_output_dir: Optional[Path]=None, memory_budget: Optional[int]=None) -> None:
+    """
+        Extracts and normalizes the features of a raw table in a single pass, i.e. the output of extract_raw_features followed
+        by normalize_raw_features, without writing and parsing back the intermediate table.
+        The table is read once, only with the columns needed, and normalized in memory.
+        Unlike the normalization of an extracted table, the params of the match are read from its serverparams and playerparams tables.
+
+        :raw_output_dir: if given, the extracted (not normalized) table is also saved there.
+        :memory_budget: if given, the table is streamed in row chunks that fit this many bytes.
+        Tables of no interest are skipped. Raises on unreadable tables, so that the caller can report them.
+    """
+    print(f"Start file {filepath}")
+    current_span().annotate(table=filepath.name)
+    try:
+        tabletype = TableType.from_filepath(filepath)
+    except ValueError as excpt:
+        print(excpt)
+        print("Skip file.")
+        return
+    raw_feature_list = raw_feature_columns(tabletype)
+    plan = normalization_plan(tabletype, NormalizationParams.of_table(filepath))
+    if raw_feature_list is None or plan is None:
+        return
+    outputfilename = _output_filename(filepath, tabletype, compress)
+    with ExitStack() as stack:
+        raw_writer = None
+        if raw_output_dir is not None:
+            raw_writer = stack.enter_context(CsvChunkWriter(raw_output_dir / outputfilename, compress))
+        def normalized_chunks() -> Iterator[pd.DataFrame]:
+            for df in read_table_chunks(filepath, memory_budget, usecols=raw_feature_list):
+                if raw_writer is not None:
+                    # Normalizing replaces the columns, so the raw projection is written first
+                    raw_writer.write(df)
+                yield _normalize_chunk(df, plan)
+        write_csv_chunks(normalized_chunks(), output_dir / outputfilename, compress)
+    print(f"Finished file {filepath} in {current_span().elapsed()} sec")
+
+
+@profiled()
 async def copy_match_metadata_to_postgres(match_filepath: Path, connection) -> None:
-    profiling_start = time.time()
     print(f"Starting file {str(match_filepath)[:100]}...")
 
     match_data = MatchData.from_filepath(match_filepath)
@@ -701,9 +836,17 @@ async def copy_match_metadata_to_postgres(match_filepath: Path, connection) -> N
     )):
         raise ValueError(f'Match filepath {match_filepath} is incomplete. Abort.')
         
-    
+    checksum = files_checksum([match_filepath])
     cursor: pg.cursor = connection.cursor()
     try:
+        if check_manifest_entry(
+            read_manifest_entry(cursor, LoadOperation.METADATA, 'public', match_data.timestamp),
+            checksum,
+            f'Match {match_data.timestamp}'
+        ) == STAGE_DONE:
+            connection.rollback()
+            print(f"Match {match_data.timestamp} metadata is already loaded. Skip.")
+            return
         columns_str = ','.join([
             'match_timestamp',
             'left_finalteamname',
@@ -718,17 +861,133 @@ async def copy_match_metadata_to_postgres(match_filepath: Path, connection) -> N
             match_data.left_finalscore,
             match_data.right_finalscore
         )).decode('utf8')
-        query = f"INSERT INTO public.matches ({columns_str}) VALUES {values_str}"
-        cursor.execute(query)
+        query = f"INSERT INTO public.matches ({columns_str}) VALUES {values_str};"
+        # Sent together so that, even in autocommit mode, the match and its manifest entry are committed as one
+        cursor.execute(query + manifest_entry_statement(cursor, LoadOperation.METADATA, 'public', match_data.timestamp, checksum, STAGE_DONE))
         # print(query)
     except Exception as excpt:
         cprint(excpt)
         print(f"The transaction failed for the match file {match_filepath}\nRollback and abort.")
         connection.rollback()
-        return
+        raise
     finally:
         cursor.close()
+    with span('commit'):
+        connection.commit()
+    print(f"Finished match {match_data.timestamp} in {current_span().elapsed()} sec")
+
+def read_match_ids(connection, filepaths: List[Path]) -> Dict[str, int]:
+    """ The match_id of the matches of some tables (by match timestamp) that are in public.matches, with a single query. """
+    timestamps = { match_data.timestamp for match_data in map(MatchData.from_filepath, filepaths) if isinstance(match_data, MatchData) }
+    with closing(connection.cursor()) as cursor:
+        cursor.execute("SELECT match_timestamp, match_id FROM public.matches WHERE match_timestamp = ANY(%s);", (list(timestamps),))
+        match_ids = dict(cursor.fetchall())
     connection.commit()
-    profiling_end = time.time()
-    print(f"Finished match {match_data.timestamp} in {profiling_end-profiling_start} sec")
+    return match_ids
+
+
+def metadata_batch(match_filepaths: List[Path]) -> Tuple[Dict[str, Tuple[Path, MatchData, str]], List[Tuple[Path, str]]]:
+    """
+        The matches of a batch of match tables, by match timestamp: (filepath, match data, checksum).
+        Returns them along with the (filepath, error message) pairs of the tables left out: the ones whose filename
+        misses some match field, and the ones of a match that already has a table in the batch, since a single
+        INSERT ... ON CONFLICT statement can't affect the same row twice.
+    """
+    failures = []
+    matches = {}
+    for match_filepath in match_filepaths:
+        match_data = MatchData.from_filepath(match_filepath)
+        if not isinstance(match_data, MatchData) or None in (
+            match_data.timestamp,
+            match_data.left_teamname,
+            match_data.left_finalscore,
+            match_data.right_teamname,
+            match_data.right_finalscore
+        ):
+            failures.append((match_filepath, f'ValueError: Match filepath {match_filepath} is incomplete'))
+        elif match_data.timestamp in matches:
+            failures.append((match_filepath, f'ValueError: Match {match_data.timestamp} has another match table in the batch'))
+        else:
+            matches[match_data.timestamp] = (match_filepath, match_data, files_checksum([match_filepath]))
+    return matches, failures
 
+def check_metadata_batch(matches: Dict[str, Tuple[Path, MatchData, str]], entries: Dict[str, ManifestEntry]) -> List[Tuple[Path, str]]:
+    """
+        Leaves out of a batch (see metadata_batch) the matches whose load manifest entry, by match timestamp,
+        was recorded for different files. Returns their (filepath, error message) pairs.
+    """
+    failures = []
+    for timestamp, entry in entries.items():
+        if timestamp not in matches:
+            continue
+        try:
+            check_manifest_entry(entry, matches[timestamp][2], f'Match {timestamp}')
+        except ValueError as excpt:
+            failures.append((matches.pop(timestamp)[0], f"{type(excpt).__name__}: {excpt}"))
+    return failures
+
+
+@profiled()
+async def upsert_matches_metadata(match_filepaths: List[Path], connection) -> Tuple[Dict[str, int], List[Tuple[Path, str]]]:
+    """
+        Batched copy_match_metadata_to_postgres: the metadata of every match is upserted into public.matches with a single
+        INSERT ... ON CONFLICT statement, along with its load manifest entries, in one transaction.
+        Matches already there are updated instead of failing, unless the load manifest has them from different files.
+        Returns the match_id of every upserted match timestamp, to be given to the contents and playertypes loaders,
+        and the (filepath, error message) pairs of the tables left out.
+    """
+    print(f"Starting {len(match_filepaths)} match files...")
+    matches, failures = metadata_batch(match_filepaths)
+    match_ids = {}
+    cursor: pg.cursor = connection.cursor()
+    try:
+        cursor.execute(
+            f"SELECT match_timestamp, checksum, stage FROM {MANIFEST_TABLE} WHERE operation = %s AND target_schema = 'public' AND match_timestamp = ANY(%s);",
+            (str(LoadOperation.METADATA), list(matches.keys()))
+        )
+        failures += check_metadata_batch(matches, {
+            timestamp: ManifestEntry(checksum, stage) for timestamp, checksum, stage in cursor.fetchall()
+        })
+        if len(matches) > 0:
+            columns_str = ','.join([
+                'match_timestamp',
+                'left_finalteamname',
+                'right_finalteamname',
+                'left_finalscore',
+                'right_finalscore'
+            ])
+            values_str = ",".join(
+                cursor.mogrify("(%s,%s,%s,%s,%s)", (
+                    match_data.timestamp,
+                    match_data.left_teamname,
+                    match_data.right_teamname,
+                    match_data.left_finalscore,
+                    match_data.right_finalscore
+                )).decode('utf8') for _, match_data, _ in matches.values()
+            )
+            # Updating on conflict (instead of doing nothing) returns the match_id of the existing matches too
+            query = f"INSERT INTO public.matches ({columns_str}) VALUES {values_str} " +\
+                    "ON CONFLICT (match_timestamp) DO UPDATE SET " +\
+                    "left_finalteamname = EXCLUDED.left_finalteamname, right_finalteamname = EXCLUDED.right_finalteamname, " +\
+                    "left_finalscore = EXCLUDED.left_finalscore, right_finalscore = EXCLUDED.right_finalscore " +\
+                    "RETURNING match_timestamp, match_id;"
+            with span('execute', rows=len(matches), bytes=len(query), table='matches'):
+                cursor.execute(query)
+                match_ids = dict(cursor.fetchall())
+            cursor.execute(
+                f"INSERT INTO {MANIFEST_TABLE} (operation, target_schema, match_timestamp, checksum, stage) " +
+                "SELECT %s, 'public', entries.match_timestamp, entries.checksum, %s FROM unnest(%s::varchar[], %s::char(64)[]) AS entries(match_timestamp, checksum) " +
+                "ON CONFLICT (operation, target_schema, match_timestamp) DO UPDATE SET checksum = EXCLUDED.checksum, stage = EXCLUDED.stage, updated_at = now();",
+                (str(LoadOperation.METADATA), STAGE_DONE, list(matches.keys()), [ checksum for _, _, checksum in matches.values() ])
+            )
+    except Exception as excpt:
+        cprint(excpt)
+        print(f"The transaction failed for the metadata of {len(matches)} matches\nRollback and abort.")
+        connection.rollback()
+        raise
+    finally:
+        cursor.close()
+    with span('commit'):
+        connection.commit()
+    print(f"Finished metadata of {len(match_ids)} matches in {current_span().elapsed()} sec")
+    return match_ids, failures
@@ -0,0 +1,199 @@
+from itertools import repeat
+from typing import Dict, Iterable, List
+
+import numpy as np
+import pandas as pd
+
+from tasks.profiling import profiled
+from tasks.rcss2d import FieldSide, UniformNumber
+from tasks.v1.types import *
+from .utils import MatchData
+
+PLAYERTYPES_COLUMNS = [
+    'match_id_fk',
+    'id',
+    'player_decay',
+    'inertia_moment',
+    'dash_power_rate',
+    'kickable_margin',
+    'kick_rand',
+    'extra_stamina',
+    'effort_min',
+    'effort_max'
+]
+MATCHSTATES_COLUMNS = [
+    'match_id_fk',
+    'cycle',
+    'stopped_cycle',
+    'playmode',
+    'left_teamname',
+    'right_teamname',
+    'ball_x',
+    'ball_y',
+    'ball_vx',
+    'ball_vy'
+]
+# Match table columns feeding MATCHSTATES_COLUMNS[1:]
+MATCHSTATES_MATCH_COLUMNS = [
+    ' cycle',
+    ' stopped',
+    ' playmode',
+    ' l_name',
+    ' r_name',
+    ' b_x',
+    ' b_y',
+    ' b_vx',
+    ' b_vy'
+]
+PLAYERSTATES_COLUMNS = [
+    'match_id_fk',
+    'matchstate_id_fk',
+    'playertype_id_fk',
+    'teamname',
+    'unum',
+    'isgoalie',
+    'isdiscarded',
+    'x',
+    'y',
+    'vx',
+    'vy',
+    'body',
+    'stamina',
+    'stamina_capacity'
+]
+# Columns of the compact player states (see db/setup_pg_v1_data_compact.sql): every column after the keys holds an array
+# with the values of the player states of a match table row, in PLAYERSTATE_ORDER
+PLAYERSTATE_BLOCKS_COLUMNS = [
+    'match_id_fk',
+    'matchstate_id_fk',
+    'playertype_ids',
+    'isgoalie',
+    'isdiscarded',
+    'x',
+    'y',
+    'vx',
+    'vy',
+    'body',
+    'stamina',
+    'stamina_capacity'
+]
+# Player states are built per match table row in this order of (side, unum)
+PLAYERSTATE_ORDER = [ (side, unum) for side in ('l', 'r') for unum in range(1,12) ]
+# Columns of a single player feeding PLAYERSTATES_COLUMNS[2:]
+PLAYERSTATE_MATCH_COLUMN_SUFFIXES = [
+    SinglePlayerColumn.TYPE,
+    SinglePlayerColumn.IS_GOALIE,
+    SinglePlayerColumn.DISCARDED,
+    SinglePlayerColumn.X,
+    SinglePlayerColumn.Y,
+    SinglePlayerColumn.VX,
+    SinglePlayerColumn.VY,
+    SinglePlayerColumn.BODY_ANGLE,
+    SinglePlayerColumn.STAMINA,
+    SinglePlayerColumn.STAMINA_RESERVE
+]
+# Match table columns feeding PLAYERSTATES_COLUMNS, player after player in PLAYERSTATE_ORDER, so that a row of them
+# reshaped to (len(PLAYERSTATE_ORDER), len(PLAYERSTATE_MATCH_COLUMN_SUFFIXES)) has one player per row
+PLAYERSTATES_MATCH_COLUMNS = [
+    MatchPlayerColumn.name(FieldSide.from_str(side), UniformNumber.from_int(unum), player_column)
+    for side, unum in PLAYERSTATE_ORDER
+        for player_column in PLAYERSTATE_MATCH_COLUMN_SUFFIXES
+]
+
+
+@profiled()
+def playertypes_rows(playertypes: pd.DataFrame, match_id: int) -> List[tuple]:
+    """ Rows of PLAYERTYPES_COLUMNS for every player type of a match. """
+    return [
+        (
+            match_id,
+            int(csv_row['id']), # The playertypes table is all numeric, so iterrows gives ids as floats
+            *(csv_row[playertypes_column] for playertypes_column in PLAYERTYPES_COLUMNS[2:]),
+        ) for _, csv_row in playertypes.iterrows()
+    ]
+
+
+@profiled()
+def matchstates_rows(match: pd.DataFrame, match_id: int) -> List[tuple]:
+    """ Rows of MATCHSTATES_COLUMNS for every row of a match table. """
+    return [
+        (
+            match_id,
+            *(csv_row[match_column] for match_column in MATCHSTATES_MATCH_COLUMNS),
+        ) for _, csv_row in match.iterrows()
+    ]
+
+
+def long_playerstates(match: pd.DataFrame) -> np.ndarray:
+    """
+        Reshapes the player columns of a match table from wide (a group of columns per player) to long:
+        one row per player at every match table row, in PLAYERSTATE_ORDER, and one column per PLAYERSTATE_MATCH_COLUMN_SUFFIXES.
+        The array holds objects, so every value keeps the python type of its own column (as tolist would give it).
+    """
+    wide = np.stack([ match[column].to_numpy(dtype=object) for column in PLAYERSTATES_MATCH_COLUMNS ], axis=1) if len(match) > 0 else\
+        np.empty((0, len(PLAYERSTATES_MATCH_COLUMNS)), dtype=object)
+    return wide.reshape(len(match) * len(PLAYERSTATE_ORDER), len(PLAYERSTATE_MATCH_COLUMN_SUFFIXES))
+
+
+def _check_playertypes(typeids: np.ndarray, known_typeids: Iterable[int]) -> None:
+    """ Raises KeyError if a player type id is not one of the :known_typeids:. """
+    unknown = set(np.unique(typeids).tolist()) - set(known_typeids)
+    if len(unknown) > 0:
+        raise KeyError(f'Player types {sorted(unknown)} are not in the playertypes table')
+
+
+def array_literal(values: Iterable) -> str:
+    """ Postgres array literal of python values, written as COPY and mogrify write them. """
+    return '{' + ','.join(map(str, values)) + '}'
+
+
+@profiled()
+def playerstates_rows(match: pd.DataFrame, match_data: MatchData, match_id: int, matchstate_id_cache: List[int], playertype_id_cache: Dict[int, int]) -> List[tuple]:
+    """
+        Rows of PLAYERSTATES_COLUMNS for every player at every row of a match table, in PLAYERSTATE_ORDER.
+        Values are taken column by column, so each keeps the type of its own column whatever the other columns read are.
+
+        :matchstate_id_cache: matchstate_id of every match table row, by row number.
+        :playertype_id_cache: playertype_id of every player type of the match.
+    """
+    players = long_playerstates(match)
+    # Foreign keys of every player, joined by indexing arrays of ids
+    matchstate_ids = np.repeat(np.asarray(matchstate_id_cache, dtype=np.int64)[match.index.to_numpy()], len(PLAYERSTATE_ORDER))
+    playertype_ids = np.full(max(playertype_id_cache.keys(), default=-1) + 1, -1, dtype=np.int64)
+    playertype_ids[list(playertype_id_cache.keys())] = list(playertype_id_cache.values())
+    typeids = players[:, 0].astype(np.int64)
+    if len(typeids) > 0 and (typeids.min() < 0 or typeids.max() >= len(playertype_ids) or (playertype_ids[typeids] < 0).any()):
+        _check_playertypes(typeids, playertype_id_cache.keys())
+    teamnames = [ (match_data.left_teamname if side == 'l' else match_data.right_teamname) for side, _ in PLAYERSTATE_ORDER ]
+    unums = [ unum for _, unum in PLAYERSTATE_ORDER ]
+    return list(zip(
+        repeat(match_id),
+        matchstate_ids.tolist(),
+        playertype_ids[typeids].tolist(),
+        teamnames * len(match),
+        unums * len(match),
+        map(str, players[:, 1].tolist()), # Postgres accepts '1'/'0' as true/false
+        map(str, players[:, 2].tolist()), # Postgres accepts '1'/'0' as true/false
+        *players[:, 3:].T.tolist()
+    ))
+
+
+@profiled()
+def playerstate_blocks_rows(match: pd.DataFrame, match_id: int, matchstate_id_cache: List[int], playertype_id_cache: Dict[int, int]) -> List[tuple]:
+    """
+        Rows of PLAYERSTATE_BLOCKS_COLUMNS for every row of a match table: its player states as Postgres array literals
+        (see array_literal), with the values playerstates_rows would give, but the player type ids of the match.
+
+        :matchstate_id_cache: matchstate_id of every match table row, by row number.
+        :playertype_id_cache: playertype_id of every player type of the match, only used to check the player types.
+    """
+    players = long_playerstates(match).reshape(len(match), len(PLAYERSTATE_ORDER), len(PLAYERSTATE_MATCH_COLUMN_SUFFIXES))
+    typeids = players[:, :, 0].astype(np.int64)
+    _check_playertypes(typeids, playertype_id_cache.keys())
+    matchstate_ids = np.asarray(matchstate_id_cache, dtype=np.int64)[match.index.to_numpy()]
+    return list(zip(
+        repeat(match_id),
+        matchstate_ids.tolist(),
+        map(array_literal, typeids.tolist()),
+        *(map(array_literal, players[:, :, column].tolist()) for column in range(1, len(PLAYERSTATE_MATCH_COLUMN_SUFFIXES)))
+    ))
@@ -0,0 +1,143 @@
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+from tasks.v1.types import *
+from .linking import PLAYERCOMMAND_PARAMETERS
+from .manifest import LoadOperation
+from .rows import MATCHSTATES_MATCH_COLUMNS, PLAYERSTATES_MATCH_COLUMNS, PLAYERTYPES_COLUMNS
+
+"""
+    Schema registry of the CSV tables, derived from the column enums of tasks/v1/types.py.
+    Without it pandas reads every integer as int64 and every string as a python object per row.
+    The registry gives the readers:
+        - compact dtypes for the integer columns. Keys the loaders can't do without (cycles, uniform numbers, player type ids)
+          are plain numpy integers; the per-player columns are nullable integers, so a missing value does not fail the read.
+        - categories for the string columns (team names, playmodes...), which repeat all along a match.
+        - the minimal set of columns every load operation reads (see load_usecols).
+    Float columns keep the type pandas infers: they are written back to CSVs and postgres numeric columns as they were read.
+"""
+ROWNUM_DTYPES = {
+    TableColumnType.ROWNUM: 'int32'
+}
+COMMAND_DTYPES = {
+    **ROWNUM_DTYPES,
+    CommandTableColumn.RUNNING_TIME:        'int32',
+    CommandTableColumn.STOPPED_TIME:        'int32',
+    CommandTableColumn.GLOBAL_ORDER_INDEX:  'int32',
+    CommandTableColumn.TEAMNAME:            'category',
+    CommandTableColumn.UNIFORM_NUMBER:      'int8',
+}
+MATCH_GENERAL_DTYPES = {
+    MatchGeneralColumn.CYCLE:               'int32',
+    MatchGeneralColumn.STOPPED:             'int32',
+    MatchGeneralColumn.PLAYMODE:            'category',
+    MatchGeneralColumn.LEFT_NAME:           'category',
+    MatchGeneralColumn.LEFT_SCORE:          'int16',
+    MatchGeneralColumn.LEFT_PENALTY_SCORE:  'int16',
+    MatchGeneralColumn.RIGHT_NAME:          'category',
+    MatchGeneralColumn.RIGHT_SCORE:         'int16',
+    MatchGeneralColumn.RIGHT_PENALTY_SCORE: 'int16',
+}
+SINGLE_PLAYER_DTYPES = {
+    SinglePlayerColumn.TYPE:                    'Int8',
+    SinglePlayerColumn.KICK_TRIED:              'Int8',
+    SinglePlayerColumn.KICK_FAILED:             'Int8',
+    SinglePlayerColumn.IS_GOALIE:               'Int8',
+    SinglePlayerColumn.CATCH_TRIED:             'Int8',
+    SinglePlayerColumn.CATCH_FAILED:            'Int8',
+    SinglePlayerColumn.DISCARDED:               'Int8',
+    SinglePlayerColumn.COLLIDED_WITH_BALL:      'Int8',
+    SinglePlayerColumn.COLLIDED_WITH_PLAYER:    'Int8',
+    SinglePlayerColumn.TACKLE_TRIED:            'Int8',
+    SinglePlayerColumn.TACKLE_FAILED:           'Int8',
+    SinglePlayerColumn.BACKPASSED:              'Int8',
+    SinglePlayerColumn.FREEKICKED_WRONG:        'Int8',
+    SinglePlayerColumn.COLLIDED_WITH_POST:      'Int8',
+    SinglePlayerColumn.FOUL_FROZEN:             'Int8',
+    SinglePlayerColumn.YELLOW_CARD:             'Int8',
+    SinglePlayerColumn.RED_CARD:                'Int8',
+    SinglePlayerColumn.DEFENDED_ILLEGALY:       'Int8',
+    SinglePlayerColumn.VIEW_QUALITY:            'category',
+    SinglePlayerColumn.FOCUS_SIDE:              'category',
+    SinglePlayerColumn.KICK_COUNT:              'Int32',
+    SinglePlayerColumn.DASH_COUNT:              'Int32',
+    SinglePlayerColumn.TURN_COUNT:              'Int32',
+    SinglePlayerColumn.CATCH_COUNT:             'Int32',
+    SinglePlayerColumn.MOVE_COUNT:              'Int32',
+    SinglePlayerColumn.TURN_NECK_COUNT:         'Int32',
+    SinglePlayerColumn.CHANGE_VIEW_COUNT:       'Int32',
+    SinglePlayerColumn.SAY_COUNT:               'Int32',
+    SinglePlayerColumn.TACKLE_COUNT:            'Int32',
+    SinglePlayerColumn.POINTTO_COUNT:           'Int32',
+    SinglePlayerColumn.FOCUS_COUNT:             'Int32',
+}
+PLAYERTYPES_DTYPES = {
+    **ROWNUM_DTYPES,
+    PlayerTypesColumn.ID:   'int8',
+}
+TACKLE_DTYPES = {
+    **COMMAND_DTYPES,
+    TackleColumn.FOUL_INTENTION: 'Int8',
+}
+
+
+def table_dtypes(tabletype: TableType) -> Dict[str, str]:
+    """ The dtype of every column of a table type with a registered one. Columns left out keep the type pandas infers. """
+    if tabletype is TableType.DASH or tabletype is TableType.TURN or tabletype is TableType.KICK:
+        return { str(column): dtype for column, dtype in COMMAND_DTYPES.items() }
+    if tabletype is TableType.TACKLE:
+        return { str(column): dtype for column, dtype in TACKLE_DTYPES.items() }
+    if tabletype is TableType.PTYPES:
+        return { str(column): dtype for column, dtype in PLAYERTYPES_DTYPES.items() }
+    if tabletype is TableType.MATCH:
+        return {
+            **{ str(column): dtype for column, dtype in ROWNUM_DTYPES.items() },
+            **{ str(column): dtype for column, dtype in MATCH_GENERAL_DTYPES.items() },
+            **{
+                MatchPlayerColumn.name(side, UniformNumber.from_int(unum), column): dtype
+                for side in [ FieldSide.LEFT, FieldSide.RIGHT ]
+                    for unum in range(1,12)
+                        for column, dtype in SINGLE_PLAYER_DTYPES.items()
+            }
+        }
+    # Params tables are a single row
+    return {}
+
+
+def file_dtypes(filepath: Path, usecols: Optional[List[str]]=None) -> Dict[str, str]:
+    """ The registered dtypes of the table at :filepath:, only of :usecols: if given. Empty for files that are not tables. """
+    try:
+        dtypes = table_dtypes(TableType.from_filepath(filepath))
+    except ValueError:
+        return {}
+    if usecols is None:
+        return dtypes
+    return { column: dtypes[column] for column in usecols if column in dtypes }
+
+
+def with_dtypes(df: pd.DataFrame, dtypes: Dict[str, str]) -> pd.DataFrame:
+    """ Casts the columns of a frame read without the registry (e.g. an older cache entry) to their registered dtypes. """
+    casts = { column: dtype for column, dtype in dtypes.items() if column in df.columns and str(df[column].dtype) != dtype }
+    return df.astype(casts) if len(casts) > 0 else df
+
+
+def load_usecols(operation: LoadOperation, tabletype: TableType) -> Optional[List[str]]:
+    """ The columns of a table a load operation reads. None if the operation does not read tables of this type. """
+    if operation is LoadOperation.CONTENTS:
+        if tabletype is TableType.MATCH:
+            return MATCHSTATES_MATCH_COLUMNS + PLAYERSTATES_MATCH_COLUMNS
+        if tabletype in PLAYERCOMMAND_PARAMETERS:
+            return [
+                CommandTableColumn.RUNNING_TIME,
+                CommandTableColumn.STOPPED_TIME,
+                CommandTableColumn.TEAMNAME,
+                CommandTableColumn.UNIFORM_NUMBER,
+                *(str(column) for column in PLAYERCOMMAND_PARAMETERS[tabletype])
+            ]
+    if operation is LoadOperation.CONTENTS or operation is LoadOperation.PLAYERTYPES:
+        if tabletype is TableType.PTYPES:
+            return [ str(PlayerTypesColumn.ID), *PLAYERTYPES_COLUMNS[2:] ]
+    # Match metadata come from the file names
+    return None
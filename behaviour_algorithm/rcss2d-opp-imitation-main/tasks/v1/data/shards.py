@@ -0,0 +1,251 @@
+import json
+import os
+from pathlib import Path
+from typing import Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from tasks.v1.experiments.columns import ALL_FEATURE_COLUMNS, CLASSIFICATION_OUTPUT_COLUMNS, COMMAND_TYPES, REGRESSION_OUTPUT_COLUMNS
+
+"""
+    Training datasets as memory-mapped shards.
+    A shard directory holds, for every shard <name>:
+        <name>.features.f32     : float32 matrix (rows, len(ALL_FEATURE_COLUMNS)), row-major
+        <name>.labels.i8        : int8 vector (rows,), index of the command in LABEL_VALUES
+        <name>.regression.f32   : float32 matrix (rows, len(REGRESSION_OUTPUT_COLUMNS)), row-major
+        <name>.json             : the shard manifest (see ShardManifest)
+    The manifest is written last, so a shard without one is incomplete and ignored.
+    Missing values get the defaults the CSV training pipelines use: NaN features, 'nop' command and 0.0 regression targets.
+"""
+SHARD_FORMAT = 'rcss2d-v1-training-shard'
+SHARD_FORMAT_VERSION = 1
+SHARD_NAME_TEMPLATE = 'shard-%05d'
+SHARD_MANIFEST_GLOB = 'shard-*.json'
+NOP_COMMAND = 'nop'
+# Commands a label can take, 'nop' included. Unknown commands are stored as 'nop', since both have no 1-hot encoding.
+LABEL_VALUES = [ command_type.decode('utf8') for command_type in COMMAND_TYPES ] + [NOP_COMMAND]
+
+
+class ShardManifest(NamedTuple):
+    name:               str
+    rows:               int
+    feature_columns:    List[str]
+    label_column:       str
+    label_values:       List[str]
+    regression_columns: List[str]
+
+    def to_json(self) -> dict:
+        return {
+            'format': SHARD_FORMAT,
+            'version': SHARD_FORMAT_VERSION,
+            **self._asdict(),
+            'files': {
+                'features': f'{self.name}.features.f32',
+                'labels': f'{self.name}.labels.i8',
+                'regression': f'{self.name}.regression.f32'
+            }
+        }
+
+    @staticmethod
+    def from_json(content: dict) -> 'ShardManifest':
+        if content.get('format') != SHARD_FORMAT or content.get('version') != SHARD_FORMAT_VERSION:
+            raise ValueError(f"Unsupported shard format {content.get('format')} version {content.get('version')}")
+        return ShardManifest(**{ field: content[field] for field in ShardManifest._fields })
+
+
+def is_shard_directory(path: Path) -> bool:
+    return path.is_dir() and any(path.glob(SHARD_MANIFEST_GLOB))
+
+
+def check_stored_columns(path: Path, feature_columns: List[str], label_values: List[str], regression_columns: List[str]) -> None:
+    """ Raises ValueError if a converted dataset was not written with the current feature columns (ALL_FEATURE_COLUMNS) or outputs. """
+    if feature_columns != ALL_FEATURE_COLUMNS:
+        raise ValueError(f"{path} features do not match ALL_FEATURE_COLUMNS. Convert the dataset again.")
+    if label_values != LABEL_VALUES or regression_columns != REGRESSION_OUTPUT_COLUMNS:
+        raise ValueError(f"{path} outputs do not match the current output columns. Convert the dataset again.")
+
+
+def read_shard_manifests(dirpath: Path) -> List[ShardManifest]:
+    """
+        Manifests of all shards of a directory, in name order.
+        Raises ValueError if a shard was not written with the current feature columns (ALL_FEATURE_COLUMNS) or labels.
+    """
+    manifests = []
+    for manifestpath in sorted(dirpath.glob(SHARD_MANIFEST_GLOB)):
+        with open(manifestpath, 'r') as file:
+            manifest = ShardManifest.from_json(json.load(file))
+        check_stored_columns(manifestpath, manifest.feature_columns, manifest.label_values, manifest.regression_columns)
+        manifests.append(manifest)
+    if len(manifests) == 0:
+        raise ValueError(f"No shards found in {dirpath}")
+    return manifests
+
+
+def open_shard(dirpath: Path, manifest: ShardManifest) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """ Read-only memory maps of the features, labels and regression targets of a shard. Nothing is read until sliced. """
+    if manifest.rows == 0:
+        return (
+            np.empty((0, len(manifest.feature_columns)), dtype=np.float32),
+            np.empty((0,), dtype=np.int8),
+            np.empty((0, len(manifest.regression_columns)), dtype=np.float32)
+        )
+    files = manifest.to_json()['files']
+    return (
+        np.memmap(dirpath / files['features'], dtype=np.float32, mode='r', shape=(manifest.rows, len(manifest.feature_columns))),
+        np.memmap(dirpath / files['labels'], dtype=np.int8, mode='r', shape=(manifest.rows,)),
+        np.memmap(dirpath / files['regression'], dtype=np.float32, mode='r', shape=(manifest.rows, len(manifest.regression_columns)))
+    )
+
+
+def shard_arrays(chunk: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """ Converts rows of a training CSV into the (features, labels, regression) arrays stored in shards. """
+    features = chunk.reindex(columns=ALL_FEATURE_COLUMNS).to_numpy(dtype=np.float32)
+    label_column = CLASSIFICATION_OUTPUT_COLUMNS[0]
+    labels = np.full(len(chunk), LABEL_VALUES.index(NOP_COMMAND), dtype=np.int8)
+    if label_column in chunk:
+        codes = pd.Categorical(chunk[label_column], categories=LABEL_VALUES).codes
+        labels[codes >= 0] = codes[codes >= 0]
+    regression = chunk.reindex(columns=REGRESSION_OUTPUT_COLUMNS).fillna(0.0).to_numpy(dtype=np.float32)
+    return features, labels, regression
+
+
+def read_training_chunks(csvpath: Path, chunk_rows: int) -> Iterator[pd.DataFrame]:
+    """ Streams the feature and output columns of a training dataset CSV in chunks of :chunk_rows: rows. """
+    dtypes = {
+        **{ column: np.float32 for column in ALL_FEATURE_COLUMNS + REGRESSION_OUTPUT_COLUMNS },
+        CLASSIFICATION_OUTPUT_COLUMNS[0]: str
+    }
+    wanted = set(dtypes)
+    return pd.read_csv(
+        csvpath,
+        compression=('gzip' if csvpath.match('*.gz') else None),
+        usecols=lambda column: column in wanted,
+        dtype=dtypes,
+        chunksize=chunk_rows
+    )
+
+
+class _ShardWriter:
+    """ Appends rows to the binary files of a shard, then seals it by writing its manifest. """
+
+    def __init__(self, dirpath: Path, name: str):
+        self.dirpath = dirpath
+        self.manifest = ShardManifest(
+            name=name,
+            rows=0,
+            feature_columns=ALL_FEATURE_COLUMNS,
+            label_column=CLASSIFICATION_OUTPUT_COLUMNS[0],
+            label_values=LABEL_VALUES,
+            regression_columns=REGRESSION_OUTPUT_COLUMNS
+        )
+        files = self.manifest.to_json()['files']
+        self.files = [ open(dirpath / files[key], 'wb') for key in ('features', 'labels', 'regression') ]
+
+    def write(self, arrays: Tuple[np.ndarray, np.ndarray, np.ndarray]) -> None:
+        for file, array in zip(self.files, arrays):
+            file.write(np.ascontiguousarray(array).tobytes())
+        self.manifest = self.manifest._replace(rows=self.manifest.rows + len(arrays[1]))
+
+    def seal(self) -> ShardManifest:
+        for file in self.files:
+            file.close()
+        manifestpath = self.dirpath / f'{self.manifest.name}.json'
+        temporary_path = manifestpath.with_name(f'.{manifestpath.name}.tmp')
+        with open(temporary_path, 'w') as file:
+            json.dump(self.manifest.to_json(), file)
+        os.replace(temporary_path, manifestpath)
+        return self.manifest
+
+
+class ShardSetWriter:
+    """
+        Writes consecutive (features, labels, regression) arrays (see shard_arrays) into shards of :rows_per_shard: rows
+        in :output_dir:, sealing each one as soon as it is full. Only the arrays being written are held in memory.
+        Shards are named after :name_template: and their number, so writers with different templates can share a directory.
+        Raises ValueError if :output_dir: already holds shards of the template.
+    """
+
+    def __init__(self, output_dir: Path, rows_per_shard: int=2**20, name_template: str=SHARD_NAME_TEMPLATE):
+        if any(output_dir.glob(name_template.replace('%05d', '*') + '.json')):
+            raise ValueError(f"{output_dir} already holds shards. Use an empty directory.")
+        self.output_dir = output_dir
+        self.rows_per_shard = rows_per_shard
+        self.name_template = name_template
+        self.manifests: List[ShardManifest] = []
+        self.writer: Optional[_ShardWriter] = None
+
+    def write(self, arrays: Tuple[np.ndarray, np.ndarray, np.ndarray]) -> None:
+        rows = len(arrays[1])
+        start = 0
+        while start < rows:
+            if self.writer is None:
+                self.writer = _ShardWriter(self.output_dir, self.name_template % len(self.manifests))
+            end = min(rows, start + self.rows_per_shard - self.writer.manifest.rows)
+            self.writer.write(tuple(array[start:end] for array in arrays))
+            start = end
+            if self.writer.manifest.rows == self.rows_per_shard:
+                self.manifests.append(self.writer.seal())
+                self.writer = None
+
+    def close(self) -> List[ShardManifest]:
+        """ Seals the last shard, even if not full. Returns the manifests of the written shards. """
+        if self.writer is not None:
+            self.manifests.append(self.writer.seal())
+            self.writer = None
+        return self.manifests
+
+    def discard(self) -> None:
+        """ Removes every shard written so far, manifests first, so that none of them is read afterwards. """
+        if self.writer is not None:
+            for file in self.writer.files:
+                file.close()
+        names = [ manifest.name for manifest in self.manifests ] + ([self.writer.manifest.name] if self.writer is not None else [])
+        for name in names:
+            (self.output_dir / f'{name}.json').unlink(missing_ok=True)
+        for name in names:
+            for filename in ShardManifest(name, 0, [], '', [], []).to_json()['files'].values():
+                (self.output_dir / filename).unlink(missing_ok=True)
+        self.manifests = []
+        self.writer = None
+
+
+def write_shard_arrays(
+    arrays: Iterable[Tuple[np.ndarray, np.ndarray, np.ndarray]],
+    output_dir: Path,
+    rows_per_shard: int=2**20
+) -> List[ShardManifest]:
+    """
+        Writes consecutive (features, labels, regression) arrays into shards of :rows_per_shard: rows in :output_dir:
+        (see ShardSetWriter). Returns the manifests of the written shards.
+    """
+    writer = ShardSetWriter(output_dir, rows_per_shard)
+    for chunk_arrays in arrays:
+        writer.write(chunk_arrays)
+    return writer.close()
+
+
+def write_training_shards(
+    csvpath: Path,
+    output_dir: Path,
+    rows_per_shard: int=2**20,
+    chunk_rows: int=2**16,
+    shuffle_seed: Optional[int]=None
+) -> List[ShardManifest]:
+    """
+        Converts a training dataset CSV (e.g. the output of db/gen_dataset_indarch.sql) into memory-mapped shards in :output_dir:.
+        The CSV is streamed in chunks of :chunk_rows: rows, so memory use does not depend on the dataset size.
+
+        :shuffle_seed: if given, the rows of every chunk are shuffled before being written. Readers slice batches out of
+            consecutive rows, so this plays the part of make_csv_dataset's shuffle buffer.
+        Returns the manifests of the written shards.
+    """
+    rng = np.random.default_rng(shuffle_seed) if shuffle_seed is not None else None
+
+    def chunk_arrays() -> Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        for chunk in read_training_chunks(csvpath, chunk_rows):
+            if rng is not None:
+                chunk = chunk.iloc[rng.permutation(len(chunk))]
+            yield shard_arrays(chunk)
+
+    return write_shard_arrays(chunk_arrays(), output_dir, rows_per_shard)
@@ -0,0 +1,330 @@
+from concurrent.futures import Future, ProcessPoolExecutor
+from collections import deque
+import gzip
+from pathlib import Path
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from tasks import profiling
+from tasks.profiling import SpanHandoff, SpanRecord, profiled, span
+from tasks.rcss2d import FieldSide, UniformNumber
+from tasks.v1.experiments.columns import ALL_FEATURE_COLUMNS, ALL_PLAYER_FEATURES, CLASSIFICATION_OUTPUT_COLUMNS, HETEROPARAM_FEATURES, OUTPUT_COLUMNS
+from tasks.v1.types import *
+from .chunking import read_table
+from .ingestion import _report
+from .linking import PLAYERCOMMAND_PARAMETERS, PLAYERCOMMAND_PRIORITY, link_playercommands, local_state_ids
+from .manifest import LoadOperation
+from .rows import PLAYERSTATE_ORDER
+from .schema import load_usecols
+from .shards import ShardSetWriter, shard_arrays
+from .utils import MatchData
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+except ImportError:
+    # Optional: without pyarrow CSV parts are written by pandas, several times slower
+    pa = None
+    pacsv = None
+
+"""
+    Training sets built straight from the tables of every match group, without going through postgres.
+    A match gives the rows db/gen_dataset_indarch.sql gives for it out of a schema loaded with the v1-data commands and
+    trimmed by db/pg_v1_optimizations.sql, with TRAINING_SET_COLUMNS:
+        - only match states in play_on playmode.
+        - a row per command of the chosen team, goalkeeper left out, linked to the state it was issued at the way the contents
+          load links them (see link_playercommands): the ball, the 22 players and the issuer as self, then the command.
+        - the heteroparams of every player come from the playertypes table of the match, by player type id.
+    Every match is joined on its own, with whole-column NumPy operations, on a pool of worker processes.
+    Rows come in match order, and in match table order inside a match, unless shuffled.
+"""
+TRAINING_SET_COLUMNS = [
+    *ALL_FEATURE_COLUMNS,
+    *OUTPUT_COLUMNS
+]
+# Team whose commands db/gen_dataset_indarch.sql outputs
+DEFAULT_TEAMNAME = 'HELIOS2019'
+TRAINING_PLAYMODE = 'play_on'
+GOALKEEPER_UNUM = 1
+TRAINING_TABLETYPES = [
+    TableType.MATCH,
+    TableType.PTYPES,
+    *PLAYERCOMMAND_PRIORITY
+]
+BALL_MATCH_COLUMNS = [
+    MatchGeneralColumn.BALL_X,
+    MatchGeneralColumn.BALL_Y,
+    MatchGeneralColumn.BALL_VX,
+    MatchGeneralColumn.BALL_VY
+]
+# Columns of a single player feeding its features, in ALL_PLAYER_FEATURES order. The heteroparams come after them
+PLAYER_FEATURE_MATCH_COLUMN_SUFFIXES = [
+    SinglePlayerColumn.X,
+    SinglePlayerColumn.Y,
+    SinglePlayerColumn.BODY_ANGLE,
+    SinglePlayerColumn.VX,
+    SinglePlayerColumn.VY
+]
+PLAYER_FEATURES_COUNT = len(ALL_PLAYER_FEATURES) // len(PLAYERSTATE_ORDER)
+TYPE_MATCH_COLUMNS = [
+    MatchPlayerColumn.name(FieldSide.from_str(side), UniformNumber.from_int(unum), SinglePlayerColumn.TYPE) for side, unum in PLAYERSTATE_ORDER
+]
+PLAYER_FEATURE_MATCH_COLUMNS = [
+    MatchPlayerColumn.name(FieldSide.from_str(side), UniformNumber.from_int(unum), player_column)
+    for side, unum in PLAYERSTATE_ORDER
+        for player_column in PLAYER_FEATURE_MATCH_COLUMN_SUFFIXES
+]
+# Match table columns the training set needs
+TRAINING_MATCH_COLUMNS = [
+    MatchGeneralColumn.CYCLE.value,
+    MatchGeneralColumn.STOPPED.value,
+    MatchGeneralColumn.PLAYMODE.value,
+    *(column.value for column in BALL_MATCH_COLUMNS),
+    *TYPE_MATCH_COLUMNS,
+    *PLAYER_FEATURE_MATCH_COLUMNS
+]
+# Gzip level of the CSV parts: most of the size reduction of the default level for a fraction of its time
+CSV_COMPRESSION_LEVEL = 6
+
+
+def read_training_tables(match_filepaths: List[Path]) -> Tuple[Dict[TableType, pd.DataFrame], MatchData]:
+    """
+        The tables of a match group with the columns the training set needs (see TRAINING_TABLETYPES), and the match data.
+        Raises ValueError if a table is missing or duplicated, or if the match table name is out of the v1 format.
+    """
+    tables = {}
+    match_data = None
+    for filepath in match_filepaths:
+        tabletype = TableType.from_filepath(filepath)
+        if tabletype not in TRAINING_TABLETYPES:
+            continue
+        if tabletype in tables:
+            raise ValueError(f'Duplicated {tabletype} tables in the match group')
+        if tabletype is TableType.MATCH:
+            match_data = MatchData.from_filepath(filepath)
+            if isinstance(match_data, ValueError):
+                raise match_data
+            tables[tabletype] = read_table(filepath, usecols=TRAINING_MATCH_COLUMNS)
+        else:
+            tables[tabletype] = read_table(filepath, usecols=load_usecols(LoadOperation.CONTENTS, tabletype))
+    missing = [ str(tabletype) for tabletype in TRAINING_TABLETYPES if tabletype not in tables ]
+    if len(missing) > 0:
+        raise ValueError(f'The match group has no {", ".join(missing)} table')
+    return tables, match_data
+
+
+def heteroparams_lookup(playertypes: pd.DataFrame, typeids: np.ndarray) -> np.ndarray:
+    """
+        The heteroparams (HETEROPARAM_FEATURES) of the player types :typeids:, of any shape, from the playertypes table of a match.
+        The result has the shape of :typeids: plus an axis of heteroparams.
+        Raises KeyError if a type is not in the table.
+    """
+    ids = playertypes[str(PlayerTypesColumn.ID)].to_numpy(dtype=np.int64)
+    params = np.full((max(ids.max(initial=-1), typeids.max(initial=-1)) + 1, len(HETEROPARAM_FEATURES)), np.nan)
+    known = np.zeros(len(params), dtype=bool)
+    params[ids] = playertypes[HETEROPARAM_FEATURES].to_numpy(dtype=np.float64)
+    known[ids] = True
+    if typeids.size > 0 and (typeids.min() < 0 or not known[typeids].all()):
+        raise KeyError(f'Player types {sorted(set(typeids[(typeids < 0) | ~known[np.maximum(typeids, 0)]].tolist()))} are not in the playertypes table')
+    return params[typeids]
+
+
+@profiled('join')
+def training_frame(tables: Dict[TableType, pd.DataFrame], match_data: MatchData, teamname: str=DEFAULT_TEAMNAME, goalkeeper: bool=False) -> pd.DataFrame:
+    """
+        The training rows of a match (see the module docstring) with TRAINING_SET_COLUMNS.
+        Output parameters of the other commands are NaN, like the NULLs of the outer joins of db/gen_dataset_indarch.sql.
+
+        :tables: the tables read by read_training_tables.
+        :teamname: team whose commands make the rows.
+        :goalkeeper: whether to also keep the commands of the goalkeeper (uniform number 1).
+    """
+    match = tables[TableType.MATCH].reset_index(drop=True)
+    states_count = len(match)
+    # Features of every player at every match state: (states, players, PLAYER_FEATURES_COUNT)
+    typeids = np.stack([ match[column].to_numpy(dtype=np.int64, na_value=-1) for column in TYPE_MATCH_COLUMNS ], axis=1)\
+        if states_count > 0 else np.empty((0, len(PLAYERSTATE_ORDER)), dtype=np.int64)
+    positions = np.stack([ match[column].to_numpy(dtype=np.float64) for column in PLAYER_FEATURE_MATCH_COLUMNS ], axis=1)\
+        if states_count > 0 else np.empty((0, len(PLAYER_FEATURE_MATCH_COLUMNS)))
+    players = np.concatenate([
+        positions.reshape(states_count, len(PLAYERSTATE_ORDER), len(PLAYER_FEATURE_MATCH_COLUMN_SUFFIXES)),
+        heteroparams_lookup(tables[TableType.PTYPES], typeids)
+    ], axis=2)
+    ball = match[[ column.value for column in BALL_MATCH_COLUMNS ]].to_numpy(dtype=np.float64)
+
+    ## Link the commands to the states, numbered in layout order, and keep the ones of the training set
+    matchstate_ids, playerstate_ids = local_state_ids(
+        match[MatchGeneralColumn.CYCLE.value].to_numpy(),
+        match[MatchGeneralColumn.STOPPED.value].to_numpy(),
+        match_data
+    )
+    linked = link_playercommands({ tabletype: tables[tabletype] for tabletype in PLAYERCOMMAND_PRIORITY }, matchstate_ids, playerstate_ids)
+    play_on = (match[MatchGeneralColumn.PLAYMODE.value].astype(str) == TRAINING_PLAYMODE).to_numpy()
+    commands = []
+    for tabletype in PLAYERCOMMAND_PRIORITY:
+        frame = linked[tabletype]
+        kept = frame[
+            (frame['teamname_fk'] == teamname).to_numpy() &
+            (goalkeeper | (frame['unum_fk'] != GOALKEEPER_UNUM).to_numpy()) &
+            play_on[frame['matchstate_id_fk'].to_numpy(dtype=np.int64)]
+        ]
+        commands.append(pd.DataFrame({
+            'playerstate_id':           kept['playerstate_id_fk'].to_numpy(dtype=np.int64),
+            CLASSIFICATION_OUTPUT_COLUMNS[0]: str(tabletype),
+            **{ str(column): kept[str(column)].to_numpy(dtype=np.float64) for column in PLAYERCOMMAND_PARAMETERS[tabletype] }
+        }))
+    commands = pd.concat(commands, ignore_index=True).sort_values('playerstate_id', kind='stable')
+
+    ## Gather the state of every command and the features of its issuer
+    states, issuers = np.divmod(commands['playerstate_id'].to_numpy(), len(PLAYERSTATE_ORDER))
+    features = np.concatenate([
+        ball[states],
+        players[states].reshape(len(states), len(PLAYERSTATE_ORDER) * PLAYER_FEATURES_COUNT),
+        players[states, issuers]
+    ], axis=1)
+    training = pd.DataFrame(features, columns=ALL_FEATURE_COLUMNS)
+    for column in OUTPUT_COLUMNS:
+        training[column] = commands[column].to_numpy()
+    return training
+
+
+def csv_bytes(frame: pd.DataFrame) -> bytes:
+    """ The rows of a frame as CSV text without header. NaN values are left empty, as pandas and psql write them. """
+    if pacsv is None:
+        return frame.to_csv(header=False, index=False).encode('utf8')
+    buffer = pa.BufferOutputStream()
+    pacsv.write_csv(pa.Table.from_pandas(frame, preserve_index=False), buffer, pacsv.WriteOptions(include_header=False))
+    return buffer.getvalue().to_pybytes()
+
+
+def _training_part(match_filepaths: List[Path], shards: bool, compress: bool, teamname: str, goalkeeper: bool, shuffle_seed: Optional[int]) -> Tuple[int, Any]:
+    """
+        The training rows of a match group, ready to be appended to the output: shard arrays (see shard_arrays)
+        or CSV text without header, GZ-compressed on its own if :compress: (GZ files may be made of many compressed members).
+        Returns the number of rows and the part.
+    """
+    tables, match_data = read_training_tables(match_filepaths)
+    training = training_frame(tables, match_data, teamname=teamname, goalkeeper=goalkeeper)
+    if shuffle_seed is not None:
+        # Seeded by the match too, so a match is shuffled the same whichever worker builds it
+        rng = np.random.default_rng([shuffle_seed, int(match_data.timestamp)])
+        training = training.iloc[rng.permutation(len(training))]
+    if shards:
+        return len(training), shard_arrays(training)
+    with span('encode', rows=len(training)) as encoding:
+        part = csv_bytes(training)
+        if compress:
+            part = gzip.compress(part, compresslevel=CSV_COMPRESSION_LEVEL)
+        encoding.add(bytes=len(part))
+    return len(training), part
+
+
+def _run_training_part(kwargs: Dict[str, Any], span_handoff: Optional[SpanHandoff]=None) -> Tuple[Optional[Tuple[int, Any]], Optional[str], List[SpanRecord]]:
+    """ Runs _training_part, returning its result or the error message, and the spans recorded by a worker process. """
+    with profiling.adopt(span_handoff) as span_records:
+        try:
+            result = _training_part(**kwargs)
+        except Exception as excpt:
+            return None, f"{type(excpt).__name__}: {excpt}", span_records
+    return result, None, span_records
+
+
+def _training_parts(match_groups: List[List[Path]], jobs: int, failures: List[Tuple[Any, str]], **kwargs: Any) -> Iterator[Tuple[int, Any]]:
+    """
+        The (rows, part) of every match group, in order, built by a pool of :jobs: worker processes.
+        At most two parts per worker are built ahead of the one being written, so memory doesn't grow with the number of matches.
+        Failed groups are reported and added to :failures:.
+    """
+    if jobs <= 1:
+        for done, match_filepaths in enumerate(match_groups, start=1):
+            result, error, _ = _run_training_part({ 'match_filepaths': match_filepaths, **kwargs })
+            _report(done, len(match_groups), match_filepaths, error, failures)
+            if result is not None:
+                yield result
+        return
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        pending: Deque[Tuple[List[Path], Future]] = deque()
+        submitted = 0
+        for done in range(1, len(match_groups) + 1):
+            while submitted < len(match_groups) and len(pending) < 2 * jobs:
+                match_filepaths = match_groups[submitted]
+                pending.append((match_filepaths, executor.submit(_run_training_part, { 'match_filepaths': match_filepaths, **kwargs }, profiling.handoff())))
+                submitted += 1
+            match_filepaths, future = pending.popleft()
+            try:
+                result, error, span_records = future.result()
+                profiling.merge(span_records)
+            except Exception as excpt:
+                # The worker itself died (e.g. killed for running out of memory)
+                result, error = None, f"{type(excpt).__name__}: {excpt}"
+            _report(done, len(match_groups), match_filepaths, error, failures)
+            if result is not None:
+                yield result
+
+
+def is_csv_path(path: Path) -> bool:
+    return path.name.endswith('.csv') or path.name.endswith('.csv.gz')
+
+
+@profiled()
+def write_training_set(
+    match_groups: List[List[Path]],
+    output_path: Path,
+    jobs: int=1,
+    teamname: str=DEFAULT_TEAMNAME,
+    goalkeeper: bool=False,
+    rows_per_shard: int=2**20,
+    shuffle_seed: Optional[int]=None
+) -> Tuple[int, List[Tuple[List[Path], str]]]:
+    """
+        Builds the training set of the match groups (see training_frame) on :jobs: worker processes and writes it to :output_path:,
+        match after match:
+            - a CSV file (GZ-compressed if its name ends with .gz) if its name ends with .csv or .csv.gz, with the header of
+              db/gen_dataset_indarch.sql, so it can be given to v1-train or make-training-shards like that script's output.
+            - else a directory of memory-mapped shards of :rows_per_shard: rows (see shards.py).
+        If a match fails, the rest is still written.
+
+        :shuffle_seed: if given, the rows of every match are shuffled before being written.
+        Returns the number of rows written and the (match group, error message) pairs of the failed matches.
+    """
+    failures: List[Tuple[Any, str]] = []
+    shards = not is_csv_path(output_path)
+    compress = output_path.name.endswith('.gz')
+    parts = _training_parts(
+        match_groups,
+        jobs,
+        failures,
+        shards=shards,
+        compress=compress,
+        teamname=teamname,
+        goalkeeper=goalkeeper,
+        shuffle_seed=shuffle_seed
+    )
+    if shards:
+        writer = ShardSetWriter(output_path, rows_per_shard)
+        try:
+            for _, arrays in parts:
+                writer.write(arrays)
+            manifests = writer.close()
+        except BaseException:
+            # Same as a partial CSV: the sealed shards would pass for the whole training set
+            writer.discard()
+            raise
+        return sum(manifest.rows for manifest in manifests), failures
+    rows = 0
+    try:
+        with open(output_path, 'wb') as file:
+            header = (','.join(TRAINING_SET_COLUMNS) + '\n').encode('utf8')
+            file.write(gzip.compress(header, compresslevel=CSV_COMPRESSION_LEVEL) if compress else header)
+            for part_rows, part in parts:
+                with span('write', rows=part_rows, bytes=len(part), table=output_path.name):
+                    file.write(part)
+                rows += part_rows
+    except BaseException:
+        # A partial training set would pass for a whole one
+        if output_path.exists():
+            output_path.unlink()
+        raise
+    return rows, failures
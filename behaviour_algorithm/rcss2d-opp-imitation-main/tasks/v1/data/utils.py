@@ -2,6 +2,8 @@ from pathlib import Path
 import re
 from typing import Optional
 
+# Filename format is <timestamp>-<left teamname>_<left final score>-vs-<right teamname>_<right final score>.<table type>.csv...
+MATCH_FILENAME_PATTERN = re.compile(r'^(\d+)-([a-zA-z0-9_\-+]+)_(\d+)-vs-([a-zA-Z0-9_\-+]+)_(\d+)\.*')
 
 class MatchData:
 
@@ -23,8 +25,7 @@ class MatchData:
         filename = filepath.name
         data = MatchData()
         try:
-            # Filename format is <timestamp>-<left teamname>_<left final score>-vs-<right final score>_teamname.match.csv...
-            capture_results = re.match(rf'^(\d+)-([a-zA-z0-9_\-+]+)_(\d+)-vs-([a-zA-Z0-9_\-+]+)_(\d+)\.*', filename)
+            capture_results = MATCH_FILENAME_PATTERN.match(filename)
             data.timestamp = capture_results[1]
             data.left_teamname = capture_results[2]
             data.left_finalscore = int(capture_results[3])
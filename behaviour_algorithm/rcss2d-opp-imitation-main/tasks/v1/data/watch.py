@@ -0,0 +1,154 @@
+import asyncio
+from contextlib import closing
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from termcolor import cprint
+
+from tasks.profiling import profiled
+from tasks.v1.types import TableType
+from .catalog import Catalog, CatalogFile
+from .ingestion import ConnectionParams, run_ingestion
+from .manifest import create_load_manifest
+from .preparation import copy_match_contents_to_postgres, copy_match_metadata_to_postgres, update_match_playertypes_at_postgres, upsert_matches_metadata
+from .utils import MatchData
+
+"""
+    Watch mode: ingests the match groups written into a dataset directory while the tournament servers keep producing them.
+    The directory is polled through its catalog (see catalog.py), so every poll only stats the tree and looks at what changed.
+    A match group is ready once it has a table of every type in MATCH_GROUP_TABLETYPES and is stable, i.e. either:
+        - none of its tables was modified in the last :settle: seconds (e.g. groups already there when watching starts), or
+        - none of its tables changed size or modification time over the last :settle: seconds of polling.
+    Ready groups go through the metadata insert (a single upsert for every group of a poll), the contents load and the playertypes
+    update, one transaction each.
+    The load manifest makes every step idempotent, so restarting the watch (or running the copy-all-matches-* commands
+    on the same directory) doesn't load anything twice.
+"""
+DEFAULT_POLL_INTERVAL = 2.0
+DEFAULT_SETTLE_TIME = 5.0
+
+
+class PollStats(NamedTuple):
+    ready:      int
+    loaded:     int
+    failed:     int
+    pending:    int
+    seconds:    float
+
+
+def _signature(catalog_files: List[CatalogFile]) -> Tuple[Tuple[str, int, int], ...]:
+    return tuple(sorted((catalog_file.relpath, catalog_file.size, catalog_file.mtime_ns) for catalog_file in catalog_files))
+
+
+class MatchGroupWatcher:
+    """
+        Tells which complete match groups of a catalog are ready to be ingested. See the module docstring for when they are.
+        A group is given once; it's given again only if its tables change afterwards (e.g. a failed group whose tables are rewritten).
+        :clock: returns the wall time in seconds, like time.time.
+    """
+
+    def __init__(self, catalog: Catalog, settle: float=DEFAULT_SETTLE_TIME, clock: Callable[[], float]=time.time) -> None:
+        self.catalog = catalog
+        self.settle = settle
+        self.clock = clock
+        # Signature of every complete group still settling, and since when it's unchanged
+        self._settling: Dict[str, Tuple[tuple, float]] = {}
+        # Signature of every group already given
+        self._given: Dict[str, tuple] = {}
+
+    @property
+    def pending(self) -> int:
+        """ Number of complete groups that aren't stable yet. """
+        return len(self._settling)
+
+    def poll(self) -> Dict[str, List[CatalogFile]]:
+        """ Refreshes the catalog and returns the groups that became ready since the last poll, by filename stem. """
+        self.catalog.refresh()
+        now = self.clock()
+        ready = {}
+        for stem, catalog_files in self.catalog.match_groups(complete=True).items():
+            signature = _signature(catalog_files)
+            if self._given.get(stem) == signature:
+                continue
+            settling = self._settling.get(stem)
+            if settling is None or settling[0] != signature:
+                settling = (signature, now)
+                self._settling[stem] = settling
+            untouched = max(catalog_file.mtime_ns for catalog_file in catalog_files) / 1e9 <= now - self.settle
+            if untouched or now - settling[1] >= self.settle:
+                del self._settling[stem]
+                self._given[stem] = signature
+                ready[stem] = catalog_files
+        return ready
+
+
+@profiled()
+async def ingest_match_group(match_filepaths: List[Path], connection, schema: str, match_ids: Optional[Dict[str, int]]=None, **kwargs) -> None:
+    """
+        Loads a match group into postgres as the copy-all-matches-* commands do, one after the other:
+        its metadata into public.matches (unless its match_id is in :match_ids:, see upsert_matches_metadata),
+        its contents into :schema: (kwargs go to copy_match_contents_to_postgres) and the params of its playertypes.
+    """
+    tabletypes = { filepath: TableType.from_filepath(filepath) for filepath in match_filepaths }
+    match_filepath = next(filepath for filepath, tabletype in tabletypes.items() if tabletype == TableType.MATCH)
+    playertypes_filepath = next(filepath for filepath, tabletype in tabletypes.items() if tabletype == TableType.PTYPES)
+    if match_ids is None or MatchData.from_filepath(match_filepath).timestamp not in match_ids:
+        await copy_match_metadata_to_postgres(match_filepath, connection)
+    await copy_match_contents_to_postgres(match_filepaths, connection, schema, match_ids=match_ids, **kwargs)
+    await update_match_playertypes_at_postgres(playertypes_filepath, connection, schema, match_ids=match_ids)
+
+
+def watch(
+    indir: Path,
+    connection_params: ConnectionParams,
+    schema: str,
+    poll_interval: float=DEFAULT_POLL_INTERVAL,
+    settle: float=DEFAULT_SETTLE_TIME,
+    workers: int=1,
+    polls: Optional[int]=None,
+    **kwargs
+) -> List[PollStats]:
+    """
+        Polls :indir: every :poll_interval: seconds and ingests its match groups as soon as they are ready (see ingest_match_group).
+        Runs until interrupted (Ctrl+C), or for :polls: polls if given. kwargs go to copy_match_contents_to_postgres.
+        Returns the stats of every poll that found something to ingest.
+    """
+    history = []
+    done = 0
+    with closing(connection_params.connect()) as connection:
+        create_load_manifest(connection)
+    with Catalog(indir) as catalog:
+        watcher = MatchGroupWatcher(catalog, settle)
+        try:
+            while polls is None or done < polls:
+                start = time.perf_counter()
+                ready = watcher.poll()
+                if len(ready) > 0:
+                    groups = [
+                        [ catalog_file.path for catalog_file in catalog_files if catalog_file.tabletype is not None ]
+                            for catalog_files in ready.values()
+                    ]
+                    # Groups left out are inserted on their own by ingest_match_group, which reports why they fail
+                    with closing(connection_params.connect()) as connection:
+                        match_ids, _ = asyncio.run(upsert_matches_metadata([
+                            filepath for filepaths in groups for filepath in filepaths if TableType.from_filepath(filepath) == TableType.MATCH
+                        ], connection))
+                    failures = run_ingestion(
+                        ingest_match_group,
+                        groups,
+                        connection_params,
+                        workers=workers,
+                        schema=schema,
+                        match_ids=match_ids,
+                        **kwargs
+                    )
+                    stats = PollStats(len(ready), len(ready) - len(failures), len(failures), watcher.pending, time.perf_counter() - start)
+                    history.append(stats)
+                    cprint(f"{stats.loaded} matches loaded, {stats.failed} failed, {stats.pending} settling in {stats.seconds:.3f} sec", 'red' if stats.failed > 0 else None)
+                done += 1
+                if polls is None or done < polls:
+                    time.sleep(max(poll_interval - (time.perf_counter() - start), 0))
+        except KeyboardInterrupt:
+            cprint(f"Stopped watching {indir}")
+    return history
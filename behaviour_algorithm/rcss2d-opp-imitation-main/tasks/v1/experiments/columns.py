@@ -0,0 +1,80 @@
+from typing import List
+
+"""
+    Features Columns:
+        ball_x                                  : float32
+        ball_y                                  : float32
+        ball_vx                                 : float32
+        ball_vy                                 : float32
+        {<side><unum>, self}_x                  : float32
+        {<side><unum>, self}_y                  : float32
+        {<side><unum>, self}_body               : float32
+        {<side><unum>, self}_vx                 : float32
+        {<side><unum>, self}_vy                 : float32
+        {<side><unum>, self}_dash_power_rate    : float32
+        {<side><unum>, self}_effort_min         : float32
+        {<side><unum>, self}_effort_max         : float32
+        {<side><unum>, self}_extra_stamina      : float32
+        {<side><unum>, self}_inertia_moment     : float32
+        {<side><unum>, self}_kick_rand          : float32
+        {<side><unum>, self}_kickable_margin    : float32
+        {<side><unum>, self}_player_decay       : float32
+    where <side> and <unum> are a player's side (l or r) and uniform number (1 to 11)
+
+    Outputs Columns:
+        playercommand_type
+        dash_power
+        dash_direction
+        turn_moment
+        kick_power
+        kick_direction
+        tackle_direction
+"""
+POSITION_FEATURES = ['x','y']
+POSE_FEATURES = POSITION_FEATURES + ['body']
+VEL_FEATURES = ['vx','vy']
+HETEROPARAM_FEATURES = [
+    'dash_power_rate',
+    'effort_min',
+    'effort_max',
+    'extra_stamina',
+    'inertia_moment',
+    'kick_rand',
+    'kickable_margin',
+    'player_decay'
+]
+ALL_BALL_FEATURES = [
+    f"ball_{feature}" for feature in POSITION_FEATURES + VEL_FEATURES
+]
+ALL_PLAYER_FEATURES = [
+    f"{side}{unum}_{feature}" for side in ('l', 'r') for unum in range(1,12) for feature in POSE_FEATURES + VEL_FEATURES + HETEROPARAM_FEATURES
+]
+ALL_SELF_FEATURES = [
+    f"self_{feature}" for feature in POSE_FEATURES + VEL_FEATURES + HETEROPARAM_FEATURES
+]
+ALL_FEATURE_COLUMNS = [
+    *ALL_BALL_FEATURES,
+    *ALL_PLAYER_FEATURES,
+    *ALL_SELF_FEATURES
+]
+CLASSIFICATION_OUTPUT_COLUMNS = [
+    'playercommand_type'
+]
+REGRESSION_OUTPUT_COLUMNS = [
+    'dash_power',
+    'dash_direction',
+    'turn_moment',
+    'kick_power',
+    'kick_direction',
+    'tackle_direction'
+]
+OUTPUT_COLUMNS = [
+    *CLASSIFICATION_OUTPUT_COLUMNS,
+    *REGRESSION_OUTPUT_COLUMNS
+]
+COMMAND_TYPES: List[bytes] = [
+    b'dash',
+    b'turn',
+    b'kick',
+    b'tackle'
+]
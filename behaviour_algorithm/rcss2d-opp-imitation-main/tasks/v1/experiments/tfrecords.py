@@ -0,0 +1,140 @@
+import json
+import os
+from pathlib import Path
+import numpy as np
+import tensorflow as tf
+from typing import List, Optional
+
+from tasks.v1.data.shards import LABEL_VALUES, check_stored_columns, read_training_chunks, shard_arrays
+
+from .columns import ALL_FEATURE_COLUMNS, REGRESSION_OUTPUT_COLUMNS
+
+"""
+    Training datasets as sharded, GZIP-compressed TFRecord files.
+    Every example holds a row as three packed tensors:
+        features    : float32 (len(ALL_FEATURE_COLUMNS),)
+        label       : int64 scalar, index of the command in LABEL_VALUES
+        regression  : float32 (len(REGRESSION_OUTPUT_COLUMNS),)
+    Rows are spread round-robin over the files, so every file is a sample of the whole dataset and files can be
+    decoded in parallel and shuffled as units. A JSON manifest (TFRECORD_MANIFEST_NAME) lists the files and columns.
+"""
+TFRECORD_FORMAT = 'rcss2d-v1-training-tfrecords'
+TFRECORD_FORMAT_VERSION = 1
+TFRECORD_MANIFEST_NAME = 'tfrecords.json'
+TFRECORD_NAME_TEMPLATE = 'part-%05d-of-%05d.tfrecord.gz'
+TFRECORD_COMPRESSION = 'GZIP'
+TFRECORD_FEATURES = {
+    'features': tf.io.FixedLenFeature([len(ALL_FEATURE_COLUMNS)], tf.float32),
+    'label': tf.io.FixedLenFeature([], tf.int64),
+    'regression': tf.io.FixedLenFeature([len(REGRESSION_OUTPUT_COLUMNS)], tf.float32)
+}
+
+
+def is_tfrecord_directory(path: Path) -> bool:
+    return path.is_dir() and (path / TFRECORD_MANIFEST_NAME).exists()
+
+
+def read_tfrecord_manifest(dirpath: Path) -> dict:
+    manifestpath = dirpath / TFRECORD_MANIFEST_NAME
+    with open(manifestpath, 'r') as file:
+        manifest = json.load(file)
+    if manifest.get('format') != TFRECORD_FORMAT or manifest.get('version') != TFRECORD_FORMAT_VERSION:
+        raise ValueError(f"Unsupported TFRecord dataset format {manifest.get('format')} version {manifest.get('version')}")
+    check_stored_columns(manifestpath, manifest['feature_columns'], manifest['label_values'], manifest['regression_columns'])
+    return manifest
+
+
+def serialize_example(features: np.ndarray, label: int, regression: np.ndarray) -> bytes:
+    return tf.train.Example(features=tf.train.Features(feature={
+        'features': tf.train.Feature(float_list=tf.train.FloatList(value=features)),
+        'label': tf.train.Feature(int64_list=tf.train.Int64List(value=[label])),
+        'regression': tf.train.Feature(float_list=tf.train.FloatList(value=regression))
+    })).SerializeToString()
+
+
+def write_training_tfrecords(
+    csvpath: Path,
+    output_dir: Path,
+    num_files: int=16,
+    chunk_rows: int=2**16,
+    shuffle_seed: Optional[int]=None
+) -> dict:
+    """
+        Converts a training dataset CSV (e.g. the output of db/gen_dataset_indarch.sql) into :num_files: TFRecord files in :output_dir:.
+        The CSV is streamed in chunks of :chunk_rows: rows, so memory use does not depend on the dataset size.
+
+        :shuffle_seed: if given, the rows of every chunk are shuffled before being written.
+        Returns the manifest of the written dataset.
+    """
+    if is_tfrecord_directory(output_dir):
+        raise ValueError(f"{output_dir} already holds a TFRecord dataset. Use an empty directory.")
+    rng = np.random.default_rng(shuffle_seed) if shuffle_seed is not None else None
+    filenames = [ TFRECORD_NAME_TEMPLATE % (index, num_files) for index in range(num_files) ]
+    rows = [0] * num_files
+    options = tf.io.TFRecordOptions(compression_type=TFRECORD_COMPRESSION)
+    writers = [ tf.io.TFRecordWriter(str(output_dir / filename), options) for filename in filenames ]
+    try:
+        written = 0
+        for chunk in read_training_chunks(csvpath, chunk_rows):
+            if rng is not None:
+                chunk = chunk.iloc[rng.permutation(len(chunk))]
+            features, labels, regression = shard_arrays(chunk)
+            for row in range(len(labels)):
+                index = written % num_files
+                writers[index].write(serialize_example(features[row], int(labels[row]), regression[row]))
+                rows[index] += 1
+                written += 1
+    finally:
+        for writer in writers:
+            writer.close()
+    manifest = {
+        'format': TFRECORD_FORMAT,
+        'version': TFRECORD_FORMAT_VERSION,
+        'compression': TFRECORD_COMPRESSION,
+        'files': [ { 'name': filename, 'rows': file_rows } for filename, file_rows in zip(filenames, rows) ],
+        'feature_columns': ALL_FEATURE_COLUMNS,
+        'label_values': LABEL_VALUES,
+        'regression_columns': REGRESSION_OUTPUT_COLUMNS
+    }
+    # The manifest goes last, so a failed conversion never looks like a dataset
+    temporary_path = output_dir / f'.{TFRECORD_MANIFEST_NAME}.tmp'
+    with open(temporary_path, 'w') as file:
+        json.dump(manifest, file)
+    os.replace(temporary_path, output_dir / TFRECORD_MANIFEST_NAME)
+    return manifest
+
+
+def make_tfrecord_dataset(
+    dirpath: Path,
+    batch_size: int,
+    shuffle: bool,
+    shuffle_buffer_size: int=80000,
+    cycle_length: Optional[int]=None
+) -> tf.data.Dataset:
+    """
+        Endless (features, labels, regression) batches of a TFRecord dataset directory.
+        :cycle_length: files are read and decompressed at once (by default, as many as CPU cores) and interleaved.
+        When shuffling, the file order changes every pass and rows also go through a shuffle buffer.
+    """
+    manifest = read_tfrecord_manifest(dirpath)
+    filepaths: List[str] = [ str(dirpath / file['name']) for file in manifest['files'] if file['rows'] > 0 ]
+    if len(filepaths) == 0:
+        raise ValueError(f"TFRecord dataset {dirpath} is empty")
+    files = tf.data.Dataset.from_tensor_slices(filepaths)
+    if shuffle:
+        files = files.shuffle(len(filepaths), reshuffle_each_iteration=True)
+    dataset = files.repeat().interleave(
+        lambda filepath: tf.data.TFRecordDataset(filepath, compression_type=manifest['compression']),
+        cycle_length=cycle_length,
+        num_parallel_calls=tf.data.AUTOTUNE,
+        deterministic=not shuffle
+    )
+    if shuffle:
+        dataset = dataset.shuffle(shuffle_buffer_size)
+
+    def parse(examples: tf.Tensor):
+        parsed = tf.io.parse_example(examples, TFRECORD_FEATURES)
+        return parsed['features'], parsed['label'], parsed['regression']
+
+    # Parsing whole batches at once is much cheaper than example by example
+    return dataset.batch(batch_size, drop_remainder=True).map(parse, num_parallel_calls=tf.data.AUTOTUNE).prefetch(tf.data.AUTOTUNE)
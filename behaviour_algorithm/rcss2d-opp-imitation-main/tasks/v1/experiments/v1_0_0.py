@@ -10,6 +10,7 @@ from .v1_0_x import (
     OUTPUT_COLUMNS,
     COMMAND_TYPES,
     TrainingOptions,
+    make_dataset,
     LearningRateFineSchedule,
     LearningRateInverseSchedule,
     correct_vel_normalizations,
@@ -30,21 +31,20 @@ def train(options: TrainingOptions) -> None:
         OUTPUT_COLUMNS[0]: str('nop'),    # Means "No Operation"
     }
     
-    trainingset = tf.data.experimental.make_csv_dataset(
-        str(options.training_datasetpath.resolve()),
+    trainingset = make_dataset(
+        options.training_datasetpath,
         select_columns=ALL_FEATURE_COLUMNS + OUTPUT_COLUMNS[:1],
         batch_size=options.batch_size,
-        column_defaults=column_defaults.values(),
-        compression_type='GZIP',
+        column_defaults=column_defaults,
         shuffle=True,
-        shuffle_buffer_size=80000
+        shuffle_buffer_size=80000,
+        seed=options.seed
     )
-    validationset = tf.data.experimental.make_csv_dataset(
-        str(options.test_and_validation_datasetpath.resolve()),
+    validationset = make_dataset(
+        options.test_and_validation_datasetpath,
         select_columns=ALL_FEATURE_COLUMNS + OUTPUT_COLUMNS[:1],
         batch_size=options.batch_size,
-        column_defaults=column_defaults.values(),
-        compression_type='GZIP',
+        column_defaults=column_defaults,
         shuffle=False,  # No need to shuffle the validation!
     ).take(1515186) # That's half the size of the test & val dataset (~2.5% of total rows)
     validationset = validationset.take(options.validation_steps) # We limit the number of evaluations cause we can't support all this computation
@@ -13,6 +13,7 @@ from .v1_0_x import (
     COMMAND_TYPES,
     REGRESSION_OUTPUT_COLUMNS,
     TrainingOptions,
+    make_dataset,
     LearningRateFineSchedule,
     LearningRateInverseSchedule,
     correct_vel_normalizations,
@@ -35,19 +36,18 @@ def train(options: TrainingOptions) -> None:
         **{regression_col: 0.0 for regression_col in OUTPUT_COLUMNS[1:]}
     }
     
-    trainingset = tf.data.experimental.make_csv_dataset(
-        str(options.training_datasetpath.resolve()),
+    trainingset = make_dataset(
+        options.training_datasetpath,
         batch_size=options.batch_size,
-        column_defaults=column_defaults.values(),
-        compression_type='GZIP',
+        column_defaults=column_defaults,
         shuffle=True,
-        shuffle_buffer_size=80000
+        shuffle_buffer_size=80000,
+        seed=options.seed
     )
-    validationset = tf.data.experimental.make_csv_dataset(
-        str(options.test_and_validation_datasetpath.resolve()),
+    validationset = make_dataset(
+        options.test_and_validation_datasetpath,
         batch_size=options.batch_size,
-        column_defaults=column_defaults.values(),
-        compression_type='GZIP',
+        column_defaults=column_defaults,
         shuffle=False,  # No need to shuffle the validation!
     ).take(1515186 // options.batch_size) # That's half the size of the test & val dataset (~2.5% of total rows)
     validationset = validationset.take(options.validation_steps) # We limit the number of evaluations cause we can't support all this computation
@@ -17,6 +17,7 @@ from .v1_0_x import (
     COMMAND_TYPES,
     REGRESSION_OUTPUT_COLUMNS,
     TrainingOptions,
+    make_dataset,
     correct_vel_normalizations,
     CommandMetrics
 )
@@ -64,21 +65,20 @@ def train(options: TrainingOptions) -> None:
     }
     selected_columns = list(column_defaults.keys())
     
-    trainingset = tf.data.experimental.make_csv_dataset(
-        str(options.training_datasetpath.resolve()),
+    trainingset = make_dataset(
+        options.training_datasetpath,
         batch_size=options.batch_size,
         select_columns=selected_columns,
-        column_defaults=column_defaults.values(),
-        compression_type='GZIP',
+        column_defaults=column_defaults,
         shuffle=True,
-        shuffle_buffer_size=80000
+        shuffle_buffer_size=80000,
+        seed=options.seed
     )
-    validationset = tf.data.experimental.make_csv_dataset(
-        str(options.test_and_validation_datasetpath.resolve()),
+    validationset = make_dataset(
+        options.test_and_validation_datasetpath,
         batch_size=options.batch_size,
         select_columns=selected_columns,
-        column_defaults=column_defaults.values(),
-        compression_type='GZIP',
+        column_defaults=column_defaults,
         shuffle=False,  # No need to shuffle the validation!
     ).take(1515186 // options.batch_size) # That's half the size of the test & val dataset (~2.5% of total rows)
     validationset = validationset.take(options.validation_steps) # We limit the number of evaluations cause we can't support all this computation
@@ -3,88 +3,26 @@ from logging import LoggerAdapter
 import numpy as np
 from pathlib import Path
 import tensorflow as tf
-from typing import List, NamedTuple, Optional, OrderedDict, Tuple, Union
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, OrderedDict, Tuple, Union
 
 from tasks.rcss2d import FieldSide, RCSSServerParamsV16 as SP, UniformNumber, RCSSPlayerParamsV16 as PP
+from tasks.v1.data.shards import LABEL_VALUES, is_shard_directory, open_shard, read_shard_manifests
 
-"""
-    Features Columns:
-        ball_x                                  : float32
-        ball_y                                  : float32
-        ball_vx                                 : float32
-        ball_vy                                 : float32
-        {<side><unum>, self}_x                  : float32
-        {<side><unum>, self}_y                  : float32
-        {<side><unum>, self}_body               : float32
-        {<side><unum>, self}_vx                 : float32
-        {<side><unum>, self}_vy                 : float32
-        {<side><unum>, self}_dash_power_rate    : float32
-        {<side><unum>, self}_effort_min         : float32
-        {<side><unum>, self}_effort_max         : float32
-        {<side><unum>, self}_extra_stamina      : float32
-        {<side><unum>, self}_inertia_moment     : float32
-        {<side><unum>, self}_kick_rand          : float32
-        {<side><unum>, self}_kickable_margin    : float32
-        {<side><unum>, self}_player_decay       : float32
-    where <side> and <unum> are a player's side (l or r) and uniform number (1 to 11)
-
-    Outputs Columns:
-        playercommand_type
-        dash_power
-        dash_direction
-        turn_moment
-        kick_power
-        kick_direction
-        tackle_direction
-"""
-POSITION_FEATURES = ['x','y']
-POSE_FEATURES = POSITION_FEATURES + ['body']
-VEL_FEATURES = ['vx','vy']
-HETEROPARAM_FEATURES = [
-    'dash_power_rate',
-    'effort_min',
-    'effort_max',
-    'extra_stamina',
-    'inertia_moment',
-    'kick_rand',
-    'kickable_margin',
-    'player_decay'
-]
-ALL_BALL_FEATURES = [
-    f"ball_{feature}" for feature in POSITION_FEATURES + VEL_FEATURES
-]
-ALL_PLAYER_FEATURES = [
-    f"{side}{unum}_{feature}" for side in ('l', 'r') for unum in range(1,12) for feature in POSE_FEATURES + VEL_FEATURES + HETEROPARAM_FEATURES
-]
-ALL_SELF_FEATURES = [
-    f"self_{feature}" for feature in POSE_FEATURES + VEL_FEATURES + HETEROPARAM_FEATURES
-]
-ALL_FEATURE_COLUMNS = [
-    *ALL_BALL_FEATURES,
-    *ALL_PLAYER_FEATURES,
-    *ALL_SELF_FEATURES
-]
-CLASSIFICATION_OUTPUT_COLUMNS = [
-    'playercommand_type'
-]
-REGRESSION_OUTPUT_COLUMNS = [
-    'dash_power',
-    'dash_direction',
-    'turn_moment',
-    'kick_power',
-    'kick_direction',
-    'tackle_direction'
-]
-OUTPUT_COLUMNS = [
-    *CLASSIFICATION_OUTPUT_COLUMNS,
-    *REGRESSION_OUTPUT_COLUMNS
-]
-COMMAND_TYPES = [
-    b'dash',
-    b'turn',
-    b'kick',
-    b'tackle'
-]
+from .columns import (
+    POSITION_FEATURES,
+    POSE_FEATURES,
+    VEL_FEATURES,
+    HETEROPARAM_FEATURES,
+    ALL_BALL_FEATURES,
+    ALL_PLAYER_FEATURES,
+    ALL_SELF_FEATURES,
+    ALL_FEATURE_COLUMNS,
+    CLASSIFICATION_OUTPUT_COLUMNS,
+    REGRESSION_OUTPUT_COLUMNS,
+    OUTPUT_COLUMNS,
+    COMMAND_TYPES
+)
+from .tfrecords import is_tfrecord_directory, make_tfrecord_dataset
 
 class TrainingOptions(NamedTuple):
 
@@ -95,11 +33,12 @@ class TrainingOptions(NamedTuple):
     session_homepath:               Path
     tensorboard_suffix:             str
     num_checkpoints:                int
+    seed:                           int     # Also given to tf.random.set_seed, drives the shuffling of training shards
     #
     # Dataset options
     #
-    training_datasetpath:           Path
-    test_and_validation_datasetpath:Path
+    training_datasetpath:           Path    # A gzip-compressed CSV or a directory of training shards (see make_dataset)
+    test_and_validation_datasetpath:Path    # Same formats as training_datasetpath
     batch_size:                     int     # The number of data points that makes a mini-batch for backpropagation.
     #
     #  Architecture options
@@ -157,6 +96,102 @@ class TrainingOptions(NamedTuple):
 #     return self.initial_learning_rate / (1 + step)
 
 
+def make_dataset(
+    datasetpath: Path,
+    batch_size: int,
+    column_defaults: Dict[str, Any],
+    shuffle: bool,
+    select_columns: Optional[List[str]]=None,
+    shuffle_buffer_size: int=80000,
+    seed: Optional[int]=None
+) -> tf.data.Dataset:
+    """
+        Endless batches of a dataset as {column: Tensor<shape=(batch_size,)>} dictionaries, whichever format it is stored in:
+            - a gzip-compressed CSV, read with make_csv_dataset;
+            - a directory of memory-mapped shards (see tasks/v1/data/shards.py), which needs no text parsing at all;
+            - a directory of TFRecord files (see tfrecords.py), decoded by several files in parallel.
+        This is what lets TrainingOptions' dataset paths point to any of these formats.
+        :seed: the shuffling seed of shards, which don't shuffle through TensorFlow (the other formats follow tf.random.set_seed).
+    """
+    if is_shard_directory(datasetpath):
+        arrays = make_shard_dataset(datasetpath, batch_size, shuffle, seed=seed)
+    elif is_tfrecord_directory(datasetpath):
+        arrays = make_tfrecord_dataset(datasetpath, batch_size, shuffle, shuffle_buffer_size=shuffle_buffer_size)
+    else:
+        return tf.data.experimental.make_csv_dataset(
+            str(datasetpath.resolve()),
+            batch_size=batch_size,
+            select_columns=select_columns,
+            column_defaults=list(column_defaults.values()),
+            compression_type='GZIP',
+            shuffle=shuffle,
+            shuffle_buffer_size=shuffle_buffer_size
+        )
+    return arrays.map(
+        array_columns(select_columns or list(column_defaults.keys())),
+        num_parallel_calls=tf.data.AUTOTUNE
+    ).prefetch(tf.data.AUTOTUNE)
+
+def array_columns(select_columns: List[str]) -> Callable[[tf.Tensor, tf.Tensor, tf.Tensor], Dict[str, tf.Tensor]]:
+    """
+        Maps (features, labels, regression) batches, as stored in shards and TFRecords, to the {column: Tensor} dictionaries
+        make_csv_dataset gives for :select_columns:.
+    """
+    label_column = CLASSIFICATION_OUTPUT_COLUMNS[0]
+    feature_index = { column: index for index, column in enumerate(ALL_FEATURE_COLUMNS) }
+    regression_index = { column: index for index, column in enumerate(REGRESSION_OUTPUT_COLUMNS) }
+    unknown = [ column for column in select_columns if column not in feature_index and column not in regression_index and column != label_column ]
+    if len(unknown) > 0:
+        raise ValueError(f"Columns {unknown} are not stored in training shards or TFRecords")
+    label_values = tf.constant([ value.encode('utf8') for value in LABEL_VALUES ])
+
+    def to_columns(features: tf.Tensor, labels: tf.Tensor, regression: tf.Tensor) -> Dict[str, tf.Tensor]:
+        columns = {}
+        for column in select_columns:
+            if column in feature_index:
+                columns[column] = features[:, feature_index[column]]
+            elif column in regression_index:
+                columns[column] = regression[:, regression_index[column]]
+            else:
+                # Back to the command strings the CSV pipelines 1-hot encode
+                columns[column] = tf.gather(label_values, tf.cast(labels, tf.int32))
+        return columns
+    return to_columns
+
+def make_shard_dataset(dirpath: Path, batch_size: int, shuffle: bool, seed: Optional[int]=None) -> tf.data.Dataset:
+    """
+        Endless (features, labels, regression) batches of a shard directory.
+        Every batch is a contiguous slice of the shards' memory maps, so nothing but the batch itself is read or copied.
+        When shuffling, batches come in a new random order (and alignment) every pass; rows were already shuffled at conversion.
+    """
+    manifests = read_shard_manifests(dirpath)
+    shards = [ open_shard(dirpath, manifest) for manifest in manifests ]
+    if sum(manifest.rows // batch_size for manifest in manifests) == 0:
+        raise ValueError(f"Shards in {dirpath} have no full batch of {batch_size} rows")
+
+    def batches():
+        rng = np.random.default_rng(seed)
+        while True:
+            slices = []
+            for index, manifest in enumerate(manifests):
+                # Rows past the last full batch of a shard are left out of a pass. A random alignment changes which ones.
+                offset = rng.integers(manifest.rows % batch_size + 1) if shuffle else 0
+                slices.extend((index, start) for start in range(offset, manifest.rows - batch_size + 1, batch_size))
+            if shuffle:
+                rng.shuffle(slices)
+            for index, start in slices:
+                features, labels, regression = shards[index]
+                yield features[start:start+batch_size], labels[start:start+batch_size], regression[start:start+batch_size]
+
+    return tf.data.Dataset.from_generator(
+        batches,
+        output_signature=(
+            tf.TensorSpec(shape=(batch_size, len(ALL_FEATURE_COLUMNS)), dtype=tf.float32),
+            tf.TensorSpec(shape=(batch_size,), dtype=tf.int8),
+            tf.TensorSpec(shape=(batch_size, len(REGRESSION_OUTPUT_COLUMNS)), dtype=tf.float32)
+        )
+    )
+
 def correct_vel_normalizations(tensor_dict: OrderedDict[str, tf.Tensor], options: Optional[TrainingOptions]=None) -> OrderedDict[str, tf.Tensor]:
     """
         Corrects the velocity domain normalization of the v1 dataset.
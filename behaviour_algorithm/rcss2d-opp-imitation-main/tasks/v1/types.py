@@ -1,6 +1,9 @@
 from enum import Enum
+from functools import lru_cache
+import numpy as np
+import pandas as pd
 from pathlib import Path
-from typing import Union
+from typing import List, NamedTuple, Optional, Tuple, Union
 
 from tasks.rcss2d import *
 
@@ -79,13 +82,39 @@ class TackleColumn(CommandTableColumn, Enum):
 
 class ServerParamsColumn(TableColumnType, Enum):
     """ The set of columns available at a ServerParams table. """
-    # TODO
+    # Only the params the normalization reads. See the server.conf file of rcssserver for all of them
+    BALL_SPEED_MAX      = 'ball_speed_max'
+    DASH_POWER_RATE     = 'dash_power_rate'
+    EFFORT_INIT         = 'effort_init'
+    EFFORT_MIN          = 'effort_min'
+    EXTRA_STAMINA       = 'extra_stamina'
+    INERTIA_MOMENT      = 'inertia_moment'
+    KICK_RAND           = 'kick_rand'
+    KICKABLE_MARGIN     = 'kickable_margin'
+    PLAYER_DECAY        = 'player_decay'
+    PLAYER_SPEED_MAX    = 'player_speed_max'
+    STAMINA_INC_MAX     = 'stamina_inc_max'
+    STAMINA_MAX         = 'stamina_max'
+    STAMINA_CAPACITY    = 'stamina_capacity'
     def __str__(self) -> str:
         return self.value
 
 class PlayerParamsColumn(TableColumnType, Enum):
     """ The set of columns available at a PlayerParams table. """
-    # TODO
+    # Only the params the normalization reads. See the player.conf file of rcssserver for all of them
+    DASH_POWER_RATE_DELTA_MIN       = 'new_dash_power_rate_delta_min'
+    DASH_POWER_RATE_DELTA_MAX       = 'new_dash_power_rate_delta_max'
+    EFFORT_MAX_DELTA_FACTOR         = 'effort_max_delta_factor'
+    EFFORT_MIN_DELTA_FACTOR         = 'effort_min_delta_factor'
+    EXTRA_STAMINA_DELTA_MIN         = 'extra_stamina_delta_min'
+    EXTRA_STAMINA_DELTA_MAX         = 'extra_stamina_delta_max'
+    INERTIA_MOMENT_DELTA_FACTOR     = 'inertia_moment_delta_factor'
+    KICK_RAND_DELTA_FACTOR          = 'kick_rand_delta_factor'
+    KICKABLE_MARGIN_DELTA_MIN       = 'kickable_margin_delta_min'
+    KICKABLE_MARGIN_DELTA_MAX       = 'kickable_margin_delta_max'
+    PLAYER_DECAY_DELTA_MIN          = 'player_decay_delta_min'
+    PLAYER_DECAY_DELTA_MAX          = 'player_decay_delta_max'
+    STAMINA_INC_MAX_DELTA_FACTOR    = 'new_stamina_inc_max_delta_factor'
     def __str__(self) -> str:
         return self.value
 
@@ -118,8 +147,8 @@ class MatchGeneralColumn(TableColumnType, Enum):
     LEFT_SCORE          = ' l_score'
     LEFT_PENALTY_SCORE  = ' l_pen_score'
     RIGHT_NAME          = ' r_name'
-    RIGHT_SCORE         = ' l_score'
-    RIGHT_PENALTY_SCORE = ' l_pen_score'
+    RIGHT_SCORE         = ' r_score'
+    RIGHT_PENALTY_SCORE = ' r_pen_score'
     BALL_X              = ' b_x'
     BALL_Y              = ' b_y'
     BALL_VX             = ' b_vx'
@@ -158,8 +187,8 @@ class SinglePlayerColumn(Enum):
     NECK_ANGLE              = 'neck'
     ARM_POINT_X             = 'arm_point_x'
     ARM_POINT_Y             = 'arm_point_y'
-    VIEW_QUALITY            = 'view_quality'
-    VIEW_WIDTH              = 'view_width'
+    VIEW_QUALITY            = 'view_q'
+    VIEW_WIDTH              = 'view_w'
     STAMINA                 = 'stamina'
     EFFORT                  = 'effort'
     STAMINA_RECOVERY        = 'stamina_rec'
@@ -264,3 +293,242 @@ def normalizer_from_columntype(column_type: TableColumn) -> FeatureNormalizer:
     if column_type is PlayerTypesColumn.EFFORT_MAX:
         return EffortMaxNormalizerV16()
     raise TypeError(f'Unsupported TableColumn of type {type(column_type)}')
+
+
+def normalizable_columns(tabletype: TableType) -> Optional[List[TableColumn]]:
+    """ Columns of an extracted table normalized for the v1.0.x experiments (see normalizer_from_columntype). None if the table is of no interest. """
+    if tabletype is TableType.DASH:
+        return [ DashColumn.DASH_POWER, DashColumn.DASH_DIRECTION ]
+    if tabletype is TableType.TURN:
+        return [ TurnColumn.TURN_MOMENT]
+    if tabletype is TableType.KICK:
+        return [ KickColumn.KICK_POWER, KickColumn.KICK_DIRECTION ]
+    if tabletype is TableType.TACKLE:
+        return [ TackleColumn.TACKLE_DIRECTION ]
+    if tabletype is TableType.MATCH:
+        normalizable = [ 
+            MatchGeneralColumn.BALL_X,
+            MatchGeneralColumn.BALL_Y,
+            MatchGeneralColumn.BALL_VX,
+            MatchGeneralColumn.BALL_VY
+        ]
+        player_normalizable = [
+            SinglePlayerColumn.X,
+            SinglePlayerColumn.Y,
+            SinglePlayerColumn.VX,
+            SinglePlayerColumn.VY,
+            SinglePlayerColumn.BODY_ANGLE,
+            SinglePlayerColumn.STAMINA,
+            SinglePlayerColumn.STAMINA_RESERVE
+        ]
+        for side in [ FieldSide.LEFT, FieldSide.RIGHT ]:
+            for unum in range(1,12):
+                for player_column in player_normalizable:
+                    normalizable.append(MatchPlayerColumn(side, UniformNumber.from_int(unum), player_column))
+        return normalizable
+    if tabletype is TableType.PTYPES:
+        return [ 
+            PlayerTypesColumn.DASH_POWER_RATE,
+            PlayerTypesColumn.PLAYER_DECAY,
+            PlayerTypesColumn.INERTIA_MOMENT,
+            PlayerTypesColumn.KICKABLE_MARGIN,
+            PlayerTypesColumn.KICK_RAND,
+            PlayerTypesColumn.EXTRA_STAMINA,
+            PlayerTypesColumn.EFFORT_MIN,
+            PlayerTypesColumn.EFFORT_MAX
+        ]
+    ## Not interested
+    return None
+
+
+class NormalizationParams(NamedTuple):
+    """
+        The server and heteroplayer params the normalization of features depends on. Defaults are the rcssserver v16 ones.
+        Fields are named after the ServerParamsColumn and PlayerParamsColumn members they are read from.
+        The pitch size is not in the serverparams tables, so it is always the default one.
+    """
+    pitch_length:                   float = float(RCSSServerParamsV16.PITCH_LENGTH)
+    pitch_width:                    float = float(RCSSServerParamsV16.PITCH_WIDTH)
+    ball_speed_max:                 float = float(RCSSServerParamsV16.BALL_SPEED_MAX)
+    dash_power_rate:                float = float(RCSSServerParamsV16.DASH_POWER_RATE)
+    effort_init:                    float = float(RCSSServerParamsV16.EFFORT_INIT)
+    effort_min:                     float = float(RCSSServerParamsV16.EFFORT_MIN)
+    extra_stamina:                  float = float(RCSSServerParamsV16.EXTRA_STAMINA)
+    inertia_moment:                 float = float(RCSSServerParamsV16.INERTIA_MOMENT)
+    kick_rand:                      float = float(RCSSServerParamsV16.KICK_RAND)
+    kickable_margin:                float = float(RCSSServerParamsV16.KICKABLE_MARGIN)
+    player_decay:                   float = float(RCSSServerParamsV16.PLAYER_DECAY)
+    player_speed_max:               float = float(RCSSServerParamsV16.PLAYER_SPEED_MAX)
+    stamina_inc_max:                float = float(RCSSServerParamsV16.STAMINA_INC_MAX)
+    stamina_max:                    float = float(RCSSServerParamsV16.STAMINA_MAX)
+    stamina_capacity:               float = float(RCSSServerParamsV16.STAMINA_CAPACITY)
+    dash_power_rate_delta_min:      float = float(RCSSPlayerParamsV16.DASH_POWER_RATE_DELTA_MIN)
+    dash_power_rate_delta_max:      float = float(RCSSPlayerParamsV16.DASH_POWER_RATE_DELTA_MAX)
+    effort_max_delta_factor:        float = float(RCSSPlayerParamsV16.EFFORT_MAX_DELTA_FACTOR)
+    effort_min_delta_factor:        float = float(RCSSPlayerParamsV16.EFFORT_MIN_DELTA_FACTOR)
+    extra_stamina_delta_min:        float = float(RCSSPlayerParamsV16.EXTRA_STAMINA_DELTA_MIN)
+    extra_stamina_delta_max:        float = float(RCSSPlayerParamsV16.EXTRA_STAMINA_DELTA_MAX)
+    inertia_moment_delta_factor:    float = float(RCSSPlayerParamsV16.INERTIA_MOMENT_DELTA_FACTOR)
+    kick_rand_delta_factor:         float = float(RCSSPlayerParamsV16.KICK_RAND_DELTA_FACTOR)
+    kickable_margin_delta_min:      float = float(RCSSPlayerParamsV16.KICKABLE_MARGIN_DELTA_MIN)
+    kickable_margin_delta_max:      float = float(RCSSPlayerParamsV16.KICKABLE_MARGIN_DELTA_MAX)
+    player_decay_delta_min:         float = float(RCSSPlayerParamsV16.PLAYER_DECAY_DELTA_MIN)
+    player_decay_delta_max:         float = float(RCSSPlayerParamsV16.PLAYER_DECAY_DELTA_MAX)
+    stamina_inc_max_delta_factor:   float = float(RCSSPlayerParamsV16.STAMINA_INC_MAX_DELTA_FACTOR)
+
+    @staticmethod
+    def from_tables(serverparams_filepath: Optional[Path], playerparams_filepath: Optional[Path]) -> 'NormalizationParams':
+        """ Reads the params from a match serverparams and playerparams tables. Missing tables or columns keep their defaults. """
+        return _read_normalization_params(serverparams_filepath, playerparams_filepath)
+
+    @staticmethod
+    def of_table(tablepath: Path) -> 'NormalizationParams':
+        """
+            The params of the match a table belongs to, read from the serverparams and playerparams tables next to it.
+            Directories without them (e.g. of extracted tables) get the defaults.
+        """
+        def sibling(tabletype: TableType) -> Optional[Path]:
+            for suffix in ('.csv', '.csv.gz'):
+                filepath = tablepath.parent / (tablepath.name.split('.')[0] + f'.{tabletype}{suffix}')
+                if filepath.exists():
+                    return filepath
+            return None
+        return NormalizationParams.from_tables(sibling(TableType.SPARAMS), sibling(TableType.PPARAMS))
+
+
+@lru_cache(maxsize=256)
+def _read_normalization_params(serverparams_filepath: Optional[Path], playerparams_filepath: Optional[Path]) -> NormalizationParams:
+    # Every table of a match reads the same params tables, so they are parsed once per process
+    params = {}
+    for filepath, columns in ((serverparams_filepath, ServerParamsColumn), (playerparams_filepath, PlayerParamsColumn)):
+        if filepath is None:
+            continue
+        table = pd.read_csv(filepath, nrows=1)
+        for column in columns:
+            if str(column) in table.columns:
+                params[column.name.lower()] = float(table[str(column)].iloc[0])
+    return NormalizationParams(**params)
+
+
+def normalization_terms(column_type: TableColumn, params: NormalizationParams=NormalizationParams()) -> Tuple[float, float]:
+    """
+        The (offset, scale) pair of a normalized column: its values are normalized as (value - offset) / scale, then clipped to [-1, 1].
+        Same normalization as normalizer_from_columntype, up to rounding, but with any params.
+    """
+    def heteroparam_terms(default: float, lower_bound_delta: float, upper_bound_delta: float) -> Tuple[float, float]:
+        # The delta is a uniform random variable in [lower_bound_delta, upper_bound_delta], so we remove its bias
+        bounds_middle = (lower_bound_delta + upper_bound_delta) / 2
+        if np.abs(upper_bound_delta - lower_bound_delta) < 1e-7:
+            return (default + bounds_middle, 1.0)
+        return (default + bounds_middle, np.abs(upper_bound_delta - lower_bound_delta) / 2)
+
+    if type(column_type) is MatchPlayerColumn:
+        column_type : MatchPlayerColumn
+        if column_type.column is SinglePlayerColumn.X:
+            return (0.0, params.pitch_length / 2)
+        if column_type.column is SinglePlayerColumn.Y:
+            return (0.0, params.pitch_width / 2)
+        if column_type.column is SinglePlayerColumn.VX or column_type.column is SinglePlayerColumn.VY:
+            return (0.0, params.player_speed_max)
+        if column_type.column is SinglePlayerColumn.BODY_ANGLE:
+            return (0.0, 180.0)
+        if column_type.column is SinglePlayerColumn.STAMINA:
+            return (params.stamina_max / 2, params.stamina_max / 2)
+        if column_type.column is SinglePlayerColumn.STAMINA_RESERVE:
+            return (params.stamina_capacity / 2, params.stamina_capacity / 2)
+        raise ValueError(f'No Normalizer for Player Column {column_type.column}')
+    column_type : StandardTableColumn
+    if column_type is MatchGeneralColumn.BALL_X:
+        return (0.0, params.pitch_length / 2)
+    if column_type is MatchGeneralColumn.BALL_Y:
+        return (0.0, params.pitch_width / 2)
+    if column_type is MatchGeneralColumn.BALL_VX or column_type is MatchGeneralColumn.BALL_VY:
+        return (0.0, params.ball_speed_max)
+    ## Commands
+    if column_type is DashColumn.DASH_POWER or column_type is KickColumn.KICK_POWER:
+        return (0.0, 100.0)
+    if (column_type is DashColumn.DASH_DIRECTION
+        or column_type is TurnColumn.TURN_MOMENT
+        or column_type is KickColumn.KICK_DIRECTION
+        or column_type is TackleColumn.TACKLE_DIRECTION):
+        return (0.0, 180.0)
+    ## Player Types
+    if column_type is PlayerTypesColumn.DASH_POWER_RATE:
+        return heteroparam_terms(params.dash_power_rate, params.dash_power_rate_delta_min, params.dash_power_rate_delta_max)
+    if column_type is PlayerTypesColumn.STAMINA_INC_MAX:
+        return heteroparam_terms(
+            params.stamina_inc_max,
+            params.stamina_inc_max_delta_factor * params.dash_power_rate_delta_min,
+            params.stamina_inc_max_delta_factor * params.dash_power_rate_delta_max
+        )
+    if column_type is PlayerTypesColumn.PLAYER_DECAY:
+        return heteroparam_terms(params.player_decay, params.player_decay_delta_min, params.player_decay_delta_max)
+    if column_type is PlayerTypesColumn.INERTIA_MOMENT:
+        return heteroparam_terms(
+            params.inertia_moment,
+            params.inertia_moment_delta_factor * params.player_decay_delta_min,
+            params.inertia_moment_delta_factor * params.player_decay_delta_max
+        )
+    if column_type is PlayerTypesColumn.KICKABLE_MARGIN:
+        return heteroparam_terms(params.kickable_margin, params.kickable_margin_delta_min, params.kickable_margin_delta_max)
+    if column_type is PlayerTypesColumn.KICK_RAND:
+        return heteroparam_terms(
+            params.kick_rand,
+            params.kick_rand_delta_factor * params.kickable_margin_delta_min,
+            params.kick_rand_delta_factor * params.kickable_margin_delta_max
+        )
+    if column_type is PlayerTypesColumn.EXTRA_STAMINA:
+        return heteroparam_terms(params.extra_stamina, params.extra_stamina_delta_min, params.extra_stamina_delta_max)
+    if column_type is PlayerTypesColumn.EFFORT_MIN:
+        return heteroparam_terms(
+            params.effort_min,
+            params.effort_min_delta_factor * params.extra_stamina_delta_min,
+            params.effort_min_delta_factor * params.extra_stamina_delta_max
+        )
+    if column_type is PlayerTypesColumn.EFFORT_MAX:
+        return heteroparam_terms(
+            params.effort_init,
+            params.effort_max_delta_factor * params.extra_stamina_delta_min,
+            params.effort_max_delta_factor * params.extra_stamina_delta_max
+        )
+    raise TypeError(f'Unsupported TableColumn of type {type(column_type)}')
+
+
+class NormalizationPlan(NamedTuple):
+    """
+        The normalization of all the normalized columns of a table, compiled into per-column vectors:
+        the column i of a block of values is normalized as (value - offset[i]) / scale[i], clipped to [lower[i], upper[i]].
+        The vectors are read-only, since plans are cached and shared (see normalization_plan).
+    """
+    columns:    List[str]
+    offset:     np.ndarray
+    scale:      np.ndarray
+    lower:      np.ndarray
+    upper:      np.ndarray
+
+    def apply(self, block: np.ndarray) -> np.ndarray:
+        """
+            Normalizes in-place a float (rows, len(columns)) block of values, e.g. a memory-mapped one, and returns it.
+            Each step is a single vectorized operation over the whole block.
+        """
+        block -= self.offset
+        block /= self.scale
+        np.clip(block, self.lower, self.upper, out=block)
+        return block
+
+
+def normalization_plan(tabletype: TableType, params: NormalizationParams=NormalizationParams()) -> Optional[NormalizationPlan]:
+    """ The cached NormalizationPlan of a table type (see normalizable_columns) and params set. None if the table is of no interest. """
+    return _compile_normalization_plan(tabletype, params)
+
+
+@lru_cache(maxsize=256)
+def _compile_normalization_plan(tabletype: TableType, params: NormalizationParams) -> Optional[NormalizationPlan]:
+    normalizable = normalizable_columns(tabletype)
+    if normalizable is None:
+        return None
+    terms = np.array([ normalization_terms(column_type, params) for column_type in normalizable ], dtype=np.float64).reshape(-1, 2)
+    vectors = [ terms[:, 0].copy(), terms[:, 1].copy(), np.full(len(normalizable), -1.0), np.full(len(normalizable), 1.0) ]
+    for vector in vectors:
+        vector.setflags(write=False)
+    return NormalizationPlan([ str(column_type) for column_type in normalizable ], *vectors)
@@ -0,0 +1,79 @@
+from pathlib import Path
+import struct
+
+import numpy as np
+import pytest
+
+from tasks.v1.data.export import EXPORT_FIELDS, PGCOPY_SIGNATURE, BinaryRowDecoder
+from tasks.v1.data.shards import ShardSetWriter
+
+FIELDS = [ ('>f4', 'a'), ('>f4', 'b'), ('>i2', 'label'), ('>f4', 'c') ]
+
+def binary_copy(rows, extension: bytes=b''):
+    """ The COPY ... TO STDOUT (FORMAT binary) stream of (a, b, label, c) rows. None is a NULL. """
+    stream = PGCOPY_SIGNATURE + struct.pack('>ii', 0, len(extension)) + extension
+    for row in rows:
+        stream += struct.pack('>h', len(row))
+        for (dtype, _), value in zip(FIELDS, row):
+            if value is None:
+                stream += struct.pack('>i', -1)
+            elif dtype == '>i2':
+                stream += struct.pack('>ih', 2, value)
+            else:
+                stream += struct.pack('>if', 4, value)
+    return stream + struct.pack('>h', -1)
+
+
+class TestBinaryExport:
+
+    ROWS = [ (float(i), -0.5 * i, i % 5, float('nan') if i % 7 == 0 else 2.0 * i) for i in range(100) ]
+
+    def _decode(self, stream: bytes, write_size: int, chunk_rows: int):
+        decoded = []
+        decoder = BinaryRowDecoder(FIELDS, decoded.append, chunk_rows)
+        for start in range(0, len(stream), write_size):
+            decoder.write(stream[start:start + write_size])
+        decoder.finish()
+        return decoder, [ np.concatenate(arrays) for arrays in zip(*decoded) ]
+
+    def test_decode(self):
+        for write_size, chunk_rows in [(1, 1), (7, 3), (37, 64), (10000, 2**14)]:
+            decoder, (ab, labels, c) = self._decode(binary_copy(TestBinaryExport.ROWS, b'ext'), write_size, chunk_rows)
+            assert decoder.rows == len(TestBinaryExport.ROWS)
+            assert ab.dtype == np.float32 and labels.dtype == np.int16 and c.dtype == np.float32
+            assert np.array_equal(ab, np.array([ row[:2] for row in TestBinaryExport.ROWS ], dtype=np.float32))
+            assert labels[:, 0].tolist() == [ row[2] for row in TestBinaryExport.ROWS ]
+            assert np.array_equal(c[:, 0], np.array([ row[3] for row in TestBinaryExport.ROWS ], dtype=np.float32), equal_nan=True)
+
+    def test_export_fields_runs(self):
+        decoder = BinaryRowDecoder(EXPORT_FIELDS, lambda arrays: None)
+        assert [ count for _, _, count in decoder.runs ] == [303, 1, 6]
+
+    def test_empty(self):
+        decoder, arrays = self._decode(binary_copy([]), 5, 8)
+        assert decoder.rows == 0 and arrays == []
+
+    def test_null_field(self):
+        with pytest.raises(ValueError):
+            self._decode(binary_copy(TestBinaryExport.ROWS[:3] + [(1.0, None, 0, 1.0)]), 10000, 2)
+
+    def test_truncated(self):
+        stream = binary_copy(TestBinaryExport.ROWS)
+        with pytest.raises(ValueError):
+            self._decode(stream[:-5], 100, 8)
+        with pytest.raises(ValueError):
+            self._decode(b'COPY' + stream[4:], 100, 8)
+
+    def test_discard_shards(self, tmpdir):
+        arrays = (np.zeros((10, 3), dtype=np.float32), np.zeros(10, dtype=np.int8), np.zeros((10, 2), dtype=np.float32))
+        kept = ShardSetWriter(Path(tmpdir), rows_per_shard=4, name_template='shard-a-%05d')
+        kept.write(arrays)
+        assert len(kept.close()) == 3
+        discarded = ShardSetWriter(Path(tmpdir), rows_per_shard=4, name_template='shard-b-%05d')
+        discarded.write(arrays)
+        discarded.discard()
+        assert sorted(path.name for path in Path(tmpdir).iterdir()) == sorted(
+            f'shard-a-{index:05d}.{extension}' for index in range(3) for extension in ('json', 'features.f32', 'labels.i8', 'regression.f32')
+        )
+        with pytest.raises(ValueError):
+            ShardSetWriter(Path(tmpdir), name_template='shard-a-%05d')
@@ -0,0 +1,101 @@
+from typing import Dict, List
+
+from tasks.v1.data.bulkload import DEFERRED_TABLE, FOREIGN_KEY, INDEX, UNIQUE, DeferredDefinition, constraint_statement, defer, drop_statement, index_statement, validate_statement
+
+class FakeCursor:
+    """ Records the statements it's given and answers the catalog queries of bulkload.py with canned rows. """
+
+    def __init__(self, connection: 'FakeConnection') -> None:
+        self.connection = connection
+        self.rows: List[tuple] = []
+
+    def execute(self, query: str, params: tuple=()) -> None:
+        self.connection.statements.append((query, params))
+        self.rows = []
+        if 'FROM pg_index' in query:
+            self.connection.index_params = params
+            self.rows = self.connection.indexes
+        elif 'FROM pg_constraint' in query:
+            self.connection.foreign_key_params = params
+            self.rows = self.connection.foreign_keys
+        elif query.startswith(f"INSERT INTO {DEFERRED_TABLE}"):
+            self.connection.recorded[params[1]] = params[1:]
+        elif query.startswith(f"SELECT name, tablename, kind, definition FROM {DEFERRED_TABLE}"):
+            self.rows = sorted(self.connection.recorded.values(), key=lambda row: (row[1], row[0]))
+
+    def fetchall(self) -> List[tuple]:
+        return list(self.rows)
+
+    def close(self) -> None:
+        pass
+
+
+class FakeConnection:
+
+    def __init__(self, indexes: List[tuple], foreign_keys: List[tuple]) -> None:
+        self.indexes = indexes
+        self.foreign_keys = foreign_keys
+        self.statements: List[tuple] = []
+        self.recorded: Dict[str, tuple] = {}
+
+    def cursor(self) -> FakeCursor:
+        return FakeCursor(self)
+
+    def commit(self) -> None:
+        pass
+
+    def rollback(self) -> None:
+        pass
+
+
+class TestBulkLoad:
+
+    INDEXES = [
+        ('playerstates_matchstate_idx', 'playerstates', INDEX, 'CREATE INDEX playerstates_matchstate_idx ON v1.playerstates USING btree (matchstate_id_fk)'),
+        ('playerstates_unique', 'playerstates', UNIQUE, 'CREATE UNIQUE INDEX playerstates_unique ON v1.playerstates USING btree (matchstate_id_fk, side, unum)')
+    ]
+    FOREIGN_KEYS = [
+        ('playercommands_playerstate_fk', 'playercommands', FOREIGN_KEY, 'FOREIGN KEY (playerstate_id_fk) REFERENCES v1.playerstates(playerstate_id) ON DELETE CASCADE'),
+        ('playerstates_matchstate_fk', 'playerstates', FOREIGN_KEY, 'FOREIGN KEY (matchstate_id_fk) REFERENCES v1.matchstates(matchstate_id) ON DELETE CASCADE')
+    ]
+
+    def test_restore_statements(self):
+        index, unique = [ DeferredDefinition(*row) for row in TestBulkLoad.INDEXES ]
+        (foreign_key, _) = [ DeferredDefinition(*row) for row in TestBulkLoad.FOREIGN_KEYS ]
+        assert drop_statement('v1', index) == 'DROP INDEX "v1"."playerstates_matchstate_idx";'
+        assert drop_statement('v1', unique) == 'ALTER TABLE "v1"."playerstates" DROP CONSTRAINT "playerstates_unique";'
+        assert index_statement(unique) == 'CREATE UNIQUE INDEX playerstates_unique ON v1.playerstates USING btree (matchstate_id_fk, side, unum);'
+        assert constraint_statement('v1', unique) == 'ALTER TABLE "v1"."playerstates" ADD CONSTRAINT "playerstates_unique" UNIQUE USING INDEX "playerstates_unique";'
+        assert constraint_statement('v1', foreign_key) == (
+            'ALTER TABLE "v1"."playercommands" ADD CONSTRAINT "playercommands_playerstate_fk" ' +
+            'FOREIGN KEY (playerstate_id_fk) REFERENCES v1.playerstates(playerstate_id) ON DELETE CASCADE NOT VALID;'
+        )
+        assert validate_statement('v1', foreign_key) == 'ALTER TABLE "v1"."playercommands" VALIDATE CONSTRAINT "playercommands_playerstate_fk";'
+
+    def test_defer_round_trip(self):
+        """ What defer captures is recorded as is, read back in the same shape and dropped: restoring builds it again. """
+        connection = FakeConnection(TestBulkLoad.INDEXES, TestBulkLoad.FOREIGN_KEYS)
+        deferred = defer(connection, 'v1', ['playerstates'])
+        assert sorted(deferred) == sorted(DeferredDefinition(*row) for row in TestBulkLoad.INDEXES + TestBulkLoad.FOREIGN_KEYS)
+        executed = [ query for query, _ in connection.statements ]
+        # Foreign keys go first, since they may rely on the unique constraints
+        drops = [ query for query in executed if query.startswith(('DROP', 'ALTER')) ]
+        assert drops == [ drop_statement('v1', DeferredDefinition(*row)) for row in TestBulkLoad.FOREIGN_KEYS + TestBulkLoad.INDEXES ]
+        restored = { definition.name: definition for definition in deferred }
+        assert index_statement(restored['playerstates_unique']) == TestBulkLoad.INDEXES[1][3] + ';'
+        assert constraint_statement('v1', restored['playerstates_matchstate_fk']) == (
+            'ALTER TABLE "v1"."playerstates" ADD CONSTRAINT "playerstates_matchstate_fk" ' +
+            'FOREIGN KEY (matchstate_id_fk) REFERENCES v1.matchstates(matchstate_id) ON DELETE CASCADE NOT VALID;'
+        )
+
+    def test_defer_tables(self):
+        """ Only the deferred tables are asked for, along with the foreign keys relying on their unique constraints. """
+        connection = FakeConnection(TestBulkLoad.INDEXES, TestBulkLoad.FOREIGN_KEYS)
+        defer(connection, 'v1', ['playerstates'])
+        assert connection.index_params == (INDEX, UNIQUE, 'v1', ['playerstates'])
+        assert connection.foreign_key_params == (FOREIGN_KEY, 'v1', ['playerstates'], ['playerstates_unique'])
+
+    def test_defer_nothing(self):
+        connection = FakeConnection([], [])
+        assert defer(connection, 'v1', ['playercommands']) == []
+        assert not any(query.startswith(('DROP', 'ALTER')) for query, _ in connection.statements)
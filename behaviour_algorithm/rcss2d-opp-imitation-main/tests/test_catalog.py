@@ -0,0 +1,168 @@
+import gzip
+import os
+from pathlib import Path
+import shutil
+
+from tasks.v1.cli.utils import catalogcsvs, listcsvs
+import tasks.v1.data.catalog as catalog_module
+from tasks.v1.data.catalog import CATALOG_FILENAME, MTIME_TICK_NS, Catalog, count_rows, default_dbpath, walk_csvs
+from tasks.v1.data.manifest import files_checksum
+from tasks.v1.types import TableType
+
+HERE = Path(os.path.dirname(os.path.realpath(__file__)))
+
+class TestCatalog:
+
+    TESTFILES_DIRPATH = HERE / 'data'
+    FILESTEM = '202101010000-MT2019_0-vs-HELIOS2019_1'
+    TABLETYPES = ['match', 'playertypes', 'dash', 'turn', 'kick', 'tackle']
+
+    def _dataset(self, tmpdir) -> Path:
+        """ A complete match deep in the tree, an incomplete compressed one at the root and a hidden directory. """
+        root = Path(tmpdir / 'dataset')
+        deep = root / 'season' / 'round' / 'match'
+        os.makedirs(deep)
+        for tabletype in TestCatalog.TABLETYPES:
+            shutil.copy(TestCatalog.TESTFILES_DIRPATH / f'test.{tabletype}.csv', deep / f'{TestCatalog.FILESTEM}.{tabletype}.csv')
+        with open(TestCatalog.TESTFILES_DIRPATH / 'test.dash.csv', 'rb') as src, gzip.open(root / '202101010001-A_0-vs-B_0.dash.csv.gz', 'wb') as dst:
+            dst.write(src.read())
+        os.makedirs(root / '.v1cache')
+        (root / '.v1cache' / 'hidden.csv').write_text('#\n')
+        (root / 'notes.txt').write_text('not a table')
+        return root
+
+    def _age(self, root: Path) -> None:
+        """ Dates every directory of the dataset back, out of the timestamp tick of the next refresh. """
+        past_ns = os.stat(root).st_mtime_ns - 10 * MTIME_TICK_NS
+        for dirpath, _, _ in os.walk(root):
+            os.utime(dirpath, ns=(past_ns, past_ns))
+
+    def test_walk_any_depth(self, tmpdir):
+        root = self._dataset(tmpdir)
+        names = sorted(entry.name for entry in walk_csvs(root))
+        assert len(names) == 7
+        assert 'hidden.csv' not in names
+        assert [ entry.name for entry in walk_csvs(root, max_depth=2) ] == ['202101010001-A_0-vs-B_0.dash.csv.gz']
+
+    def test_listcsvs_depth(self, tmpdir):
+        """ listcsvs only looks at the root and its subdirectories (hidden ones too), as it always did. """
+        root = self._dataset(tmpdir)
+        shutil.copy(TestCatalog.TESTFILES_DIRPATH / 'test.turn.csv', root / 'season' / '202101010001-A_0-vs-B_0.turn.csv')
+        csvpaths, compressedcsvpaths = listcsvs(root)
+        assert sorted(path.name for path in csvpaths) == ['202101010001-A_0-vs-B_0.turn.csv', 'hidden.csv']
+        assert [ path.name for path in compressedcsvpaths ] == ['202101010001-A_0-vs-B_0.dash.csv.gz']
+
+    def test_files(self, tmpdir):
+        root = self._dataset(tmpdir)
+        with Catalog(root) as catalog:
+            stats = catalog.refresh(checksums=True, rows=True)
+            assert (stats.added, stats.changed, stats.removed, stats.unchanged) == (7, 0, 0, 0)
+            (match,) = catalog.files(TableType.MATCH)
+        assert match.path == root / 'season' / 'round' / 'match' / f'{TestCatalog.FILESTEM}.match.csv'
+        assert match.rows == 100
+        assert match.checksum == files_checksum([match.path])
+        data = match.match_data()
+        assert (data.timestamp, data.left_teamname, data.left_finalscore, data.right_teamname, data.right_finalscore) == ('202101010000', 'MT2019', 0, 'HELIOS2019', 1)
+
+    def test_rows_of_compressed_tables(self, tmpdir):
+        root = self._dataset(tmpdir)
+        rows = len((TestCatalog.TESTFILES_DIRPATH / 'test.dash.csv').read_text().splitlines()) - 1
+        assert count_rows(root / '202101010001-A_0-vs-B_0.dash.csv.gz') == rows
+
+    def test_incremental_refresh(self, tmpdir):
+        root = self._dataset(tmpdir)
+        deep = root / 'season' / 'round' / 'match'
+        with Catalog(root) as catalog:
+            catalog.refresh(checksums=True)
+        # Reopened: nothing changed
+        with Catalog(root) as catalog:
+            stats = catalog.refresh(checksums=True)
+            assert (stats.added, stats.changed, stats.removed, stats.unchanged) == (0, 0, 0, 7)
+        (deep / f'{TestCatalog.FILESTEM}.kick.csv').unlink()
+        with open(deep / f'{TestCatalog.FILESTEM}.dash.csv', 'a') as file:
+            file.write('101,3001,0,1,MT2019,1,100,0\n')
+        shutil.copy(TestCatalog.TESTFILES_DIRPATH / 'test.turn.csv', root / '202101010001-A_0-vs-B_0.turn.csv')
+        with Catalog(root) as catalog:
+            stats = catalog.refresh(checksums=True)
+            assert (stats.added, stats.changed, stats.removed, stats.unchanged) == (1, 1, 1, 5)
+            dash = next(catalog_file for catalog_file in catalog.files(TableType.DASH) if catalog_file.filestem == TestCatalog.FILESTEM)
+            assert dash.checksum == files_checksum([dash.path])
+
+    def test_quick_refresh(self, tmpdir):
+        root = self._dataset(tmpdir)
+        deep = root / 'season' / 'round' / 'match'
+        self._age(root)
+        with Catalog(root) as catalog:
+            stats = catalog.refresh(full=False)
+            assert (stats.added, stats.changed, stats.removed, stats.unchanged) == (7, 0, 0, 0)
+            stats = catalog.refresh(full=False)
+            assert (stats.added, stats.changed, stats.removed, stats.unchanged) == (0, 0, 0, 7)
+            # Tables added and removed change their directory
+            (deep / f'{TestCatalog.FILESTEM}.kick.csv').unlink()
+            shutil.copy(TestCatalog.TESTFILES_DIRPATH / 'test.turn.csv', root / 'season' / '202101010001-A_0-vs-B_0.turn.csv')
+            stats = catalog.refresh(full=False)
+            assert (stats.added, stats.changed, stats.removed, stats.unchanged) == (1, 0, 1, 6)
+            self._age(root)
+            catalog.refresh(full=False)
+            # A table rewritten in place doesn't: only a full refresh sees it
+            with open(deep / f'{TestCatalog.FILESTEM}.dash.csv', 'a') as file:
+                file.write('101,3001,0,1,MT2019,1,100,0\n')
+            assert catalog.refresh(full=False).changed == 0
+            assert catalog.refresh().changed == 1
+            # Tables of the directories that are gone
+            shutil.rmtree(root / 'season' / 'round')
+            stats = catalog.refresh(full=False)
+            assert (stats.added, stats.changed, stats.removed, stats.unchanged) == (0, 0, 5, 2)
+            assert len(catalog.files()) == 2
+
+    def test_quick_refresh_within_a_tick(self, tmpdir):
+        """ A table added in the same timestamp tick as the last refresh leaves its directory's modification time as it was. """
+        root = self._dataset(tmpdir)
+        deep = root / 'season' / 'round' / 'match'
+        with Catalog(root) as catalog:
+            catalog.refresh(full=False)
+            mtime_ns = os.stat(deep).st_mtime_ns
+            shutil.copy(TestCatalog.TESTFILES_DIRPATH / 'test.turn.csv', deep / '202101010001-A_0-vs-B_0.turn.csv')
+            os.utime(deep, ns=(mtime_ns, mtime_ns))
+            assert catalog.refresh(full=False).added == 1
+
+    def test_read_only_dataset(self, tmpdir, monkeypatch):
+        """ The catalog of a dataset that can't be written to is kept in the user cache directory, or else in memory. """
+        root = self._dataset(tmpdir)
+        monkeypatch.setattr(catalog_module, 'CATALOG_CACHE_DIRPATH', Path(tmpdir) / 'cache')
+        assert default_dbpath(root) == root / CATALOG_FILENAME
+        monkeypatch.setattr(catalog_module.os, 'access', lambda path, mode: False)
+        dbpath = default_dbpath(root)
+        assert dbpath.parent == Path(tmpdir) / 'cache'
+        with Catalog(root) as catalog:
+            assert catalog.dbpath == dbpath
+            assert catalog.refresh().added == 7
+        assert not (root / CATALOG_FILENAME).exists()
+        # Not even a cache directory
+        shutil.rmtree(Path(tmpdir) / 'cache')
+        (Path(tmpdir) / 'cache').write_text('not a directory')
+        csvpaths, compressedcsvpaths = catalogcsvs(root)
+        assert len(csvpaths) == 6 and len(compressedcsvpaths) == 1
+
+    def test_match_groups(self, tmpdir):
+        root = self._dataset(tmpdir)
+        with Catalog(root) as catalog:
+            catalog.refresh()
+            assert sorted(catalog.match_groups()) == [TestCatalog.FILESTEM, '202101010001-A_0-vs-B_0']
+            assert list(catalog.match_groups(complete=True)) == [TestCatalog.FILESTEM]
+            assert catalog.csvpaths() == (
+                sorted(Path(entry.path) for entry in walk_csvs(root) if entry.name.endswith('.csv')),
+                [ root / '202101010001-A_0-vs-B_0.dash.csv.gz' ]
+            )
+
+    def test_exclude(self, tmpdir):
+        """ The tables under the excluded directories (e.g. an output directory inside the dataset) are left out. """
+        root = self._dataset(tmpdir)
+        with Catalog(root) as catalog:
+            catalog.refresh()
+            assert catalog.csvpaths(exclude=[root / 'season' / 'round']) == ([], [ root / '202101010001-A_0-vs-B_0.dash.csv.gz' ])
+            assert catalog.match_groups(complete=True, exclude=[root / 'season']) == {}
+            assert len(catalog.files(exclude=[root / 'seas'])) == 7
+            # Directories out of the dataset exclude nothing
+            assert len(catalog.files(exclude=[Path(tmpdir) / 'elsewhere'])) == 7
+            assert catalog.files(exclude=[root]) == []
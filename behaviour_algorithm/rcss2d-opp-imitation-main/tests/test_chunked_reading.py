@@ -0,0 +1,56 @@
+import os
+import pandas as pd
+from pathlib import Path
+import pytest
+
+from tasks.v1.data import extract_raw_features, normalize_raw_features
+from tasks.v1.data.chunking import read_table_chunks, rows_per_chunk
+from tasks.v1.data.schema import file_dtypes
+
+HERE = Path(os.path.dirname(os.path.realpath(__file__)))
+
+class TestChunkedReading:
+
+    TESTFILES_DIRPATH = HERE / 'data'
+    INPUTNAME_TEMPLATE = 'test.%s.csv'
+    # Small enough to split the test match table into several chunks
+    MEMORY_BUDGET = 2**20
+
+    def test_budget_splits_table(self):
+        filepath = TestChunkedReading.TESTFILES_DIRPATH / (TestChunkedReading.INPUTNAME_TEMPLATE % 'match')
+        chunks = list(read_table_chunks(filepath, TestChunkedReading.MEMORY_BUDGET))
+        assert len(chunks) > 1
+        assert len(chunks[0]) == rows_per_chunk(filepath, TestChunkedReading.MEMORY_BUDGET)
+
+    def test_chunks_cover_table(self):
+        filepath = TestChunkedReading.TESTFILES_DIRPATH / (TestChunkedReading.INPUTNAME_TEMPLATE % 'match')
+        whole = pd.read_csv(filepath, dtype=file_dtypes(filepath))
+        # Every chunk has its own categories, so concatenated categorical columns fall back to objects
+        chunked = pd.concat(read_table_chunks(filepath, TestChunkedReading.MEMORY_BUDGET)).astype(whole.dtypes.to_dict())
+        pd.testing.assert_frame_equal(chunked, whole)
+
+    def test_chunks_keep_whole_table_dtypes(self):
+        filepath = TestChunkedReading.TESTFILES_DIRPATH / (TestChunkedReading.INPUTNAME_TEMPLATE % 'match')
+        whole = pd.read_csv(filepath, dtype=file_dtypes(filepath))
+        for chunk in read_table_chunks(filepath, TestChunkedReading.MEMORY_BUDGET):
+            assert chunk.dtypes.astype(str).equals(whole.dtypes.astype(str))
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize('tabletype', ['match', 'dash', 'playertypes'])
+    async def test_extract_same_output(self, tmpdir, tabletype):
+        inputfilepath = TestChunkedReading.TESTFILES_DIRPATH / (TestChunkedReading.INPUTNAME_TEMPLATE % tabletype)
+        os.makedirs(tmpdir / 'whole')
+        os.makedirs(tmpdir / 'chunked')
+        await extract_raw_features(inputfilepath, False, Path(tmpdir / 'whole'))
+        await extract_raw_features(inputfilepath, False, Path(tmpdir / 'chunked'), TestChunkedReading.MEMORY_BUDGET)
+        assert (tmpdir / 'chunked' / inputfilepath.name).read_text('utf8') == (tmpdir / 'whole' / inputfilepath.name).read_text('utf8')
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize('tabletype', ['match', 'dash', 'playertypes'])
+    async def test_normalize_same_output(self, tmpdir, tabletype):
+        inputfilepath = TestChunkedReading.TESTFILES_DIRPATH / (TestChunkedReading.INPUTNAME_TEMPLATE % tabletype)
+        os.makedirs(tmpdir / 'whole')
+        os.makedirs(tmpdir / 'chunked')
+        await normalize_raw_features(inputfilepath, False, Path(tmpdir / 'whole'))
+        await normalize_raw_features(inputfilepath, False, Path(tmpdir / 'chunked'), TestChunkedReading.MEMORY_BUDGET)
+        assert (tmpdir / 'chunked' / inputfilepath.name).read_text('utf8') == (tmpdir / 'whole' / inputfilepath.name).read_text('utf8')
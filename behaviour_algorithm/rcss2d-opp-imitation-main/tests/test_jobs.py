@@ -0,0 +1,44 @@
+import os
+from pathlib import Path
+import pytest
+import shutil
+
+from tasks.v1.data import extract_raw_features, normalize_raw_features
+from tasks.v1.data.jobs import run_jobs
+
+HERE = Path(os.path.dirname(os.path.realpath(__file__)))
+
+class TestJobs:
+
+    TESTFILES_DIRPATH = HERE / 'data'
+    INPUTNAME_TEMPLATE = 'test.%s.csv'
+    TABLETYPES = ['match', 'playertypes', 'dash', 'turn', 'kick', 'tackle']
+
+    def _inputpaths(self):
+        return sorted(TestJobs.TESTFILES_DIRPATH / (TestJobs.INPUTNAME_TEMPLATE % tabletype) for tabletype in TestJobs.TABLETYPES)
+
+    @pytest.mark.parametrize('job', [extract_raw_features, normalize_raw_features])
+    def test_pool_same_outputs(self, tmpdir, job):
+        for outdirname in ('serial', 'pool'):
+            os.makedirs(tmpdir / outdirname)
+        assert run_jobs(job, self._inputpaths(), jobs=1, compress=False, output_dir=Path(tmpdir / 'serial')) == []
+        assert run_jobs(job, self._inputpaths(), jobs=3, compress=False, output_dir=Path(tmpdir / 'pool')) == []
+        for filepath in self._inputpaths():
+            assert (tmpdir / 'pool' / filepath.name).read_text('utf8') == (tmpdir / 'serial' / filepath.name).read_text('utf8')
+
+    @pytest.mark.parametrize('jobs', [1, 3])
+    def test_failures_are_reported_in_order(self, tmpdir, capsys, jobs):
+        inputpaths = []
+        for tabletype in ('dash', 'kick', 'turn'):
+            filepath = Path(tmpdir / (TestJobs.INPUTNAME_TEMPLATE % tabletype))
+            shutil.copy(TestJobs.TESTFILES_DIRPATH / filepath.name, filepath)
+            inputpaths.append(filepath)
+        # A table that can not be read
+        inputpaths[1].write_bytes(b'\x00not a table')
+        os.makedirs(tmpdir / 'out')
+        failures = run_jobs(extract_raw_features, inputpaths, jobs=jobs, compress=False, output_dir=Path(tmpdir / 'out'))
+        assert [ filepath for filepath, _ in failures ] == [inputpaths[1]]
+        reported = [ line.split(' ')[0] for line in capsys.readouterr().out.splitlines() if line.startswith('[') ]
+        assert reported == ['[1/3]', '[2/3]', '[3/3]']
+        assert (tmpdir / 'out' / inputpaths[0].name).exists()
+        assert (tmpdir / 'out' / inputpaths[2].name).exists()
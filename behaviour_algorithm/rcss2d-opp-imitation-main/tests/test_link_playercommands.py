@@ -0,0 +1,127 @@
+import os
+import pandas as pd
+from pathlib import Path
+import pytest
+
+from tasks.v1.data.linking import FLAT_PLAYERCOMMAND_PARAMETERS, LINKED_PLAYERCOMMAND_COLUMNS, PLAYERCOMMAND_PARAMETERS, PLAYERCOMMAND_PRIORITY, flat_playercommand_rows, link_playercommands
+from tasks.v1.types import TableType
+
+HERE = Path(os.path.dirname(os.path.realpath(__file__)))
+
+class TestLinkPlayercommands:
+
+    TESTFILES_DIRPATH = HERE / 'data'
+    INPUTNAME_TEMPLATE = 'test.%s.csv'
+
+    def _read(self, tabletype: TableType) -> pd.DataFrame:
+        return pd.read_csv(TestLinkPlayercommands.TESTFILES_DIRPATH / (TestLinkPlayercommands.INPUTNAME_TEMPLATE % tabletype))
+
+    def _ids(self):
+        match = self._read(TableType.MATCH)
+        matchstate_ids = pd.DataFrame({
+            'matchstate_id': range(1000, 1000 + len(match)),
+            'cycle': match[' cycle'],
+            'stopped_cycle': match[' stopped'],
+        })
+        playerstate_ids = pd.DataFrame(
+            [
+                (matchstate_id, teamname, unum)
+                for matchstate_id, left_teamname, right_teamname in zip(matchstate_ids['matchstate_id'], match[' l_name'], match[' r_name'])
+                for teamname in (left_teamname, right_teamname)
+                for unum in range(1, 12)
+            ],
+            columns=['matchstate_id', 'teamname', 'unum']
+        )
+        playerstate_ids.insert(0, 'playerstate_id', range(5000, 5000 + len(playerstate_ids)))
+        return matchstate_ids, playerstate_ids
+
+    def _commands(self, matchstate_ids: pd.DataFrame):
+        """ The example command tables go further than the example match table, so keep only the known moments (and cycle 0). """
+        known = set(zip(matchstate_ids['cycle'], matchstate_ids['stopped_cycle']))
+        commands = {}
+        for tabletype in PLAYERCOMMAND_PRIORITY:
+            table = self._read(tabletype)
+            commands[tabletype] = table[[
+                time in known or time[0] == 0 for time in zip(table['running_time'], table['stopped_time'])
+            ]].reset_index(drop=True)
+        return commands
+
+    def _reference(self, commands, matchstate_ids, playerstate_ids):
+        """ The row by row linking the loader used to do. """
+        matchstate_per_time = { (cycle, stopped): matchstate_id for matchstate_id, cycle, stopped in matchstate_ids.itertuples(index=False) }
+        playerstate_per_key = { (matchstate_id, teamname, unum): playerstate_id for playerstate_id, matchstate_id, teamname, unum in playerstate_ids.itertuples(index=False) }
+        used = set()
+        linked = {}
+        for tabletype in PLAYERCOMMAND_PRIORITY:
+            rows = []
+            for _, csv_row in commands[tabletype].iterrows():
+                if csv_row['running_time'] in (0, 3000):
+                    continue
+                matchstate_id = matchstate_per_time[(csv_row['running_time'], csv_row['stopped_time'])]
+                key = (matchstate_id, csv_row['teamname'], csv_row['unum'])
+                if key in used:
+                    continue
+                used.add(key)
+                rows.append((matchstate_id, csv_row['running_time'], csv_row['stopped_time'], csv_row['unum'], csv_row['teamname'], playerstate_per_key[key]))
+            linked[tabletype] = rows
+        return linked
+
+    def test_same_as_rowwise_linking(self):
+        matchstate_ids, playerstate_ids = self._ids()
+        commands = self._commands(matchstate_ids)
+        # Make the same players issue commands of other types at the same moments
+        commands[TableType.TACKLE] = pd.concat([
+            commands[TableType.TACKLE],
+            commands[TableType.DASH].iloc[[0, 3]].rename(columns={'dash_direction': 'tackle_direction'}).drop(columns=['dash_power']),
+        ], ignore_index=True)
+        commands[TableType.DASH] = pd.concat([commands[TableType.DASH], commands[TableType.DASH].iloc[[5]]], ignore_index=True)
+        linked = link_playercommands(commands, matchstate_ids, playerstate_ids)
+        reference = self._reference(commands, matchstate_ids, playerstate_ids)
+        for tabletype in PLAYERCOMMAND_PRIORITY:
+            assert list(linked[tabletype][LINKED_PLAYERCOMMAND_COLUMNS].itertuples(index=False, name=None)) == reference[tabletype]
+        assert len(linked[TableType.TACKLE]) == len(reference[TableType.TACKLE]) > 0
+
+    def test_priority(self):
+        matchstate_ids, playerstate_ids = self._ids()
+        commands = self._commands(matchstate_ids)
+        dash = commands[TableType.DASH].iloc[[0]]
+        commands[TableType.KICK] = pd.concat([commands[TableType.KICK], dash.rename(columns={'dash_power': 'kick_power', 'dash_direction': 'kick_direction'})], ignore_index=True)
+        linked = link_playercommands(commands, matchstate_ids, playerstate_ids)
+        key = tuple(dash[['running_time', 'stopped_time', 'teamname', 'unum']].iloc[0])
+        assert key in set(linked[TableType.KICK][['cycle_fk', 'stopped_cycle_fk', 'teamname_fk', 'unum_fk']].itertuples(index=False, name=None))
+        assert key not in set(linked[TableType.DASH][['cycle_fk', 'stopped_cycle_fk', 'teamname_fk', 'unum_fk']].itertuples(index=False, name=None))
+
+    def test_unavailable_cycles_are_dropped(self):
+        matchstate_ids, playerstate_ids = self._ids()
+        commands = self._commands(matchstate_ids)
+        assert (commands[TableType.TURN]['running_time'] == 0).any()
+        linked = link_playercommands(commands, matchstate_ids, playerstate_ids)
+        assert not linked[TableType.TURN]['cycle_fk'].isin([0, 3000]).any()
+
+    def test_missing_matchstate(self):
+        matchstate_ids, playerstate_ids = self._ids()
+        commands = self._commands(matchstate_ids)
+        with pytest.raises(ValueError):
+            link_playercommands(commands, matchstate_ids.iloc[1:], playerstate_ids)
+
+    def test_empty_tables(self):
+        matchstate_ids, playerstate_ids = self._ids()
+        commands = { tabletype: self._read(tabletype).iloc[:0] for tabletype in PLAYERCOMMAND_PRIORITY }
+        linked = link_playercommands(commands, matchstate_ids, playerstate_ids)
+        assert all(len(linked[tabletype]) == 0 for tabletype in PLAYERCOMMAND_PRIORITY)
+
+    def test_flat_rows(self):
+        matchstate_ids, playerstate_ids = self._ids()
+        linked = link_playercommands(self._commands(matchstate_ids), matchstate_ids, playerstate_ids)
+        rows = flat_playercommand_rows(linked, LINKED_PLAYERCOMMAND_COLUMNS)
+        assert len(rows) == sum(len(linked[tabletype]) for tabletype in PLAYERCOMMAND_PRIORITY)
+        # In priority order, each command with the parameters of its own type only
+        expected = []
+        for tabletype in PLAYERCOMMAND_PRIORITY:
+            parameters = [ str(column) for column in PLAYERCOMMAND_PARAMETERS[tabletype] ]
+            for row in linked[tabletype].to_dict('records'):
+                expected.append((
+                    *(row[column] for column in LINKED_PLAYERCOMMAND_COLUMNS),
+                    *(row[column] if column in parameters else None for column in FLAT_PLAYERCOMMAND_PARAMETERS)
+                ))
+        assert rows == expected
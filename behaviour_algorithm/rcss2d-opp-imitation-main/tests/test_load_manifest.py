@@ -0,0 +1,88 @@
+import os
+from pathlib import Path
+import pytest
+
+from tasks.v1.data.manifest import STAGE_DONE, ManifestEntry, check_manifest_entry, files_checksum
+from tasks.v1.data.preparation import check_metadata_batch, metadata_batch
+
+HERE = Path(os.path.dirname(os.path.realpath(__file__)))
+
+class TestLoadManifest:
+
+    TESTFILES_DIRPATH = HERE / 'data'
+
+    def test_checksum_ignores_order(self):
+        filepaths = sorted(TestLoadManifest.TESTFILES_DIRPATH.glob('test.*.csv'))
+        assert files_checksum(filepaths) == files_checksum(list(reversed(filepaths)))
+
+    def test_checksum_follows_contents(self, tmpdir):
+        filepath = Path(tmpdir) / 'test.match.csv'
+        filepath.write_text('a,b\n1,2\n')
+        checksum = files_checksum([filepath])
+        filepath.write_text('a,b\n1,3\n')
+        assert files_checksum([filepath]) != checksum
+
+    def test_checksum_follows_names(self, tmpdir):
+        filepath = Path(tmpdir) / 'test.match.csv'
+        filepath.write_text('a,b\n1,2\n')
+        renamed = Path(tmpdir) / 'test.dash.csv'
+        checksum = files_checksum([filepath])
+        filepath.rename(renamed)
+        assert files_checksum([renamed]) != checksum
+
+    def test_check_entry(self):
+        assert check_manifest_entry(None, 'abc', 'Match') is None
+        assert check_manifest_entry(ManifestEntry('abc', 'matchstates'), 'abc', 'Match') == 'matchstates'
+        assert check_manifest_entry(ManifestEntry('abc', STAGE_DONE), 'abc', 'Match') == STAGE_DONE
+
+    def test_check_entry_of_other_files(self):
+        with pytest.raises(ValueError):
+            check_manifest_entry(ManifestEntry('abc', STAGE_DONE), 'def', 'Match')
+
+
+class TestMetadataBatch:
+
+    def _match_table(self, dirpath: Path, filename: str) -> Path:
+        filepath = dirpath / filename
+        filepath.write_text('show_time,playmode\n1,play_on\n')
+        return filepath
+
+    def test_batch(self, tmpdir):
+        first = self._match_table(Path(tmpdir), '202101010000-MT2019_0-vs-HELIOS2019_1.match.csv')
+        second = self._match_table(Path(tmpdir), '202101010001-A_2-vs-B_0.match.csv')
+        matches, failures = metadata_batch([first, second])
+        assert failures == []
+        assert list(matches) == ['202101010000', '202101010001']
+        filepath, match_data, checksum = matches['202101010000']
+        assert filepath == first and checksum == files_checksum([first])
+        assert (match_data.left_teamname, match_data.left_finalscore, match_data.right_teamname, match_data.right_finalscore) == ('MT2019', 0, 'HELIOS2019', 1)
+
+    def test_incomplete_filenames(self, tmpdir):
+        incomplete = self._match_table(Path(tmpdir), 'test.match.csv')
+        matches, failures = metadata_batch([incomplete])
+        assert matches == {}
+        assert [ filepath for filepath, _ in failures ] == [incomplete]
+
+    def test_duplicate_timestamps(self, tmpdir):
+        """ ON CONFLICT can't affect a row a second time: only the first table of a match is upserted. """
+        os.makedirs(Path(tmpdir) / 'again')
+        first = self._match_table(Path(tmpdir), '202101010000-MT2019_0-vs-HELIOS2019_1.match.csv')
+        again = self._match_table(Path(tmpdir) / 'again', '202101010000-MT2019_0-vs-HELIOS2019_1.match.csv')
+        matches, failures = metadata_batch([first, again])
+        assert matches['202101010000'][0] == first
+        assert [ filepath for filepath, _ in failures ] == [again]
+        assert 'another match table' in failures[0][1]
+
+    def test_manifest_mismatches(self, tmpdir):
+        first = self._match_table(Path(tmpdir), '202101010000-MT2019_0-vs-HELIOS2019_1.match.csv')
+        second = self._match_table(Path(tmpdir), '202101010001-A_2-vs-B_0.match.csv')
+        matches, _ = metadata_batch([first, second])
+        failures = check_metadata_batch(matches, {
+            '202101010000': ManifestEntry(files_checksum([first]), STAGE_DONE),
+            '202101010001': ManifestEntry('other files', STAGE_DONE),
+            # Not in the batch
+            '202101010002': ManifestEntry('other files', STAGE_DONE)
+        })
+        assert list(matches) == ['202101010000']
+        assert [ filepath for filepath, _ in failures ] == [second]
+        assert failures[0][1].startswith('ValueError: ')
@@ -0,0 +1,53 @@
+import numpy as np
+import os
+from pathlib import Path
+import pytest
+
+from tasks.v1.types import *
+
+HERE = Path(os.path.dirname(os.path.realpath(__file__)))
+
+class TestNormalizationPlan:
+
+    TESTFILES_DIRPATH = HERE / 'data'
+    TABLETYPES = [ TableType.MATCH, TableType.PTYPES, TableType.DASH, TableType.TURN, TableType.KICK, TableType.TACKLE ]
+
+    def _values(self, plan: NormalizationPlan) -> np.ndarray:
+        """ Values around and beyond the range of every column, so that clipping is exercised. """
+        rng = np.random.default_rng(3)
+        return plan.offset + plan.scale * rng.uniform(-1.5, 1.5, size=(500, len(plan.columns)))
+
+    @pytest.mark.parametrize('tabletype', TABLETYPES)
+    def test_same_as_normalizers(self, tabletype):
+        plan = normalization_plan(tabletype)
+        values = self._values(plan)
+        expected = np.stack([
+            normalizer_from_columntype(column_type).normalize(values[:, index])
+            for index, column_type in enumerate(normalizable_columns(tabletype))
+        ], axis=1)
+        np.testing.assert_allclose(plan.apply(values.copy()), expected, rtol=1e-12, atol=1e-12)
+
+    def test_cached(self):
+        assert normalization_plan(TableType.MATCH) is normalization_plan(TableType.MATCH, NormalizationParams())
+        assert normalization_plan(TableType.SPARAMS) is None
+
+    def test_params_of_table(self):
+        params = NormalizationParams.of_table(TestNormalizationPlan.TESTFILES_DIRPATH / 'test.match.csv')
+        # The test match was played with the default params
+        assert params == NormalizationParams()
+        assert NormalizationParams.of_table(Path('/nonexistent/test.match.csv')) == NormalizationParams()
+
+    def test_params_change_plan(self):
+        params = NormalizationParams(ball_speed_max=2.0, stamina_max=6000.0)
+        plan = normalization_plan(TableType.MATCH, params)
+        assert plan is not normalization_plan(TableType.MATCH)
+        assert plan.scale[plan.columns.index(' b_vx')] == 2.0
+        assert plan.offset[plan.columns.index(' l1_stamina')] == 3000.0
+
+    def test_memory_mapped_block(self, tmpdir):
+        plan = normalization_plan(TableType.MATCH)
+        values = self._values(plan).astype(np.float32)
+        block = np.memmap(Path(tmpdir / 'block.f32'), dtype=np.float32, mode='w+', shape=values.shape)
+        block[:] = values
+        plan.apply(block)
+        np.testing.assert_allclose(block, plan.apply(values.astype(np.float64)), rtol=1e-6, atol=1e-6)
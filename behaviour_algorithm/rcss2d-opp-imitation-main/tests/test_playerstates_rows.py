@@ -0,0 +1,75 @@
+import os
+from pathlib import Path
+import pytest
+
+from tasks.v1.data.chunking import read_table
+from tasks.v1.data.rows import PLAYERSTATE_BLOCKS_COLUMNS, PLAYERSTATE_ORDER, PLAYERSTATES_MATCH_COLUMNS, array_literal, long_playerstates, playerstate_blocks_rows, playerstates_rows
+from tasks.v1.data.utils import MatchData
+
+HERE = Path(os.path.dirname(os.path.realpath(__file__)))
+
+class TestPlayerstatesRows:
+
+    TESTFILES_DIRPATH = HERE / 'data'
+    MATCH_DATA = MatchData.from_filepath(Path('202101010000-MT2019_0-vs-HELIOS2019_1.match.csv'))
+
+    def _match(self):
+        return read_table(TestPlayerstatesRows.TESTFILES_DIRPATH / 'test.match.csv', usecols=PLAYERSTATES_MATCH_COLUMNS)
+
+    def test_long_layout(self):
+        match = self._match()
+        players = long_playerstates(match)
+        assert players.shape == (len(match) * 22, 10)
+        # Row 1, player r3
+        position = PLAYERSTATE_ORDER.index(('r', 3))
+        assert players[22 + position].tolist() == [ match[column].tolist()[1] for column in PLAYERSTATES_MATCH_COLUMNS[position * 10:(position + 1) * 10] ]
+
+    def test_rows(self):
+        match = self._match()
+        matchstate_id_cache = list(range(1000, 1000 + len(match)))
+        playertype_id_cache = { typeid: 500 + typeid for typeid in range(18) }
+        rows = playerstates_rows(match.iloc[10:20], TestPlayerstatesRows.MATCH_DATA, 7, matchstate_id_cache, playertype_id_cache)
+        assert len(rows) == 10 * 22
+        # Row by row, as the loaders number player states
+        expected = []
+        for index in range(10, 20):
+            for side, unum in PLAYERSTATE_ORDER:
+                typeid, goalie, discarded, *features = (match[' %s%s_%s' % (side, unum, suffix)].tolist()[index] for suffix in ['t', 'goalie', 'discarded', 'x', 'y', 'vx', 'vy', 'body', 'stamina', 'stamina_cap'])
+                teamname = 'MT2019' if side == 'l' else 'HELIOS2019'
+                expected.append((7, matchstate_id_cache[index], playertype_id_cache[typeid], teamname, unum, str(goalie), str(discarded), *features))
+        assert rows == expected
+        assert [ type(value) for value in rows[0] ] == [ type(value) for value in expected[0] ]
+
+    def test_unknown_playertype(self):
+        match = self._match()
+        with pytest.raises(KeyError):
+            playerstates_rows(match, TestPlayerstatesRows.MATCH_DATA, 7, list(range(len(match))), { 0: 1 })
+
+    def test_empty(self):
+        match = self._match().iloc[:0]
+        assert playerstates_rows(match, TestPlayerstatesRows.MATCH_DATA, 7, [], { 0: 1 }) == []
+
+    def test_blocks(self):
+        match = self._match()
+        matchstate_id_cache = list(range(1000, 1000 + len(match)))
+        playertype_id_cache = { typeid: 500 + typeid for typeid in range(18) }
+        players = playerstates_rows(match.iloc[10:20], TestPlayerstatesRows.MATCH_DATA, 7, matchstate_id_cache, playertype_id_cache)
+        blocks = playerstate_blocks_rows(match.iloc[10:20], 7, matchstate_id_cache, playertype_id_cache)
+        assert len(blocks) == 10 and all(len(block) == len(PLAYERSTATE_BLOCKS_COLUMNS) for block in blocks)
+        # A block per match state holds its player states in PLAYERSTATE_ORDER, with the player type ids of the match
+        typeids = { playertype_id: typeid for typeid, playertype_id in playertype_id_cache.items() }
+        for block, index in zip(blocks, range(0, len(players), 22)):
+            states = players[index:index + 22]
+            assert block[:2] == (7, states[0][1])
+            assert block[2] == array_literal(typeids[state[2]] for state in states)
+            assert list(block[3:]) == [ array_literal(state[column] for state in states) for column in range(5, 14) ]
+
+    def test_blocks_unknown_playertype(self):
+        match = self._match()
+        with pytest.raises(KeyError):
+            playerstate_blocks_rows(match, 7, list(range(len(match))), { 0: 1 })
+
+    def test_array_literal(self):
+        assert array_literal([1, 2, 3]) == '{1,2,3}'
+        assert array_literal([True, False]) == '{True,False}'
+        assert array_literal([0.5, -1e-07]) == '{0.5,-1e-07}'
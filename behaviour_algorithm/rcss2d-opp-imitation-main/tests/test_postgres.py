@@ -0,0 +1,184 @@
+import asyncio
+import os
+from pathlib import Path
+import shutil
+from typing import Any, Dict, List, Optional, Sequence
+
+import pytest
+
+from tasks.v1.data.manifest import MANIFEST_TABLE, STAGE_DONE, LoadOperation, files_checksum
+from tasks.v1.data.postgres import copy_rows, reserve_ids
+from tasks.v1.data.preparation import PLAYERTYPES_UPDATING_COLUMNS, update_matches_playertypes_at_postgres
+
+HERE = Path(os.path.dirname(os.path.realpath(__file__)))
+
+def _literal(value: Any) -> str:
+    if value is None:
+        return 'NULL'
+    if isinstance(value, str):
+        return "'" + value.replace("'", "''") + "'"
+    return str(value)
+
+
+class FakeCursor:
+    """ Records the statements and COPY buffers it's given, escapes parameters like mogrify and answers with canned rows. """
+
+    def __init__(self, connection: 'FakeConnection') -> None:
+        self.connection = connection
+        self.rows: List[tuple] = []
+
+    def mogrify(self, query: str, params: Sequence[Any]=()) -> bytes:
+        return (query % tuple(_literal(value) for value in params)).encode('utf8')
+
+    def execute(self, query: str, params: Optional[tuple]=None) -> None:
+        self.connection.statements.append((query, params))
+        if self.connection.failing is not None and query.startswith(self.connection.failing):
+            raise RuntimeError('failing statement')
+        self.rows = []
+        for prefix, rows in self.connection.answers.items():
+            if query.startswith(prefix):
+                self.rows = rows
+
+    def copy_expert(self, query: str, buffer) -> None:
+        self.connection.copies.append((query, buffer.read()))
+
+    def fetchall(self) -> List[tuple]:
+        return list(self.rows)
+
+    def fetchone(self) -> tuple:
+        return self.rows[0]
+
+    def close(self) -> None:
+        pass
+
+
+class FakeConnection:
+
+    def __init__(self, answers: Optional[Dict[str, List[tuple]]]=None, failing: Optional[str]=None) -> None:
+        self.answers = answers if answers is not None else {}
+        self.failing = failing
+        self.statements: List[tuple] = []
+        self.copies: List[tuple] = []
+        self.committed = False
+        self.rolled_back = False
+
+    def cursor(self) -> FakeCursor:
+        return FakeCursor(self)
+
+    def commit(self) -> None:
+        self.committed = True
+
+    def rollback(self) -> None:
+        self.rolled_back = True
+
+
+class TestCopyRows:
+
+    def test_csv_text(self):
+        connection = FakeConnection()
+        rows = [
+            (1, 'l', 0.5, None, float('nan')),
+            (2, 'say "hi", all\nof you', -1e-07, True, 3)
+        ]
+        assert copy_rows(connection.cursor(), 'v1', 'things', ['id', 'side', 'x', 'flag', 'y'], rows) == 2
+        assert connection.copies == [(
+            "COPY v1.things (id,side,x,flag,y) FROM STDIN WITH (FORMAT csv)",
+            # None is an unquoted empty field (NULL), NaN is read as such by the float and numeric columns
+            '1,l,0.5,,nan\n' +
+            '2,"say ""hi"", all\nof you",-1e-07,True,3\n'
+        )]
+
+    def test_empty_string_is_null(self):
+        connection = FakeConnection()
+        copy_rows(connection.cursor(), 'v1', 'things', ['a', 'b'], [('', None)])
+        assert connection.copies[0][1] == ',\n'
+
+    def test_nothing(self):
+        connection = FakeConnection()
+        assert copy_rows(connection.cursor(), 'v1', 'things', ['a'], []) == 0
+        assert connection.copies == []
+
+
+class TestReserveIds:
+
+    LOCK = "hashtext('v1.reserve_ids')"
+
+    def test_statement(self):
+        connection = FakeConnection({ 'SELECT blocks.*': [(101, 1, None)] })
+        firsts = reserve_ids(connection.cursor(), 'v1', { ('matchstates', 'matchstate_id'): 20, ('playerstates', 'playerstate_id'): 0 })
+        assert firsts == { ('matchstates', 'matchstate_id'): 101, ('playerstates', 'playerstate_id'): 1 }
+        matchstates = "pg_get_serial_sequence('v1.matchstates', 'matchstate_id')"
+        playerstates = "pg_get_serial_sequence('v1.playerstates', 'playerstate_id')"
+        # An empty block still takes one id, the sequence can't go back below its start
+        assert connection.statements == [(
+            f"SELECT blocks.*, pg_advisory_unlock({TestReserveIds.LOCK}) FROM (" +
+            f"SELECT setval({matchstates}, nextval({matchstates}) + 19) - 19, setval({playerstates}, nextval({playerstates}) + 0) - 0 " +
+            f"FROM (SELECT pg_advisory_lock({TestReserveIds.LOCK}) OFFSET 0) AS locked OFFSET 0) AS blocks;",
+            None
+        )]
+
+    def test_nothing(self):
+        connection = FakeConnection()
+        assert reserve_ids(connection.cursor(), 'v1', {}) == {}
+        assert connection.statements == []
+
+
+class TestUpdatePlayertypes:
+
+    TESTFILES_DIRPATH = HERE / 'data'
+    SKIPPED = '202101010000'
+    MISSING = '202101010001'
+    UPDATED = '202101010002'
+
+    def _playertypes(self, dirpath: Path, timestamp: str) -> Path:
+        filepath = dirpath / f'{timestamp}-MT2019_0-vs-HELIOS2019_1.playertypes.csv'
+        shutil.copy(TestUpdatePlayertypes.TESTFILES_DIRPATH / 'test.playertypes.csv', filepath)
+        return filepath
+
+    def _filepaths(self, dirpath: Path) -> Dict[str, Path]:
+        return { timestamp: self._playertypes(dirpath, timestamp) for timestamp in (TestUpdatePlayertypes.SKIPPED, TestUpdatePlayertypes.MISSING, TestUpdatePlayertypes.UPDATED) }
+
+    def test_staging(self, tmpdir):
+        filepaths = self._filepaths(Path(tmpdir))
+        unreadable = Path(tmpdir) / '202101010003-MT2019_0-vs-HELIOS2019_1.playertypes.csv'
+        checksum = files_checksum([filepaths[TestUpdatePlayertypes.SKIPPED]])
+        connection = FakeConnection({
+            f"SELECT match_timestamp, checksum, stage FROM {MANIFEST_TABLE}": [(TestUpdatePlayertypes.SKIPPED, checksum, STAGE_DONE)],
+            "SELECT DISTINCT staging.match_timestamp": [(TestUpdatePlayertypes.MISSING,)]
+        })
+        failures = asyncio.run(update_matches_playertypes_at_postgres([ *filepaths.values(), unreadable ], connection, 'v1'))
+        assert [ filepath for filepath, _ in failures ] == [ unreadable, filepaths[TestUpdatePlayertypes.MISSING] ]
+        assert failures[1][1] == f"Match {TestUpdatePlayertypes.MISSING} is not in public.matches"
+        assert connection.committed and not connection.rolled_back
+
+        queries = [ query for query, _ in connection.statements ]
+        assert queries[0].startswith(f"SELECT match_timestamp, checksum, stage FROM {MANIFEST_TABLE}")
+        assert sorted(connection.statements[0][1][2]) == [ TestUpdatePlayertypes.SKIPPED, TestUpdatePlayertypes.MISSING, TestUpdatePlayertypes.UPDATED ]
+        assert queries[1] == (
+            "CREATE TEMPORARY TABLE playertypes_staging (match_timestamp varchar(64) NOT NULL, checksum char(64) NOT NULL, id int NOT NULL, " +
+            ",".join(f"{column} numeric NOT NULL" for column in PLAYERTYPES_UPDATING_COLUMNS[2:]) + ") ON COMMIT DROP;"
+        )
+        assert queries[2].startswith("SELECT DISTINCT staging.match_timestamp")
+        assert queries[3] == (
+            "UPDATE \"v1\".playertypes AS current SET " +
+            ",".join(f"{column} = staging.{column}" for column in PLAYERTYPES_UPDATING_COLUMNS[2:]) +
+            " FROM pg_temp.playertypes_staging AS staging JOIN public.matches AS matches ON matches.match_timestamp = staging.match_timestamp" +
+            " WHERE current.match_id_fk = matches.match_id AND current.id = staging.id;"
+        )
+        assert queries[4].startswith(f"INSERT INTO {MANIFEST_TABLE}")
+        assert connection.statements[4][1] == (str(LoadOperation.PLAYERTYPES), 'v1', STAGE_DONE)
+        assert len(queries) == 5
+
+        # A single COPY of the matches not updated yet, the one missing from public.matches included
+        ((query, text),) = connection.copies
+        assert query == f"COPY pg_temp.playertypes_staging (match_timestamp,checksum,{','.join(PLAYERTYPES_UPDATING_COLUMNS[1:])}) FROM STDIN WITH (FORMAT csv)"
+        lines = text.splitlines()
+        assert len(lines) == 2 * 18
+        assert { line.split(',')[0] for line in lines } == { TestUpdatePlayertypes.MISSING, TestUpdatePlayertypes.UPDATED }
+        assert lines[0] == f'{TestUpdatePlayertypes.MISSING},{files_checksum([filepaths[TestUpdatePlayertypes.MISSING]])},0,0.4,5.0,0.006,0.7,0.1,50.0,0.6,1.0'
+
+    def test_rollback(self, tmpdir):
+        connection = FakeConnection(failing='UPDATE')
+        with pytest.raises(RuntimeError):
+            asyncio.run(update_matches_playertypes_at_postgres(list(self._filepaths(Path(tmpdir)).values()), connection, 'v1'))
+        assert connection.rolled_back and not connection.committed
@@ -0,0 +1,50 @@
+import os
+from pathlib import Path
+import pytest
+
+from tasks.v1.data import extract_raw_features, normalize_raw_features, prepare_raw_features
+
+HERE = Path(os.path.dirname(os.path.realpath(__file__)))
+
+class TestPrepareRawFeatures:
+
+    TESTFILES_DIRPATH = HERE / 'data'
+    INPUTNAME_TEMPLATE = 'test.%s.csv'
+    TABLETYPES = ['match', 'playertypes', 'dash', 'turn', 'kick', 'tackle']
+
+    async def _two_pass(self, tmpdir, inputfilepath: Path) -> None:
+        for outdirname in ('extracted', 'normalized'):
+            os.makedirs(tmpdir / outdirname)
+        await extract_raw_features(inputfilepath, False, Path(tmpdir / 'extracted'))
+        await normalize_raw_features(Path(tmpdir / 'extracted' / inputfilepath.name), False, Path(tmpdir / 'normalized'))
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize('tabletype', TABLETYPES)
+    async def test_same_as_extract_and_normalize(self, tmpdir, tabletype):
+        inputfilepath = TestPrepareRawFeatures.TESTFILES_DIRPATH / (TestPrepareRawFeatures.INPUTNAME_TEMPLATE % tabletype)
+        await self._two_pass(tmpdir, inputfilepath)
+        for outdirname in ('prepared', 'raw'):
+            os.makedirs(tmpdir / outdirname)
+        await prepare_raw_features(inputfilepath, False, Path(tmpdir / 'prepared'), raw_output_dir=Path(tmpdir / 'raw'))
+        assert (tmpdir / 'prepared' / inputfilepath.name).read_text('utf8') == (tmpdir / 'normalized' / inputfilepath.name).read_text('utf8')
+        assert (tmpdir / 'raw' / inputfilepath.name).read_text('utf8') == (tmpdir / 'extracted' / inputfilepath.name).read_text('utf8')
+
+    @pytest.mark.asyncio
+    async def test_chunked_same_output(self, tmpdir):
+        inputfilepath = TestPrepareRawFeatures.TESTFILES_DIRPATH / (TestPrepareRawFeatures.INPUTNAME_TEMPLATE % 'match')
+        await self._two_pass(tmpdir, inputfilepath)
+        os.makedirs(tmpdir / 'prepared')
+        await prepare_raw_features(inputfilepath, False, Path(tmpdir / 'prepared'), memory_budget=2**20)
+        assert (tmpdir / 'prepared' / inputfilepath.name).read_text('utf8') == (tmpdir / 'normalized' / inputfilepath.name).read_text('utf8')
+
+    @pytest.mark.asyncio
+    async def test_raw_output_is_optional(self, tmpdir):
+        inputfilepath = TestPrepareRawFeatures.TESTFILES_DIRPATH / (TestPrepareRawFeatures.INPUTNAME_TEMPLATE % 'dash')
+        await prepare_raw_features(inputfilepath, False, Path(tmpdir))
+        assert os.listdir(tmpdir) == [inputfilepath.name]
+
+    @pytest.mark.asyncio
+    async def test_tables_of_no_interest_are_skipped(self, tmpdir):
+        inputfilepath = TestPrepareRawFeatures.TESTFILES_DIRPATH / (TestPrepareRawFeatures.INPUTNAME_TEMPLATE % 'serverparams')
+        await prepare_raw_features(inputfilepath, False, Path(tmpdir))
+        assert os.listdir(tmpdir) == []
@@ -0,0 +1,111 @@
+import asyncio
+import json
+import os
+from pathlib import Path
+import threading
+
+from tasks import profiling
+from tasks.profiling import format_summary, in_thread, profiled, span, summary
+from tasks.v1.data import extract_raw_features
+from tasks.v1.data.jobs import run_jobs
+
+HERE = Path(os.path.dirname(os.path.realpath(__file__)))
+
+class TestProfiling:
+
+    TESTFILES_DIRPATH = HERE / 'data'
+
+    def setup_method(self):
+        profiling.enable()
+
+    def teardown_method(self):
+        profiling.disable()
+
+    def test_nested_spans(self):
+        with span('load', match='1') as load:
+            with span('read', rows=10, bytes=100):
+                pass
+            with span('read') as read:
+                read.add(rows=5, bytes=50)
+        records = { record.name: record for record in profiling.records() if record.name == 'load' }
+        reads = [ record for record in profiling.records() if record.name == 'read' ]
+        assert [ read.parent_id for read in reads ] == [load.span_id, load.span_id]
+        assert [ (read.rows, read.bytes) for read in reads ] == [(10, 100), (5, 50)]
+        assert records['load'].parent_id is None
+        assert records['load'].attributes == { 'match': '1' }
+
+    def test_failed_span_is_recorded(self):
+        try:
+            with span('load'):
+                raise ValueError()
+        except ValueError:
+            pass
+        (record,) = profiling.records()
+        assert record.attributes['error'] == 'ValueError'
+
+    def test_disabled_records_nothing(self):
+        profiling.disable()
+        with span('load') as load:
+            pass
+        assert profiling.records() == []
+        assert load.wall > 0
+
+    def test_coroutine_decorator(self):
+        @profiled()
+        async def load():
+            with span('read'):
+                await asyncio.sleep(0.01)
+        asyncio.run(load())
+        (read, load) = profiling.records()
+        assert load.name == 'load' and load.wall >= 0.01
+        assert read.parent_id == load.span_id
+        # Sleeping takes no CPU
+        assert load.cpu < load.wall
+
+    def test_threads(self):
+        def read():
+            with span('read'):
+                pass
+        with span('load') as load:
+            threads = [ threading.Thread(target=in_thread(read)) for _ in range(4) ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        reads = [ record for record in profiling.records() if record.name == 'read' ]
+        assert len(reads) == 4
+        assert all(read.parent_id == load.span_id for read in reads)
+        assert len({ read.tid for read in reads }) > 1
+
+    def test_processes(self, tmpdir):
+        inputpaths = [ TestProfiling.TESTFILES_DIRPATH / f'test.{tabletype}.csv' for tabletype in ('match', 'dash', 'kick') ]
+        with span('run') as run:
+            assert run_jobs(extract_raw_features, inputpaths, jobs=2, compress=False, output_dir=Path(tmpdir)) == []
+        records = profiling.records()
+        jobs = [ record for record in records if record.name == 'extract_raw_features' ]
+        assert len(jobs) == 3
+        assert all(job.parent_id == run.span_id and job.pid != os.getpid() for job in jobs)
+        writes = [ record for record in records if record.name == 'write' ]
+        assert sum(write.rows for write in writes) == sum(len(path.read_text().splitlines()) - 1 for path in inputpaths)
+        assert { write.parent_id for write in writes } <= { job.span_id for job in jobs }
+
+    def test_summary(self):
+        for _ in range(3):
+            with span('load'):
+                with span('read', rows=10):
+                    pass
+        assert [ (row.path, row.calls, row.rows) for row in summary() ] == [(('load',), 3, 0), (('load', 'read'), 3, 30)]
+        assert len(format_summary().splitlines()) == 3
+
+    def test_exports(self, tmpdir):
+        with span('load'):
+            with span('read', rows=10, table='test.match.csv'):
+                pass
+        spanspath, tracepath = profiling.save(Path(tmpdir / 'profile'))
+        spans = json.loads(spanspath.read_text())['spans']
+        assert [ record['name'] for record in spans ] == ['read', 'load']
+        events = json.loads(tracepath.read_text())['traceEvents']
+        assert [ event['ph'] for event in events ] == ['X', 'X']
+        assert events[0]['args']['rows'] == 10 and events[0]['args']['table'] == 'test.match.csv'
+        # The parent covers its child
+        assert events[1]['ts'] <= events[0]['ts'] and events[0]['ts'] + events[0]['dur'] <= events[1]['ts'] + events[1]['dur']
@@ -0,0 +1,75 @@
+import os
+import pandas as pd
+from pathlib import Path
+import pytest
+import shutil
+
+from tasks.v1.data import extract_raw_features, normalize_raw_features
+from tasks.v1.data.cache import build_cache, cache_path, fresh_cache_path
+from tasks.v1.data.chunking import read_table, read_table_chunks
+from tasks.v1.data.schema import file_dtypes
+
+pytest.importorskip('pyarrow')
+
+HERE = Path(os.path.dirname(os.path.realpath(__file__)))
+
+class TestTableCache:
+
+    TESTFILES_DIRPATH = HERE / 'data'
+    INPUTNAME_TEMPLATE = 'test.%s.csv'
+    TABLETYPES = ['match', 'playertypes', 'dash', 'turn', 'kick', 'tackle']
+
+    def _cached_copy(self, tmpdir, tabletype: str, compressed: bool=False) -> Path:
+        inputfilename = TestTableCache.INPUTNAME_TEMPLATE % tabletype + ('.gz' if compressed else '')
+        filepath = Path(tmpdir) / inputfilename
+        shutil.copy(TestTableCache.TESTFILES_DIRPATH / inputfilename, filepath)
+        assert build_cache([filepath]) == 1
+        return filepath
+
+    @pytest.mark.parametrize('tabletype', TABLETYPES)
+    def test_same_table(self, tmpdir, tabletype):
+        filepath = self._cached_copy(tmpdir, tabletype)
+        assert fresh_cache_path(filepath) == cache_path(filepath)
+        pd.testing.assert_frame_equal(read_table(filepath), pd.read_csv(filepath, dtype=file_dtypes(filepath)))
+
+    def test_compressed_table(self, tmpdir):
+        filepath = self._cached_copy(tmpdir, 'match', compressed=True)
+        assert cache_path(filepath).name == 'test.match.parquet'
+        pd.testing.assert_frame_equal(read_table(filepath), pd.read_csv(filepath, dtype=file_dtypes(filepath)))
+
+    def test_selected_columns_keep_table_order(self, tmpdir):
+        filepath = self._cached_copy(tmpdir, 'match')
+        usecols = [' b_y', ' cycle', ' l1_x']
+        pd.testing.assert_frame_equal(read_table(filepath, usecols=usecols), pd.read_csv(filepath, usecols=usecols, dtype=file_dtypes(filepath, usecols)))
+
+    def test_chunks(self, tmpdir):
+        filepath = self._cached_copy(tmpdir, 'match')
+        chunks = list(read_table_chunks(filepath, 2**20))
+        assert len(chunks) > 1
+        pd.testing.assert_frame_equal(pd.concat(chunks), pd.read_csv(filepath, dtype=file_dtypes(filepath)))
+
+    def test_fresh_entries_are_kept(self, tmpdir):
+        filepath = self._cached_copy(tmpdir, 'dash')
+        assert build_cache([filepath]) == 0
+
+    def test_changed_source_is_not_read_from_cache(self, tmpdir):
+        filepath = self._cached_copy(tmpdir, 'dash')
+        df = pd.read_csv(filepath)
+        df.head(10).to_csv(filepath, index=False)
+        assert fresh_cache_path(filepath) is None
+        assert len(read_table(filepath)) == 10
+        assert build_cache([filepath]) == 1
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize('tabletype', ['match', 'playertypes'])
+    async def test_same_outputs(self, tmpdir, tabletype):
+        filepath = self._cached_copy(tmpdir, tabletype)
+        for outdirname in ('extracted', 'normalized'):
+            os.makedirs(tmpdir / outdirname)
+        await extract_raw_features(filepath, False, Path(tmpdir / 'extracted'))
+        await normalize_raw_features(filepath, False, Path(tmpdir / 'normalized'))
+        for outdirname, job in (('extracted', extract_raw_features), ('normalized', normalize_raw_features)):
+            os.makedirs(tmpdir / 'from_csv')
+            await job(TestTableCache.TESTFILES_DIRPATH / filepath.name, False, Path(tmpdir / 'from_csv'))
+            assert (tmpdir / outdirname / filepath.name).read_text('utf8') == (tmpdir / 'from_csv' / filepath.name).read_text('utf8')
+            shutil.rmtree(tmpdir / 'from_csv')
@@ -0,0 +1,45 @@
+import os
+import pandas as pd
+from pathlib import Path
+import pytest
+
+from tasks.v1.data.chunking import read_table
+from tasks.v1.data.manifest import LoadOperation
+from tasks.v1.data.schema import file_dtypes, load_usecols
+from tasks.v1.types import TableType
+
+HERE = Path(os.path.dirname(os.path.realpath(__file__)))
+
+class TestTableSchema:
+
+    TESTFILES_DIRPATH = HERE / 'data'
+    INPUTNAME_TEMPLATE = 'test.%s.csv'
+    TABLETYPES = ['match', 'playertypes', 'dash', 'turn', 'kick', 'tackle']
+
+    @pytest.mark.parametrize('tabletype', TABLETYPES)
+    def test_same_values(self, tabletype):
+        filepath = TestTableSchema.TESTFILES_DIRPATH / (TestTableSchema.INPUTNAME_TEMPLATE % tabletype)
+        inferred = pd.read_csv(filepath)
+        typed = read_table(filepath)
+        assert set(file_dtypes(filepath)).issubset(inferred.columns)
+        pd.testing.assert_frame_equal(typed.astype(inferred.dtypes.to_dict()), inferred)
+
+    def test_match_columns_are_registered(self):
+        filepath = TestTableSchema.TESTFILES_DIRPATH / (TestTableSchema.INPUTNAME_TEMPLATE % 'match')
+        dtypes = file_dtypes(filepath)
+        typed = read_table(filepath)
+        # Whatever is not registered is a real-valued column, even if some of them only hold round values
+        assert all(typed[column].dtype.kind in 'if' for column in typed.columns if column not in dtypes)
+        assert typed[' playmode'].dtype == 'category' and typed[' l1_t'].dtype == 'Int8'
+
+    @pytest.mark.parametrize('tabletype', TABLETYPES)
+    def test_load_columns_exist(self, tabletype):
+        filepath = TestTableSchema.TESTFILES_DIRPATH / (TestTableSchema.INPUTNAME_TEMPLATE % tabletype)
+        usecols = load_usecols(LoadOperation.CONTENTS, TableType.from_filepath(filepath))
+        assert set(usecols).issubset(pd.read_csv(filepath, nrows=0).columns)
+
+    def test_contents_load_memory(self):
+        filepath = TestTableSchema.TESTFILES_DIRPATH / (TestTableSchema.INPUTNAME_TEMPLATE % 'match')
+        inferred = pd.read_csv(filepath).memory_usage(deep=True).sum()
+        typed = read_table(filepath, usecols=load_usecols(LoadOperation.CONTENTS, TableType.MATCH)).memory_usage(deep=True).sum()
+        assert inferred / typed > 4
@@ -0,0 +1,113 @@
+import os
+from pathlib import Path
+import shutil
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import tasks.v1.data.training as training_module
+from tasks.v1.data.shards import LABEL_VALUES, open_shard, read_shard_manifests
+from tasks.v1.data.training import TRAINING_SET_COLUMNS, read_training_tables, training_frame, write_training_set
+from tasks.v1.experiments.columns import ALL_FEATURE_COLUMNS, HETEROPARAM_FEATURES, REGRESSION_OUTPUT_COLUMNS
+from tasks.v1.types import TableType
+
+HERE = Path(os.path.dirname(os.path.realpath(__file__)))
+
+class TestTrainingSet:
+
+    TESTFILES_DIRPATH = HERE / 'data'
+    FILESTEM = '202101010000-MT2019_0-vs-HELIOS2019_1'
+
+    def _match_group(self, dirpath: Path, filestem: str=FILESTEM):
+        """ The example match group. Its command tables go further than its match table, so they're cut to its cycles. """
+        os.makedirs(dirpath, exist_ok=True)
+        match = pd.read_csv(TestTrainingSet.TESTFILES_DIRPATH / 'test.match.csv')
+        for tabletype in ['match', 'playertypes']:
+            shutil.copy(TestTrainingSet.TESTFILES_DIRPATH / f'test.{tabletype}.csv', dirpath / f'{filestem}.{tabletype}.csv')
+        for tabletype in ['dash', 'turn', 'kick', 'tackle']:
+            commands = pd.read_csv(TestTrainingSet.TESTFILES_DIRPATH / f'test.{tabletype}.csv')
+            commands = commands[commands['running_time'].between(1, match[' cycle'].max())]
+            commands.to_csv(dirpath / f'{filestem}.{tabletype}.csv', index=False)
+        return sorted(dirpath.glob(f'{filestem}.*.csv'))
+
+    def test_rows(self, tmpdir):
+        match_filepaths = self._match_group(Path(tmpdir))
+        training = training_frame(*read_training_tables(match_filepaths))
+        assert list(training.columns) == TRAINING_SET_COLUMNS
+        assert len(training) > 0
+        match = pd.read_csv(TestTrainingSet.TESTFILES_DIRPATH / 'test.match.csv')
+        playertypes = pd.read_csv(TestTrainingSet.TESTFILES_DIRPATH / 'test.playertypes.csv').set_index('id')
+        dash = pd.read_csv(match_filepaths[0].with_name(f'{TestTrainingSet.FILESTEM}.dash.csv'))
+        for _, row in training[training['playercommand_type'] == 'dash'].iterrows():
+            # The state the command was issued at, with the issuer as self
+            state = match[(match[' b_x'] == row['ball_x']) & (match[' r1_x'] == row['r1_x']) & (match[' l5_body'] == row['l5_body'])]
+            assert len(state) == 1
+            state = state.iloc[0]
+            assert state[' playmode'] == 'play_on'
+            unums = [ unum for unum in range(2, 12) if state[f' r{unum}_x'] == row['self_x'] and state[f' r{unum}_vy'] == row['self_vy'] ]
+            assert len(unums) > 0
+            unum = unums[0]
+            assert row['self_player_decay'] == playertypes.loc[state[f' r{unum}_t'], 'player_decay']
+            assert [ row[f'r{unum}_{feature}'] for feature in HETEROPARAM_FEATURES ] == [ row[f'self_{feature}'] for feature in HETEROPARAM_FEATURES ]
+            issued = dash[(dash['running_time'] == state[' cycle']) & (dash['teamname'] == 'HELIOS2019') & (dash['unum'] == unum)]
+            assert row['dash_power'] in issued['dash_power'].tolist()
+            assert np.isnan(row['kick_power']) and np.isnan(row['turn_moment'])
+
+    def test_team_and_goalkeeper(self, tmpdir):
+        tables, match_data = read_training_tables(self._match_group(Path(tmpdir)))
+        helios = training_frame(tables, match_data)
+        mt = training_frame(tables, match_data, teamname='MT2019')
+        mt_goalkeeper = training_frame(tables, match_data, teamname='MT2019', goalkeeper=True)
+        # MT2019 plays on the left side
+        assert not (mt['self_x'].values[:, np.newaxis] == mt[[ f'r{unum}_x' for unum in range(1, 12) ]].values).all(axis=1).any()
+        assert len(mt_goalkeeper) > len(mt)
+        assert len(training_frame(tables, match_data, teamname='Nobody')) == 0
+        assert len(helios) > 0
+
+    def test_unknown_player_type(self, tmpdir):
+        tables, match_data = read_training_tables(self._match_group(Path(tmpdir)))
+        tables[TableType.PTYPES] = tables[TableType.PTYPES].iloc[1:]
+        with pytest.raises(KeyError):
+            training_frame(tables, match_data)
+
+    def test_write_csv_and_shards(self, tmpdir):
+        match_filepaths = self._match_group(Path(tmpdir) / 'dataset')
+        other_filepaths = self._match_group(Path(tmpdir) / 'dataset', '202101010001-MT2019_0-vs-HELIOS2019_1')
+        incomplete_filepaths = [ filepath for filepath in self._match_group(Path(tmpdir) / 'incomplete') if not filepath.name.endswith('.kick.csv') ]
+        expected = training_frame(*read_training_tables(match_filepaths))
+        groups = [ match_filepaths, incomplete_filepaths, other_filepaths ]
+
+        rows, failures = write_training_set(groups, Path(tmpdir) / 'training.csv.gz')
+        assert rows == 2 * len(expected)
+        assert [ group for group, _ in failures ] == [ incomplete_filepaths ]
+        written = pd.read_csv(Path(tmpdir) / 'training.csv.gz')
+        assert list(written.columns) == TRAINING_SET_COLUMNS
+        pd.testing.assert_frame_equal(written.iloc[:len(expected)], expected, check_dtype=False)
+
+        os.makedirs(Path(tmpdir) / 'shards')
+        rows, failures = write_training_set(groups, Path(tmpdir) / 'shards', rows_per_shard=len(expected) // 2 + 1, shuffle_seed=7)
+        assert rows == 2 * len(expected) and len(failures) == 1
+        manifests = read_shard_manifests(Path(tmpdir) / 'shards')
+        assert len(manifests) == 4
+        features, labels, regression = [ np.concatenate(arrays) for arrays in zip(*(open_shard(Path(tmpdir) / 'shards', manifest) for manifest in manifests)) ]
+        # Shuffled inside each match
+        first = np.lexsort(features[:len(expected)].T)
+        ordered = np.lexsort(expected[ALL_FEATURE_COLUMNS].to_numpy(dtype=np.float32).T)
+        assert np.array_equal(features[first], expected[ALL_FEATURE_COLUMNS].to_numpy(dtype=np.float32)[ordered])
+        assert [ LABEL_VALUES[label] for label in labels[first] ] == expected['playercommand_type'].to_numpy()[ordered].tolist()
+        assert np.array_equal(regression[first], expected[REGRESSION_OUTPUT_COLUMNS].fillna(0.0).to_numpy(dtype=np.float32)[ordered])
+
+    def test_interrupted_shards(self, tmpdir, monkeypatch):
+        """ Shards already sealed are removed along with the unsealed one: they would pass for a whole training set. """
+        match_filepaths = self._match_group(Path(tmpdir) / 'dataset')
+        other_filepaths = self._match_group(Path(tmpdir) / 'dataset', '202101010001-MT2019_0-vs-HELIOS2019_1')
+        training_parts = training_module._training_parts
+        def interrupted_parts(*args, **kwargs):
+            yield next(training_parts(*args, **kwargs))
+            raise KeyboardInterrupt()
+        monkeypatch.setattr(training_module, '_training_parts', interrupted_parts)
+        os.makedirs(Path(tmpdir) / 'shards')
+        with pytest.raises(KeyboardInterrupt):
+            write_training_set([ match_filepaths, other_filepaths ], Path(tmpdir) / 'shards', rows_per_shard=100)
+        assert list((Path(tmpdir) / 'shards').iterdir()) == []
@@ -0,0 +1,88 @@
+import json
+import numpy as np
+import pandas as pd
+from pathlib import Path
+import pytest
+
+from tasks.v1.data.shards import LABEL_VALUES, open_shard, read_shard_manifests, write_training_shards
+from tasks.v1.experiments.columns import ALL_FEATURE_COLUMNS, OUTPUT_COLUMNS, REGRESSION_OUTPUT_COLUMNS
+
+class TestTrainingShards:
+
+    ROWS = 1000
+
+    def _dataset(self, tmpdir) -> Path:
+        """ A training CSV like the output of db/gen_dataset_indarch.sql, with missing values and an unknown command. """
+        rng = np.random.default_rng(7)
+        df = pd.DataFrame(rng.uniform(-1, 1, size=(TestTrainingShards.ROWS, len(ALL_FEATURE_COLUMNS))), columns=ALL_FEATURE_COLUMNS)
+        df.iloc[::7, 3] = np.nan
+        df['playercommand_type'] = rng.choice(['dash', 'turn', 'kick', 'tackle', 'catch'], size=TestTrainingShards.ROWS)
+        df.loc[::11, 'playercommand_type'] = np.nan
+        for column in REGRESSION_OUTPUT_COLUMNS:
+            df[column] = rng.uniform(-1, 1, size=TestTrainingShards.ROWS)
+        df.loc[::5, 'kick_power'] = np.nan
+        csvpath = Path(tmpdir / 'training.csv')
+        df.to_csv(csvpath, index=False)
+        return csvpath
+
+    def _read_back(self, dirpath: Path):
+        arrays = [ open_shard(dirpath, manifest) for manifest in read_shard_manifests(dirpath) ]
+        return tuple(np.concatenate([ shard[index] for shard in arrays ]) for index in range(3))
+
+    def test_same_values(self, tmpdir):
+        csvpath = self._dataset(tmpdir)
+        write_training_shards(csvpath, Path(tmpdir), rows_per_shard=300, chunk_rows=128)
+        features, labels, regression = self._read_back(Path(tmpdir))
+        df = pd.read_csv(csvpath)
+        assert features.dtype == np.float32 and labels.dtype == np.int8 and regression.dtype == np.float32
+        np.testing.assert_array_equal(features, df[ALL_FEATURE_COLUMNS].to_numpy(dtype=np.float32))
+        expected_labels = df['playercommand_type'].where(df['playercommand_type'].isin(LABEL_VALUES), 'nop')
+        assert [ LABEL_VALUES[label] for label in labels ] == expected_labels.tolist()
+        np.testing.assert_array_equal(regression, df[REGRESSION_OUTPUT_COLUMNS].fillna(0.0).to_numpy(dtype=np.float32))
+
+    def test_shard_sizes(self, tmpdir):
+        write_training_shards(self._dataset(tmpdir), Path(tmpdir), rows_per_shard=300, chunk_rows=128)
+        assert [ manifest.rows for manifest in read_shard_manifests(Path(tmpdir)) ] == [300, 300, 300, 100]
+
+    def test_shuffled_rows(self, tmpdir):
+        csvpath = self._dataset(tmpdir)
+        for dirname, seed in (('ordered', None), ('shuffled', 11)):
+            (Path(tmpdir) / dirname).mkdir()
+            write_training_shards(csvpath, Path(tmpdir) / dirname, chunk_rows=128, shuffle_seed=seed)
+        ordered, _, _ = self._read_back(Path(tmpdir) / 'ordered')
+        shuffled, _, _ = self._read_back(Path(tmpdir) / 'shuffled')
+        assert not np.array_equal(ordered, shuffled)
+        # Rows only move within their chunk
+        np.testing.assert_array_equal(np.sort(ordered[:128, 0]), np.sort(shuffled[:128, 0]))
+
+    def test_stale_manifest(self, tmpdir):
+        write_training_shards(self._dataset(tmpdir), Path(tmpdir))
+        manifestpath = Path(tmpdir) / 'shard-00000.json'
+        manifest = json.loads(manifestpath.read_text())
+        manifest['feature_columns'] = manifest['feature_columns'][::-1]
+        manifestpath.write_text(json.dumps(manifest))
+        with pytest.raises(ValueError):
+            read_shard_manifests(Path(tmpdir))
+
+    def test_dataset(self, tmpdir):
+        pytest.importorskip('tensorflow')
+        from tasks.v1.experiments.v1_0_x import make_dataset
+        csvpath = self._dataset(tmpdir)
+        (Path(tmpdir) / 'shards').mkdir()
+        write_training_shards(csvpath, Path(tmpdir) / 'shards', rows_per_shard=300)
+        batch = next(iter(make_dataset(Path(tmpdir) / 'shards', 64, {}, shuffle=False, select_columns=['ball_x', *OUTPUT_COLUMNS])))
+        df = pd.read_csv(csvpath).head(64)
+        np.testing.assert_array_equal(batch['ball_x'].numpy(), df['ball_x'].to_numpy(dtype=np.float32))
+        assert batch['playercommand_type'].shape == (64,)
+
+    def test_dataset_seed(self, tmpdir):
+        """ Shuffled shards follow the seed given to make_dataset: a session can be repeated. """
+        pytest.importorskip('tensorflow')
+        from tasks.v1.experiments.v1_0_x import make_dataset
+        (Path(tmpdir) / 'shards').mkdir()
+        write_training_shards(self._dataset(tmpdir), Path(tmpdir) / 'shards', rows_per_shard=300)
+        def first_batches(seed: int):
+            dataset = make_dataset(Path(tmpdir) / 'shards', 64, {}, shuffle=True, select_columns=['ball_x'], seed=seed)
+            return np.concatenate([ batch['ball_x'].numpy() for batch in dataset.take(4) ])
+        np.testing.assert_array_equal(first_batches(3), first_batches(3))
+        assert not np.array_equal(first_batches(3), first_batches(4))
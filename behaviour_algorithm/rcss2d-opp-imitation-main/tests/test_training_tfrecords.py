@@ -0,0 +1,42 @@
+import numpy as np
+import pandas as pd
+from pathlib import Path
+import pytest
+
+pytest.importorskip('tensorflow')
+
+from tasks.v1.data.shards import LABEL_VALUES
+from tasks.v1.experiments.columns import ALL_FEATURE_COLUMNS, REGRESSION_OUTPUT_COLUMNS
+from tasks.v1.experiments.tfrecords import make_tfrecord_dataset, read_tfrecord_manifest, write_training_tfrecords
+
+class TestTrainingTFRecords:
+
+    ROWS = 300
+
+    def _dataset(self, tmpdir) -> Path:
+        rng = np.random.default_rng(7)
+        df = pd.DataFrame(rng.uniform(-1, 1, size=(TestTrainingTFRecords.ROWS, len(ALL_FEATURE_COLUMNS))), columns=ALL_FEATURE_COLUMNS)
+        df['playercommand_type'] = rng.choice(['dash', 'turn', 'kick', 'tackle'], size=TestTrainingTFRecords.ROWS)
+        for column in REGRESSION_OUTPUT_COLUMNS:
+            df[column] = rng.uniform(-1, 1, size=TestTrainingTFRecords.ROWS)
+        csvpath = Path(tmpdir / 'training.csv')
+        df.to_csv(csvpath, index=False)
+        return csvpath
+
+    def test_files(self, tmpdir):
+        (Path(tmpdir) / 'out').mkdir()
+        write_training_tfrecords(self._dataset(tmpdir), Path(tmpdir) / 'out', num_files=4, chunk_rows=128)
+        manifest = read_tfrecord_manifest(Path(tmpdir) / 'out')
+        assert [ file['rows'] for file in manifest['files'] ] == [75, 75, 75, 75]
+
+    def test_same_rows(self, tmpdir):
+        csvpath = self._dataset(tmpdir)
+        (Path(tmpdir) / 'out').mkdir()
+        write_training_tfrecords(csvpath, Path(tmpdir) / 'out', num_files=3)
+        features, labels, regression = next(iter(make_tfrecord_dataset(Path(tmpdir) / 'out', TestTrainingTFRecords.ROWS, shuffle=False)))
+        df = pd.read_csv(csvpath)
+        order = np.argsort(features.numpy()[:, 0])
+        expected_order = np.argsort(df[ALL_FEATURE_COLUMNS[0]].to_numpy(dtype=np.float32))
+        np.testing.assert_array_equal(features.numpy()[order], df[ALL_FEATURE_COLUMNS].to_numpy(dtype=np.float32)[expected_order])
+        assert [ LABEL_VALUES[label] for label in labels.numpy()[order] ] == df['playercommand_type'].to_numpy()[expected_order].tolist()
+        np.testing.assert_array_equal(regression.numpy()[order], df[REGRESSION_OUTPUT_COLUMNS].to_numpy(dtype=np.float32)[expected_order])
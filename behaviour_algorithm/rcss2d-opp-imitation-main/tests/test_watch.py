@@ -0,0 +1,73 @@
+import os
+from pathlib import Path
+import shutil
+import time
+
+from tasks.v1.data.catalog import Catalog
+from tasks.v1.data.watch import MatchGroupWatcher
+
+HERE = Path(os.path.dirname(os.path.realpath(__file__)))
+
+class TestWatch:
+
+    TESTFILES_DIRPATH = HERE / 'data'
+    FILESTEM = '202101010000-MT2019_0-vs-HELIOS2019_1'
+    TABLETYPES = ['match', 'playertypes', 'dash', 'turn', 'kick', 'tackle']
+
+    class Clock:
+        def __init__(self) -> None:
+            self.now = time.time()
+
+        def __call__(self) -> float:
+            return self.now
+
+    def _write(self, dirpath: Path, tabletypes) -> None:
+        for tabletype in tabletypes:
+            shutil.copy(TestWatch.TESTFILES_DIRPATH / f'test.{tabletype}.csv', dirpath / f'{TestWatch.FILESTEM}.{tabletype}.csv')
+
+    def test_complete_and_stable_groups(self, tmpdir):
+        root = Path(tmpdir)
+        clock = TestWatch.Clock()
+        with Catalog(root) as catalog:
+            watcher = MatchGroupWatcher(catalog, settle=5, clock=clock)
+            self._write(root, TestWatch.TABLETYPES[:-1])
+            # Incomplete
+            assert watcher.poll() == {}
+            self._write(root, TestWatch.TABLETYPES[-1:])
+            # Complete but just written
+            assert watcher.poll() == {} and watcher.pending == 1
+            clock.now += 3
+            assert watcher.poll() == {}
+            clock.now += 3
+            (ready,) = watcher.poll().values()
+            assert sorted(catalog_file.tabletype.value for catalog_file in ready) == sorted(TestWatch.TABLETYPES)
+            assert watcher.pending == 0
+            # Given once
+            clock.now += 10
+            assert watcher.poll() == {}
+
+    def test_changing_group_waits(self, tmpdir):
+        root = Path(tmpdir)
+        clock = TestWatch.Clock()
+        with Catalog(root) as catalog:
+            watcher = MatchGroupWatcher(catalog, settle=5, clock=clock)
+            self._write(root, TestWatch.TABLETYPES)
+            assert watcher.poll() == {}
+            clock.now += 4
+            # Still being written: settles again from now
+            with open(root / f'{TestWatch.FILESTEM}.dash.csv', 'a') as file:
+                file.write('101,3001,0,1,MT2019,1,100,0\n')
+            os.utime(root / f'{TestWatch.FILESTEM}.dash.csv', (clock.now, clock.now))
+            assert watcher.poll() == {}
+            clock.now += 4
+            assert watcher.poll() == {}
+            clock.now += 1
+            assert list(watcher.poll()) == [TestWatch.FILESTEM]
+
+    def test_old_groups_are_ready_at_once(self, tmpdir):
+        root = Path(tmpdir)
+        self._write(root, TestWatch.TABLETYPES)
+        clock = TestWatch.Clock()
+        clock.now += 60
+        with Catalog(root) as catalog:
+            assert list(MatchGroupWatcher(catalog, settle=5, clock=clock).poll()) == [TestWatch.FILESTEM]